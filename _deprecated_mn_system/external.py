@@ -67,10 +67,9 @@ def features():
         return redirect(url_for('external.external_login'))
     if request.method == 'POST':
         # 簡易開關（示範）：根據提交的鍵更新 enabled。付費流程另接第三方。
-        for f in FeatureFlag.query.all():
-            enabled = request.form.get(f'flag_{f.key}') == 'on'
-            f.enabled = enabled
-        db.session.commit()
+        from utils.feature_flags import set_flags
+        keys = [k for (k,) in db.session.query(FeatureFlag.key).filter(FeatureFlag.company_id.is_(None))]
+        set_flags({k: request.form.get(f'flag_{k}') == 'on' for k in keys})
         flash('已更新功能開關','success')
     flags = FeatureFlag.query.order_by(FeatureFlag.name.asc()).all()
     # Remaining days countdown
@@ -38,76 +38,17 @@ app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 db.init_app(app)
+# 每個請求 / LINE 事件的 SQL 查詢數與耗時統計（/admin/query_stats）
+from utils.query_stats import init_query_stats
+init_query_stats(app)
+# Prometheus 指標（/metrics）
+from utils.metrics import init_metrics
+init_metrics(app)
+# 上傳：MAX_CONTENT_LENGTH 上限、multipart 邊解析邊算 sha256（utils/upload_stream.py）
+from utils.upload_stream import init_upload_stream
+init_upload_stream(app)
 migrate = Migrate(app, db, directory=os.path.join(os.path.dirname(__file__), 'migrations'))
 
-# APScheduler：每日清除過期優惠券（若有殘留未查詢）
-try:
-    from apscheduler.schedulers.background import BackgroundScheduler
-    scheduler = BackgroundScheduler(timezone='Asia/Taipei')
-
-    def expire_coupons_job():
-        from models import StoredValueWallet, StoredValueTransaction
-        import pytz
-        from datetime import datetime as _dt
-        tz = pytz.timezone('Asia/Taipei')
-        now_dt = _dt.now(tz)
-        expire_dt = tz.localize(_dt(now_dt.year, 12, 31, 23, 59, 59))
-        if now_dt.date() != expire_dt.date():
-            return  # 僅在 12/31 當天執行一次批次清除
-        wallets = StoredValueWallet.query.all()
-        for w in wallets:
-            txns = StoredValueTransaction.query.filter_by(wallet_id=w.id).all()
-            c500 = c300 = c100 = 0
-            for t in txns:
-                sign = 1 if t.type == 'topup' else -1
-                c500 += sign * (t.coupon_500_count or 0)
-                c300 += sign * (t.coupon_300_count or 0)
-                try:
-                    c100 += sign * (getattr(t, 'coupon_100_count', 0) or 0)
-                except Exception:
-                    pass
-            c500 = max(c500,0)
-            c300 = max(c300,0)
-            c100 = max(c100,0)
-            if c500 > 0 or c300 > 0 or c100 > 0:
-                try:
-                    txn = StoredValueTransaction()
-                    txn.wallet_id = w.id
-                    txn.type = 'consume'
-                    txn.amount = 0
-                    txn.remark = f"AUTO_EXPIRE {expire_dt.strftime('%Y/%m/%d')}"
-                    txn.coupon_500_count = c500
-                    txn.coupon_300_count = c300
-                    try:
-                        txn.coupon_100_count = c100
-                    except Exception:
-                        pass
-                    db.session.add(txn)
-                    db.session.commit()
-                except Exception:
-                    db.session.rollback()
-    scheduler.add_job(expire_coupons_job, 'cron', hour=0, minute=10, id='expire_coupons_daily')
-
-    # 每日 02:00 自動清除「待驗證名單」（temp_verify 狀態為 pending）
-    def clear_pending_verify_job():
-        from models import TempVerify
-        try:
-            # 僅刪除仍為 pending 的暫存驗證資料
-            pending = TempVerify.query.filter_by(status='pending').all()
-            for item in pending:
-                db.session.delete(item)
-            if pending:
-                db.session.commit()
-            else:
-                db.session.rollback()
-        except Exception:
-            db.session.rollback()
-
-    scheduler.add_job(clear_pending_verify_job, 'cron', hour=2, minute=0, id='clear_pending_verify_daily')
-    scheduler.start()
-except Exception:
-    pass  # 若未安裝 apscheduler 則略過排程功能
-
 """Blueprint 註冊"""
 app.register_blueprint(message_bp)
 csrf.exempt(message_bp)  # 豁免 LINE Webhook /callback 不使用 CSRF Token
@@ -153,6 +94,16 @@ def not_found(e):
     except Exception:
         return 'Not Found', 404
 
+@app.errorhandler(413)
+def request_too_large(e):
+    msg = f"上傳檔案超過上限（{app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)}MB）"
+    if 'text/html' not in request.headers.get('Accept', ''):
+        return {'error': msg}, 413  # fetch / API 呼叫
+    if request.referrer and request.referrer.startswith(request.host_url):
+        flash(msg, 'danger')
+        return redirect(request.referrer)
+    return msg, 413
+
 @app.route('/line_status')
 def line_status():
     from extensions import ACCESS_TOKEN, CHANNEL_SECRET, line_bot_api
@@ -245,7 +196,7 @@ with app.app_context():
             try:
                 # stamp to latest known revision to align DB with migrations state
                 from flask_migrate import stamp as _stamp  # ensure defined in this scope
-                _stamp(migrations_path, '0003_add_wallet_notice')
+                _stamp(migrations_path, '0015_add_media_asset')
             except Exception:
                 pass
     else:
@@ -253,7 +204,7 @@ with app.app_context():
         used_create_all = True
         try:
             from flask_migrate import stamp as _stamp
-            _stamp(migrations_path, '0003_add_wallet_notice')
+            _stamp(migrations_path, '0015_add_media_asset')
         except Exception:
             pass
 
@@ -299,6 +250,23 @@ with app.app_context():
         except Exception:
             db.session.rollback()
 
+    # 兼容補丁：確保 whitelist 有 richmenu_id 欄位（已連結的 Rich Menu）
+    try:
+        db.session.execute(text("ALTER TABLE whitelist ADD COLUMN IF NOT EXISTS richmenu_id VARCHAR(64)"))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        try:
+            engine_name = db.get_engine().name
+            if engine_name == 'sqlite':
+                info = db.session.execute(text("PRAGMA table_info(whitelist)")).fetchall()
+                cols = {row[1] for row in info}
+                if 'richmenu_id' not in cols:
+                    db.session.execute(text("ALTER TABLE whitelist ADD COLUMN richmenu_id VARCHAR(64)"))
+                    db.session.commit()
+        except Exception:
+            db.session.rollback()
+
     # 兼容補丁：精準對帳欄位（payment_method, reference_id, operator）
     try:
         db.session.execute(text("ALTER TABLE stored_value_txn ADD COLUMN IF NOT EXISTS payment_method VARCHAR(50)"))
@@ -326,6 +294,26 @@ with app.app_context():
         except Exception:
             db.session.rollback()
 
+    # 兼容補丁：stored_value_txn.business_date 會計日 generated column（與 migrations 0010 相同）
+    # PostgreSQL 只支援 STORED；SQLite 的 ALTER TABLE 只能加 VIRTUAL（一樣可以建索引）
+    try:
+        from utils.business_calendar import business_date_of
+        engine = db.get_engine()
+        expr = business_date_of(db.column("created_at")).compile(
+            dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+        if engine.name == 'sqlite':
+            info = db.session.execute(text("PRAGMA table_xinfo(stored_value_txn)")).fetchall()
+            cols = {row[1] for row in info}
+            if 'business_date' not in cols:
+                db.session.execute(text(
+                    f"ALTER TABLE stored_value_txn ADD COLUMN business_date DATE GENERATED ALWAYS AS ({expr}) VIRTUAL"))
+        else:
+            db.session.execute(text(
+                f"ALTER TABLE stored_value_txn ADD COLUMN IF NOT EXISTS business_date DATE GENERATED ALWAYS AS ({expr}) STORED"))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+
     # 兼容補丁：多公司與會員欄位
     # 建立 company 與 company_user 表（SQLite/PG 簡單兼容，PG 用 IF NOT EXISTS）
     try:
@@ -397,6 +385,66 @@ with app.app_context():
         except Exception:
             db.session.rollback()
 
+    # 兼容補丁：feature_flag 唯一約束由 key 改為 (key, company_id)（與 migrations 0013 相同）
+    # 舊資料表的 UNIQUE(key) 會讓公司覆寫與全域旗標同 key 時寫入失敗
+    try:
+        from models import FeatureFlag
+        engine_name = db.get_engine().name
+        if engine_name == 'sqlite':
+            # SQLite 無法單獨移除行內 UNIQUE：確認仍有 UNIQUE(key) 時依模型重建資料表
+            old_unique = False
+            for row in db.session.execute(text("PRAGMA index_list(feature_flag)")).fetchall():
+                if row[2] and row[3] == 'u':
+                    ix_cols = [r[2] for r in db.session.execute(text(f'PRAGMA index_info("{row[1]}")')).fetchall()]
+                    old_unique = old_unique or ix_cols == ['key']
+            if old_unique:
+                from sqlalchemy import MetaData
+                from sqlalchemy.schema import CreateTable
+                metadata = MetaData()
+                for fk in FeatureFlag.__table__.foreign_keys:
+                    fk.column.table.to_metadata(metadata)  # 外鍵參照的資料表（company），供 DDL 解析
+                new_table = FeatureFlag.__table__.to_metadata(metadata, name='feature_flag__new')
+                old_cols = {row[1] for row in db.session.execute(text("PRAGMA table_info(feature_flag)")).fetchall()}
+                copy_cols = ", ".join(f'"{c.name}"' for c in new_table.columns if c.name in old_cols)
+                db.session.execute(CreateTable(new_table))
+                db.session.execute(text(f"INSERT INTO feature_flag__new ({copy_cols}) SELECT {copy_cols} FROM feature_flag"))
+                db.session.execute(text("DROP TABLE feature_flag"))
+                db.session.execute(text("ALTER TABLE feature_flag__new RENAME TO feature_flag"))
+        else:
+            db.session.execute(text("ALTER TABLE feature_flag DROP CONSTRAINT IF EXISTS feature_flag_key_key"))
+            exists = db.session.execute(text(
+                "SELECT 1 FROM pg_constraint WHERE conname = 'uq_feature_flag_key_company'")).first()
+            if not exists:
+                db.session.execute(text(
+                    'ALTER TABLE feature_flag ADD CONSTRAINT uq_feature_flag_key_company UNIQUE ("key", company_id)'))
+        db.session.execute(text(
+            'CREATE UNIQUE INDEX IF NOT EXISTS uq_feature_flag_global_key ON feature_flag ("key") WHERE company_id IS NULL'))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+
+    # 兼容補丁：熱門查詢欄位索引（與 migrations 0004 相同；create_all 不會替既有資料表補索引）
+    hot_indexes = [
+        ("ix_temp_verify_phone", "temp_verify", "phone"),
+        ("ix_temp_verify_line_user_id", "temp_verify", "line_user_id"),
+        ("ix_temp_verify_status_created_at", "temp_verify", "status, created_at"),
+        ("ix_whitelist_name", "whitelist", "name"),
+        ("ix_whitelist_line_id", "whitelist", "line_id"),
+        ("ix_whitelist_created_at", "whitelist", "created_at"),
+        ("ix_blacklist_name", "blacklist", "name"),
+        ("ix_blacklist_created_at", "blacklist", "created_at"),
+        ("ix_stored_value_txn_created_at", "stored_value_txn", "created_at"),
+        ("ix_stored_value_txn_type_created_at", "stored_value_txn", "type, created_at"),
+        ("ix_stored_value_txn_type_business_date", "stored_value_txn", "type, business_date"),
+        ("ix_stored_value_txn_dup_key", "stored_value_txn", "type, wallet_id, amount, created_at"),
+    ]
+    for ix_name, ix_table, ix_cols in hot_indexes:
+        try:
+            db.session.execute(text(f"CREATE INDEX IF NOT EXISTS {ix_name} ON {ix_table} ({ix_cols})"))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+
     # 預設超級管理員帳號密碼（若不存在）
     try:
         from models import ExternalUser
@@ -416,5 +464,29 @@ with app.app_context():
     except Exception:
         db.session.rollback()
 
+# 功能旗標：註冊修改時遞增版本號的事件（utils/feature_flags.py）
+import utils.feature_flags  # noqa: F401
+
+# 儲值金會計日彙總表：交易寫入時同步累加；flask wallet-rollup backfill 可重建
+from utils.wallet_rollup import init_wallet_rollup
+init_wallet_rollup(app)
+
+# 已驗證會員的 Rich Menu 批次連結（白名單異動時於背景 bulk link；flask richmenu link-all 補齊）
+from utils.richmenu_link import init_richmenu_link
+init_richmenu_link(app)
+
+# 媒體儲存：模板輔助函式 media_url / media_srcset 與產生縮圖的背景執行緒
+from utils.media_store import init_media_store
+init_media_store(app)
+
+# 背景推播佇列（reply 之後的額外推播改由背景執行緒送出）；需在資料表建立之後啟動
+from utils.push_queue import init_push_queue
+init_push_queue(app)
+
+# 排程（utils/jobs.py）：各 worker 以 leader election 選出一個行程執行；
+# 已部署獨立排程行程（Procfile: scheduler）時才替 web 設 SCHEDULER_MODE=off，此處回傳 None
+from utils.scheduler import init_scheduler
+scheduler = init_scheduler(app)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI 執行模式（選用）：LINE webhook 不再佔住同步 worker。
+
+同步 gunicorn worker 一次只處理一個請求，事件處理中每個 LINE API 呼叫（reply / push / get_profile /
+get_message_content）與 OCR 都讓整個 worker 等待。此模組以 ASGI 接手 /callback，其餘路由照舊交給 Flask：
+
+  /callback  驗簽（同 routes/message.py）後立即回 200，事件在背景處理：
+             加好友且已在白名單  async 查白名單（utils/async_db.py）+ aiohttp reply，不佔任何執行緒
+             圖片訊息            OCR 執行緒池（截圖下載、辨識、寫庫都在這裡，慢的 OCR 不會拖住文字訊息）
+             其餘事件            事件執行緒池以 app context 執行 hander/ 原本的同步處理函式；其中的 LINE 呼叫
+                                 經 utils/line_async.bridge_line_bot_api 改由事件迴圈上的 aiohttp 連線池送出
+             處理中事件超過 ASGI_MAX_PENDING_EVENTS 時回 503，由 LINE 重送
+  其他路由   asgiref WsgiToAsgi 轉給 Flask（未安裝 asgiref 時改用 uvicorn 內建的 WSGIMiddleware）
+
+啟動：WEB_RUNTIME=asgi（gunicorn.conf.py 會改用 uvicorn worker 載入 asgi:app），或直接
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8080
+套件見 requirements-asgi.txt（pip install -r requirements-asgi.txt）：aiohttp、uvicorn、asgiref；
+asyncpg（PostgreSQL）/ aiosqlite（SQLite）可選，未安裝時熱查詢改在執行緒池執行。
+與同步 worker 的比較見 bench/asgi_bench.py。
+
+環境變數：
+  ASGI_EVENT_WORKERS       事件執行緒池大小（預設 16；不宜超過 DB 連線池上限）
+  ASGI_OCR_WORKERS         OCR 執行緒池大小（預設 CPU 數）
+  ASGI_MAX_PENDING_EVENTS  處理中事件上限（預設 1000）
+"""
+import asyncio
+import inspect
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import FollowEvent, ImageMessage, MessageEvent, TextSendMessage
+
+from app import app as flask_app
+from extensions import ACCESS_TOKEN, CHANNEL_SECRET, handler, line_bot_api
+from hander.entrypoint import verified_info_text
+from utils import async_db
+from utils.line_async import AsyncLineClient, bridge_line_bot_api
+from utils.menu_helpers import get_menu_carousel
+from utils.metrics import HANDLER_ERRORS, HANDLER_LATENCY, WEBHOOK_EVENTS
+from utils.upload_stream import MAX_CONTENT_LENGTH
+
+CALLBACK_PATH = "/callback"
+EVENT_WORKERS = int(os.getenv("ASGI_EVENT_WORKERS", "16"))
+OCR_WORKERS = int(os.getenv("ASGI_OCR_WORKERS", str(os.cpu_count() or 2)))
+MAX_PENDING_EVENTS = int(os.getenv("ASGI_MAX_PENDING_EVENTS", "1000"))
+
+_state = {"started": False, "client": None, "unbridge": None, "event_pool": None, "ocr_pool": None}
+_start_lock = None
+_tasks = set()
+_wsgi = None
+
+
+# ───────────────────────────────────────────────────────────────
+# 啟動 / 關閉
+# ───────────────────────────────────────────────────────────────
+async def startup():
+    global _start_lock
+    if _start_lock is None:
+        _start_lock = asyncio.Lock()
+    async with _start_lock:
+        if _state["started"]:
+            return
+        loop = asyncio.get_running_loop()
+        _state["event_pool"] = ThreadPoolExecutor(EVENT_WORKERS, thread_name_prefix="asgi-event")
+        _state["ocr_pool"] = ThreadPoolExecutor(OCR_WORKERS, thread_name_prefix="asgi-ocr")
+        if ACCESS_TOKEN and CHANNEL_SECRET:
+            client = await AsyncLineClient(ACCESS_TOKEN).start()
+            _state["client"] = client
+            _state["unbridge"] = bridge_line_bot_api(line_bot_api, client, loop)
+        await async_db.init_async_db(flask_app, _state["event_pool"])
+        _state["started"] = True
+        logging.info(f"[asgi] 已啟動：事件執行緒 {EVENT_WORKERS}、OCR 執行緒 {OCR_WORKERS}、"
+                     f"async DB {'是' if async_db.using_async_engine() else '否（執行緒池）'}")
+
+
+async def drain(timeout=None):
+    """等待所有已接收的事件處理完成（含背景送出的 reply）；回傳仍未完成的數量。"""
+    left = 0
+    if _tasks:
+        _, pending = await asyncio.wait(set(_tasks), timeout=timeout)
+        left = len(pending)
+    if _state["client"] is not None:
+        left += await _state["client"].wait_background(timeout=timeout)
+    return left
+
+
+async def shutdown():
+    if not _state["started"]:
+        return
+    left = await drain(timeout=25)
+    if left:
+        logging.warning(f"[asgi] 關閉時仍有 {left} 個事件未處理完")
+    if _state["unbridge"]:
+        _state["unbridge"]()
+    if _state["client"]:
+        await _state["client"].close()
+    await async_db.close_async_db()
+    for name in ("event_pool", "ocr_pool"):
+        _state[name].shutdown(wait=False)
+    _state.update(started=False, client=None, unbridge=None, event_pool=None, ocr_pool=None)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await startup()
+            except Exception as e:
+                logging.exception("[asgi] 啟動失敗")
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+# ───────────────────────────────────────────────────────────────
+# 事件分派
+# ───────────────────────────────────────────────────────────────
+def _handler_for(event):
+    """與 WebhookHandler.handle 相同的查找順序（line-bot-sdk 2.x：事件類別_訊息類別 → 事件類別 → default）。"""
+    handlers = handler._handlers
+    func = None
+    if isinstance(event, MessageEvent):
+        func = handlers.get(f"{type(event).__name__}_{type(event.message).__name__}")
+    return func or handlers.get(type(event).__name__) or handler._default
+
+
+def _run_sync(func, event, destination):
+    spec = inspect.getfullargspec(func)
+    with flask_app.app_context():
+        try:
+            if spec.varargs is not None or len(spec.args) == 2:
+                func(event, destination)
+            elif len(spec.args) == 1:
+                func(event)
+            else:
+                func()
+        except Exception:
+            logging.exception(f"[asgi] 事件處理失敗 type={type(event).__name__}")
+
+
+async def _fast_follow(event):
+    """已在白名單的用戶加好友：async 查詢 + reply；不在白名單時回傳 False 交給原本的處理函式。"""
+    if _state["client"] is None:
+        return False
+    t0 = time.perf_counter()
+    user = await async_db.find_whitelist(event.source.user_id)
+    if user is None:
+        return False
+    WEBHOOK_EVENTS.labels("follow", "follow").inc()
+    try:
+        await _state["client"].reply_message(
+            event.reply_token, [TextSendMessage(text=verified_info_text(user)), get_menu_carousel()])
+    except Exception:
+        HANDLER_ERRORS.labels("follow").inc()
+        logging.exception(f"[asgi] 加好友回覆失敗 user_id={event.source.user_id}")
+    finally:
+        HANDLER_LATENCY.labels("follow").observe(time.perf_counter() - t0)
+    return True
+
+
+async def _dispatch(event, destination):
+    try:
+        if isinstance(event, FollowEvent) and await _fast_follow(event):
+            return
+        func = _handler_for(event)
+        if func is None:
+            return
+        pool = _state["ocr_pool"] if isinstance(event, MessageEvent) and isinstance(event.message, ImageMessage) \
+            else _state["event_pool"]
+        await asyncio.get_running_loop().run_in_executor(pool, _run_sync, func, event, destination)
+    except Exception:
+        logging.exception(f"[asgi] 事件分派失敗 type={type(event).__name__}")
+
+
+def _spawn(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+# ───────────────────────────────────────────────────────────────
+# HTTP
+# ───────────────────────────────────────────────────────────────
+async def _respond(send, status, text):
+    body = text.encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8"),
+                            (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _read_body(receive, limit):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            raise ValueError("body too large")
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _callback(scope, receive, send):
+    # 環境變數缺失時直接回 OK，避免 LINE 重試暴增（同 routes/message.py）
+    if not ACCESS_TOKEN or not CHANNEL_SECRET:
+        return await _respond(send, 200, "LINE not configured")
+    headers = dict(scope.get("headers") or [])
+    signature = headers.get(b"x-line-signature", b"").decode("latin-1")
+    if not signature:
+        return await _respond(send, 400, "Missing signature")
+    try:
+        body = await _read_body(receive, MAX_CONTENT_LENGTH)
+    except ValueError:
+        return await _respond(send, 413, "Payload too large")
+    if body is None:
+        return
+    if len(_tasks) >= MAX_PENDING_EVENTS:
+        return await _respond(send, 503, "Busy")
+    try:
+        payload = handler.parser.parse(body.decode("utf-8"), signature, as_payload=True)
+    except InvalidSignatureError:
+        return await _respond(send, 400, "Invalid signature")
+    except Exception:
+        logging.exception("[asgi] webhook 解析失敗")
+        return await _respond(send, 500, "Internal error")
+    for event in payload.events:
+        _spawn(_dispatch(event, payload.destination))
+    await _respond(send, 200, "OK")
+
+
+def _wsgi_app():
+    global _wsgi
+    if _wsgi is None:
+        try:
+            from asgiref.wsgi import WsgiToAsgi
+            _wsgi = WsgiToAsgi(flask_app)
+        except ImportError:
+            from uvicorn.middleware.wsgi import WSGIMiddleware
+            _wsgi = WSGIMiddleware(flask_app)
+    return _wsgi
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] == "http" and scope["path"] == CALLBACK_PATH and scope["method"] == "POST":
+        if not _state["started"]:
+            await startup()
+        return await _callback(scope, receive, send)
+    return await _wsgi_app()(scope, receive, send)
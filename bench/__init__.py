@@ -0,0 +1 @@
+# 效能量測工具：資料播種、查詢計畫報告、Webhook 壓測
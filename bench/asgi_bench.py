@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+同步 worker 與 ASGI 執行模式（asgi.py）的 webhook 事件處理量比較（每核）。
+
+假 LINE API 以獨立行程的 aiohttp 伺服器模擬（每個呼叫延遲 --line-latency-ms），兩種模式都真的走 HTTP：
+  sync  以 N 條執行緒模擬 N 個同步 gunicorn worker（各自一次一個請求，Flask test client 打 /callback），
+        line_bot_api 為指向假伺服器的 LineBotApi（requests）
+  asgi  直接呼叫 asgi.app（不經伺服器），同時送出 --concurrency 個已簽章的 webhook，
+        量測到所有事件處理完成（asgi.drain()）為止；LINE 呼叫走 aiohttp 連線池
+預設把本行程綁定在單一 CPU（sched_setaffinity），events/s 即每核處理量；events/cpu-s 為每 CPU 秒處理的事件數。
+
+用法：
+    python bench/asgi_bench.py                                   # follow_verified,menu,wallet，各 200 個事件
+    python bench/asgi_bench.py --events 500 --line-latency-ms 150 --sync-workers 1,3,5 --concurrency 200
+    python bench/asgi_bench.py --intents image --events 20       # 含 OCR（需 tesseract）
+需要 aiohttp（假伺服器與 ASGI 模式的 LINE 用戶端）。注意：會匯入 app.py，請勿指向正式資料庫。
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(ROOT)
+
+from bench.webhook_bench import (  # noqa: E402
+    BENCH_ACCESS_TOKEN, BENCH_CHANNEL_SECRET, SAMPLE_IMAGE, build_intents, install_line_bot_api, percentile, sign,
+    webhook_body,
+)
+
+DEFAULT_INTENTS = "follow_verified,menu,wallet"
+
+
+# ───────────────────────────────────────────────────────────────
+# 假 LINE API（獨立行程）
+# ───────────────────────────────────────────────────────────────
+def _serve_fake_line(port, latency_ms, image_path, counter):
+    from aiohttp import web
+
+    image = b""
+    if image_path and os.path.exists(image_path):
+        with open(image_path, "rb") as f:
+            image = f.read()
+
+    async def handle(request):
+        with counter.get_lock():
+            counter.value += 1
+        await asyncio.sleep(latency_ms / 1000.0)
+        path = request.path
+        if path.startswith("/v2/bot/profile/"):
+            return web.json_response({"userId": path.rsplit("/", 1)[-1], "displayName": "壓測"})
+        if path.endswith("/content"):
+            return web.Response(body=image, content_type="image/jpeg")
+        return web.json_response({})
+
+    fake = web.Application()
+    fake.router.add_route("*", "/{tail:.*}", handle)
+    web.run_app(fake, host="127.0.0.1", port=port, print=None, handle_signals=False)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake_line(latency_ms):
+    port = _free_port()
+    counter = multiprocessing.Value("L", 0)
+    proc = multiprocessing.Process(target=_serve_fake_line, args=(port, latency_ms, SAMPLE_IMAGE, counter),
+                                   daemon=True)
+    proc.start()
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc, f"http://127.0.0.1:{port}", counter
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("假 LINE API 啟動失敗")
+
+
+# ───────────────────────────────────────────────────────────────
+# 量測
+# ───────────────────────────────────────────────────────────────
+def _result(runtime, width, intent, n, wall, cpu, acks, api_calls, statuses):
+    return {
+        "runtime": runtime,
+        "width": width,
+        "intent": intent,
+        "events": n,
+        "events_per_s": round(n / wall, 1) if wall else 0.0,
+        "events_per_cpu_s": round(n / cpu, 1) if cpu else 0.0,
+        "ack_p50_ms": round(percentile(acks, 50), 1),
+        "ack_p95_ms": round(percentile(acks, 95), 1),
+        "wall_s": round(wall, 2),
+        "line_api_calls": round(api_calls / n, 1) if n else 0.0,
+        "status": statuses,
+    }
+
+
+def run_sync(flask_app, make_event, n, workers, counter):
+    """workers 條執行緒各自依序處理請求（= workers 個同步 worker）；回應即處理完成。"""
+    acks, statuses = [], {}
+    lock = threading.Lock()
+    next_i = iter(range(n))
+
+    def worker():
+        client = flask_app.test_client()
+        while True:
+            with lock:
+                i = next(next_i, None)
+            if i is None:
+                return
+            body = webhook_body(make_event(i))
+            t0 = time.perf_counter()
+            resp = client.post("/callback", data=body,
+                               headers={"X-Line-Signature": sign(body), "Content-Type": "application/json"})
+            dt = (time.perf_counter() - t0) * 1000.0
+            with lock:
+                acks.append(dt)
+                statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+
+    api_before, cpu0, t0 = counter.value, time.process_time(), time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0, time.process_time() - cpu0, acks, counter.value - api_before, statuses
+
+
+async def _asgi_post(asgi_app, body):
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.sleep(3600)
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    status = {}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/callback", "raw_path": b"/callback", "query_string": b"",
+        "root_path": "", "client": ("127.0.0.1", 0), "server": ("127.0.0.1", 8080),
+        "headers": [(b"content-type", b"application/json"),
+                    (b"x-line-signature", sign(body.decode("utf-8")).encode())],
+    }
+    await asgi_app(scope, receive, send)
+    return status.get("code")
+
+
+async def _run_asgi_async(asgi_module, make_event, n, concurrency):
+    acks, statuses = [], {}
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            body = webhook_body(make_event(i)).encode("utf-8")
+            t0 = time.perf_counter()
+            code = await _asgi_post(asgi_module.app, body)
+            acks.append((time.perf_counter() - t0) * 1000.0)
+            statuses[code] = statuses.get(code, 0) + 1
+
+    await asyncio.gather(*(one(i) for i in range(n)))
+    await asgi_module.drain()
+    return acks, statuses
+
+
+def run_asgi(asgi_module, loop, make_event, n, concurrency, counter):
+    api_before, cpu0, t0 = counter.value, time.process_time(), time.perf_counter()
+    acks, statuses = loop.run_until_complete(_run_asgi_async(asgi_module, make_event, n, concurrency))
+    return time.perf_counter() - t0, time.process_time() - cpu0, acks, counter.value - api_before, statuses
+
+
+def print_results(results, latency_ms, cpus):
+    header = (f"{'runtime':<8}{'width':>6}  {'intent':<18}{'events':>7}{'ev/s':>9}{'ev/cpu-s':>10}"
+              f"{'ack p50':>9}{'ack p95':>9}{'wall s':>8}{'api':>5}  status")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['runtime']:<8}{r['width']:>6}  {r['intent']:<18}{r['events']:>7}{r['events_per_s']:>9}"
+              f"{r['events_per_cpu_s']:>10}{r['ack_p50_ms']:>9}{r['ack_p95_ms']:>9}{r['wall_s']:>8}"
+              f"{r['line_api_calls']:>5}  {r['status']}")
+    print(f"（CPU：{cpus}；LINE API 延遲 {latency_ms}ms；width = sync 的 worker 數 / asgi 的同時請求數；"
+          f"ack = webhook 回應時間 ms；api = 每事件 LINE API 呼叫數）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="同步 worker 與 ASGI 模式的 webhook 處理量比較")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    parser.add_argument("--scale", type=float, default=0.2, help="播種資料量倍率")
+    parser.add_argument("--events", type=int, default=200, help="每個意圖、每種模式的事件數")
+    parser.add_argument("--intents", default=DEFAULT_INTENTS, help="逗號分隔（意圖名稱同 webhook_bench.py）")
+    parser.add_argument("--line-latency-ms", type=float, default=100.0, help="假 LINE API 每次呼叫延遲")
+    parser.add_argument("--sync-workers", default="1,3", help="逗號分隔，每個值各跑一輪")
+    parser.add_argument("--concurrency", type=int, default=100, help="ASGI 模式同時送出的 webhook 數")
+    parser.add_argument("--cpus", type=int, default=1, help="綁定的 CPU 數（0 = 不綁定）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出")
+    args = parser.parse_args(argv)
+
+    fake_proc, fake_url, counter = start_fake_line(args.line_latency_ms)
+    cpus = "未綁定"
+    if args.cpus and hasattr(os, "sched_setaffinity"):
+        chosen = sorted(os.sched_getaffinity(0))[:args.cpus]
+        os.sched_setaffinity(0, chosen)
+        cpus = ",".join(str(c) for c in chosen)
+
+    tmp_path = None
+    database_url = args.database_url
+    if not database_url:
+        fd, tmp_path = tempfile.mkstemp(prefix="asgi_bench_", suffix=".db")
+        os.close(fd)
+        database_url = f"sqlite:///{tmp_path}"
+
+    # 必須在匯入 app / extensions / utils.line_async 前設定
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["LINE_CHANNEL_SECRET"] = BENCH_CHANNEL_SECRET
+    os.environ["LINE_CHANNEL_ACCESS_TOKEN"] = BENCH_ACCESS_TOKEN
+    os.environ["LINE_API_ENDPOINT"] = fake_url
+    os.environ["LINE_API_DATA_ENDPOINT"] = fake_url
+
+    from linebot import LineBotApi
+    import app as app_module
+    from extensions import db
+    from bench.seed import seed_database, is_seeded, fake_line_user_id, volumes_for
+
+    flask_app = app_module.app
+    install_line_bot_api(LineBotApi(BENCH_ACCESS_TOKEN, endpoint=fake_url, data_endpoint=fake_url))
+    import asgi as asgi_module  # 取得換過的 line_bot_api
+
+    with flask_app.app_context():
+        if not is_seeded():
+            seed_database(scale=args.scale)
+
+    n_verified = min(500, volumes_for(args.scale)["whitelist"])
+    verified_users = [fake_line_user_id(i) for i in range(n_verified)]
+    selected = [s.strip() for s in args.intents.split(",") if s.strip()]
+    sync_widths = [int(w) for w in args.sync_workers.split(",") if w.strip()]
+
+    def intents_for(tag):
+        # 每一輪用不同的未驗證用戶，避免前一輪的暫存狀態影響結果
+        run_id = f"{tag}{uuid.uuid4().hex[:6]}"
+        return build_intents(verified_users, lambda t, i: f"Ubench{run_id}{t}{i:010d}")
+
+    results = []
+    try:
+        for name in selected:
+            if name not in intents_for("x"):
+                print(f"未知意圖：{name}")
+                continue
+            for width in sync_widths:
+                make_event = intents_for("s")[name]
+                results.append(_result("sync", width, name, args.events,
+                                       *run_sync(flask_app, make_event, args.events, width, counter)))
+
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(asgi_module.startup())
+        try:
+            for name in selected:
+                if name not in intents_for("x"):
+                    continue
+                make_event = intents_for("a")[name]
+                results.append(_result("asgi", args.concurrency, name, args.events,
+                                       *run_asgi(asgi_module, loop, make_event, args.events, args.concurrency,
+                                                 counter)))
+        finally:
+            loop.run_until_complete(asgi_module.shutdown())
+            loop.close()
+    finally:
+        fake_proc.terminate()
+        try:
+            scheduler = getattr(app_module, "scheduler", None)
+            if scheduler:
+                scheduler.shutdown(wait=False)
+        except Exception:
+            pass
+        if tmp_path:
+            with flask_app.app_context():
+                db.engine.dispose()
+            os.remove(tmp_path)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_results(results, args.line_latency_ms, cpus)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
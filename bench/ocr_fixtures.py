@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+OCR 測試用截圖：以 static/example_line_screenshot.jpg 為底，蓋掉「請顯示電話號碼 / 請顯示 ID」
+的黃色提示框，寫入隨機手機與 LINE ID，再套用縮放、JPEG 壓縮、淺色主題、裁切狀態列等變化。
+每張圖都附正確答案與文字框座標，供 bench/ocr_roi_bench.py 計算準確率與 ROI 命中率。
+"""
+import io
+import os
+import random
+import string
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+BASE_IMAGE = os.path.join(ROOT, 'static', 'example_line_screenshot.jpg')
+
+# 原圖（869x1882）中黃色提示框與欄位文字的位置
+BACKGROUND = (17, 17, 17)
+TEXT_COLOR = (236, 236, 236)
+PHONE_PLACEHOLDER = (8, 1030, 456, 1134)
+ID_PLACEHOLDER = (8, 1262, 410, 1356)
+PHONE_ORIGIN = (38, 1056)
+ID_ORIGIN = (38, 1288)
+FONT_SIZE = 40
+
+PHONE_FORMATS = (
+    lambda p: p,
+    lambda p: f"{p[:4]} {p[4:7]} {p[7:]}",
+    lambda p: f"{p[:4]}-{p[4:7]}-{p[7:]}",
+    lambda p: f"+886 {p[1:4]} {p[4:7]} {p[7:]}",
+)
+SCALES = (1.0, 0.75, 1.25)
+JPEG_QUALITIES = (92, 60, 35)
+CROPS = (0, 120)
+THEMES = ('dark', 'light')
+
+
+def _random_phone(rng):
+    return '09' + ''.join(rng.choice(string.digits) for _ in range(8))
+
+
+def _random_line_id(rng):
+    head = rng.choice(string.ascii_lowercase)
+    body = ''.join(rng.choice(string.ascii_lowercase + string.digits + '._-') for _ in range(rng.randint(4, 12)))
+    return head + body
+
+
+def _render(base, phone_text, line_id, font):
+    im = base.copy()
+    draw = ImageDraw.Draw(im)
+    draw.rectangle(PHONE_PLACEHOLDER, fill=BACKGROUND)
+    draw.rectangle(ID_PLACEHOLDER, fill=BACKGROUND)
+    draw.text(PHONE_ORIGIN, phone_text, font=font, fill=TEXT_COLOR)
+    draw.text(ID_ORIGIN, line_id, font=font, fill=TEXT_COLOR)
+    boxes = {
+        'phone': draw.textbbox(PHONE_ORIGIN, phone_text, font=font),
+        'line_id': draw.textbbox(ID_ORIGIN, line_id, font=font),
+    }
+    return im, boxes
+
+
+def _transform_box(box, crop_top, scale):
+    x0, y0, x1, y1 = box
+    return (int(x0 * scale), int((y0 - crop_top) * scale), int((x1 - x0) * scale), int((y1 - y0) * scale))
+
+
+def build_fixtures(count=24, seed=0):
+    """回傳 [{name, image, phone, line_id, boxes}]；boxes 為 (x, y, w, h)，座標已對應到變化後的圖。"""
+    rng = random.Random(seed)
+    base = Image.open(BASE_IMAGE).convert('RGB')
+    font = ImageFont.load_default(size=FONT_SIZE)
+    fixtures = []
+    for i in range(count):
+        phone = _random_phone(rng)
+        line_id = _random_line_id(rng)
+        phone_text = PHONE_FORMATS[i % len(PHONE_FORMATS)](phone)
+        scale = SCALES[i % len(SCALES)]
+        quality = JPEG_QUALITIES[(i // len(SCALES)) % len(JPEG_QUALITIES)]
+        crop_top = CROPS[(i // 2) % len(CROPS)]
+        theme = THEMES[(i // 4) % len(THEMES)]
+
+        im, boxes = _render(base, phone_text, line_id, font)
+        if crop_top:
+            im = im.crop((0, crop_top, im.width, im.height))
+        if scale != 1.0:
+            im = im.resize((int(im.width * scale), int(im.height * scale)), Image.LANCZOS)
+        if theme == 'light':
+            im = ImageOps.invert(im)
+        buf = io.BytesIO()
+        im.save(buf, 'JPEG', quality=quality)
+        data = buf.getvalue()
+        fixtures.append({
+            'name': f"fx{i:02d}_{theme}_s{scale}_q{quality}_c{crop_top}",
+            'bytes': data,
+            'image': Image.open(io.BytesIO(data)).convert('RGB'),
+            'phone': phone,
+            'line_id': line_id,
+            'boxes': {k: _transform_box(v, crop_top, scale) for k, v in boxes.items()},
+        })
+    return fixtures
+
+
+def save_fixtures(fixtures, directory):
+    os.makedirs(directory, exist_ok=True)
+    for fx in fixtures:
+        with open(os.path.join(directory, fx['name'] + '.jpg'), 'wb') as f:
+            f.write(fx['bytes'])
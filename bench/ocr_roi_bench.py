@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+區域 OCR（utils/ocr_roi.py）準確率與延遲基準測試。
+
+以 bench/ocr_fixtures.py 產生的截圖變化組比較：
+  full : 整張 eng+chi_tra（utils/image_verification.extract_lineid_phone_full）
+  roi  : 靠左文字列裁切 + 二值化 + 英數白名單（utils/ocr_roi.extract_fields）
+  tier : 分層辨識（utils/image_verification.recognize，帶入正確答案作為預期值，取得即停止）
+另外量測 ROI 定位本身的耗時與命中率（手機 / ID 文字框是否被偵測到的文字列涵蓋），
+此部分不需 tesseract。
+
+用法：
+    python bench/ocr_roi_bench.py
+    python bench/ocr_roi_bench.py --count 48 --seed 3 --json
+    python bench/ocr_roi_bench.py --save-dir /tmp/ocr_fixtures     # 匯出測試圖
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+import pytesseract
+
+from bench.ocr_fixtures import build_fixtures, save_fixtures
+from utils import ocr_roi
+from utils.image_verification import extract_lineid_phone_full, normalize_phone, recognize, tier_stats
+
+
+def tesseract_available():
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def _covered(truth, boxes, min_ratio=0.8):
+    """truth 文字框至少 min_ratio 的面積落在某個偵測框內，且偵測框沒有高出兩倍以上。"""
+    tx, ty, tw, th = truth
+    for x, y, w, h in boxes:
+        ix = max(0, min(tx + tw, x + w) - max(tx, x))
+        iy = max(0, min(ty + th, y + h) - max(ty, y))
+        if tw * th and ix * iy / float(tw * th) >= min_ratio and h <= 2 * th:
+            return True
+    return False
+
+
+def _ms(t0):
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def _summary(values):
+    if not values:
+        return {'avg': 0.0, 'p50': 0.0, 'max': 0.0}
+    ordered = sorted(values)
+    return {
+        'avg': round(sum(ordered) / len(ordered), 1),
+        'p50': round(ordered[len(ordered) // 2], 1),
+        'max': round(ordered[-1], 1),
+    }
+
+
+MODES = (('full', extract_lineid_phone_full), ('roi', ocr_roi.extract_fields))
+ALL_MODES = ('full', 'roi', 'tier')
+
+
+def run(fixtures, with_ocr):
+    rows = []
+    for fx in fixtures:
+        image = fx['image']
+        t0 = time.perf_counter()
+        boxes = ocr_roi.locate_text_lines(image)
+        ocr_roi.build_strip(image, boxes)
+        row = {
+            'name': fx['name'],
+            'locate_ms': round(_ms(t0), 1),
+            'lines': len(boxes),
+            'roi_hit_phone': _covered(fx['boxes']['phone'], boxes),
+            'roi_hit_line_id': _covered(fx['boxes']['line_id'], boxes),
+        }
+        if with_ocr:
+            def tiered(img, fx=fx):
+                r = recognize(img, expected_phone=fx['phone'], expected_line_id=fx['line_id'])
+                return r['phone'], r['line_id'], r['text']
+
+            for mode, fn in MODES + (('tier', tiered),):
+                t0 = time.perf_counter()
+                phone, line_id, _ = fn(image)
+                row[f'{mode}_ms'] = round(_ms(t0), 1)
+                row[f'{mode}_phone_ok'] = bool(phone) and normalize_phone(phone) == fx['phone']
+                row[f'{mode}_line_id_ok'] = bool(line_id) and line_id.lower() == fx['line_id'].lower()
+        rows.append(row)
+    return rows
+
+
+def summarize(rows, with_ocr):
+    n = len(rows) or 1
+    out = {
+        'fixtures': len(rows),
+        'locate_ms': _summary([r['locate_ms'] for r in rows]),
+        'roi_hit_phone': round(sum(r['roi_hit_phone'] for r in rows) / n, 3),
+        'roi_hit_line_id': round(sum(r['roi_hit_line_id'] for r in rows) / n, 3),
+    }
+    if with_ocr:
+        out['tiers'] = tier_stats()
+        for mode in ALL_MODES:
+            out[mode] = {
+                'ms': _summary([r[f'{mode}_ms'] for r in rows]),
+                'phone_acc': round(sum(r[f'{mode}_phone_ok'] for r in rows) / n, 3),
+                'line_id_acc': round(sum(r[f'{mode}_line_id_ok'] for r in rows) / n, 3),
+            }
+    return out
+
+
+def print_report(rows, summary, with_ocr):
+    header = f"{'fixture':<32}{'locate':>8}{'lines':>6}{'roi:tel':>8}{'roi:id':>7}"
+    if with_ocr:
+        header += f"{'full ms':>9}{'tel':>5}{'id':>4}{'roi ms':>8}{'tel':>5}{'id':>4}{'tier ms':>9}{'tel':>5}{'id':>4}"
+    print(header)
+    print('-' * len(header))
+    yn = lambda v: 'Y' if v else '-'
+    for r in rows:
+        line = (f"{r['name']:<32}{r['locate_ms']:>8}{r['lines']:>6}"
+                f"{yn(r['roi_hit_phone']):>8}{yn(r['roi_hit_line_id']):>7}")
+        if with_ocr:
+            line += (f"{r['full_ms']:>9}{yn(r['full_phone_ok']):>5}{yn(r['full_line_id_ok']):>4}"
+                     f"{r['roi_ms']:>8}{yn(r['roi_phone_ok']):>5}{yn(r['roi_line_id_ok']):>4}"
+                     f"{r['tier_ms']:>9}{yn(r['tier_phone_ok']):>5}{yn(r['tier_line_id_ok']):>4}")
+        print(line)
+    print()
+    print(f"ROI 定位：平均 {summary['locate_ms']['avg']}ms，手機框命中 {summary['roi_hit_phone']:.0%}，"
+          f"ID 框命中 {summary['roi_hit_line_id']:.0%}")
+    if with_ocr:
+        for mode in ALL_MODES:
+            s = summary[mode]
+            print(f"{mode:<5} 平均 {s['ms']['avg']}ms / p50 {s['ms']['p50']}ms / max {s['ms']['max']}ms，"
+                  f"手機正確率 {s['phone_acc']:.0%}，ID 正確率 {s['line_id_acc']:.0%}")
+        for tier, st in summary['tiers']['tiers'].items():
+            print(f"  {tier:<11} 執行 {st['runs']} 次，命中率 {st['hit_rate']:.0%}，平均 {st['avg_ms']}ms")
+        print(f"  分層估計省下 {summary['tiers']['time_saved_ms']}ms")
+    else:
+        print("未安裝 tesseract，僅量測 ROI 定位（OCR 準確率與延遲略過）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='區域 OCR 準確率與延遲基準測試')
+    parser.add_argument('--count', type=int, default=24, help='測試圖數量')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save-dir', help='將測試圖輸出到此目錄')
+    parser.add_argument('--no-ocr', action='store_true', help='只量測 ROI 定位')
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出')
+    args = parser.parse_args(argv)
+
+    if not ocr_roi.ROI_AVAILABLE:
+        print('未安裝 opencv-python-headless / numpy，無法執行 ROI')
+        return 1
+    fixtures = build_fixtures(args.count, args.seed)
+    if args.save_dir:
+        save_fixtures(fixtures, args.save_dir)
+    with_ocr = not args.no_ocr and tesseract_available()
+    rows = run(fixtures, with_ocr)
+    summary = summarize(rows, with_ocr)
+    if args.json:
+        print(json.dumps({'summary': summary, 'fixtures': rows}, ensure_ascii=False, indent=2))
+    else:
+        print_report(rows, summary, with_ocr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+熱門查詢執行計畫報告：播種接近正式環境的資料量後，對 routes/admin.py 與 hander/verify.py
+中的熱門查詢執行 EXPLAIN，確認皆有使用索引。
+
+用法：
+    python bench/query_plan_report.py                      # 使用暫存 SQLite
+    python bench/query_plan_report.py --scale 0.2
+    python bench/query_plan_report.py --database-url postgresql://...   # 空資料庫才會播種
+結束代碼：任何「應使用索引」的查詢走全表掃描時回傳 1，方便接在 CI / 部署前檢查。
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from flask import Flask
+from sqlalchemy import select
+
+from extensions import db
+from models import Whitelist, Blacklist, TempVerify, StoredValueWallet, StoredValueTransaction
+from bench.seed import seed_database, is_seeded, fake_phone, fake_line_user_id
+
+DASHBOARD_LIMIT = 20
+
+
+def create_bench_app(database_url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def hot_queries(now=None):
+    """
+    回傳 [(名稱, 來源, select 陳述式, 是否應使用索引)]。
+    LIKE '%q%' 前綴萬用字元無法走 B-tree 索引，列出僅供參考。
+    """
+    now = now or datetime.utcnow()
+    phone = fake_phone(123)
+    uid = fake_line_user_id(123)
+    start, end = now - timedelta(days=1), now
+    T = StoredValueTransaction
+    return [
+        ('dashboard_whitelist', 'routes/admin.py:load_dashboard_data',
+         select(Whitelist).order_by(Whitelist.created_at.desc()).limit(DASHBOARD_LIMIT), True),
+        ('dashboard_blacklist', 'routes/admin.py:load_dashboard_data',
+         select(Blacklist).order_by(Blacklist.created_at.desc()).limit(DASHBOARD_LIMIT), True),
+        ('dashboard_tempverify', 'routes/admin.py:load_dashboard_data',
+         select(TempVerify).where(TempVerify.status == 'pending',
+                                  TempVerify.phone.isnot(None), TempVerify.phone != '',
+                                  TempVerify.line_id.isnot(None), TempVerify.line_id != '')
+         .order_by(TempVerify.created_at.desc()).limit(DASHBOARD_LIMIT), True),
+        ('whitelist_by_phone', 'routes/admin.py:whitelist_delete / hander/verify.py',
+         select(Whitelist).where(Whitelist.phone == phone).limit(1), True),
+        ('whitelist_by_line_user_id', 'hander/verify.py:handle_text',
+         select(Whitelist).where(Whitelist.line_user_id == uid).limit(1), True),
+        ('whitelist_by_line_id', 'routes/admin.py:whitelist 精確比對',
+         select(Whitelist).where(Whitelist.line_id == 'line_000123').limit(1), True),
+        ('whitelist_by_name', 'routes/admin.py:whitelist 精確比對',
+         select(Whitelist).where(Whitelist.name == '會員123').limit(1), True),
+        ('blacklist_by_phone', 'hander/verify.py:handle_text',
+         select(Blacklist).where(Blacklist.phone == phone).limit(1), True),
+        ('blacklist_by_name', 'routes/admin.py:blacklist 精確比對',
+         select(Blacklist).where(Blacklist.name == '黑名單1').limit(1), True),
+        ('tempverify_by_phone', 'hander/verify.py:upsert_tempverify / mark_tempverify_*',
+         select(TempVerify).where(TempVerify.phone == phone).limit(1), True),
+        ('tempverify_by_line_user_id', 'hander/verify.py',
+         select(TempVerify).where(TempVerify.line_user_id == uid).limit(1), True),
+        ('wallet_by_phone', 'hander/verify.py:reply_wallet',
+         select(StoredValueWallet).where(StoredValueWallet.phone == phone).limit(1), True),
+        ('wallet_by_whitelist_id', 'routes/admin.py:wallet_home',
+         select(StoredValueWallet).where(StoredValueWallet.whitelist_id == 123).limit(1), True),
+        ('txn_recent_by_wallet', 'routes/admin.py:wallet_home / hander/verify.py:reply_wallet',
+         select(T).where(T.wallet_id == 123).order_by(T.created_at.desc()).limit(100), True),
+        ('reconcile_topup_range', 'routes/admin.py:wallet_reconcile',
+         select(T).where(T.type == 'topup', T.created_at >= start, T.created_at < end)
+         .order_by(T.created_at.asc()), True),
+        ('reconcile_consume_range', 'routes/admin.py:wallet_reconcile_consume',
+         select(T).where(T.type == 'consume', T.created_at >= start, T.created_at < end)
+         .order_by(T.created_at.asc()), True),
+        ('export_range', 'routes/admin.py:wallet_transactions_export',
+         select(T).where(T.created_at >= start, T.created_at < end).order_by(T.id.asc()), True),
+        ('whitelist_search_like', 'routes/admin.py:whitelist_search',
+         select(Whitelist).where(Whitelist.phone.like('%123%') | Whitelist.name.like('%123%')
+                                 | Whitelist.line_id.like('%123%'))
+         .order_by(Whitelist.created_at.desc()).limit(DASHBOARD_LIMIT), False),
+    ]
+
+
+def _compile(stmt, dialect):
+    compiled = stmt.compile(dialect=dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[k] for k in compiled.positiontup)
+    else:
+        params = dict(compiled.params)
+    return compiled.string, params
+
+
+def explain(stmt):
+    """回傳 (計畫文字列, 是否有全表掃描)。"""
+    engine = db.engine
+    sql, params = _compile(stmt, engine.dialect)
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+            lines = [r[-1] for r in rows]
+            # SCAN <table>（無 USING INDEX）即為全表掃描
+            full_scan = any(l.startswith('SCAN ') and ' USING ' not in l for l in lines)
+        else:
+            rows = conn.exec_driver_sql('EXPLAIN ' + sql, params).fetchall()
+            lines = [r[0] for r in rows]
+            full_scan = any('Seq Scan' in l for l in lines)
+    return lines, full_scan
+
+
+def build_report(now=None):
+    report = []
+    for name, source, stmt, expect_index in hot_queries(now):
+        lines, full_scan = explain(stmt)
+        report.append({
+            'name': name,
+            'source': source,
+            'expect_index': expect_index,
+            'uses_index': not full_scan,
+            'ok': (not full_scan) or (not expect_index),
+            'plan': lines,
+        })
+    return report
+
+
+def print_report(report):
+    for r in report:
+        flag = 'OK  ' if r['ok'] else 'FAIL'
+        note = '' if r['expect_index'] else '（前綴萬用字元，預期全表掃描）'
+        print(f"[{flag}] {r['name']:<28} {r['source']}{note}")
+        for line in r['plan']:
+            print(f"        {line}")
+    failed = [r['name'] for r in report if not r['ok']]
+    print()
+    print(f"共 {len(report)} 條查詢，未使用索引：{len(failed)} 條 {failed if failed else ''}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='熱門查詢執行計畫報告')
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'))
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出')
+    args = parser.parse_args(argv)
+
+    database_url = args.database_url
+    tmp_path = None
+    if not database_url:
+        fd, tmp_path = tempfile.mkstemp(prefix='query_plan_', suffix='.db')
+        os.close(fd)
+        database_url = f"sqlite:///{tmp_path}"
+
+    app = create_bench_app(database_url)
+    with app.app_context():
+        db.create_all()
+        if not is_seeded():
+            vol = seed_database(scale=args.scale)
+            if not args.json:
+                print(f"已播種：{vol}")
+        report = build_report()
+        db.engine.dispose()
+    if tmp_path:
+        os.remove(tmp_path)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return 0 if all(r['ok'] for r in report) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+以接近正式環境的資料量播種資料庫（白名單、黑名單、暫存驗證、錢包、交易、抽獎券）。
+僅供效能量測使用，請勿對正式資料庫執行。
+"""
+import hashlib
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from extensions import db
+from models import Whitelist, Blacklist, TempVerify, Coupon, StoredValueWallet, StoredValueTransaction
+
+# scale=1.0 時的筆數
+BASE_VOLUMES = {
+    'whitelist': 20000,
+    'blacklist': 1000,
+    'temp_verify': 5000,
+    'stored_value_wallet': 8000,
+    'stored_value_txn': 100000,
+    'coupon': 20000,
+}
+
+BATCH_SIZE = 5000
+
+
+def fake_phone(i):
+    return f"09{i:08d}"
+
+
+def fake_line_user_id(i):
+    return "U" + hashlib.md5(f"user-{i}".encode()).hexdigest()
+
+
+def fake_line_id(i):
+    return f"line_{i:06d}"
+
+
+def _bulk_insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+    db.session.commit()
+
+
+def volumes_for(scale):
+    return {k: max(1, int(v * scale)) for k, v in BASE_VOLUMES.items()}
+
+
+def is_seeded():
+    """資料表已有資料時不重複播種。"""
+    try:
+        return db.session.query(Whitelist.id).first() is not None
+    except Exception:
+        db.session.rollback()
+        return False
+
+
+def seed_database(scale=1.0, seed=42, now=None):
+    """
+    寫入假資料並回傳實際筆數 dict。
+    :param scale: 資料量倍率（1.0 ≈ 兩萬會員、十萬筆交易）
+    :param seed: 亂數種子，確保每次結果可重現
+    """
+    rnd = random.Random(seed)
+    now = now or datetime.utcnow()
+    vol = volumes_for(scale)
+    span_days = 365
+
+    def rand_time():
+        return now - timedelta(seconds=rnd.randint(0, span_days * 86400))
+
+    n_wl = vol['whitelist']
+    _bulk_insert(Whitelist, [{
+        'phone': fake_phone(i),
+        'name': f"會員{i}",
+        'line_id': fake_line_id(i),
+        'line_user_id': fake_line_user_id(i),
+        'date': now.strftime('%Y-%m-%d'),
+        'created_at': rand_time(),
+    } for i in range(n_wl)])
+
+    # 黑名單號碼與白名單不重疊
+    _bulk_insert(Blacklist, [{
+        'phone': fake_phone(n_wl + i),
+        'name': f"黑名單{i}",
+        'reason': '測試資料',
+        'created_at': rand_time(),
+    } for i in range(vol['blacklist'])])
+
+    statuses = ['verified'] * 7 + ['pending'] * 2 + ['failed']
+    _bulk_insert(TempVerify, [{
+        'phone': fake_phone(rnd.randrange(n_wl + vol['blacklist'] + vol['temp_verify'])),
+        'line_id': fake_line_id(i),
+        'nickname': f"暫存{i}",
+        'line_user_id': fake_line_user_id(rnd.randrange(n_wl * 2)),
+        'status': rnd.choice(statuses),
+        'created_at': rand_time(),
+    } for i in range(vol['temp_verify'])])
+
+    n_wallet = min(vol['stored_value_wallet'], n_wl)
+    _bulk_insert(StoredValueWallet, [{
+        'whitelist_id': i + 1,
+        'phone': fake_phone(i),
+        'balance': rnd.randrange(0, 20000, 100),
+        'created_at': rand_time(),
+        'updated_at': now,
+    } for i in range(n_wallet)])
+
+    txn_rows = []
+    for i in range(vol['stored_value_txn']):
+        kind = 'topup' if rnd.random() < 0.45 else 'consume'
+        txn_rows.append({
+            'wallet_id': rnd.randint(1, n_wallet),
+            'type': kind,
+            'amount': rnd.randrange(0, 10000, 100),
+            'remark': 'TOPUP_CASH' if kind == 'topup' else 'CONSUME_SERVICE',
+            'payment_method': rnd.choice(['CASH', 'BANK', 'CARD', 'TWQR', None]),
+            'coupon_500_count': rnd.choice([0, 0, 0, 1]),
+            'coupon_300_count': rnd.choice([0, 0, 0, 1]),
+            'coupon_100_count': rnd.choice([0, 0, 1]),
+            'created_at': rand_time(),
+        })
+    _bulk_insert(StoredValueTransaction, txn_rows)
+    # 大量寫入不經 ORM，會計日彙總表需重建
+    from utils.wallet_rollup import backfill
+    backfill()
+
+    _bulk_insert(Coupon, [{
+        'line_user_id': fake_line_user_id(rnd.randrange(n_wl)),
+        'date': (now - timedelta(days=rnd.randrange(span_days))).strftime('%Y-%m-%d'),
+        'amount': rnd.choice([0, 0, 0, 100, 200, 300]),
+        'type': rnd.choice(['draw', 'draw', 'report']),
+        'created_at': rand_time(),
+    } for _ in range(vol['coupon'])])
+
+    # 讓規劃器取得統計資訊
+    try:
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+    vol['stored_value_wallet'] = n_wallet
+    return vol
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+LINE Webhook 壓測：產生已簽章的 webhook 事件（加好友、文字指令、圖片、postback），
+透過 Flask test client 打到 routes/message.py:callback，line_bot_api 以錄製用的假物件取代
+（同 extensions._MockLineBotApi 的做法），回報各意圖的吞吐量、p50/p95/p99 延遲與 DB 查詢數。
+
+用法：
+    python bench/webhook_bench.py                          # 暫存 SQLite，自動播種
+    python bench/webhook_bench.py --requests 200 --concurrency 4
+    python bench/webhook_bench.py --database-url postgresql://...  --intents menu,wallet
+注意：會匯入 app.py（含啟動時的資料表補丁），請勿指向正式資料庫。
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(ROOT)
+
+BENCH_CHANNEL_SECRET = 'bench-channel-secret'
+BENCH_ACCESS_TOKEN = 'bench-access-token'
+SAMPLE_IMAGE = os.path.join(ROOT, 'static', 'example_line_screenshot.jpg')
+
+
+# ───────────────────────────────────────────────────────────────
+# 假 LINE API：記錄呼叫次數，回傳最小可用的物件
+# ───────────────────────────────────────────────────────────────
+class _BenchProfile:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.display_name = f"壓測{user_id[-4:]}"
+
+
+class _BenchContent:
+    def __init__(self, data):
+        self.content = data
+
+    def iter_content(self, chunk_size=1024):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+
+class BenchLineBotApi:
+    def __init__(self, image_bytes=b''):
+        self.image_bytes = image_bytes
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _record(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def get_profile(self, user_id, *a, **kw):
+        self._record('get_profile')
+        return _BenchProfile(user_id)
+
+    def get_message_content(self, message_id, *a, **kw):
+        self._record('get_message_content')
+        return _BenchContent(self.image_bytes)
+
+    def __getattr__(self, name):
+        def _call(*a, **kw):
+            self._record(name)
+        return _call
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+
+def install_line_bot_api(fake):
+    """把所有已匯入模組中的 line_bot_api 換成假物件（各模組以 from extensions import line_bot_api 取得）。"""
+    import extensions
+    original = extensions.line_bot_api
+    for mod in list(sys.modules.values()):
+        if mod is not None and getattr(mod, 'line_bot_api', None) is original:
+            setattr(mod, 'line_bot_api', fake)
+
+
+# ───────────────────────────────────────────────────────────────
+# Webhook 事件產生
+# ───────────────────────────────────────────────────────────────
+def sign(body, secret=BENCH_CHANNEL_SECRET):
+    digest = hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def _base_event(event_type, user_id):
+    return {
+        'type': event_type,
+        'mode': 'active',
+        'timestamp': int(time.time() * 1000),
+        'source': {'type': 'user', 'userId': user_id},
+        'replyToken': uuid.uuid4().hex,
+        'webhookEventId': uuid.uuid4().hex,
+        'deliveryContext': {'isRedelivery': False},
+    }
+
+
+def follow_event(user_id):
+    return _base_event('follow', user_id)
+
+
+def text_event(user_id, text):
+    ev = _base_event('message', user_id)
+    ev['message'] = {'type': 'text', 'id': str(uuid.uuid4().int)[:18], 'text': text}
+    return ev
+
+
+def image_event(user_id):
+    ev = _base_event('message', user_id)
+    ev['message'] = {'type': 'image', 'id': str(uuid.uuid4().int)[:18], 'contentProvider': {'type': 'line'}}
+    return ev
+
+
+def postback_event(user_id, data):
+    ev = _base_event('postback', user_id)
+    ev['postback'] = {'data': data}
+    return ev
+
+
+def webhook_body(*events):
+    return json.dumps({'destination': 'Ubench', 'events': list(events)}, ensure_ascii=False)
+
+
+def build_intents(verified_users, new_user_id):
+    """
+    意圖名稱 → 產生單一事件的函式（參數為第 i 次請求）。
+    new_user_id(tag, i) 依意圖產生不重複的未驗證用戶，避免彼此的暫存狀態互相干擾。
+    """
+    from utils.temp_users import set_temp_user
+
+    def verified(i):
+        return verified_users[i % len(verified_users)]
+
+    def screenshot_event(i):
+        # 圖片事件需先處於等待截圖步驟，才會走到下載與 OCR
+        uid = new_user_id('img', i)
+        set_temp_user(uid, {"step": "waiting_screenshot", "name": "壓測", "phone": f"09{80000000 + i:08d}",
+                            "line_id": f"bench{i}"})
+        return image_event(uid)
+
+    return {
+        'follow_verified': lambda i: follow_event(verified(i)),
+        'follow_new': lambda i: follow_event(new_user_id('fol', i)),
+        'menu': lambda i: text_event(verified(i), '主選單'),
+        'verify_info': lambda i: text_event(verified(i), '驗證資訊'),
+        'wallet': lambda i: text_event(verified(i), '儲值金'),
+        'daily_draw': lambda i: text_event(verified(i), '每日抽獎'),
+        'coupon_records': lambda i: text_event(verified(i), '折價券管理'),
+        'promo': lambda i: text_event(verified(i), '活動快訊'),
+        'phone_new': lambda i: text_event(new_user_id('tel', i), f"09{90000000 + i:08d}"),
+        'image': screenshot_event,
+        'postback_manual_verify': lambda i: postback_event(new_user_id('pbk', i), 'manual_verify'),
+        'postback_report': lambda i: postback_event(verified(i), f"report_ok|bench_{i}"),
+    }
+
+
+# ───────────────────────────────────────────────────────────────
+# 量測
+# ───────────────────────────────────────────────────────────────
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+class QueryCounter:
+    """以 SQLAlchemy before_cursor_execute 事件計算每個執行緒的 SQL 數量。"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *a, **kw):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+def run_intent(app, counter, fake_api, name, make_event, n, concurrency):
+    latencies = []
+    queries = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def one(i):
+        body = webhook_body(make_event(i))
+        headers = {'X-Line-Signature': sign(body), 'Content-Type': 'application/json'}
+        client = app.test_client()
+        counter.reset()
+        t0 = time.perf_counter()
+        resp = client.post('/callback', data=body, headers=headers)
+        dt = (time.perf_counter() - t0) * 1000.0
+        with lock:
+            latencies.append(dt)
+            queries.append(counter.count)
+            statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+
+    api_before = fake_api.total_calls()
+    t_start = time.perf_counter()
+    if concurrency <= 1:
+        for i in range(n):
+            one(i)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(n)))
+    wall = time.perf_counter() - t_start
+    return {
+        'intent': name,
+        'requests': n,
+        'throughput_rps': round(n / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'avg_queries': round(sum(queries) / len(queries), 1) if queries else 0.0,
+        'max_queries': max(queries) if queries else 0,
+        'line_api_calls': round((fake_api.total_calls() - api_before) / n, 1) if n else 0.0,
+        'status': statuses,
+    }
+
+
+def print_results(results):
+    header = f"{'intent':<24}{'req':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'q/avg':>8}{'q/max':>7}{'api':>6}  status"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['intent']:<24}{r['requests']:>6}{r['throughput_rps']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+              f"{r['p99_ms']:>9}{r['avg_queries']:>8}{r['max_queries']:>7}{r['line_api_calls']:>6}  {r['status']}")
+    print('（延遲單位 ms；q = 每事件 SQL 數；api = 每事件 LINE API 呼叫數）')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='LINE Webhook 壓測')
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'))
+    parser.add_argument('--scale', type=float, default=0.2, help='播種資料量倍率')
+    parser.add_argument('--requests', type=int, default=100, help='每個意圖的請求數')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--intents', default='', help='逗號分隔，預設全部')
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出')
+    args = parser.parse_args(argv)
+
+    tmp_path = None
+    database_url = args.database_url
+    if not database_url:
+        fd, tmp_path = tempfile.mkstemp(prefix='webhook_bench_', suffix='.db')
+        os.close(fd)
+        database_url = f"sqlite:///{tmp_path}"
+
+    # 必須在匯入 app/extensions 前設定，才會使用真正的 WebhookHandler 驗簽與分派
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['LINE_CHANNEL_SECRET'] = BENCH_CHANNEL_SECRET
+    os.environ['LINE_CHANNEL_ACCESS_TOKEN'] = BENCH_ACCESS_TOKEN
+
+    import app as app_module
+    from extensions import db
+    from bench.seed import seed_database, is_seeded, fake_line_user_id, volumes_for
+
+    flask_app = app_module.app
+    image_bytes = b''
+    if os.path.exists(SAMPLE_IMAGE):
+        with open(SAMPLE_IMAGE, 'rb') as f:
+            image_bytes = f.read()
+    fake_api = BenchLineBotApi(image_bytes)
+    install_line_bot_api(fake_api)
+
+    with flask_app.app_context():
+        if not is_seeded():
+            seed_database(scale=args.scale)
+        counter = QueryCounter(db.engine)
+
+    n_verified = min(500, volumes_for(args.scale)['whitelist'])
+    verified_users = [fake_line_user_id(i) for i in range(n_verified)]
+    run_id = uuid.uuid4().hex[:8]
+    intents = build_intents(verified_users, lambda tag, i: f"Ubench{run_id}{tag}{i:010d}")
+    selected = [s.strip() for s in args.intents.split(',') if s.strip()] or list(intents)
+
+    results = []
+    for name in selected:
+        if name not in intents:
+            print(f"未知意圖：{name}（可用：{', '.join(intents)}）")
+            continue
+        results.append(run_intent(flask_app, counter, fake_api, name, intents[name], args.requests, args.concurrency))
+
+    try:
+        scheduler = getattr(app_module, 'scheduler', None)
+        if scheduler:
+            scheduler.shutdown(wait=False)
+    except Exception:
+        pass
+    if tmp_path:
+        with flask_app.app_context():
+            db.engine.dispose()
+        os.remove(tmp_path)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_results(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,4 +21,7 @@ if not ACCESS_TOKEN or not CHANNEL_SECRET:
 	handler = _MockHandler()
 else:
 	line_bot_api = LineBotApi(ACCESS_TOKEN)
+	# LINE API 呼叫延遲 / 錯誤碼指標
+	from utils.metrics import instrument_line_bot_api
+	instrument_line_bot_api(line_bot_api)
 	handler = WebhookHandler(CHANNEL_SECRET)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# gunicorn 會自動讀取工作目錄下的 gunicorn.conf.py；此處只放 Prometheus 多行程模式所需的掛勾
+import os
+import shutil
+
+
+def on_starting(server):
+    # 清除上次執行殘留的指標檔，避免計數延續到新的 master
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        try:
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(worker.pid)
+        except Exception:
+            pass
+
+
+# 應用程式由這裡指定（Procfile / start.sh / Dockerfile 不再帶 app:app）：
+# WEB_RUNTIME=asgi 時改用 uvicorn worker 載入 asgi.py（/callback 非阻塞，見 asgi.py；需安裝 requirements-asgi.txt），
+# 其餘維持同步 worker
+if os.getenv("WEB_RUNTIME", "wsgi") == "asgi":
+    wsgi_app = "asgi:app"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "app:app"
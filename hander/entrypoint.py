@@ -3,7 +3,7 @@ from extensions import handler, line_bot_api, db
 from utils.menu_helpers import reply_with_menu, notify_admins, reply_with_ad_menu
 from hander.report import handle_report, handle_report_postback
 from hander.admin import handle_admin
-from hander.verify import handle_verify, maybe_push_coupon_expiry_notice
+from hander.verify import handle_verify
 from utils.temp_users import temp_users
 from models import Whitelist, Coupon
 from utils.draw_utils import draw_coupon, has_drawn_today, save_coupon_record, get_today_coupon_flex
@@ -12,6 +12,9 @@ from datetime import datetime
 
 from hander.follow import handle_follow
 from hander.image import handle_image
+from utils.query_stats import track
+from utils.metrics import observe_event
+from utils.promo_events import active_events, daily_banner
 
 import logging
 
@@ -22,40 +25,45 @@ def _norm(text: str) -> str:
     return text.replace('\u3000', ' ').strip()
 logging.basicConfig(level=logging.INFO)
 
+def verified_info_text(user):
+    """已驗證用戶的驗證資訊（加好友 / 驗證資訊 共用；asgi.py 快速路徑傳入的是查詢結果列）。"""
+    tz = pytz.timezone("Asia/Taipei")
+    return (
+        f"📱 {user.phone}\n"
+        f"🌸 暱稱：{user.name or '未登記'}\n"
+        f"       個人編號：{user.id}\n"
+        f"🔗 LINE ID：{user.line_id or '未登記'}\n"
+        f"🕒 {user.created_at.astimezone(tz).strftime('%Y/%m/%d %H:%M:%S')}\n"
+        f"✅ 驗證成功，歡迎加入茗殿\n"
+        f"🌟 加入密碼：ming666"
+    )
+
 @handler.add(FollowEvent)
+@track("line:follow")
+@observe_event("follow")
 def on_follow(event):
     logging.info(f"[FollowEvent] Source: {event.source}")
     user_id = event.source.user_id
 
     # 若此 LINE 使用者已在白名單，直接顯示驗證資訊＋主選單
-    tz = pytz.timezone("Asia/Taipei")
     user = Whitelist.query.filter_by(line_user_id=user_id).first()
     if user:
-        reply = (
-            f"📱 {user.phone}\n"
-            f"🌸 暱稱：{user.name or '未登記'}\n"
-            f"       個人編號：{user.id}\n"
-            f"🔗 LINE ID：{user.line_id or '未登記'}\n"
-            f"🕒 {user.created_at.astimezone(tz).strftime('%Y/%m/%d %H:%M:%S')}\n"
-            f"✅ 驗證成功，歡迎加入茗殿\n"
-            f"🌟 加入密碼：ming666"
-        )
-        reply_with_menu(event.reply_token, reply)
-        try:
-            maybe_push_coupon_expiry_notice(user_id)
-        except Exception:
-            logging.exception("maybe_push_coupon_expiry_notice in on_follow failed")
+        reply_with_menu(event.reply_token, verified_info_text(user))
         return
 
     # 不在白名單：走原本的驗證導引流程
     handle_follow(event, line_bot_api)
 
 @handler.add(MessageEvent, message=ImageMessage)
+@track("line:message.image")
+@observe_event("message.image")
 def on_image(event):
     logging.info(f"[ImageMessage] user_id={event.source.user_id}")
     handle_image(event)
 
 @handler.add(MessageEvent, message=TextMessage)
+@track("line:message.text")
+@observe_event("message.text")
 def entrypoint(event):
     user_text = _norm(event.message.text)
     user_id = event.source.user_id
@@ -86,49 +94,20 @@ def entrypoint(event):
 
     # 驗證資訊
     if user_text in ["驗證資訊", "驗證 資訊", "驗證資訊 "]:
-        tz = pytz.timezone("Asia/Taipei")
-        now = datetime.now(tz)
-        today_str = now.strftime('%Y-%m-%d')
-        pre_event_end = datetime(2025, 9, 10, tzinfo=tz)
-        img_url = "https://raw.githubusercontent.com/Suan0503/Test_Mod/refs/heads/main/static/20250904.jpg"  # 你的前導圖網址
-        # 9/1~9/9 每日首次跳前導圖
-        if now < pre_event_end:
-            if user_id not in temp_users or temp_users[user_id].get('pre_event_shown') != today_str:
-                from linebot.models import ImageSendMessage
-                if user_id not in temp_users:
-                    temp_users[user_id] = {}
-                temp_users[user_id]['pre_event_shown'] = today_str
-                user = Whitelist.query.filter_by(line_user_id=user_id).first()
-                if user:
-                    reply = (
-                        f"📱 {user.phone}\n"
-                        f"🌸 暱稱：{user.name or '未登記'}\n"
-                        f"       個人編號：{user.id}\n"
-                        f"🔗 LINE ID：{user.line_id or '未登記'}\n"
-                        f"🕒 {user.created_at.astimezone(tz).strftime('%Y/%m/%d %H:%M:%S')}\n"
-                        f"✅ 驗證成功，歡迎加入茗殿\n"
-                        f"🌟 加入密碼：ming666"
-                    )
-                else:
-                    reply = "查無你的驗證資訊，請先完成驗證流程。"
-                line_bot_api.reply_message(event.reply_token, [
-                    ImageSendMessage(original_content_url=img_url, preview_image_url=img_url),
-                    TextSendMessage(text=reply)
-                ])
-                return
         user = Whitelist.query.filter_by(line_user_id=user_id).first()
         if user:
-            reply = (
-                f"📱 {user.phone}\n"
-                f"🌸 暱稱：{user.name or '未登記'}\n"
-                f"       個人編號：{user.id}\n"
-                f"🔗 LINE ID：{user.line_id or '未登記'}\n"
-                f"🕒 {user.created_at.astimezone(tz).strftime('%Y/%m/%d %H:%M:%S')}\n"
-                f"✅ 驗證成功，歡迎加入茗殿\n"
-                f"🌟 加入密碼：ming666"
-            )
+            reply = verified_info_text(user)
         else:
             reply = "查無你的驗證資訊，請先完成驗證流程。"
+        # 活動前導圖：每日首次先顯示（promo_event kind=banner）
+        banner = daily_banner(user_id)
+        if banner:
+            from linebot.models import ImageSendMessage
+            line_bot_api.reply_message(event.reply_token, [
+                ImageSendMessage(original_content_url=banner.image_url, preview_image_url=banner.image_url),
+                TextSendMessage(text=reply)
+            ])
+            return
         reply_with_menu(event.reply_token, reply)
         return
 
@@ -204,78 +183,36 @@ def entrypoint(event):
         "主選單", "功能選單", "選單", "menu", "Menu",
         "查詢規則", "規則查詢"
     ]:
-        tz = pytz.timezone("Asia/Taipei")
-        now = datetime.now(tz)
-        today_str = now.strftime('%Y-%m-%d')
-        # 第二活動前導圖：9/1~9/9，每日首次顯示
-        pre_event_end = datetime(2025, 9, 10, tzinfo=tz)
-        img_url = "https://raw.githubusercontent.com/Suan0503/Test_Mod/refs/heads/main/static/20250904.jpg"  # 請換成你的前導圖網址
-        if now < pre_event_end:
-            # 檢查 temp_users 是否已記錄今日已顯示
-            if user_id not in temp_users or temp_users[user_id].get('pre_event_shown') != today_str:
-                from linebot.models import ImageSendMessage
-                from utils.menu import get_menu_carousel
-                # 記錄今日已顯示
-                if user_id not in temp_users:
-                    temp_users[user_id] = {}
-                temp_users[user_id]['pre_event_shown'] = today_str
-                line_bot_api.reply_message(event.reply_token, [
-                    get_menu_carousel(),
-                    ImageSendMessage(original_content_url=img_url, preview_image_url=img_url)
-                ])
-                return
+        # 活動前導圖：每日首次隨選單顯示（promo_event kind=banner）
+        banner = daily_banner(user_id)
+        if banner:
+            from linebot.models import ImageSendMessage
+            from utils.menu import get_menu_carousel
+            line_bot_api.reply_message(event.reply_token, [
+                get_menu_carousel(),
+                ImageSendMessage(original_content_url=banner.image_url, preview_image_url=banner.image_url)
+            ])
+            return
         reply_with_menu(event.reply_token)
         return
 
-    # 活動快訊：多活動期間判斷
+    # 活動快訊：進行中的活動（promo_event kind=promo，後台 /admin/events 管理）
     if user_text == "活動快訊":
-        tz = pytz.timezone("Asia/Taipei")
-        now = datetime.now(tz)
-        # 第一活動：9/1 ~ 9/30
-        act1_start = datetime(2025, 9, 1, tzinfo=tz)
-        act1_end = datetime(2025, 9, 30, 23, 59, 59, tzinfo=tz)
-        # 第二活動：9/10 ~ 9/30
-        act2_start = datetime(2025, 9, 10, tzinfo=tz)
-        act2_end = datetime(2025, 9, 30, 23, 59, 59, tzinfo=tz)
-
-        msg = ""
-        img_url = None
-        # 第一活動
-        if act1_start <= now <= act1_end:
-            msg += "🌸 茗殿好鄰居 1+1 活動 🌸\n"
-            msg += "⏰ 即日起～9月底\n\n"
-            msg += "💌 邀好友‧齊享優惠\n"
-            msg += "✔️ 邀請好友加入並完成驗證：\n"
-            msg += "\t• 邀請人 🎁 折價券 200 元\n"
-            msg += "\t• 受邀人 🎁 折價券 100 元\n\n"
-            msg += "👭 一起來更划算！\n"
-            msg += "當日兩人同行預約 👉 現折 100 元\n\n"
-            msg += "⚡溫馨提醒：\n領取折價券時，記得主動告知活動喔！"
-            img_url = "https://raw.githubusercontent.com/Suan0503/Test_Mod/refs/heads/main/static/%E5%A5%BD%E9%84%B0%E5%B1%851%2B1.png"  # 請換成好鄰居1+1.png的實際網址
-
-        # 第二活動
-        if act2_start <= now <= act2_end:
-            if msg:
-                msg += "\n\n"
-            msg += "🏫✨ 茗殿學院祭 — 少女的邀請 ✨🏫\n"
-            msg += "⏰ 活動期間：9/10～9/30\n\n"
-            msg += "🎀 妹妹們換上 清純校服，帶來滿滿青春氣息 💕\n"
-            msg += "🎁 特別準備了 祭典限定特典，\n只送給參加的有緣人！（數量有限，送完為止）\n\n"
-            msg += "🌸 在這個屬於學院的季節，\n快來和妹妹們留下專屬回憶吧！"
-
+        promos = active_events("promo")
+        msg = "\n\n".join(e.text or e.title for e in promos)
         if not msg:
             msg = "🌟 目前無進行中活動，敬請期待！"
             reply_with_menu(event.reply_token, msg)
+            return
+        # 一次回覆最多 5 則：文字 + 最多 4 張活動圖
+        images = [e.image_url for e in promos if e.image_url][:4]
+        if images:
+            from linebot.models import ImageSendMessage
+            line_bot_api.reply_message(event.reply_token, [TextSendMessage(text=msg)] + [
+                ImageSendMessage(original_content_url=url, preview_image_url=url) for url in images
+            ])
         else:
-            # 若有圖片網址，直接用 ImageSendMessage 顯示圖片
-            if img_url:
-                from linebot.models import ImageSendMessage
-                line_bot_api.reply_message(event.reply_token, [
-                    TextSendMessage(text=msg),
-                    ImageSendMessage(original_content_url=img_url, preview_image_url=img_url)
-                ])
-            else:
-                reply_with_menu(event.reply_token, msg)
+            reply_with_menu(event.reply_token, msg)
         return
 
     # 呼叫管理員
@@ -294,6 +231,8 @@ def entrypoint(event):
     handle_verify(event)
 
 @handler.add(PostbackEvent)
+@track("line:postback")
+@observe_event("postback")
 def entrypoint_postback(event):
     data = event.postback.data
     user_id = event.source.user_id
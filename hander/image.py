@@ -1,13 +1,17 @@
-from linebot.models import MessageEvent, ImageMessage, TextSendMessage
+from linebot.models import MessageEvent, ImageMessage, TextSendMessage, ImageSendMessage
 from extensions import line_bot_api
-from utils.image_verification import extract_lineid_phone, normalize_phone
-from utils.temp_users import get_temp_user, set_temp_user, pop_temp_user  # 確認 utils/temp_users.py 有這三個函式
-from utils.db_utils import update_or_create_whitelist_from_data
-from datetime import datetime
-import re
+from utils.temp_users import get_temp_user, pop_temp_user
 from utils.menu_helpers import reply_with_menu  # 只要這個
+from hander import verify_pipeline
+from utils.unit_of_work import unit_of_work, commit_now
+from utils.push_queue import enqueue_push
+from hander.verify import EXTRA_NOTICE, make_qr, save_debug_image
+import logging
+import pytz
 
+@unit_of_work("verify:image")
 def handle_image(event):
+    """截圖驗證唯一入口（hander/verify.py 的圖片事件也轉到這裡），流程見 hander/verify_pipeline.py。"""
     user_id = event.source.user_id
     print(f"[ImageHandler] Received image from user_id={user_id}")
     try:
@@ -17,104 +21,100 @@ def handle_image(event):
             line_bot_api.reply_message(event.reply_token, TextSendMessage(text="請先完成手機號與 LINE ID 驗證，再上傳截圖！"))
             return
 
-        message_content = line_bot_api.get_message_content(event.message.id)
-        image_path = f"/tmp/{user_id}_line_profile.png"
-        with open(image_path, 'wb') as fd:
-            for chunk in message_content.iter_content():
-                fd.write(chunk)
-
-        phone_ocr, lineid_ocr, ocr_text = extract_lineid_phone(image_path)
-        input_phone = tu.get("phone")
-        input_lineid = tu.get("line_id")
+        matcher = verify_pipeline.get_matcher()
+        ctx = verify_pipeline.run(line_bot_api, user_id, event.message.id, tu, matcher)
         record = tu
 
-        phone_ocr_norm = normalize_phone(phone_ocr) if phone_ocr else None
-        input_phone_norm = normalize_phone(input_phone) if input_phone else None
-
-        # --- OCR 與手動輸入完全吻合且格式正確才自動通關 ---
-        if (
-            phone_ocr_norm and lineid_ocr
-            and phone_ocr_norm == input_phone_norm
-            and input_lineid is not None and lineid_ocr.lower() == input_lineid.lower()
-            and re.match(r"^09\d{8}$", phone_ocr_norm)
-            and len(lineid_ocr) >= 3 and len(lineid_ocr) <= 20 and re.match(r"^[A-Za-z0-9_\-\.]+$", lineid_ocr)
-        ):
-            now_str = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-            data = {
-                "phone": record['phone'],
-                "name": record['name'],
-                "line_id": record['line_id'],
-                "date": now_str,
-                "reason": "OCR自動通過"
-            }
-            db_record, _ = update_or_create_whitelist_from_data(data, user_id)
+        if ctx.outcome == verify_pipeline.PASS:
+            # 先確定白名單已寫入，才回覆驗證成功（commit 失敗走下方的系統錯誤回覆）
+            commit_now()
+            pop_temp_user(user_id)
+            tz = pytz.timezone("Asia/Taipei")
+            db_record = ctx.record
             code = str(db_record.id) if getattr(db_record, "id", None) else "待驗證後產生"
-
             msg = (
-                f"📱 {record['phone']}\n"
-                f"🌸 暱稱：{record['name']}\n"
+                f"📱 {db_record.phone}\n"
+                f"🌸 暱稱：{db_record.name or record.get('name') or '用戶'}\n"
                 f"       個人編號：{code}\n"
-                f"🔗 LINE ID：{record['line_id']}\n"
-                f"🕒 {now_str}\n"
+                f"🔗 LINE ID：{db_record.line_id or '未登記'}\n"
+                f"🕒 {db_record.created_at.astimezone(tz).strftime('%Y/%m/%d %H:%M:%S')}\n"
                 f"✅ 驗證成功，歡迎加入茗殿\n"
                 f"🌟 加入密碼：ming666"
             )
-            pop_temp_user(user_id)
             reply_with_menu(event.reply_token, msg)
+            try:
+                enqueue_push(user_id, TextSendMessage(text=EXTRA_NOTICE), source="extra_notice")
+            except Exception:
+                logging.exception("push EXTRA_NOTICE after OCR pass failed")
             return
 
-        # --- LINE ID 尚未設定時，僅允許 phone_ocr 完全正確且格式正確 ---
-        if input_lineid == "尚未設定":
-            if phone_ocr_norm == input_phone_norm and phone_ocr_norm and re.match(r"^09\d{8}$", phone_ocr_norm):
-                reply = (
-                    f"📱 {record['phone']}\n"
-                    f"🌸 暱稱：{record['name']}\n"
-                    f"       個人編號：待驗證後產生\n"
-                    f"🔗 LINE ID：尚未設定\n"
-                    f"請問以上資料是否正確？正確請回復 1\n"
-                    f"⚠️輸入錯誤請從新輸入手機號碼即可⚠️"
-                )
-                record["step"] = "waiting_confirm"
-                set_temp_user(user_id, record)
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
-            else:
-                detect_phone = phone_ocr_norm or '未識別'
-                detect_lineid = lineid_ocr or '未識別'
-                msg = (
-                    "❌ 截圖中的手機號碼或 LINE ID 與您輸入的不符，請重新上傳正確的 LINE 個人頁面截圖。\n"
-                    f"【圖片偵測結果】\n手機:{detect_phone}\nLINE ID:{detect_lineid}"
-                )
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=msg))
-            return
-
-        # --- 兩者都必須格式正確且完全吻合才能通過 ---
-        lineid_match = (lineid_ocr is not None and input_lineid is not None and lineid_ocr.lower() == input_lineid.lower())
-        if (
-            phone_ocr_norm == input_phone_norm and phone_ocr_norm and re.match(r"^09\d{8}$", phone_ocr_norm)
-            and (lineid_match or lineid_ocr == "尚未設定")
-            and lineid_ocr and len(lineid_ocr) >= 3 and len(lineid_ocr) <= 20 and re.match(r"^[A-Za-z0-9_\-\.]+$", lineid_ocr)
-        ):
+        if ctx.outcome == verify_pipeline.CONFIRM:
             reply = (
                 f"📱 {record['phone']}\n"
                 f"🌸 暱稱：{record['name']}\n"
                 f"       個人編號：待驗證後產生\n"
-                f"🔗 LINE ID：{record['line_id']}\n"
+                f"🔗 LINE ID：{record.get('line_id') or '尚未設定'}\n"
                 f"請問以上資料是否正確？正確請回復 1\n"
                 f"⚠️輸入錯誤請從新輸入手機號碼即可⚠️"
             )
-            record["step"] = "waiting_confirm"
-            set_temp_user(user_id, record)
             line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
             return
 
-        # --- fallback: OCR 不符，顯示細節（合併為一則訊息）---
-        detect_phone = phone_ocr_norm or '未識別'
-        detect_lineid = lineid_ocr or '未識別'
-        msg = (
-            "❌ 截圖中的手機號碼或 LINE ID 與您輸入的不符，請重新上傳正確的 LINE 個人頁面截圖。\n"
-            f"【圖片偵測結果】\n手機:{detect_phone}\nLINE ID:{detect_lineid}"
-        )
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=msg))
+        if ctx.outcome == verify_pipeline.MISMATCH:
+            MISMATCH_REPLIES.get(matcher.name, _reply_detected_mismatch)(event, ctx)
+            return
+
+        if ctx.outcome == verify_pipeline.TOO_LARGE:
+            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="圖片檔案過大，請改傳 LINE 個人頁面截圖。"))
+            return
+
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="系統錯誤，請重新上傳圖片或聯絡管理員。"))
     except Exception as e:
         print(f"[ImageHandler] Exception: {e}")
         line_bot_api.reply_message(event.reply_token, TextSendMessage(text="系統錯誤，請重新上傳圖片或聯絡管理員。"))
+
+
+def _reply_detected_mismatch(event, ctx):
+    """strict：顯示辨識到的手機 / LINE ID，請使用者重傳。"""
+    detect_phone = ctx.phone or '未識別'
+    detect_lineid = ctx.line_id or '未識別'
+    msg = (
+        "❌ 截圖中的手機號碼或 LINE ID 與您輸入的不符，請重新上傳正確的 LINE 個人頁面截圖。\n"
+        f"【圖片偵測結果】\n手機:{detect_phone}\nLINE ID:{detect_lineid}"
+    )
+    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=msg))
+
+
+def _reply_ocr_text_mismatch(event, ctx):
+    """line_id：顯示 OCR 重點文字與截圖預覽，提供重新上傳 / 重新輸入 LINE ID / 重新驗證。"""
+    public_url = save_debug_image(ctx.image_bytes, ctx.user_id)
+    preview_note = ""
+    preview_msg = []
+    if public_url:
+        preview_note = "\n📷 這是我們辨識用的截圖預覽（僅你可見）："
+        preview_msg.append(ImageSendMessage(original_content_url=public_url, preview_image_url=public_url))
+    warn = (
+        "⚠️ 截圖中的內容無法對上您剛輸入的 LINE ID。\n"
+        "以下是 OCR 辨識到的重點文字（供你核對）：\n"
+        "——— OCR ———\n"
+        f"{ctx.text.strip()[:900] or '（無文字或辨識失敗）'}\n"
+        "———————\n"
+        "請選擇：重新上傳 / 重新輸入LINE ID / 重新驗證（從頭）。"
+        f"{preview_note}"
+    )
+    text_msg = TextSendMessage(
+        text=warn,
+        quick_reply=make_qr(
+            ("重新上傳", "重新上傳"),
+            ("重新輸入LINE ID", "重新輸入LINE ID"),
+            ("重新驗證", "重新驗證")
+        )
+    )
+    line_bot_api.reply_message(event.reply_token, [text_msg] + preview_msg if preview_msg else text_msg)
+
+
+# 比對規則名稱 → 不符時的回覆方式
+MISMATCH_REPLIES = {
+    "strict": _reply_detected_mismatch,
+    "line_id": _reply_ocr_text_mismatch,
+}
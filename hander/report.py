@@ -5,6 +5,7 @@ from extensions import line_bot_api, db
 from models import Whitelist, Coupon
 from utils.temp_users import temp_users
 from storage import ADMIN_IDS
+from utils.push_queue import enqueue_push
 import re, time
 from datetime import datetime
 import pytz
@@ -76,8 +77,8 @@ def handle_report(event):
                 "url": url,
                 "report_no": report_no_str
             }
-            line_bot_api.push_message(
-                admin_id,
+            # 按鈕與明細同一次推播，確保順序
+            enqueue_push(admin_id, [
                 TemplateSendMessage(
                     alt_text="收到用戶回報文",
                     template=ButtonsTemplate(
@@ -88,9 +89,9 @@ def handle_report(event):
                             PostbackAction(label="❌ X", data=f"report_ng|{report_id}")
                         ]
                     )
-                )
-            )
-            line_bot_api.push_message(admin_id, TextSendMessage(text=detail_text))
+                ),
+                TextSendMessage(text=detail_text),
+            ], source="report")
         line_bot_api.reply_message(
             event.reply_token,
             TextSendMessage(text="✅ 已收到您的回報，管理員會盡快處理！")
@@ -107,7 +108,7 @@ def handle_report(event):
             to_user_id = info["user_id"]
             reply = f"❌ 您的回報文未通過審核，原因如下：\n{reason}"
             try:
-                line_bot_api.push_message(to_user_id, TextSendMessage(text=reply))
+                enqueue_push(to_user_id, TextSendMessage(text=reply), source="report")
             except Exception as e:
                 print("推播用戶回報拒絕失敗", e)
             temp_users.pop(user_id)
@@ -142,7 +143,7 @@ def handle_report_postback(event):
                 )
                 db.session.add(new_coupon)
                 db.session.commit()
-                line_bot_api.push_message(to_user_id, TextSendMessage(text=reply))
+                enqueue_push(to_user_id, TextSendMessage(text=reply), source="report")
             except Exception as e:
                 print("推播用戶通過回報文失敗", e)
             report_pending_map.pop(report_id, None)
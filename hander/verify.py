@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage, ImageMessage, FollowEvent,
-    QuickReply, QuickReplyButton, MessageAction, ImageSendMessage
+    QuickReply, QuickReplyButton, MessageAction
 )
 from extensions import handler, line_bot_api, db
 from models import Blacklist, Whitelist, TempVerify, StoredValueWallet, StoredValueTransaction
@@ -17,11 +17,11 @@ def get_all_temp_users():
 from hander.admin import ADMIN_IDS
 from utils.menu_helpers import reply_with_menu
 from utils.db_utils import update_or_create_whitelist_from_data
-import re, time, os, shutil, secrets, logging
+from utils.unit_of_work import unit_of_work, savepoint, commit_now
+from utils.push_queue import enqueue_push
+import re, time, os, secrets, logging
 from datetime import datetime, timedelta
 import pytz
-from PIL import Image
-import pytesseract
 
 # ───────────────────────────────────────────────────────────────
 # 全域設定
@@ -72,58 +72,6 @@ EXTRA_NOTICE = (
     "❤️如果有需要刪除總機的好友跟對話，可以再加入總機後索取該總機的QR碼保存❤️"
 )
 
-def maybe_push_coupon_expiry_notice(user_id):
-    """在 12/10~12/31 期間，針對已驗證用戶每日第一次顯示折價券到期提醒。"""
-    try:
-        wl = Whitelist.query.filter_by(line_user_id=user_id).first()
-        if not wl:
-            return
-        wallet = StoredValueWallet.query.filter_by(phone=wl.phone).first()
-        if not wallet:
-            return
-        tz = pytz.timezone("Asia/Taipei")
-        now_dt = datetime.now(tz)
-        notice_start = tz.localize(datetime(now_dt.year, 12, 10, 0, 0, 0))
-        expire_dt = tz.localize(datetime(now_dt.year, 12, 31, 23, 59, 59))
-        if not (notice_start <= now_dt <= expire_dt):
-            return
-        q = StoredValueTransaction.query.filter_by(wallet_id=wallet.id).all()
-        c500 = c300 = c100 = 0
-        for t in q:
-            sign = 1 if t.type == 'topup' else -1
-            c500 += sign * (t.coupon_500_count or 0)
-            c300 += sign * (t.coupon_300_count or 0)
-            c100 += sign * (getattr(t, 'coupon_100_count', 0) or 0)
-        c500 = max(c500, 0)
-        c300 = max(c300, 0)
-        c100 = max(c100, 0)
-        if c500 <= 0 and c300 <= 0 and c100 <= 0:
-            return
-        last = wallet.last_coupon_notice_at
-        show_notice = False
-        if not last:
-            show_notice = True
-        else:
-            last_local = last.astimezone(tz)
-            show_notice = last_local.date() < now_dt.date()
-        if not show_notice:
-            return
-        msg = (
-            f"提醒：您的折價券將於 {expire_dt.strftime('%Y/%m/%d')} 到期。\n"
-            f"目前剩餘：500券 x {c500}、300券 x {c300}、100券 x {c100}"
-        )
-        try:
-            line_bot_api.push_message(user_id, TextSendMessage(text=msg))
-        except Exception:
-            pass
-        wallet.last_coupon_notice_at = datetime.utcnow()
-        try:
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
-    except Exception:
-        logging.exception("maybe_push_coupon_expiry_notice failed")
-
 def make_qr(*labels_texts):
     """快速小工具：產生 QuickReply from tuples(label, text)"""
     return QuickReply(items=[
@@ -149,15 +97,16 @@ def reply_with_choices(event, text, choices):
         TextSendMessage(text=text, quick_reply=make_qr(*choices))
     )
 
-def save_debug_image(temp_path, user_id):
-    """將使用者上傳的截圖複製到 DEBUG 目錄並回傳可公開檢視的 URL。失敗則回傳 None。"""
+def save_debug_image(image_bytes, user_id):
+    """將使用者上傳的截圖寫入 DEBUG 目錄並回傳可公開檢視的 URL。未啟用或失敗則回傳 None。"""
     try:
         if not (OCR_DEBUG_IMAGE_BASEURL and OCR_DEBUG_IMAGE_DIR):
             return None
         os.makedirs(OCR_DEBUG_IMAGE_DIR, exist_ok=True)
-        filename = f"{user_id}_{int(time.time())}.jpg"
+        filename = f"{user_id}_{int(time.time() * 1000)}.jpg"
         dest = os.path.join(OCR_DEBUG_IMAGE_DIR, filename)
-        shutil.copy(temp_path, dest)
+        with open(dest, 'wb') as f:
+            f.write(image_bytes)
         return f"{OCR_DEBUG_IMAGE_BASEURL}/{filename}"
     except Exception:
         logging.exception("save_debug_image failed")
@@ -170,47 +119,42 @@ def upsert_tempverify(phone, line_id=None, nickname=None, line_user_id=None):
     """以 phone 為 key upsert temp_verify 資料，供後台待驗證列表顯示。"""
     try:
         phone_n = normalize_phone(phone)
-        rec = TempVerify.query.filter_by(phone=phone_n).first()
-        if not rec:
-            rec = TempVerify()
-            rec.phone = phone_n
-            db.session.add(rec)
-        # 更新欄位
-        if line_id is not None:
-            rec.line_id = line_id
-        if nickname is not None:
-            rec.nickname = nickname
-        if line_user_id is not None:
-            rec.line_user_id = line_user_id
-        if not rec.status:
-            rec.status = "pending"
-        try:
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
+        with savepoint():
+            rec = TempVerify.query.filter_by(phone=phone_n).first()
+            if not rec:
+                rec = TempVerify()
+                rec.phone = phone_n
+                db.session.add(rec)
+            # 更新欄位
+            if line_id is not None:
+                rec.line_id = line_id
+            if nickname is not None:
+                rec.nickname = nickname
+            if line_user_id is not None:
+                rec.line_user_id = line_user_id
+            if not rec.status:
+                rec.status = "pending"
     except Exception:
         logging.exception("upsert_tempverify failed")
 
 def mark_tempverify_verified_by_phone(phone):
     try:
         phone_n = normalize_phone(phone)
-        rec = TempVerify.query.filter_by(phone=phone_n).first()
-        if rec:
-            rec.status = "verified"
-            db.session.commit()
+        with savepoint():
+            rec = TempVerify.query.filter_by(phone=phone_n).first()
+            if rec:
+                rec.status = "verified"
     except Exception:
-        db.session.rollback()
         logging.exception("mark_tempverify_verified_by_phone failed")
 
 def mark_tempverify_failed_by_phone(phone):
     try:
         phone_n = normalize_phone(phone)
-        rec = TempVerify.query.filter_by(phone=phone_n).first()
-        if rec:
-            rec.status = "failed"
-            db.session.commit()
+        with savepoint():
+            rec = TempVerify.query.filter_by(phone=phone_n).first()
+            if rec:
+                rec.status = "failed"
     except Exception:
-        db.session.rollback()
         logging.exception("mark_tempverify_failed_by_phone failed")
 
 def _find_pending_by_code(code):
@@ -269,12 +213,12 @@ def admin_approve_manual_verify(admin_id, target_user_id):
             f"🕒 {record.created_at.astimezone(tz).strftime('%Y/%m/%d %H:%M:%S')}\n"
             f"管理員已人工核准，驗證完成，歡迎加入。"
         ) + EXTRA_NOTICE
-        line_bot_api.push_message(target_user_id, TextSendMessage(text=msg))
+        enqueue_push(target_user_id, TextSendMessage(text=msg), source="manual_verify")
     except Exception:
         logging.exception("notify user after admin approve failed")
     # 回覆管理員
     try:
-        line_bot_api.push_message(admin_id, TextSendMessage(text=f"已核准 {target_user_id}，寫入白名單：{record.phone}"))
+        enqueue_push(admin_id, TextSendMessage(text=f"已核准 {target_user_id}，寫入白名單：{record.phone}"), source="manual_verify")
     except Exception:
         logging.exception("notify admin after approve failed")
     return True, "已核准"
@@ -304,11 +248,11 @@ def admin_reject_manual_verify(admin_id, target_user_id):
     except Exception:
         logging.exception("mark_tempverify_failed_by_phone (admin reject) failed")
     try:
-        line_bot_api.push_message(target_user_id, TextSendMessage(text="管理員已拒絕您的手動驗證申請，請重新聯絡客服或重新申請。"))
+        enqueue_push(target_user_id, TextSendMessage(text="管理員已拒絕您的手動驗證申請，請重新聯絡客服或重新申請。"), source="manual_verify")
     except Exception:
         logging.exception("notify user after admin reject failed")
     try:
-        line_bot_api.push_message(admin_id, TextSendMessage(text=f"已拒絕 {target_user_id}"))
+        enqueue_push(admin_id, TextSendMessage(text=f"已拒絕 {target_user_id}"), source="manual_verify")
     except Exception:
         logging.exception("notify admin after reject failed")
     return True, "已拒絕"
@@ -420,24 +364,23 @@ def handle_text(event):
             rem100 = max(c100, 0)
             if rem500 > 0 or rem300 > 0 or rem100 > 0:
                 try:
-                    expire_txn = StoredValueTransaction()
-                    expire_txn.wallet_id = wallet.id
-                    expire_txn.type = 'consume'
-                    expire_txn.amount = 0
-                    expire_txn.remark = f"優惠券到期自動清除 {expire_dt.strftime('%Y/%m/%d')}"
-                    expire_txn.coupon_500_count = rem500
-                    expire_txn.coupon_300_count = rem300
-                    expire_txn.coupon_100_count = rem100
-                    db.session.add(expire_txn)
-                    db.session.commit()
+                    with savepoint():
+                        expire_txn = StoredValueTransaction()
+                        expire_txn.wallet_id = wallet.id
+                        expire_txn.type = 'consume'
+                        expire_txn.amount = 0
+                        expire_txn.remark = f"優惠券到期自動清除 {expire_dt.strftime('%Y/%m/%d')}"
+                        expire_txn.coupon_500_count = rem500
+                        expire_txn.coupon_300_count = rem300
+                        expire_txn.coupon_100_count = rem100
+                        db.session.add(expire_txn)
                 except Exception:
-                    db.session.rollback()
+                    logging.exception("expire coupons in reply_wallet failed")
             c500 = c300 = c100 = 0
         else:
             c500 = max(c500, 0)
             c300 = max(c300, 0)
             c100 = max(c100, 0)
-        maybe_push_coupon_expiry_notice(user_id)
         txn_boxes = []
         if not txns:
             txn_boxes.append({"type": "text", "text": "(尚無交易紀錄)", "size": "sm", "color": "#999999"})
@@ -546,13 +489,9 @@ def handle_text(event):
             )
             reply_with_menu(event.reply_token, reply)
             try:
-                line_bot_api.push_message(user_id, TextSendMessage(text=EXTRA_NOTICE))
+                enqueue_push(user_id, TextSendMessage(text=EXTRA_NOTICE), source="extra_notice")
             except Exception:
                 logging.exception("push EXTRA_NOTICE after existing whitelist view failed")
-            try:
-                maybe_push_coupon_expiry_notice(user_id)
-            except Exception:
-                logging.exception("expiry notice after whitelist view failed")
         else:
             reply_with_reverify(event, "⚠️ 已驗證，若要查看資訊請輸入您當時驗證的手機號碼或輸入『儲值金』查錢包。")
         return
@@ -601,11 +540,12 @@ def handle_text(event):
                 return
             # 綁定 line_user_id（若尚未綁定）
             if wl.line_user_id != user_id:
-                wl.line_user_id = user_id
                 try:
-                    db.session.commit()
+                    with savepoint():
+                        wl.line_user_id = user_id
                 except Exception:
-                    db.session.rollback()
+                    logging.exception("bind line_user_id failed")
+                commit_now()
             # 回覆主選單
             reply = (
                 f"📱 {wl.phone}\n"
@@ -618,13 +558,9 @@ def handle_text(event):
             )
             reply_with_menu(event.reply_token, reply)
             try:
-                line_bot_api.push_message(user_id, TextSendMessage(text=EXTRA_NOTICE))
+                enqueue_push(user_id, TextSendMessage(text=EXTRA_NOTICE), source="extra_notice")
             except Exception:
                 logging.exception("push EXTRA_NOTICE after phone bind failed")
-            try:
-                maybe_push_coupon_expiry_notice(user_id)
-            except Exception:
-                logging.exception("expiry notice after phone bind failed")
             pop_temp_user(user_id)
             return
     if not get_temp_user(user_id) and re.match(r"^09\d{8}$", phone_candidate):
@@ -728,12 +664,13 @@ def handle_text(event):
         )
         try:
             from linebot.models import ImageSendMessage
-            line_bot_api.push_message(
+            enqueue_push(
                 user_id,
                 ImageSendMessage(
                     original_content_url="https://github.com/Suan0503/Test_Mod/blob/main/static/example_line_screenshot.jpg?raw=true",
                     preview_image_url="https://github.com/Suan0503/Test_Mod/blob/main/static/example_line_screenshot.jpg?raw=true"
-                )
+                ),
+                source="screenshot_example"
             )
         except Exception:
             pass
@@ -756,107 +693,9 @@ def handle_text(event):
 # ───────────────────────────────────────────────────────────────
 @handler.add(MessageEvent, message=ImageMessage)
 def handle_image(event):
-    user_id = event.source.user_id
-    tu = get_temp_user(user_id)
-    if not tu or tu.get("step") != "waiting_screenshot":
-        reply_with_reverify(event, "請先完成前面步驟後再上傳截圖唷～")
-        return
-
-    message_content = line_bot_api.get_message_content(event.message.id)
-    tmp_dir = "/tmp/ocr_inbox"
-    os.makedirs(tmp_dir, exist_ok=True)
-    temp_path = os.path.join(tmp_dir, f"{user_id}_{int(time.time())}.jpg")
-    with open(temp_path, 'wb') as f:
-        for chunk in message_content.iter_content():
-            f.write(chunk)
-
-    expected_line_id = (tu.get("line_id") or "").strip()
-    try:
-        image = Image.open(temp_path)
-        ocr_text = pytesseract.image_to_string(image)
-        ocr_text_low = (ocr_text or "").lower()
-
-        def fast_pass():
-            tz = pytz.timezone("Asia/Taipei")
-            data = tu
-            now = datetime.now(tz)
-            data["date"] = now.strftime("%Y-%m-%d")
-            record, _ = update_or_create_whitelist_from_data(
-                data, user_id, reverify=tu.get("reverify", False)
-            )
-            # 標記 TempVerify 為 verified
-            try:
-                mark_tempverify_verified_by_phone(record.phone)
-            except Exception:
-                logging.exception("mark_tempverify_verified_by_phone (fast_pass) failed")
-            reply = (
-                f"📱 {record.phone}\n"
-                f"🌸 暱稱：{record.name or '用戶'}\n"
-                f"🔗 LINE ID：{record.line_id or '未登記'}\n"
-                f"🕒 {record.created_at.astimezone(tz).strftime('%Y/%m/%d %H:%M:%S')}\n"
-                f"✅ 驗證成功，歡迎加入茗殿\n"
-                f"🌟 加入密碼：ming666"
-            )
-            reply_with_menu(event.reply_token, reply)
-            try:
-                line_bot_api.push_message(user_id, TextSendMessage(text=EXTRA_NOTICE))
-            except Exception:
-                logging.exception("push EXTRA_NOTICE after fast_pass failed")
-            try:
-                maybe_push_coupon_expiry_notice(user_id)
-            except Exception:
-                logging.exception("expiry notice after fast_pass failed")
-            pop_temp_user(user_id)
-
-        # 修正：用 .strip().lower() 強化容錯
-        if expected_line_id.strip().lower() in ["尚未設定", "未設定", "無", "none", "not set"]:
-            fast_pass()
-            return
-
-        if expected_line_id and expected_line_id.strip().lower() in ocr_text_low:
-            fast_pass()
-            return
-
-        public_url = save_debug_image(temp_path, user_id)
-        preview_note = ""
-        preview_msg = []
-        if public_url:
-            preview_note = "\n📷 這是我們辨識用的截圖預覽（僅你可見）："
-            preview_msg.append(ImageSendMessage(original_content_url=public_url, preview_image_url=public_url))
-
-        warn = (
-            "⚠️ 截圖中的內容無法對上您剛輸入的 LINE ID。\n"
-            "以下是 OCR 辨識到的重點文字（供你核對）：\n"
-            "——— OCR ———\n"
-            f"{ocr_text.strip()[:900] or '（無文字或辨識失敗）'}\n"
-            "———————\n"
-            "請選擇：重新上傳 / 重新輸入LINE ID / 重新驗證（從頭）。"
-            f"{preview_note}"
-        )
-        tu["step"] = "waiting_confirm_after_ocr"
-        set_temp_user(user_id, tu)
-        text_msg = TextSendMessage(
-            text=warn,
-            quick_reply=make_qr(
-                ("重新上傳", "重新上傳"),
-                ("重新輸入LINE ID", "重新輸入LINE ID"),
-                ("重新驗證", "重新驗證")
-            )
-        )
-        if preview_msg:
-            line_bot_api.reply_message(event.reply_token, [text_msg] + preview_msg)
-        else:
-            line_bot_api.reply_message(event.reply_token, text_msg)
-
-    except Exception:
-        logging.exception("handle_image error")
-        reply_with_reverify(event, "⚠️ 圖片處理失敗，請重新上傳或改由客服協助。")
-    finally:
-        if os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except Exception:
-                pass
+    """截圖驗證統一由 hander/image.py（hander/verify_pipeline.py）處理，避免重複下載與 OCR。"""
+    from hander.image import handle_image as _handle_image
+    return _handle_image(event)
 
 # ───────────────────────────────────────────────────────────────
 # 4) OCR/手動驗證後的確認處理
@@ -909,6 +748,7 @@ def handle_post_ocr_confirm(event):
                 mark_tempverify_verified_by_phone(record.phone)
             except Exception:
                 logging.exception("mark_tempverify_verified_by_phone (post_ocr user confirm) failed")
+            commit_now()
             reply = (
                 f"📱 {record.phone}\n"
                 f"🌸 暱稱：{record.name or '用戶'}\n"
@@ -919,13 +759,9 @@ def handle_post_ocr_confirm(event):
             )
             reply_with_menu(event.reply_token, reply)
             try:
-                line_bot_api.push_message(user_id, TextSendMessage(text=EXTRA_NOTICE))
+                enqueue_push(user_id, TextSendMessage(text=EXTRA_NOTICE), source="extra_notice")
             except Exception:
                 logging.exception("push EXTRA_NOTICE after post_ocr confirm failed")
-            try:
-                maybe_push_coupon_expiry_notice(user_id)
-            except Exception:
-                logging.exception("expiry notice after post_ocr confirm failed")
             pop_temp_user(user_id)
             return True
         # 管理員人工驗證流程
@@ -947,6 +783,7 @@ def handle_post_ocr_confirm(event):
                     mark_tempverify_verified_by_phone(record.phone)
                 except Exception:
                     logging.exception("mark_tempverify_verified_by_phone (admin manual 1) failed")
+                commit_now()
                 reply = (
                     f"📱 {record.phone}\n"
                     f"🌸 暱稱：{record.name or '用戶'}\n"
@@ -957,13 +794,9 @@ def handle_post_ocr_confirm(event):
                 )
                 reply_with_menu(event.reply_token, reply)
                 try:
-                    line_bot_api.push_message(user_id, TextSendMessage(text=EXTRA_NOTICE))
+                    enqueue_push(user_id, TextSendMessage(text=EXTRA_NOTICE), source="extra_notice")
                 except Exception:
                     logging.exception("push EXTRA_NOTICE after manual verify confirm failed")
-                try:
-                    maybe_push_coupon_expiry_notice(user_id)
-                except Exception:
-                    logging.exception("expiry notice after manual verify confirm failed")
                 manual_verify_pending.pop(user_id, None)
                 pop_temp_user(user_id)
                 return True
@@ -1008,6 +841,7 @@ def handle_post_ocr_confirm(event):
 
     return False
 
+@unit_of_work("verify:text")
 def handle_verify(event):
     try:
         if hasattr(event, "message") and event.message is not None:
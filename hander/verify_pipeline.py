@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+截圖驗證流程（統一版）：fetch → preprocess → ocr → extract → match → persist
+
+原本 hander/image.py 與 hander/verify.py 各有一套下載 / OCR / 比對 / 寫庫，
+現在兩個入口都走這裡，OCR 只做一次（分層辨識 + 圖片雜湊快取，見 utils/image_verification.py）。
+
+比對規則可抽換（VERIFY_MATCHER 環境變數或 run(matcher=...)）：
+  strict   手機與 LINE ID 皆需與輸入相符且格式正確（原 hander/image.py）
+  line_id  OCR 全文包含輸入的 LINE ID 即通過（原 hander/verify.py）
+自訂規則以 register_matcher() 註冊，需提供 name / need_phone / mismatch_step / match(ctx)。
+
+每個階段的耗時記錄在 ctx.timings，並累計到 stage_stats() 與 Prometheus verify_stage_duration_seconds。
+"""
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import pytz
+
+from utils.image_verification import (
+    download_message_image, open_image, recognize, normalize_phone, ImageTooLarge, LINE_ID_NOT_SET,
+)
+from utils.temp_users import set_temp_user
+from utils.db_utils import update_or_create_whitelist_from_data
+from utils.metrics import ocr_result, observe_verify_stage
+from hander.verify import mark_tempverify_verified_by_phone
+
+VERIFY_MATCHER = os.getenv("VERIFY_MATCHER", "strict")
+
+STAGES = ("fetch", "preprocess", "ocr", "extract", "match", "persist")
+PHONE_FORMAT = re.compile(r"^09\d{8}$")
+LINE_ID_FORMAT = re.compile(r"^[A-Za-z0-9_\-\.]+$")
+
+# 比對結果
+PASS = "pass"            # 自動通過，已寫入白名單
+CONFIRM = "confirm"      # 資料吻合，待使用者回覆 1 確認
+MISMATCH = "mismatch"    # 不符
+TOO_LARGE = "too_large"  # 圖片超過大小上限
+ERROR = "error"
+
+
+class VerificationContext:
+    """單次截圖驗證的狀態；各階段依序填入。"""
+
+    def __init__(self, user_id, message_id, temp_user):
+        self.user_id = user_id
+        self.message_id = message_id
+        self.temp_user = temp_user
+        self.expected_phone = temp_user.get("phone")
+        self.expected_line_id = (temp_user.get("line_id") or "").strip() or None
+        self.image_bytes = None
+        self.image = None
+        self.ocr = None
+        self.phone = None
+        self.line_id = None
+        self.text = ""
+        self.outcome = None
+        self.record = None
+        self.error = None
+        self.stage = None
+        self.timings = {}
+
+
+# ───────────────────────────────────────────────────────────────
+# 比對規則
+# ───────────────────────────────────────────────────────────────
+class StrictMatcher:
+    name = "strict"
+    need_phone = True
+    mismatch_step = "waiting_screenshot"  # 不符時維持等待截圖，請使用者重傳
+
+    def match(self, ctx):
+        phone = ctx.phone
+        input_phone = normalize_phone(ctx.expected_phone) if ctx.expected_phone else None
+        input_lineid = ctx.expected_line_id
+        lineid = ctx.line_id
+        phone_ok = bool(phone) and phone == input_phone and bool(PHONE_FORMAT.match(phone))
+        lineid_format_ok = bool(lineid) and 3 <= len(lineid) <= 20 and bool(LINE_ID_FORMAT.match(lineid))
+        lineid_match = bool(lineid) and input_lineid is not None and lineid.lower() == input_lineid.lower()
+
+        # OCR 與手動輸入完全吻合且格式正確才自動通關
+        if phone_ok and lineid_match and lineid_format_ok:
+            return PASS
+        # LINE ID 尚未設定時，僅允許手機完全正確
+        if input_lineid == "尚未設定":
+            return CONFIRM if phone_ok else MISMATCH
+        if phone_ok and (lineid_match or lineid == "尚未設定") and lineid_format_ok:
+            return CONFIRM
+        return MISMATCH
+
+
+class LineIdMatcher:
+    name = "line_id"
+    need_phone = False
+    mismatch_step = "waiting_confirm_after_ocr"  # 不符時讓使用者選擇重傳 / 重新輸入 LINE ID
+
+    def match(self, ctx):
+        expected = (ctx.expected_line_id or "").lower()
+        if expected in LINE_ID_NOT_SET:
+            return PASS
+        if expected and (expected == (ctx.line_id or "").lower() or expected in (ctx.text or "").lower()):
+            return PASS
+        return MISMATCH
+
+
+_matchers = {}
+
+
+def register_matcher(matcher):
+    _matchers[matcher.name] = matcher
+    return matcher
+
+
+def get_matcher(name=None):
+    return _matchers.get(name or VERIFY_MATCHER) or _matchers["strict"]
+
+
+register_matcher(StrictMatcher())
+register_matcher(LineIdMatcher())
+
+
+# ───────────────────────────────────────────────────────────────
+# 階段
+# ───────────────────────────────────────────────────────────────
+def fetch(ctx, api):
+    ctx.image_bytes = download_message_image(api, ctx.message_id)
+
+
+def preprocess(ctx, matcher):
+    # 只有在真的要跑 OCR 時才解碼（LINE ID 尚未設定時 line_id 規則直接通過）
+    if matcher.name == "line_id" and (ctx.expected_line_id or "").lower() in LINE_ID_NOT_SET:
+        return
+    ctx.image = open_image(ctx.image_bytes)
+
+
+def ocr(ctx, matcher):
+    if ctx.image is None:
+        return
+    ctx.ocr = recognize(ctx.image, image_bytes=ctx.image_bytes,
+                        expected_phone=ctx.expected_phone if matcher.need_phone else None,
+                        expected_line_id=ctx.expected_line_id, user_id=ctx.user_id,
+                        need_phone=matcher.need_phone)
+
+
+def extract(ctx):
+    if not ctx.ocr:
+        return
+    ctx.text = ctx.ocr.get("text") or ""
+    ctx.phone = normalize_phone(ctx.ocr["phone"]) if ctx.ocr.get("phone") else None
+    ctx.line_id = ctx.ocr.get("line_id")
+
+
+def match(ctx, matcher):
+    ctx.outcome = matcher.match(ctx)
+
+
+def persist(ctx, matcher):
+    """PASS 時不清除暫存流程資料：由呼叫端在 commit 成功後 pop_temp_user，commit 失敗時使用者仍可重傳截圖。"""
+    tu = ctx.temp_user
+    if ctx.outcome == PASS:
+        now = datetime.now(pytz.timezone("Asia/Taipei"))
+        data = {
+            "phone": tu.get("phone"),
+            "name": tu.get("name"),
+            "line_id": tu.get("line_id"),
+            "date": now.strftime("%Y/%m/%d %H:%M:%S"),
+            "reason": "OCR自動通過",
+        }
+        ctx.record, _ = update_or_create_whitelist_from_data(data, ctx.user_id, reverify=tu.get("reverify", False))
+        try:
+            mark_tempverify_verified_by_phone(ctx.record.phone)
+        except Exception:
+            logging.exception("mark_tempverify_verified_by_phone (pipeline) failed")
+    elif ctx.outcome == CONFIRM:
+        tu["step"] = "waiting_confirm"
+        set_temp_user(ctx.user_id, tu)
+    elif ctx.outcome == MISMATCH and tu.get("step") != matcher.mismatch_step:
+        tu["step"] = matcher.mismatch_step
+        set_temp_user(ctx.user_id, tu)
+
+
+# ───────────────────────────────────────────────────────────────
+# 執行與統計
+# ───────────────────────────────────────────────────────────────
+_stats_lock = threading.Lock()
+_stage_stats = {}   # stage -> {"count", "ms"}
+_outcomes = {}      # outcome -> count
+
+
+def _timed(ctx, stage, fn, *args):
+    ctx.stage = stage
+    t0 = time.perf_counter()
+    try:
+        return fn(ctx, *args)
+    finally:
+        seconds = time.perf_counter() - t0
+        ctx.timings[stage] = round(seconds * 1000.0, 2)
+        observe_verify_stage(stage, seconds)
+        with _stats_lock:
+            st = _stage_stats.setdefault(stage, {"count": 0, "ms": 0.0})
+            st["count"] += 1
+            st["ms"] += seconds * 1000.0
+
+
+def run(api, user_id, message_id, temp_user, matcher=None):
+    """執行整個驗證流程並回傳 VerificationContext（outcome 之一：pass / confirm / mismatch / too_large / error）。"""
+    matcher = matcher if hasattr(matcher, "match") else get_matcher(matcher)
+    ctx = VerificationContext(user_id, message_id, temp_user)
+    try:
+        _timed(ctx, "fetch", fetch, api)
+        _timed(ctx, "preprocess", preprocess, matcher)
+        _timed(ctx, "ocr", ocr, matcher)
+        _timed(ctx, "extract", extract)
+        _timed(ctx, "match", match, matcher)
+        _timed(ctx, "persist", persist, matcher)
+    except ImageTooLarge:
+        ctx.outcome = TOO_LARGE
+    except Exception as e:
+        logging.exception("verify pipeline failed at stage %s", ctx.stage)
+        ctx.outcome = ERROR
+        ctx.error = e
+    ocr_result(matcher.name, ctx.outcome)
+    with _stats_lock:
+        _outcomes[ctx.outcome] = _outcomes.get(ctx.outcome, 0) + 1
+    logging.info(f"[VerifyPipeline] user_id={user_id} matcher={matcher.name} outcome={ctx.outcome} timings={ctx.timings}")
+    return ctx
+
+
+def stage_stats():
+    with _stats_lock:
+        return {
+            "stages": {
+                stage: {"count": st["count"], "avg_ms": round(st["ms"] / st["count"], 2) if st["count"] else None}
+                for stage, st in _stage_stats.items()
+            },
+            "outcomes": dict(_outcomes),
+        }
+
+
+def reset_stage_stats():
+    with _stats_lock:
+        _stage_stats.clear()
+        _outcomes.clear()
@@ -0,0 +1,56 @@
+"""add indexes for whitelist/blacklist/temp_verify/stored_value_txn hot columns
+
+Revision ID: 0004_add_hot_indexes
+Revises: 0003_add_wallet_notice
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_add_hot_indexes'
+down_revision = '0003_add_wallet_notice'
+branch_labels = None
+depends_on = None
+
+
+# (index 名稱, 資料表, 欄位)
+INDEXES = [
+    ('ix_temp_verify_phone', 'temp_verify', ['phone']),
+    ('ix_temp_verify_line_user_id', 'temp_verify', ['line_user_id']),
+    ('ix_temp_verify_status_created_at', 'temp_verify', ['status', 'created_at']),
+    ('ix_whitelist_name', 'whitelist', ['name']),
+    ('ix_whitelist_line_id', 'whitelist', ['line_id']),
+    ('ix_whitelist_created_at', 'whitelist', ['created_at']),
+    ('ix_blacklist_name', 'blacklist', ['name']),
+    ('ix_blacklist_created_at', 'blacklist', ['created_at']),
+    ('ix_stored_value_txn_created_at', 'stored_value_txn', ['created_at']),
+    ('ix_stored_value_txn_type_created_at', 'stored_value_txn', ['type', 'created_at']),
+]
+
+
+def _existing_indexes(bind, table_name):
+    insp = inspect(bind)
+    try:
+        return {ix['name'] for ix in insp.get_indexes(table_name)}
+    except Exception:
+        return None  # 資料表不存在
+
+
+def upgrade():
+    bind = op.get_bind()
+    for name, table, cols in INDEXES:
+        existing = _existing_indexes(bind, table)
+        if existing is None or name in existing:
+            continue
+        op.create_index(name, table, cols)
+
+
+def downgrade():
+    bind = op.get_bind()
+    for name, table, _cols in reversed(INDEXES):
+        existing = _existing_indexes(bind, table)
+        if existing and name in existing:
+            op.drop_index(name, table_name=table)
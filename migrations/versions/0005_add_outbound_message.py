@@ -0,0 +1,40 @@
+"""add outbound_message table for the background push queue
+
+Revision ID: 0005_add_outbound_message
+Revises: 0004_add_hot_indexes
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_add_outbound_message'
+down_revision = '0004_add_hot_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'outbound_message',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('to_id', sa.String(length=255), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('source', sa.String(length=50), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_outbound_message_status_next_attempt', 'outbound_message', ['status', 'next_attempt_at'])
+    op.create_index('ix_outbound_message_to_id_id', 'outbound_message', ['to_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_outbound_message_to_id_id', table_name='outbound_message')
+    op.drop_index('ix_outbound_message_status_next_attempt', table_name='outbound_message')
+    op.drop_table('outbound_message')
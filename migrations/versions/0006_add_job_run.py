@@ -0,0 +1,38 @@
+"""add job_run table for scheduler run history
+
+Revision ID: 0006_add_job_run
+Revises: 0005_add_outbound_message
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_add_job_run'
+down_revision = '0005_add_outbound_message'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'job_run',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('job_id', sa.String(length=100), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('duration_ms', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('host', sa.String(length=255), nullable=True),
+    )
+    op.create_index('ix_job_run_started_at', 'job_run', ['started_at'])
+    op.create_index('ix_job_run_job_id_started_at', 'job_run', ['job_id', 'started_at'])
+
+
+def downgrade():
+    op.drop_index('ix_job_run_job_id_started_at', table_name='job_run')
+    op.drop_index('ix_job_run_started_at', table_name='job_run')
+    op.drop_table('job_run')
@@ -0,0 +1,64 @@
+"""add campaign and campaign_delivery tables for broadcast campaigns
+
+Revision ID: 0007_add_campaign
+Revises: 0006_add_job_run
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_add_campaign'
+down_revision = '0006_add_job_run'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'campaign',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('audience', sa.String(length=50), nullable=False),
+        sa.Column('audience_params', sa.Text(), nullable=True),
+        sa.Column('mode', sa.String(length=20), nullable=False, server_default='multicast'),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='draft'),
+        sa.Column('scheduled_at', sa.DateTime(), nullable=True),
+        sa.Column('total', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('sent_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('failed_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('audience_group_id', sa.String(length=100), nullable=True),
+        sa.Column('request_id', sa.String(length=100), nullable=True),
+        sa.Column('retry_key', sa.String(length=36), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_by', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_campaign_status_scheduled_at', 'campaign', ['status', 'scheduled_at'])
+
+    op.create_table(
+        'campaign_delivery',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('campaign_id', sa.Integer(), nullable=False),
+        sa.Column('line_user_id', sa.String(length=255), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('batch_key', sa.String(length=36), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('error', sa.String(length=255), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.UniqueConstraint('campaign_id', 'line_user_id', name='uq_campaign_delivery_campaign_user'),
+    )
+    op.create_index('ix_campaign_delivery_campaign_status_id', 'campaign_delivery',
+                    ['campaign_id', 'status', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_campaign_delivery_campaign_status_id', table_name='campaign_delivery')
+    op.drop_table('campaign_delivery')
+    op.drop_index('ix_campaign_status_scheduled_at', table_name='campaign')
+    op.drop_table('campaign')
@@ -0,0 +1,84 @@
+"""add promo_event table (event / banner calendar)
+
+Revision ID: 0008_add_promo_event
+Revises: 0007_add_campaign
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_add_promo_event'
+down_revision = '0007_add_campaign'
+branch_labels = None
+depends_on = None
+
+_STATIC = "https://raw.githubusercontent.com/Suan0503/Test_Mod/refs/heads/main/static/"
+
+
+def upgrade():
+    promo_event = op.create_table(
+        'promo_event',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('kind', sa.String(length=20), nullable=False, server_default='promo'),
+        sa.Column('title', sa.String(length=255), nullable=False),
+        sa.Column('text', sa.Text(), nullable=True),
+        sa.Column('image_url', sa.String(length=500), nullable=True),
+        sa.Column('start_at', sa.DateTime(), nullable=False),
+        sa.Column('end_at', sa.DateTime(), nullable=False),
+        sa.Column('priority', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('enabled', sa.Boolean(), nullable=False, server_default=sa.true()),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_promo_event_end_at', 'promo_event', ['end_at'])
+
+    # 原本寫死在 hander/entrypoint.py 的 2025/9 活動（時間換算為 UTC）
+    now = datetime.utcnow()
+    op.bulk_insert(promo_event, [
+        {
+            'kind': 'banner', 'title': '茗殿學院祭前導圖', 'text': None,
+            'image_url': _STATIC + '20250904.jpg',
+            'start_at': datetime(2025, 8, 31, 16, 0), 'end_at': datetime(2025, 9, 9, 16, 0),
+            'priority': 0, 'enabled': True, 'created_at': now, 'updated_at': now,
+        },
+        {
+            'kind': 'promo', 'title': '茗殿好鄰居 1+1 活動',
+            'text': (
+                "🌸 茗殿好鄰居 1+1 活動 🌸\n"
+                "⏰ 即日起～9月底\n\n"
+                "💌 邀好友‧齊享優惠\n"
+                "✔️ 邀請好友加入並完成驗證：\n"
+                "\t• 邀請人 🎁 折價券 200 元\n"
+                "\t• 受邀人 🎁 折價券 100 元\n\n"
+                "👭 一起來更划算！\n"
+                "當日兩人同行預約 👉 現折 100 元\n\n"
+                "⚡溫馨提醒：\n領取折價券時，記得主動告知活動喔！"
+            ),
+            'image_url': _STATIC + '%E5%A5%BD%E9%84%B0%E5%B1%851%2B1.png',
+            'start_at': datetime(2025, 8, 31, 16, 0), 'end_at': datetime(2025, 9, 30, 16, 0),
+            'priority': 0, 'enabled': True, 'created_at': now, 'updated_at': now,
+        },
+        {
+            'kind': 'promo', 'title': '茗殿學院祭 — 少女的邀請',
+            'text': (
+                "🏫✨ 茗殿學院祭 — 少女的邀請 ✨🏫\n"
+                "⏰ 活動期間：9/10～9/30\n\n"
+                "🎀 妹妹們換上 清純校服，帶來滿滿青春氣息 💕\n"
+                "🎁 特別準備了 祭典限定特典，\n只送給參加的有緣人！（數量有限，送完為止）\n\n"
+                "🌸 在這個屬於學院的季節，\n快來和妹妹們留下專屬回憶吧！"
+            ),
+            'image_url': None,
+            'start_at': datetime(2025, 9, 9, 16, 0), 'end_at': datetime(2025, 9, 30, 16, 0),
+            'priority': 1, 'enabled': True, 'created_at': now, 'updated_at': now,
+        },
+    ])
+
+
+def downgrade():
+    op.drop_index('ix_promo_event_end_at', table_name='promo_event')
+    op.drop_table('promo_event')
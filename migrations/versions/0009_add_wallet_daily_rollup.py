@@ -0,0 +1,42 @@
+"""add wallet_daily_rollup table for reconciliation reports
+
+Revision ID: 0009_add_wallet_daily_rollup
+Revises: 0008_add_promo_event
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_add_wallet_daily_rollup'
+down_revision = '0008_add_promo_event'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 既有交易的彙總由應用程式啟動時自動 backfill（或 flask wallet-rollup backfill）
+    op.create_table(
+        'wallet_daily_rollup',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('business_date', sa.Date(), nullable=False),
+        sa.Column('type', sa.String(length=20), nullable=False),
+        sa.Column('payment_method', sa.String(length=50), nullable=False, server_default=''),
+        sa.Column('off_hours', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('txn_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('amount_sum', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('coupon_500_sum', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('coupon_300_sum', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('coupon_100_sum', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('coupon_only_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('coupon_only_coupons', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.UniqueConstraint('business_date', 'type', 'payment_method', 'off_hours',
+                            name='uq_wallet_daily_rollup_key'),
+    )
+
+
+def downgrade():
+    op.drop_table('wallet_daily_rollup')
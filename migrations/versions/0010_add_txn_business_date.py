@@ -0,0 +1,47 @@
+"""add generated business_date column to stored_value_txn
+
+Revision ID: 0010_add_txn_business_date
+Revises: 0009_add_wallet_daily_rollup
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_add_txn_business_date'
+down_revision = '0009_add_wallet_daily_rollup'
+branch_labels = None
+depends_on = None
+
+
+# 會計日 = 台北時間減 3 小時後的日期（與 utils/business_calendar.py 的 business_date_of 相同）
+BUSINESS_DATE_SQL = {
+    'postgresql': "CAST(date_trunc('day', ((created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Taipei') - INTERVAL '3 hours')) AS DATE)",
+    'sqlite': "date(created_at, '+5 hours')",
+}
+INDEX_NAME = 'ix_stored_value_txn_type_business_date'
+
+
+def upgrade():
+    bind = op.get_bind()
+    insp = inspect(bind)
+    cols = {c['name'] for c in insp.get_columns('stored_value_txn')}
+    if 'business_date' not in cols:
+        dialect = bind.dialect.name
+        # SQLite 的 ALTER TABLE 只能加 VIRTUAL generated column（一樣可以建索引）；PostgreSQL 12+ 只支援 STORED
+        op.add_column('stored_value_txn', sa.Column(
+            'business_date', sa.Date(),
+            sa.Computed(BUSINESS_DATE_SQL.get(dialect, BUSINESS_DATE_SQL['postgresql']),
+                        persisted=(dialect != 'sqlite')),
+        ))
+    existing = {ix['name'] for ix in insp.get_indexes('stored_value_txn')}
+    if INDEX_NAME not in existing:
+        op.create_index(INDEX_NAME, 'stored_value_txn', ['type', 'business_date'])
+
+
+def downgrade():
+    op.drop_index(INDEX_NAME, table_name='stored_value_txn')
+    op.drop_column('stored_value_txn', 'business_date')
@@ -0,0 +1,52 @@
+"""add wallet_txn_issue and wallet_repair_log tables for the wallet repair job
+
+Revision ID: 0011_add_wallet_repair
+Revises: 0010_add_txn_business_date
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011_add_wallet_repair'
+down_revision = '0010_add_txn_business_date'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'wallet_txn_issue',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('txn_id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('wallet_id', sa.Integer(), nullable=True),
+        sa.Column('detected_at', sa.DateTime(), nullable=False),
+        sa.Column('last_seen_at', sa.DateTime(), nullable=False),
+        sa.UniqueConstraint('txn_id'),
+    )
+    op.create_index('ix_wallet_txn_issue_kind', 'wallet_txn_issue', ['kind'])
+    op.create_table(
+        'wallet_repair_log',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('action', sa.String(length=30), nullable=False),
+        sa.Column('txn_id', sa.Integer(), nullable=True),
+        sa.Column('wallet_id', sa.Integer(), nullable=True),
+        sa.Column('detail', sa.Text(), nullable=True),
+        sa.Column('source', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_wallet_repair_log_txn_id', 'wallet_repair_log', ['txn_id'])
+    op.create_index('ix_wallet_repair_log_wallet_id', 'wallet_repair_log', ['wallet_id'])
+    op.create_index('ix_wallet_repair_log_created_at', 'wallet_repair_log', ['created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_wallet_repair_log_created_at', table_name='wallet_repair_log')
+    op.drop_index('ix_wallet_repair_log_wallet_id', table_name='wallet_repair_log')
+    op.drop_index('ix_wallet_repair_log_txn_id', table_name='wallet_repair_log')
+    op.drop_table('wallet_repair_log')
+    op.drop_index('ix_wallet_txn_issue_kind', table_name='wallet_txn_issue')
+    op.drop_table('wallet_txn_issue')
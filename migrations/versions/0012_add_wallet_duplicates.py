@@ -0,0 +1,42 @@
+"""add duplicate-detection index on stored_value_txn and wallet_duplicate_candidate table
+
+Revision ID: 0012_add_wallet_duplicates
+Revises: 0011_add_wallet_repair
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0012_add_wallet_duplicates'
+down_revision = '0011_add_wallet_repair'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_stored_value_txn_dup_key', 'stored_value_txn',
+                    ['type', 'wallet_id', 'amount', 'created_at'])
+    op.create_table(
+        'wallet_duplicate_candidate',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('txn_id', sa.Integer(), nullable=False),
+        sa.Column('duplicate_of', sa.Integer(), nullable=False),
+        sa.Column('wallet_id', sa.Integer(), nullable=True),
+        sa.Column('amount', sa.Integer(), nullable=True),
+        sa.Column('gap_minutes', sa.Float(), nullable=True),
+        sa.Column('txn_created_at', sa.DateTime(), nullable=True),
+        sa.Column('detected_at', sa.DateTime(), nullable=False),
+        sa.UniqueConstraint('txn_id'),
+    )
+    op.create_index('ix_wallet_duplicate_candidate_wallet_id', 'wallet_duplicate_candidate', ['wallet_id'])
+    op.create_index('ix_wallet_duplicate_candidate_txn_created_at', 'wallet_duplicate_candidate', ['txn_created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_wallet_duplicate_candidate_txn_created_at', table_name='wallet_duplicate_candidate')
+    op.drop_index('ix_wallet_duplicate_candidate_wallet_id', table_name='wallet_duplicate_candidate')
+    op.drop_table('wallet_duplicate_candidate')
+    op.drop_index('ix_stored_value_txn_dup_key', table_name='stored_value_txn')
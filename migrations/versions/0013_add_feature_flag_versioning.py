@@ -0,0 +1,50 @@
+"""add config_version table and per-company uniqueness for feature_flag
+
+Revision ID: 0013_add_feature_flag_versioning
+Revises: 0012_add_wallet_duplicates
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = '0013_add_feature_flag_versioning'
+down_revision = '0012_add_wallet_duplicates'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'config_version',
+        sa.Column('name', sa.String(length=50), primary_key=True),
+        sa.Column('version', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+
+    # feature_flag 由 create_all 建立（不在遷移內）；存在時才調整唯一約束
+    bind = op.get_bind()
+    insp = inspect(bind)
+    if 'feature_flag' not in insp.get_table_names():
+        return
+    if bind.dialect.name == 'postgresql':
+        # 原本 key 全域唯一，公司層級的旗標無法與全域同 key 並存
+        op.execute('ALTER TABLE feature_flag DROP CONSTRAINT IF EXISTS feature_flag_key_key')
+        op.create_unique_constraint('uq_feature_flag_key_company', 'feature_flag', ['key', 'company_id'])
+    # SQLite 的行內 UNIQUE(key) 無法單獨移除（需重建資料表），保留；全域唯一索引兩者皆建立
+    op.create_index('uq_feature_flag_global_key', 'feature_flag', ['key'], unique=True,
+                    postgresql_where=sa.text('company_id IS NULL'), sqlite_where=sa.text('company_id IS NULL'))
+
+
+def downgrade():
+    bind = op.get_bind()
+    insp = inspect(bind)
+    if 'feature_flag' in insp.get_table_names():
+        op.drop_index('uq_feature_flag_global_key', table_name='feature_flag')
+        if bind.dialect.name == 'postgresql':
+            op.drop_constraint('uq_feature_flag_key_company', 'feature_flag', type_='unique')
+            op.create_unique_constraint('feature_flag_key_key', 'feature_flag', ['key'])
+    op.drop_table('config_version')
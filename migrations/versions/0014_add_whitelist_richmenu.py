@@ -0,0 +1,30 @@
+"""add richmenu_id to whitelist for bulk rich menu linking
+
+Revision ID: 0014_add_whitelist_richmenu
+Revises: 0013_add_feature_flag_versioning
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision = '0014_add_whitelist_richmenu'
+down_revision = '0013_add_feature_flag_versioning'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    insp = inspect(op.get_bind())
+    if 'whitelist' not in insp.get_table_names():
+        return
+    cols = {c['name'] for c in insp.get_columns('whitelist')}
+    if 'richmenu_id' not in cols:
+        op.add_column('whitelist', sa.Column('richmenu_id', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    op.drop_column('whitelist', 'richmenu_id')
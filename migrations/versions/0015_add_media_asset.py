@@ -0,0 +1,44 @@
+"""add media_asset table for the content-addressed media store
+
+Revision ID: 0015_add_media_asset
+Revises: 0014_add_whitelist_richmenu
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0015_add_media_asset'
+down_revision = '0014_add_whitelist_richmenu'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'media_asset',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('sha256', sa.String(length=64), nullable=False, unique=True),
+        sa.Column('storage', sa.String(length=20), nullable=False),
+        sa.Column('key', sa.String(length=255), nullable=False),
+        sa.Column('url', sa.String(length=500), nullable=False),
+        sa.Column('filename', sa.String(length=255)),
+        sa.Column('content_type', sa.String(length=100)),
+        sa.Column('size', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('width', sa.Integer()),
+        sa.Column('height', sa.Integer()),
+        sa.Column('variants', sa.Text()),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('error', sa.Text()),
+        sa.Column('created_by', sa.Integer()),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('processed_at', sa.DateTime()),
+    )
+    op.create_index('ix_media_asset_status', 'media_asset', ['status'])
+
+
+def downgrade():
+    op.drop_index('ix_media_asset_status', table_name='media_asset')
+    op.drop_table('media_asset')
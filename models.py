@@ -1,13 +1,19 @@
 from extensions import db
 from datetime import datetime, timedelta
 
+from utils.business_calendar import business_date_of
+
 class TempVerify(db.Model):
     __tablename__ = "temp_verify"
+    # 後台待驗證列表：WHERE status='pending' ORDER BY created_at DESC
+    __table_args__ = (
+        db.Index("ix_temp_verify_status_created_at", "status", "created_at"),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    phone = db.Column(db.String(20))
+    phone = db.Column(db.String(20), index=True)
     line_id = db.Column(db.String(100))
     nickname = db.Column(db.String(255))
-    line_user_id = db.Column(db.String(255))
+    line_user_id = db.Column(db.String(255), index=True)
     status = db.Column(db.String(20), default="pending")  # pending/verified/failed
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
@@ -24,22 +30,24 @@ class ManualVerifyCode(db.Model):
 class Whitelist(db.Model):
     __tablename__ = "whitelist"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     date = db.Column(db.String(20))
     phone = db.Column(db.String(20), unique=True)
     reason = db.Column(db.Text)
-    name = db.Column(db.String(255))
-    line_id = db.Column(db.String(100))
+    name = db.Column(db.String(255), index=True)
+    line_id = db.Column(db.String(100), index=True)
     line_user_id = db.Column(db.String(255), unique=True)
+    # 已連結給此用戶的 Rich Menu（utils/richmenu_link.py）；NULL 或與設定不同者由背景批次連結
+    richmenu_id = db.Column(db.String(64))
 
 class Blacklist(db.Model):
     __tablename__ = "blacklist"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     date = db.Column(db.String(20))
     phone = db.Column(db.String(20), unique=True)
     reason = db.Column(db.Text)
-    name = db.Column(db.String(255))
+    name = db.Column(db.String(255), index=True)
 
 class Coupon(db.Model):
     __tablename__ = "coupon"
@@ -69,6 +77,13 @@ class StoredValueWallet(db.Model):
 # 儲值金交易紀錄
 class StoredValueTransaction(db.Model):
     __tablename__ = "stored_value_txn"
+    # 對帳報表：WHERE type=? AND created_at 區間；WHERE type=? AND business_date 區間 GROUP BY business_date
+    __table_args__ = (
+        db.Index("ix_stored_value_txn_type_created_at", "type", "created_at"),
+        db.Index("ix_stored_value_txn_type_business_date", "type", "business_date"),
+        # 重複偵測：PARTITION BY wallet_id, amount, remark ORDER BY created_at
+        db.Index("ix_stored_value_txn_dup_key", "type", "wallet_id", "amount", "created_at"),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     wallet_id = db.Column(db.Integer, index=True, nullable=False)
     type = db.Column(db.String(20), nullable=False)  # topup / consume
@@ -82,7 +97,167 @@ class StoredValueTransaction(db.Model):
     coupon_300_count = db.Column(db.Integer, default=0, nullable=False)
     # 新增 100 券
     coupon_100_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    # 會計日（台北時間 -3 小時的日期），由資料庫依 created_at 產生（utils/business_calendar.py）
+    business_date = db.Column(db.Date, db.Computed(business_date_of(db.column("created_at")), persisted=True))
+
+
+# 儲值金交易的會計日彙總（utils/wallet_rollup.py 於交易寫入時同步累加；對帳報表讀此表）
+class WalletDailyRollup(db.Model):
+    __tablename__ = "wallet_daily_rollup"
+    __table_args__ = (
+        db.UniqueConstraint("business_date", "type", "payment_method", "off_hours",
+                            name="uq_wallet_daily_rollup_key"),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    business_date = db.Column(db.Date, nullable=False)                  # 台北時間 -3 小時的日期
+    type = db.Column(db.String(20), nullable=False)                     # topup / consume
+    payment_method = db.Column(db.String(50), default="", nullable=False)  # 未填為空字串
+    off_hours = db.Column(db.Boolean, default=False, nullable=False)    # 03:00~11:59（不在單日會計窗內）
+    txn_count = db.Column(db.Integer, default=0, nullable=False)
+    amount_sum = db.Column(db.BigInteger, default=0, nullable=False)
+    coupon_500_sum = db.Column(db.Integer, default=0, nullable=False)
+    coupon_300_sum = db.Column(db.Integer, default=0, nullable=False)
+    coupon_100_sum = db.Column(db.Integer, default=0, nullable=False)
+    coupon_only_count = db.Column(db.Integer, default=0, nullable=False)    # 金額 0 且有用券（純用券）筆數
+    coupon_only_coupons = db.Column(db.Integer, default=0, nullable=False)  # 純用券交易的券張數合計
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+# 儲值金交易的待處理問題（utils/wallet_repair.py 排程掃描寫入；對帳報表只讀）
+class WalletTxnIssue(db.Model):
+    __tablename__ = "wallet_txn_issue"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    txn_id = db.Column(db.Integer, unique=True, nullable=False)
+    kind = db.Column(db.String(20), nullable=False, index=True)  # invalid（儲值無電話）/ orphan（錢包不存在）
+    wallet_id = db.Column(db.Integer)
+    detected_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_seen_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # 最近一次掃描仍存在
+
+
+# 疑似重複儲值（utils/wallet_duplicates.py 夜間全帳掃描結果，每次整批重建）
+class WalletDuplicateCandidate(db.Model):
+    __tablename__ = "wallet_duplicate_candidate"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    txn_id = db.Column(db.Integer, unique=True, nullable=False)   # 疑似重複的交易
+    duplicate_of = db.Column(db.Integer, nullable=False)          # 同錢包 / 金額 / 備註的前一筆交易
+    wallet_id = db.Column(db.Integer, index=True)
+    amount = db.Column(db.Integer)
+    gap_minutes = db.Column(db.Float)                             # 與前一筆的間隔
+    txn_created_at = db.Column(db.DateTime, index=True)
+    detected_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+# 儲值金資料修復的稽核紀錄（補電話、清理無效交易）
+class WalletRepairLog(db.Model):
+    __tablename__ = "wallet_repair_log"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    action = db.Column(db.String(30), nullable=False)  # fill_phone / delete_invalid
+    txn_id = db.Column(db.Integer, index=True)
+    wallet_id = db.Column(db.Integer, index=True)
+    detail = db.Column(db.Text)                        # JSON：修改前後的值
+    source = db.Column(db.String(100))                 # job / admin
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+# 背景推播佇列（utils/push_queue.py）：先寫入再由背景執行緒送出，失敗依 next_attempt_at 重試
+class OutboundMessage(db.Model):
+    __tablename__ = "outbound_message"
+    # 掃描到期待送：WHERE status='pending' AND next_attempt_at <= now；同一收件者依 id 先後送出
+    __table_args__ = (
+        db.Index("ix_outbound_message_status_next_attempt", "status", "next_attempt_at"),
+        db.Index("ix_outbound_message_to_id_id", "to_id", "id"),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    to_id = db.Column(db.String(255), nullable=False)  # LINE user / group id
+    payload = db.Column(db.Text, nullable=False)       # JSON：訊息物件陣列（as_json_dict）
+    source = db.Column(db.String(50))                  # 例如 extra_notice / report / notify_admins
+    status = db.Column(db.String(20), default="pending", nullable=False)  # pending/sending/sent/failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = db.Column(db.DateTime)
+
+
+# 排程執行紀錄（utils/scheduler.py 的 scheduled_job 寫入）
+class JobRun(db.Model):
+    __tablename__ = "job_run"
+    __table_args__ = (
+        db.Index("ix_job_run_job_id_started_at", "job_id", "started_at"),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_id = db.Column(db.String(100), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False, index=True)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Integer)
+    status = db.Column(db.String(20), nullable=False)  # success / failed
+    error = db.Column(db.Text)
+    host = db.Column(db.String(255))                   # 執行的主機:pid
+
+
+# 推播活動（utils/campaign.py）：名單以 SQL 篩選後寫入 campaign_delivery，由排程分批 multicast / narrowcast
+class Campaign(db.Model):
+    __tablename__ = "campaign"
+    __table_args__ = (
+        db.Index("ix_campaign_status_scheduled_at", "status", "scheduled_at"),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String(255), nullable=False)
+    payload = db.Column(db.Text, nullable=False)           # JSON：訊息物件陣列（as_json_dict）
+    audience = db.Column(db.String(50), nullable=False)    # utils/campaign.py 的 AUDIENCES 名稱
+    audience_params = db.Column(db.Text)                   # JSON：名單參數（例如 {"days": 30}）
+    mode = db.Column(db.String(20), default="multicast", nullable=False)  # multicast / narrowcast
+    # draft/queued/running/paused/done/failed/cancelled
+    status = db.Column(db.String(20), default="draft", nullable=False)
+    scheduled_at = db.Column(db.DateTime)                  # UTC；空值表示排入後立即送出
+    total = db.Column(db.Integer, default=0, nullable=False)
+    sent_count = db.Column(db.Integer, default=0, nullable=False)
+    failed_count = db.Column(db.Integer, default=0, nullable=False)
+    audience_group_id = db.Column(db.String(100))          # narrowcast：上傳的受眾群組
+    request_id = db.Column(db.String(100))                 # narrowcast：X-Line-Request-Id（查詢進度用）
+    retry_key = db.Column(db.String(36))                   # narrowcast：X-Line-Retry-Key
+    error = db.Column(db.Text)
+    created_by = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+
+# 推播活動的逐一收件紀錄；同時是斷點：pending 尚未送出，sending 以 batch_key 重送（LINE 依 retry key 去重）
+class CampaignDelivery(db.Model):
+    __tablename__ = "campaign_delivery"
+    __table_args__ = (
+        db.UniqueConstraint("campaign_id", "line_user_id", name="uq_campaign_delivery_campaign_user"),
+        db.Index("ix_campaign_delivery_campaign_status_id", "campaign_id", "status", "id"),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    campaign_id = db.Column(db.Integer, nullable=False)
+    line_user_id = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), default="pending", nullable=False)  # pending/sending/sent/failed
+    batch_key = db.Column(db.String(36))                   # 所屬批次（multicast 的 X-Line-Retry-Key）
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.String(255))
+    sent_at = db.Column(db.DateTime)
+
+
+# 活動行事曆（utils/promo_events.py）：promo = 活動快訊內容；banner = 主選單 / 驗證資訊每日首次顯示的前導圖
+class PromoEvent(db.Model):
+    __tablename__ = "promo_event"
+    __table_args__ = (
+        db.Index("ix_promo_event_end_at", "end_at"),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(20), default="promo", nullable=False)  # promo / banner
+    title = db.Column(db.String(255), nullable=False)
+    text = db.Column(db.Text)
+    image_url = db.Column(db.String(500))
+    start_at = db.Column(db.DateTime, nullable=False)   # UTC
+    end_at = db.Column(db.DateTime, nullable=False)     # UTC（不含）
+    priority = db.Column(db.Integer, default=0, nullable=False)  # 同時進行時小的在前
+    enabled = db.Column(db.Boolean, default=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
 
 class WageConfig(db.Model):
@@ -125,8 +300,14 @@ class CompanyUser(db.Model):
 
 class FeatureFlag(db.Model):
     __tablename__ = 'feature_flag'
+    # 同一 key 可有全域（company_id 為 NULL）與各公司各一筆；NULL 不參與唯一約束，全域另以部分唯一索引限制
+    __table_args__ = (
+        db.UniqueConstraint('key', 'company_id', name='uq_feature_flag_key_company'),
+        db.Index('uq_feature_flag_global_key', 'key', unique=True,
+                 postgresql_where=db.text('company_id IS NULL'), sqlite_where=db.text('company_id IS NULL')),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    key = db.Column(db.String(100), unique=True, nullable=False)
+    key = db.Column(db.String(100), nullable=False)
     name = db.Column(db.String(150), nullable=False)
     enabled = db.Column(db.Boolean, default=False)
     description = db.Column(db.String(255))
@@ -134,6 +315,36 @@ class FeatureFlag(db.Model):
     # Optional scoping per company (null = global)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=True)
 
+# 設定類資料的全域版本號（utils/feature_flags.py）：修改時 +1，各行程比對版本決定是否重載快照
+class ConfigVersion(db.Model):
+    __tablename__ = 'config_version'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+# 上傳媒體（utils/media_store.py）：以內容 sha256 去重，原檔與縮圖 / 響應式尺寸以 sha256 命名存放
+class MediaAsset(db.Model):
+    __tablename__ = 'media_asset'
+    __table_args__ = (
+        db.Index('ix_media_asset_status', 'status'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    storage = db.Column(db.String(20), nullable=False)       # local / s3
+    key = db.Column(db.String(255), nullable=False)          # 原檔 key：media/ab/<sha256>.<ext>
+    url = db.Column(db.String(500), nullable=False)
+    filename = db.Column(db.String(255))                     # 第一次上傳時的原始檔名（僅顯示用）
+    content_type = db.Column(db.String(100))
+    size = db.Column(db.Integer, default=0, nullable=False)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    variants = db.Column(db.Text)                            # JSON：{"w320": {"key", "url", "width", "height", "format", "bytes"}, ...}
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending/ready/failed
+    error = db.Column(db.Text)
+    created_by = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = db.Column(db.DateTime)
+
 def ensure_external_user_defaults(user: ExternalUser):
     """Ensure expires_at default if missing."""
     if user and user.expires_at is None:
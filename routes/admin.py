@@ -1,17 +1,16 @@
 import os
-import requests
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from models import Whitelist, Blacklist, TempVerify, StoredValueWallet, StoredValueTransaction, WageConfig
 from utils.db_utils import update_or_create_whitelist_from_data
 from hander.verify import EXTRA_NOTICE
 from linebot.models import TextSendMessage
-from extensions import line_bot_api
+from utils.push_queue import enqueue_push
+from utils import business_calendar, richmenu, richmenu_link
 from extensions import db
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from models import ExternalUser, FeatureFlag
 from flask import session
-from config import LINE_CHANNEL_ACCESS_TOKEN
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -73,6 +72,64 @@ def admin_dashboard():
     return render_dashboard()
 
 
+@admin_bp.route('/query_stats')
+def query_stats():
+    """各路由 / LINE 事件的 SQL 統計（查詢數、DB 耗時、最慢語句），依平均 DB 耗時排序；?reset=1 讀取後清除。"""
+    from utils import query_stats as _qs
+    data = _qs.snapshot()
+    if request.args.get('reset') == '1':
+        _qs.reset()
+    rows = [dict(name=name, **stats) for name, stats in data.items()]
+    rows.sort(key=lambda r: r['avg_db_ms'], reverse=True)
+    return {
+        'enabled': _qs.QUERY_STATS_ENABLED,
+        'slow_ms': _qs.SLOW_MS,
+        'max_queries': _qs.MAX_QUERIES,
+        'scopes': rows,
+    }
+
+
+@admin_bp.route('/ocr_stats')
+def ocr_stats():
+    """截圖驗證各階段平均耗時、結果分布，及分層 OCR 各層命中率與估計省下的時間（本 worker）；?reset=1 讀取後清除。"""
+    from utils import image_verification as _iv
+    from hander import verify_pipeline as _vp
+    data = _iv.tier_stats()
+    data['pipeline'] = _vp.stage_stats()
+    if request.args.get('reset') == '1':
+        _iv.reset_tier_stats()
+        _vp.reset_stage_stats()
+    return data
+
+
+@admin_bp.route('/push_queue')
+def push_queue_stats():
+    """背景推播佇列：各狀態筆數（pending / sending / sent / failed）與本 worker 佇列深度。"""
+    from utils import push_queue as _pq
+    return _pq.queue_stats()
+
+
+@admin_bp.route('/jobs')
+def jobs_status():
+    """排程狀態（本行程是否為 leader、各工作下次執行時間）與最近 50 筆 job_run；?job=<id> 只看單一工作。"""
+    from utils.scheduler import scheduler_status
+    from models import JobRun
+    q = JobRun.query
+    if request.args.get('job'):
+        q = q.filter_by(job_id=request.args.get('job'))
+    runs = q.order_by(JobRun.started_at.desc()).limit(50).all()
+    data = scheduler_status()
+    data['runs'] = [{
+        'job_id': r.job_id,
+        'started_at': r.started_at.isoformat() if r.started_at else None,
+        'duration_ms': r.duration_ms,
+        'status': r.status,
+        'host': r.host,
+        'error': r.error,
+    } for r in runs]
+    return data
+
+
 # 白名單
 @admin_bp.route('/whitelist/search')
 def whitelist_search():
@@ -182,7 +239,7 @@ def tempverify_verify():
                     f"✅ 驗證成功，歡迎加入茗殿\n"
                     f"🌟 加入密碼：ming666"
                 ) + EXTRA_NOTICE
-                line_bot_api.push_message(record.line_user_id, TextSendMessage(text=msg))
+                enqueue_push(record.line_user_id, TextSendMessage(text=msg), source="admin_approve")
             except Exception:
                 pass
     except Exception as e:
@@ -209,29 +266,6 @@ def admin_schedule():
     return render_template('schedule.html')
 
 
-def fetch_line_richmenus():
-    """呼叫 LINE API 取得 Rich Menu 清單，回傳 (list, error_message)。"""
-    access_token = LINE_CHANNEL_ACCESS_TOKEN or os.getenv('LINE_CHANNEL_ACCESS_TOKEN', '')
-    if not access_token:
-        return [], '尚未設定 LINE_CHANNEL_ACCESS_TOKEN，無法取得 Rich Menu 清單'
-    try:
-        url = 'https://api.line.me/v2/bot/richmenu/list'
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-        }
-        resp = requests.get(url, headers=headers, timeout=10)
-        if 200 <= resp.status_code < 300:
-            data = resp.json() or {}
-            return data.get('richmenus', []) or [], None
-        try:
-            detail = resp.json().get('message') or resp.text
-        except Exception:
-            detail = resp.text
-        return [], f'LINE API 讀取 Rich Menu 清單失敗（{resp.status_code}）：{detail}'
-    except Exception as e:
-        return [], f'呼叫 LINE Rich Menu 清單 API 發生錯誤：{e}'
-
-
 # ========= LINE Rich Menu 圖片更新 =========
 @admin_bp.route('/richmenu', methods=['GET', 'POST'])
 def admin_richmenu():
@@ -247,42 +281,284 @@ def admin_richmenu():
             flash('上傳檔案必須為圖片格式', 'danger')
             return redirect(url_for('admin.admin_richmenu'))
 
-        access_token = LINE_CHANNEL_ACCESS_TOKEN or os.getenv('LINE_CHANNEL_ACCESS_TOKEN', '')
-        if not access_token:
-            flash('環境尚未設定 LINE_CHANNEL_ACCESS_TOKEN，無法呼叫 LINE API', 'danger')
-            return redirect(url_for('admin.admin_richmenu'))
+        # 縮放 / 壓縮到 LINE 規格後上傳（utils/richmenu.py）
+        ok, message = richmenu.upload_image(rich_menu_id, file.stream)
+        flash(message, 'success' if ok else 'danger')
+        return redirect(url_for('admin.admin_richmenu'))
+
+    richmenus, richmenus_error, _etag = richmenu.list_richmenus(force=request.args.get('refresh') == '1')
+    try:
+        link_summary = richmenu_link.link_summary()
+    except Exception:
+        link_summary = None
+    return render_template('admin_richmenu.html', richmenus=richmenus, richmenus_error=richmenus_error,
+                           link_summary=link_summary)
+
 
+@admin_bp.route('/richmenu/link', methods=['POST'])
+def admin_richmenu_link():
+    """立即把待連結的白名單用戶連結到已驗證選單（背景執行緒處理；未啟動時同步執行）。"""
+    if not richmenu_link.enabled():
+        flash('尚未設定 RICHMENU_VERIFIED_ID 或 LINE_CHANNEL_ACCESS_TOKEN，無法連結', 'warning')
+        return redirect(url_for('admin.admin_richmenu'))
+    try:
+        stats = richmenu_link.request_link()
+        if stats is None:
+            flash('已排入背景連結，稍後重新整理查看進度', 'success')
+        else:
+            flash(f"已連結 {stats['linked']} 人，拒絕 {stats['rejected']} 人"
+                  + (f"（{stats['error']}）" if stats['error']
+                     else "（LINE 暫時無法處理，稍後再試）" if stats['stopped'] else ''),
+                  'warning' if stats['stopped'] else 'success')
+    except Exception as e:
+        flash(f'連結 Rich Menu 時發生錯誤：{e}', 'danger')
+    return redirect(url_for('admin.admin_richmenu'))
+
+
+@admin_bp.route('/richmenu/list')
+def admin_richmenu_list():
+    """Rich Menu 清單 JSON（快取）；帶 If-None-Match 且內容未變時回 304。"""
+    richmenus, error, etag = richmenu.list_richmenus(force=request.args.get('refresh') == '1')
+    if error:
+        return {'ok': False, 'error': error}, 502
+    if etag and etag in request.if_none_match:
+        return '', 304, {'ETag': f'"{etag}"'}
+    return {'ok': True, 'richmenus': richmenus}, 200, {'ETag': f'"{etag}"'}
+
+
+# ========= 推播活動 =========
+@admin_bp.route('/campaigns', methods=['GET', 'POST'])
+def admin_campaigns():
+    """推播活動：建立（草稿或立即排入）與列表；實際送出由排程 campaign_dispatch 執行。"""
+    from models import Campaign
+    from utils import campaign as _cp
+    from linebot.models import ImageSendMessage
+    if request.method == 'POST':
+        name = (request.form.get('name') or '').strip()
+        text = (request.form.get('text') or '').strip()
+        image_url = (request.form.get('image_url') or '').strip()
+        audience = request.form.get('audience') or ''
+        params = {k: request.form.get(k).strip() for k in ('days', 'min_balance', 'type') if (request.form.get(k) or '').strip()}
+        if not name or not (text or image_url):
+            flash('請輸入活動名稱與訊息內容', 'warning')
+            return redirect(url_for('admin.admin_campaigns'))
+        messages = []
+        if text:
+            messages.append(TextSendMessage(text=text))
+        if image_url:
+            messages.append(ImageSendMessage(original_content_url=image_url, preview_image_url=image_url))
+        scheduled_at = None
+        if request.form.get('scheduled_at'):
+            try:
+                scheduled_at = _parse_taipei_datetime(request.form['scheduled_at'])
+            except ValueError:
+                flash('預定時間格式錯誤', 'warning')
+                return redirect(url_for('admin.admin_campaigns'))
         try:
-            image_bytes = file.stream.read()
-            # 根據 LINE 官方文件，上傳 Rich Menu 圖片需使用 api-data.line.me 網域
-            url = f"https://api-data.line.me/v2/bot/richmenu/{rich_menu_id}/content"
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': file.mimetype,
-            }
-            resp = requests.post(url, data=image_bytes, headers=headers, timeout=15)
-            if 200 <= resp.status_code < 300:
-                flash('Rich Menu 圖片更新成功', 'success')
+            c = _cp.create_campaign(name, messages, audience, params, mode=request.form.get('mode') or 'multicast',
+                                    scheduled_at=scheduled_at)
+            if request.form.get('queue') == '1':
+                total = _cp.queue_campaign(c.id)
+                flash(f'活動已排入，共 {total} 位收件人', 'success')
             else:
-                try:
-                    detail = resp.json().get('message') or resp.text
-                except Exception:
-                    detail = resp.text
+                flash('活動草稿已建立', 'success')
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+        return redirect(url_for('admin.admin_campaigns'))
+
+    campaigns = Campaign.query.order_by(Campaign.id.desc()).limit(50).all()
+    return render_template('admin_campaigns.html', campaigns=campaigns, audiences=_cp.AUDIENCES)
+
+
+@admin_bp.route('/campaigns/preview')
+def campaign_preview():
+    """名單人數預覽：?audience=<名稱>&days=&min_balance=&type="""
+    from utils import campaign as _cp
+    params = {k: request.args.get(k) for k in ('days', 'min_balance', 'type') if request.args.get(k)}
+    try:
+        return {'audience': request.args.get('audience'), 'count': _cp.preview_audience(request.args.get('audience'), params)}
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+
+@admin_bp.route('/campaigns/<int:cid>')
+def campaign_detail(cid):
+    """單一活動進度（各收件狀態人數）。"""
+    from models import Campaign
+    from utils import campaign as _cp
+    c = Campaign.query.get_or_404(cid)
+    return {
+        'id': c.id, 'name': c.name, 'mode': c.mode, 'status': c.status, 'audience': c.audience,
+        'total': c.total, 'sent': c.sent_count, 'failed': c.failed_count, 'error': c.error,
+        'started_at': c.started_at.isoformat() if c.started_at else None,
+        'finished_at': c.finished_at.isoformat() if c.finished_at else None,
+        'deliveries': _cp.campaign_progress(c.id),
+    }
+
+
+@admin_bp.route('/campaigns/<int:cid>/<action>', methods=['POST'])
+def campaign_action(cid, action):
+    from utils import campaign as _cp
+    actions = {
+        'queue': (_cp.queue_campaign, '活動已排入'),
+        'pause': (_cp.pause_campaign, '活動已暫停'),
+        'cancel': (_cp.cancel_campaign, '活動已取消'),
+        'retry': (_cp.retry_failed, '失敗名單已重新排入'),
+    }
+    if action not in actions:
+        flash('未知的操作', 'warning')
+        return redirect(url_for('admin.admin_campaigns'))
+    fn, done_msg = actions[action]
+    try:
+        fn(cid)
+        flash(done_msg, 'success')
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
+    return redirect(url_for('admin.admin_campaigns'))
+
+
+# ========= 活動行事曆 =========
+def _parse_taipei_datetime(value):
+    """表單 datetime-local（台北時間）→ UTC naive。"""
+    import pytz
+    local = pytz.timezone('Asia/Taipei').localize(datetime.strptime(value, '%Y-%m-%dT%H:%M'))
+    return local.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+@admin_bp.route('/events', methods=['GET', 'POST'])
+def admin_events():
+    """活動快訊內容（promo）與每日首次前導圖（banner）的期間設定；修改後本 worker 立即生效，其他 worker 於索引 TTL 內生效。"""
+    from models import PromoEvent
+    if request.method == 'POST':
+        title = (request.form.get('title') or '').strip()
+        kind = request.form.get('kind') or 'promo'
+        text = (request.form.get('text') or '').strip() or None
+        image_url = (request.form.get('image_url') or '').strip() or None
+        try:
+            start_at = _parse_taipei_datetime(request.form.get('start_at') or '')
+            end_at = _parse_taipei_datetime(request.form.get('end_at') or '')
+        except ValueError:
+            flash('請輸入活動開始與結束時間', 'warning')
+            return redirect(url_for('admin.admin_events'))
+        if not title or kind not in ('promo', 'banner') or end_at <= start_at:
+            flash('活動資料不完整或結束時間早於開始時間', 'warning')
+            return redirect(url_for('admin.admin_events'))
+        if kind == 'banner' and not image_url:
+            flash('前導圖必須填寫圖片網址', 'warning')
+            return redirect(url_for('admin.admin_events'))
+        db.session.add(PromoEvent(kind=kind, title=title, text=text, image_url=image_url, start_at=start_at,
+                                  end_at=end_at, priority=int(request.form.get('priority') or 0)))
+        db.session.commit()
+        flash('活動已新增', 'success')
+        return redirect(url_for('admin.admin_events'))
+
+    events = PromoEvent.query.order_by(PromoEvent.start_at.desc()).limit(100).all()
+    return render_template('admin_events.html', events=events, now=datetime.utcnow())
+
+
+@admin_bp.route('/events/<int:eid>/toggle', methods=['POST'])
+def event_toggle(eid):
+    from models import PromoEvent
+    e = PromoEvent.query.get_or_404(eid)
+    e.enabled = not e.enabled
+    db.session.commit()
+    flash('活動已啟用' if e.enabled else '活動已停用', 'success')
+    return redirect(url_for('admin.admin_events'))
+
+
+@admin_bp.route('/events/<int:eid>/delete', methods=['POST'])
+def event_delete(eid):
+    from models import PromoEvent
+    db.session.delete(PromoEvent.query.get_or_404(eid))
+    db.session.commit()
+    flash('活動已刪除', 'success')
+    return redirect(url_for('admin.admin_events'))
+
+
+@admin_bp.route('/flags', methods=['GET', 'POST'])
+def admin_flags():
+    """功能旗標：全域或單一公司（?company_id=）的開關，送出時以單一 UPDATE 批次更新（utils/feature_flags.py）。"""
+    from utils import feature_flags
+    company_id = request.values.get('company_id', type=int)
+    scope = FeatureFlag.company_id.is_(None) if company_id is None else FeatureFlag.company_id == company_id
+    flags = FeatureFlag.query.filter(scope).order_by(FeatureFlag.name.asc()).all()
+    if request.method == 'POST':
+        n = feature_flags.set_flags({f.key: request.form.get(f'flag_{f.key}') == 'on' for f in flags}, company_id)
+        flash(f'已更新 {n} 個功能開關', 'success')
+        return redirect(url_for('admin.admin_flags', company_id=company_id))
+    return render_template('admin_flags.html', flags=flags, company_id=company_id,
+                           global_flags=FeatureFlag.query.filter(FeatureFlag.company_id.is_(None))
+                           .order_by(FeatureFlag.name.asc()).all())
+
+
+@admin_bp.route('/flags/override', methods=['POST'])
+def flag_override():
+    """新增公司層級的旗標設定（覆寫全域）。"""
+    key = (request.form.get('key') or '').strip()
+    company_id = request.form.get('company_id', type=int)
+    base = FeatureFlag.query.filter(FeatureFlag.key == key, FeatureFlag.company_id.is_(None)).first()
+    if not base or company_id is None:
+        flash('請選擇旗標並輸入公司編號', 'warning')
+        return redirect(url_for('admin.admin_flags'))
+    if FeatureFlag.query.filter_by(key=key, company_id=company_id).first():
+        flash('此公司已有該旗標設定', 'warning')
+        return redirect(url_for('admin.admin_flags', company_id=company_id))
+    db.session.add(FeatureFlag(key=key, name=base.name, description=base.description, company_id=company_id,
+                               enabled=request.form.get('enabled') == 'on'))
+    try:
+        db.session.commit()
+        flash('已新增公司設定', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'新增失敗：{e}', 'danger')
+    return redirect(url_for('admin.admin_flags', company_id=company_id))
+
+
+@admin_bp.route('/flags/snapshot')
+def flags_snapshot():
+    """本行程的旗標快照與版本號。"""
+    from utils import feature_flags
+    data = feature_flags.snapshot()
+    return {
+        'version': data['version'],
+        'flags': [{'key': k, 'company_id': c, 'enabled': v} for (k, c), v in sorted(data['flags'].items(), key=str)],
+    }
+
 
-                # 特別處理「圖片已存在」的情況，給出更清楚的中文說明
-                if 'An image has already been uploaded to the richmenu' in str(detail):
-                    human_msg = 'LINE 回覆：這個 Rich Menu 已經有設定圖片，官方規則不允許覆蓋。若要換圖，必須建立新的 Rich Menu 再上傳圖片。'
-                else:
-                    human_msg = f'LINE API 回應錯誤（{resp.status_code}）：{detail}'
 
-                flash(human_msg, 'danger')
+# ========= 媒體庫 =========
+@admin_bp.route('/media', methods=['GET', 'POST'])
+def admin_media():
+    """圖片上傳（內容去重 + 背景產生縮圖 / 響應式尺寸，utils/media_store.py）；網址可用於推播活動與活動行事曆。"""
+    from models import MediaAsset
+    from utils import media_store
+    if request.method == 'POST':
+        file = request.files.get('image')
+        if not file:
+            flash('請選擇圖片檔案', 'warning')
+            return redirect(url_for('admin.admin_media'))
+        try:
+            asset, is_new = media_store.save(file.stream, filename=file.filename or None)
+            flash('已上傳' if is_new else f'相同圖片已存在（#{asset.id}），未重複存放', 'success' if is_new else 'info')
+        except ValueError as e:
+            flash(str(e), 'danger')
         except Exception as e:
-            flash(f'上傳至 LINE 時發生錯誤：{e}', 'danger')
+            db.session.rollback()
+            flash(f'上傳失敗：{e}', 'danger')
+        return redirect(url_for('admin.admin_media'))
+    assets = MediaAsset.query.order_by(MediaAsset.created_at.desc()).limit(100).all()
+    return render_template('admin_media.html', assets=assets)
 
-        return redirect(url_for('admin.admin_richmenu'))
 
-    richmenus, richmenus_error = fetch_line_richmenus()
-    return render_template('admin_richmenu.html', richmenus=richmenus, richmenus_error=richmenus_error)
+@admin_bp.route('/media/<int:mid>/delete', methods=['POST'])
+def admin_media_delete(mid):
+    from models import MediaAsset
+    from utils import media_store
+    media_store.delete(MediaAsset.query.get_or_404(mid))
+    flash('圖片已刪除', 'info')
+    return redirect(url_for('admin.admin_media'))
 
 
 # ========= 儲值金專區 =========
@@ -440,7 +716,6 @@ def wallet_summary():
 def wallet_reconcile():
     """對帳報表：顯示本日時段（12:00~次日03:00）儲值總額，並提供自訂日期區間查詢與明細、彙總、現金應收。"""
     import pytz
-    from datetime import datetime as _dt, timedelta
     import re
     tz = pytz.timezone('Asia/Taipei')
 
@@ -455,83 +730,24 @@ def wallet_reconcile():
     reference_kw = (request.args.get('reference_kw') or '').strip()
     cash_keywords = [k.strip() for k in cash_kw.split(',') if k.strip()]
 
-    now_local = _dt.now(tz)
-
-    def business_day_window(base_date):
-        """回傳某個基準日期的會計日區間：當日 12:00 ~ 次日 03:00（半開區間）。"""
-        start_local = tz.localize(_dt(base_date.year, base_date.month, base_date.day, 12, 0, 0))
-        # 次日 03:00
-        next_day = start_local + timedelta(days=1)
-        end_local = tz.localize(_dt(next_day.year, next_day.month, next_day.day, 3, 0, 0))
-        return start_local, end_local
-
-    # 依現在時間決定「今日」基準（淩晨 00:00~03:00 視為前一會計日）
-    def current_business_base_date(now_dt):
-        if now_dt.hour < 3:  # 00:00~02:59 -> 前一日
-            return (now_dt - timedelta(days=1)).date()
-        return now_dt.date()
-
-    # 計算查詢區間
-    if preset in ('today', 'yesterday') and not start_str and not end_str:
-        base_date = current_business_base_date(now_local)
-        if preset == 'yesterday':
-            base_date = base_date - timedelta(days=1)
-        start_local, end_local = business_day_window(base_date)
-    elif preset == 'thisweek' and not start_str and not end_str:
-        # 本週（以週一為基準），使用會計日窗拼接至今
-        weekday = current_business_base_date(now_local).weekday()  # Monday=0
-        monday_date = current_business_base_date(now_local) - timedelta(days=weekday)
-        start_local, _ = business_day_window(monday_date)
-        _, end_local = business_day_window(current_business_base_date(now_local))
-    elif preset == 'thismonth' and not start_str and not end_str:
-        first_date = current_business_base_date(now_local).replace(day=1)
-        start_local, _ = business_day_window(first_date)
-        # 到當前會計日的結束
-        _, end_local = business_day_window(current_business_base_date(now_local))
-    elif preset == 'lastmonth' and not start_str and not end_str:
-        # 上個月：從上個月1日到上個月最後一天（以會計日窗包住）
-        base = current_business_base_date(now_local)
-        first_this = base.replace(day=1)
-        last_month_end = first_this - timedelta(days=1)
-        first_last = last_month_end.replace(day=1)
-        start_local, _ = business_day_window(first_last)
-        _, end_local = business_day_window(last_month_end)
-    else:
-        # 自訂日期以會計日窗解讀：起日的 12:00 到 迄日次日 03:00
-        if start_str:
-            try:
-                y, m, d = [int(x) for x in start_str.split('-')]
-                start_local, _ = business_day_window(_dt(y, m, d).date())
-            except Exception:
-                start_local, _ = business_day_window(now_local.date())
-        else:
-            start_local, _ = business_day_window(now_local.date())
-        if end_str:
-            try:
-                y2, m2, d2 = [int(x) for x in end_str.split('-')]
-                _, end_local = business_day_window(_dt(y2, m2, d2).date())
-            except Exception:
-                _, end_local = business_day_window(now_local.date())
-        else:
-            _, end_local = business_day_window(now_local.date())
-
-    # 轉為 UTC 過濾
-    start_utc = start_local.astimezone(pytz.utc)
-    end_utc = end_local.astimezone(pytz.utc)
+    # 計算查詢區間（會計窗：起日 12:00 ~ 迄日次日 03:00）
+    br = business_calendar.resolve_range(preset, start_str, end_str)
+    start_local, end_local = br.start_local, br.end_local
 
     # 查詢 topup 交易
     q = (StoredValueTransaction.query
          .filter(StoredValueTransaction.type == 'topup')
-         .filter(StoredValueTransaction.created_at >= start_utc)
-         .filter(StoredValueTransaction.created_at < end_utc)
+         .filter(business_calendar.in_range(StoredValueTransaction, br))
          .order_by(StoredValueTransaction.created_at.asc()))
     if payment_method_filter:
         q = q.filter(StoredValueTransaction.payment_method == payment_method_filter)
     txns = q.all()
 
-    # 明細與總計（儲值）
-    total_amount = sum(t.amount or 0 for t in txns)
-    count = len(txns)
+    # 明細與總計（儲值）：合計讀會計日彙總表（utils/wallet_rollup.py）
+    from utils import wallet_rollup
+    topup_totals = wallet_rollup.totals(br, 'topup', payment_method_filter or None)
+    total_amount = topup_totals['amount']
+    count = topup_totals['count']
     avg_amount = (total_amount // count) if count else 0
     # 顯示沖正：僅影響頁面展示，不改動資料庫
     display_offset = int(request.args.get('offset') or 0)
@@ -539,13 +755,9 @@ def wallet_reconcile():
     adj_avg_amount = (adj_total_amount // count) if count else 0
 
     # 同時期間的支出（consume）統計
-    consume_q = (StoredValueTransaction.query
-                 .filter(StoredValueTransaction.type == 'consume')
-                 .filter(StoredValueTransaction.created_at >= start_utc)
-                 .filter(StoredValueTransaction.created_at < end_utc))
-    consume_txns = consume_q.all()
-    consume_total = sum(t.amount or 0 for t in consume_txns)
-    consume_count = len(consume_txns)
+    consume_totals = wallet_rollup.totals(br, 'consume')
+    consume_total = consume_totals['amount']
+    consume_count = consume_totals['count']
 
     # 顯示剩餘金額（顯示總額 - 本期間支出）
     adj_remaining = adj_total_amount - consume_total
@@ -625,21 +837,8 @@ def wallet_reconcile():
         by_remark[k]['amount'] += r['amount']
         by_remark[k]['count'] += 1
 
-    # 依會計日（日）彙總：以 12:00~次日03:00 分群
-    by_day = {}
-    for t in txns:
-        dt = t.created_at
-        if dt and dt.tzinfo is None:
-            dt = pytz.utc.localize(dt)
-        local_dt = dt.astimezone(tz) if dt else None
-        if local_dt is None:
-            day_key = '—'
-        else:
-            # 將 00:00~02:59 歸屬前一日
-            bd_date = (local_dt - timedelta(days=1)).date() if local_dt.hour < 3 else local_dt.date()
-            day_key = bd_date.strftime('%Y-%m-%d')
-        by_day.setdefault(day_key, 0)
-        by_day[day_key] += (t.amount or 0)
+    # 依會計日（日）彙總：00:00~02:59 歸屬前一日
+    by_day = wallet_rollup.amount_by_day(br, 'topup', payment_method_filter or None)
 
     # 現金應收：以關鍵字（remark 含任一關鍵字）快速計算
     def is_cash_remark(text):
@@ -654,76 +853,16 @@ def wallet_reconcile():
     cash_count = sum(1 for r in rows if is_cash_remark(r['remark']))
 
     # ====== 無效紀錄與重複紀錄偵測 ======
-    invalid_rows = []
-    for r in rows:
-        # 無電話且有金額且備註包含儲值關鍵字或 TOPUP_CASH -> 嘗試修復
-        if (r['phone'] == '—' and r['amount'] > 0 and (
-            'TOPUP_CASH' in (r['remark'] or '') or '儲值' in (r['remark'] or '')
-        )):
-            # 嘗試由交易紀錄重新抓 wallet 並補 phone
-            tfix = StoredValueTransaction.query.filter_by(id=r['id']).first()
-            if tfix:
-                wfix = StoredValueWallet.query.filter_by(id=tfix.wallet_id).first()
-                repaired = False
-                if wfix and wfix.phone:
-                    r['phone'] = wfix.phone
-                    repaired = True
-                else:
-                    # 從 remark 解析手機
-                    import re as _re
-                    m2 = _re.search(r'(09\d{8})', tfix.remark or '')
-                    if m2:
-                        if wfix and not wfix.phone:
-                            wfix.phone = m2.group(1)
-                            wfix.updated_at = datetime.utcnow()
-                            db.session.commit()
-                        r['phone'] = m2.group(1)
-                        repaired = True
-                if not repaired:
-                    invalid_rows.append(r)
-            else:
-                # 交易不存在 -> 不呈現（幽靈 ID），跳過
-                continue
+    # 無效（無電話）由排程 wallet_repair 掃描標記（utils/wallet_repair.py），報表只讀
+    from utils import wallet_repair
+    invalid_ids = wallet_repair.flagged_txn_ids(br, 'invalid')
+    invalid_rows = [r for r in rows if r['id'] in invalid_ids]
+    repair_summary = wallet_repair.repair_summary()
 
-    # 重複判斷：相同 phone != '—'、amount、remark（移除時以最晚時間保留一筆）
-    dup_groups = {}
-    for r in rows:
-        if r['phone'] == '—':
-            continue
-        key = (r['phone'], r['amount'], r['remark'])
-        dup_groups.setdefault(key, []).append(r)
-    duplicate_rows = []
-    for key, group in dup_groups.items():
-        if len(group) > 1:
-            # 依時間排序保留第一筆，其餘視為重複
-            # 時間字串格式 '%Y/%m/%d %H:%M'
-            try:
-                group_sorted = sorted(group, key=lambda x: x['time'])
-            except Exception:
-                group_sorted = group
-            # 保留第一筆，其餘列出
-            for rr in group_sorted[1:]:
-                duplicate_rows.append(rr)
-
-    # 自動清理無效紀錄（選項）
-    clean_invalid = request.args.get('clean_invalid') == '1'
-    if clean_invalid and invalid_rows:
-        removed_ids = []
-        for r in invalid_rows:
-            tdel = StoredValueTransaction.query.filter_by(id=r['id']).first()
-            if tdel:
-                # 還原餘額（topup 則扣回）避免影響餘額
-                if tdel.type == 'topup' and tdel.amount:
-                    wallet = StoredValueWallet.query.filter_by(id=tdel.wallet_id).first()
-                    if wallet:
-                        wallet.balance -= tdel.amount
-                        wallet.updated_at = datetime.utcnow()
-                db.session.delete(tdel)
-                removed_ids.append(r['id'])
-        db.session.commit()
-        flash(f'已自動清理 {len(removed_ids)} 筆無效交易','info')
-        # 重新導向以刷新
-        return redirect(url_for('admin.wallet_reconcile'))
+    # 重複判斷：同錢包 + 金額 + 備註且與前一筆相隔在容許分鐘內（資料庫 window function，utils/wallet_duplicates.py）
+    from utils import wallet_duplicates
+    duplicate_ids = {d['id'] for d in wallet_duplicates.find_duplicates(br, limit=None)}
+    duplicate_rows = [r for r in rows if r['id'] in duplicate_ids]
 
     # CSV 匯出
     if export == 'csv':
@@ -740,13 +879,7 @@ def wallet_reconcile():
         return Response(output, mimetype='text/csv', headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
     # 本日時段總額（以會計日理解）
-    base_today = current_business_base_date(now_local)
-    today_start_local, today_end_local = business_day_window(base_today)
-    today_q = (StoredValueTransaction.query
-               .filter(StoredValueTransaction.type == 'topup')
-               .filter(StoredValueTransaction.created_at >= today_start_local.astimezone(pytz.utc))
-               .filter(StoredValueTransaction.created_at < today_end_local.astimezone(pytz.utc)))
-    today_total = sum(t.amount or 0 for t in today_q.all())
+    today_total = wallet_rollup.totals(business_calendar.resolve_range('today'), 'topup')['amount']
 
     # Debug 資訊：DB URL、交易數量、最大 ID
     from config import DATABASE_URL as _DB_URL
@@ -776,7 +909,9 @@ def wallet_reconcile():
                            consume_total=consume_total,
                            consume_count=consume_count,
                            invalid_rows=invalid_rows,
+                           repair_summary=repair_summary,
                            duplicate_rows=duplicate_rows,
+                           duplicate_tolerance=wallet_duplicates.DUPLICATE_TOLERANCE_MINUTES,
                            today_total=today_total,
                            start_local_display=(start_local.strftime('%Y-%m-%d %H:%M')),
                            end_local_display=(end_local.strftime('%Y-%m-%d %H:%M')),
@@ -788,7 +923,6 @@ def wallet_reconcile():
 def wallet_reconcile_consume():
     """扣款對帳：顯示 consume 交易，區分使用儲值金與使用折價券（僅券），同會計時段與篩選。"""
     import pytz
-    from datetime import datetime as _dt, timedelta
     tz = pytz.timezone('Asia/Taipei')
     preset = (request.args.get('preset') or '').strip()  # today,yesterday,thisweek,thismonth,lastmonth
     start_str = (request.args.get('start') or '').strip()
@@ -796,60 +930,11 @@ def wallet_reconcile_consume():
     remark_kw = (request.args.get('remark_kw') or '').strip()
     only = (request.args.get('only') or '').strip()  # 'stored' or 'coupon'
 
-    now_local = _dt.now(tz)
-    def business_day_window(base_date):
-        start_local = tz.localize(_dt(base_date.year, base_date.month, base_date.day, 12, 0, 0))
-        next_day = start_local + timedelta(days=1)
-        end_local = tz.localize(_dt(next_day.year, next_day.month, next_day.day, 3, 0, 0))
-        return start_local, end_local
-    def current_business_base_date(now_dt):
-        if now_dt.hour < 3:
-            return (now_dt - timedelta(days=1)).date()
-        return now_dt.date()
-    if preset in ('today','yesterday') and not start_str and not end_str:
-        base_date = current_business_base_date(now_local)
-        if preset=='yesterday':
-            base_date = base_date - timedelta(days=1)
-        start_local, end_local = business_day_window(base_date)
-    elif preset=='thisweek' and not start_str and not end_str:
-        weekday = current_business_base_date(now_local).weekday()
-        monday_date = current_business_base_date(now_local) - timedelta(days=weekday)
-        start_local,_ = business_day_window(monday_date)
-        _,end_local = business_day_window(current_business_base_date(now_local))
-    elif preset=='thismonth' and not start_str and not end_str:
-        first_date = current_business_base_date(now_local).replace(day=1)
-        start_local,_ = business_day_window(first_date)
-        _,end_local = business_day_window(current_business_base_date(now_local))
-    elif preset=='lastmonth' and not start_str and not end_str:
-        base = current_business_base_date(now_local)
-        first_this = base.replace(day=1)
-        last_month_end = first_this - timedelta(days=1)
-        first_last = last_month_end.replace(day=1)
-        start_local,_ = business_day_window(first_last)
-        _,end_local = business_day_window(last_month_end)
-    else:
-        if start_str:
-            try:
-                y,m,d = [int(x) for x in start_str.split('-')]
-                start_local,_ = business_day_window(_dt(y,m,d).date())
-            except Exception:
-                start_local,_ = business_day_window(now_local.date())
-        else:
-            start_local,_ = business_day_window(now_local.date())
-        if end_str:
-            try:
-                y2,m2,d2 = [int(x) for x in end_str.split('-')]
-                _,end_local = business_day_window(_dt(y2,m2,d2).date())
-            except Exception:
-                _,end_local = business_day_window(now_local.date())
-        else:
-            _,end_local = business_day_window(now_local.date())
-    start_utc = start_local.astimezone(pytz.utc)
-    end_utc = end_local.astimezone(pytz.utc)
+    br = business_calendar.resolve_range(preset, start_str, end_str)
+    start_local, end_local = br.start_local, br.end_local
     txns = (StoredValueTransaction.query
             .filter(StoredValueTransaction.type=='consume')
-            .filter(StoredValueTransaction.created_at>=start_utc)
-            .filter(StoredValueTransaction.created_at<end_utc)
+            .filter(business_calendar.in_range(StoredValueTransaction, br))
             .order_by(StoredValueTransaction.created_at.asc()).all())
     rows = []
     stored_sum = 0
@@ -919,6 +1004,16 @@ def wallet_reconcile_consume():
         rows = [r for r in rows if remark_kw in (r['remark'] or '')]
     stored_count = sum(1 for r in rows if not r['coupon_only'])
     coupon_only_count = sum(1 for r in rows if r['coupon_only'])
+    if not only and not remark_kw:
+        # 未篩選時合計讀會計日彙總表（與明細同一會計窗）
+        from utils import wallet_rollup
+        consume_totals = wallet_rollup.totals(br, 'consume')
+        stored_sum = consume_totals['amount']
+        coupon_only_sum = consume_totals['coupon_only_coupons']
+        coupon_only_count = consume_totals['coupon_only_count']
+        stored_count = consume_totals['count'] - coupon_only_count
+        coupon_value_total = (consume_totals['coupon_500'] * 500 + consume_totals['coupon_300'] * 300
+                              + consume_totals['coupon_100'] * 100)
     # 顯示沖正（扣款頁）：僅影響顯示，不改資料庫；用於調整顯示的使用儲值金總額
     display_offset = int(request.args.get('offset') or 0)
     adj_stored_sum = stored_sum + display_offset
@@ -946,6 +1041,103 @@ def wallet_reconcile_consume():
                            txn_count=txn_count,
                            last_txn_id=last_txn_id)
 
+@admin_bp.route('/wallet/repair/run', methods=['POST'])
+def wallet_repair_run():
+    """立即執行一次交易資料修復掃描（平常由排程 wallet_repair 執行）。"""
+    from utils.wallet_repair import run_repair
+    try:
+        stats = run_repair(source=f"admin:{session.get('uid') or ''}")
+        flash(f"掃描 {stats['scanned']} 筆：補電話 {stats['phones_filled']}、無效 {stats['invalid']}、"
+              f"孤兒 {stats['orphan']}、已解決 {stats['resolved']}", 'info')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'掃描失敗：{e}', 'danger')
+    return redirect(request.form.get('redirect_url') or url_for('admin.wallet_reconcile'))
+
+
+@admin_bp.route('/wallet/repair/clean-invalid', methods=['POST'])
+def wallet_repair_clean_invalid():
+    """刪除所有標記為無效的儲值交易並扣回餘額（寫入稽核紀錄）。"""
+    from utils.wallet_repair import clean_invalid
+    try:
+        n = clean_invalid(source=f"admin:{session.get('uid') or ''}")
+        flash(f'已自動清理 {n} 筆無效交易', 'info')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'清理失敗：{e}', 'danger')
+    return redirect(request.form.get('redirect_url') or url_for('admin.wallet_reconcile'))
+
+
+@admin_bp.route('/wallet/repair/log')
+def wallet_repair_log():
+    """資料修復稽核紀錄（最近 N 筆，預設 100）；?txn=<id> 只看單一交易。"""
+    from models import WalletRepairLog
+    from utils.wallet_repair import repair_summary
+    limit = int(request.args.get('limit') or 100)
+    q = WalletRepairLog.query
+    if request.args.get('txn'):
+        q = q.filter_by(txn_id=int(request.args.get('txn')))
+    logs = q.order_by(WalletRepairLog.id.desc()).limit(limit).all()
+    data = repair_summary()
+    data['last_run_at'] = data['last_run_at'].isoformat() if data['last_run_at'] else None
+    data['logs'] = [{
+        'id': l.id,
+        'action': l.action,
+        'txn_id': l.txn_id,
+        'wallet_id': l.wallet_id,
+        'detail': l.detail,
+        'source': l.source,
+        'created_at': l.created_at.isoformat() if l.created_at else None,
+    } for l in logs]
+    return data
+
+@admin_bp.route('/wallet/duplicates')
+def wallet_duplicates_report():
+    """疑似重複儲值（同錢包 + 金額 + 備註，相隔 tolerance 分鐘內）。
+    參數：preset/start/end（同會計窗，即時查詢）、tolerance（分鐘）、limit（預設 500）；
+    scope=all 改讀夜間全帳掃描結果（wallet_duplicate_candidate）。"""
+    from utils import wallet_duplicates
+    limit = int(request.args.get('limit') or 500)
+    if request.args.get('scope') == 'all':
+        from models import WalletDuplicateCandidate as C
+        items = C.query.order_by(C.txn_created_at.desc()).limit(limit).all()
+        return {
+            'scope': 'all',
+            'detected_at': items[0].detected_at.isoformat() if items else None,
+            'count': C.query.count(),
+            'rows': [{
+                'id': c.txn_id,
+                'duplicate_of': c.duplicate_of,
+                'wallet_id': c.wallet_id,
+                'amount': c.amount,
+                'gap_minutes': round(c.gap_minutes or 0, 1),
+                'created_at': c.txn_created_at.isoformat() if c.txn_created_at else None,
+            } for c in items],
+        }
+    br = business_calendar.resolve_range(request.args.get('preset'), request.args.get('start'), request.args.get('end'))
+    tolerance = request.args.get('tolerance', type=float)
+    if tolerance is None:
+        tolerance = wallet_duplicates.DUPLICATE_TOLERANCE_MINUTES
+    rows = wallet_duplicates.find_duplicates(br, tolerance_minutes=tolerance, limit=limit)
+    return {
+        'start': br.start_local.isoformat(),
+        'end': br.end_local.isoformat(),
+        'tolerance_minutes': tolerance,
+        'count': len(rows),
+        'rows': [{
+            'id': r['id'],
+            'duplicate_of': r['duplicate_of'],
+            'wallet_id': r['wallet_id'],
+            'phone': r['phone'],
+            'amount': r['amount'],
+            'remark': r['remark'],
+            'seq': r['seq'],
+            'gap_minutes': round(r['gap_minutes'] or 0, 1),
+            'created_at': r['created_at'].isoformat() if r['created_at'] else None,
+        } for r in rows],
+    }
+
+
 @admin_bp.route('/wallet/txn/<int:tid>')
 def wallet_txn_detail(tid):
     """單筆交易檢視，協助比對前端顯示 ID 與資料庫真實內容。"""
@@ -975,38 +1167,14 @@ def wallet_txn_detail(tid):
 @admin_bp.route('/wallet/transactions/export')
 def wallet_transactions_export():
     """匯出交易：支援 type(topup/consume/all)、日期區間(會計日 12:00~次日03:00)與格式(csv/json)。"""
-    import pytz
-    from datetime import datetime as _dt, timedelta
     fmt = (request.args.get('fmt') or 'csv').lower()
     tx_type = (request.args.get('type') or 'all').lower()
     start_str = (request.args.get('start') or '').strip()
     end_str = (request.args.get('end') or '').strip()
-    tz = pytz.timezone('Asia/Taipei')
 
-    def business_window(d):
-        s = tz.localize(_dt(d.year, d.month, d.day, 12, 0, 0))
-        e = s + timedelta(days=1, hours=15)  # +1天+15小時 = 次日03:00
-        return s, e
-    now_local = _dt.now(tz)
-    if start_str:
-        try:
-            y,m,d = [int(x) for x in start_str.split('-')]
-            start_local,_ = business_window(_dt(y,m,d).date())
-        except Exception:
-            start_local,_ = business_window(now_local.date())
-    else:
-        start_local,_ = business_window(now_local.date())
-    if end_str:
-        try:
-            y2,m2,d2 = [int(x) for x in end_str.split('-')]
-            _,end_local = business_window(_dt(y2,m2,d2).date())
-        except Exception:
-            _,end_local = business_window(now_local.date())
-    else:
-        _,end_local = business_window(now_local.date())
-    su = start_local.astimezone(pytz.utc)
-    eu = end_local.astimezone(pytz.utc)
-    base_q = StoredValueTransaction.query.filter(StoredValueTransaction.created_at >= su).filter(StoredValueTransaction.created_at < eu)
+    br = business_calendar.resolve_range(None, start_str, end_str)
+    start_local, end_local = br.start_local, br.end_local
+    base_q = StoredValueTransaction.query.filter(business_calendar.in_range(StoredValueTransaction, br))
     if tx_type in ('topup','consume'):
         base_q = base_q.filter(StoredValueTransaction.type == tx_type)
     txns = base_q.order_by(StoredValueTransaction.id.asc()).all()
@@ -1256,76 +1424,19 @@ def wallet_reconcile_adjusted():
       - 支出：原始支出總額 + consume_offset（未提供則顯示原始）
       - 剩餘：上述兩者相減
     """
-    import pytz
-    from datetime import datetime as _dt, timedelta
-    tz = pytz.timezone('Asia/Taipei')
     preset = (request.args.get('preset') or '').strip()
     start_str = (request.args.get('start') or '').strip()
     end_str = (request.args.get('end') or '').strip()
     total_offset = int(request.args.get('total_offset') or 0)
     consume_offset = int(request.args.get('consume_offset') or 0)
 
-    now_local = _dt.now(tz)
-    def business_day_window(base_date):
-        start_local = tz.localize(_dt(base_date.year, base_date.month, base_date.day, 12, 0, 0))
-        next_day = start_local + timedelta(days=1)
-        end_local = tz.localize(_dt(next_day.year, next_day.month, next_day.day, 3, 0, 0))
-        return start_local, end_local
-    def current_business_base_date(now_dt):
-        if now_dt.hour < 3:
-            return (now_dt - timedelta(days=1)).date()
-        return now_dt.date()
-    if preset in ('today','yesterday') and not start_str and not end_str:
-        base_date = current_business_base_date(now_local)
-        if preset=='yesterday':
-            base_date = base_date - timedelta(days=1)
-        start_local, end_local = business_day_window(base_date)
-    elif preset=='thisweek' and not start_str and not end_str:
-        weekday = current_business_base_date(now_local).weekday()
-        monday_date = current_business_base_date(now_local) - timedelta(days=weekday)
-        start_local,_ = business_day_window(monday_date)
-        _,end_local = business_day_window(current_business_base_date(now_local))
-    elif preset=='thismonth' and not start_str and not end_str:
-        first_date = current_business_base_date(now_local).replace(day=1)
-        start_local,_ = business_day_window(first_date)
-        _,end_local = business_day_window(current_business_base_date(now_local))
-    elif preset=='lastmonth' and not start_str and not end_str:
-        first_this = current_business_base_date(now_local).replace(day=1)
-        last_month_end = first_this - timedelta(days=1)
-        first_last = last_month_end.replace(day=1)
-        start_local,_ = business_day_window(first_last)
-        _,end_local = business_day_window(last_month_end)
-    else:
-        if start_str:
-            try:
-                y,m,d = [int(x) for x in start_str.split('-')]
-                start_local,_ = business_day_window(_dt(y,m,d).date())
-            except Exception:
-                start_local,_ = business_day_window(now_local.date())
-        else:
-            start_local,_ = business_day_window(now_local.date())
-        if end_str:
-            try:
-                y2,m2,d2 = [int(x) for x in end_str.split('-')]
-                _,end_local = business_day_window(_dt(y2,m2,d2).date())
-            except Exception:
-                _,end_local = business_day_window(now_local.date())
-        else:
-            _,end_local = business_day_window(now_local.date())
-
-    # 原始金額
-    su = start_local.astimezone(pytz.utc)
-    eu = end_local.astimezone(pytz.utc)
-    topup_total = (db.session.query(db.func.sum(StoredValueTransaction.amount))
-                   .filter(StoredValueTransaction.type=='topup')
-                   .filter(StoredValueTransaction.created_at>=su)
-                   .filter(StoredValueTransaction.created_at<eu)
-                   .scalar()) or 0
-    consume_total = (db.session.query(db.func.sum(StoredValueTransaction.amount))
-                     .filter(StoredValueTransaction.type=='consume')
-                     .filter(StoredValueTransaction.created_at>=su)
-                     .filter(StoredValueTransaction.created_at<eu)
-                     .scalar()) or 0
+    br = business_calendar.resolve_range(preset, start_str, end_str)
+    start_local, end_local = br.start_local, br.end_local
+
+    # 原始金額（會計日彙總表）
+    from utils import wallet_rollup
+    topup_total = wallet_rollup.totals(br, 'topup')['amount']
+    consume_total = wallet_rollup.totals(br, 'consume')['amount']
 
     adj_total = topup_total + total_offset
     adj_consume = consume_total + consume_offset
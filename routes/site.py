@@ -1,10 +1,9 @@
-import os
-import uuid
 from datetime import datetime
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 from werkzeug.utils import secure_filename
 from extensions import db
 from models import SiteUser, ScheduleEntry, Post, MediaAsset
+from utils import media_store
 
 site_bp = Blueprint('site', __name__)
 
@@ -199,56 +198,20 @@ def schedule_delete(sid):
 
 
 # ===== Uploads =====
-def _upload_to_local(file_storage):
-    upload_dir = os.path.join(os.path.dirname(__file__), '..', 'static', 'uploads')
-    upload_dir = os.path.abspath(upload_dir)
-    os.makedirs(upload_dir, exist_ok=True)
-    fname = secure_filename(file_storage.filename or f"upload-{uuid.uuid4().hex}")
-    path = os.path.join(upload_dir, fname)
-    file_storage.save(path)
-    url = f"/static/uploads/{fname}"
-    return url, fname, None
-
-
-def _upload_to_s3(file_storage):
-    # 動態匯入以避免在未安裝 boto3 的環境觸發靜態檢查錯誤
-    boto3 = __import__('boto3')
-    bucket = os.getenv('S3_BUCKET')
-    region = os.getenv('S3_REGION')
-    key_prefix = os.getenv('S3_KEY_PREFIX', 'uploads/')
-    if not bucket or not region:
-        raise RuntimeError('S3 參數未設定')
-    s3 = boto3.client('s3', region_name=region,
-                      aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-                      aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'))
-    fname = secure_filename(file_storage.filename or f"upload-{uuid.uuid4().hex}")
-    key = f"{key_prefix}{uuid.uuid4().hex}-{fname}"
-    s3.upload_fileobj(file_storage.stream, bucket, key, ExtraArgs={'ContentType': file_storage.mimetype or 'application/octet-stream', 'ACL': 'public-read'})
-    url = f"https://{bucket}.s3.{region}.amazonaws.com/{key}"
-    return url, key, fname
-
-
 @site_bp.route('/upload', methods=['POST'])
 @login_required
 def upload():
     f = request.files.get('file')
     if not f:
         return jsonify({'error': 'no file'}), 400
-    use_s3 = os.getenv('USE_S3', '0') == '1'
     try:
-        if use_s3:
-            url, key, fname = _upload_to_s3(f)
-        else:
-            url, fname, key = _upload_to_local(f)
-        m = MediaAsset()
-        m.url = url
-        m.key = key
-        m.filename = fname
-        m.content_type = f.mimetype
-        m.size = request.content_length or 0
-        db.session.add(m)
-        db.session.commit()
-        return jsonify({'url': url, 'id': m.id})
+        # 以內容 sha256 去重存放，縮圖 / 響應式尺寸由背景產生（utils/media_store.py）
+        _cu = current_user()
+        m, is_new = media_store.save(f.stream, filename=secure_filename(f.filename or '') or None,
+                                     created_by=_cu.id if _cu else None)
+        return jsonify({'url': m.url, 'id': m.id, 'sha256': m.sha256, 'deduplicated': not is_new})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -257,30 +220,6 @@ def upload():
 @login_required
 def media_delete(mid):
     asset = MediaAsset.query.filter_by(id=mid).first_or_404()
-    use_s3 = os.getenv('USE_S3', '0') == '1'
-    if use_s3 and asset.key:
-        try:
-            boto3 = __import__('boto3')
-            bucket = os.getenv('S3_BUCKET')
-            region = os.getenv('S3_REGION')
-            if bucket and region:
-                s3 = boto3.client('s3', region_name=region,
-                                  aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-                                  aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'))
-                s3.delete_object(Bucket=bucket, Key=asset.key)
-        except Exception:
-            pass  # 刪除失敗不阻斷流程
-    else:
-        # 本地檔案刪除
-        try:
-            if asset.filename:
-                local_path = os.path.join(os.path.dirname(__file__), '..', 'static', 'uploads', asset.filename)
-                local_path = os.path.abspath(local_path)
-                if os.path.isfile(local_path):
-                    os.remove(local_path)
-        except Exception:
-            pass
-    db.session.delete(asset)
-    db.session.commit()
+    media_store.delete(asset)
     flash('圖片已刪除','info')
     return redirect(url_for('site.dashboard'))
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""
+獨立排程行程（Procfile: scheduler）：只負責執行 utils/jobs.py 的排程工作，不處理 HTTP。
+選用：預設 web 行程已內嵌排程（leader election），不需啟動此行程。要把排程移出 web 時才部署此行程
+（Heroku：heroku ps:scale scheduler=1），並只在已有此行程的環境替 web 設 SCHEDULER_MODE=off；
+web 未設 off 時兩者一起搶 leader 鎖，仍只有一個行程執行。
+"""
+import logging
+import os
+import sys
+
+os.environ.setdefault("SCHEDULER_MODE", "off")  # import app 時不另外啟動內嵌排程
+
+from app import app  # noqa: E402
+from utils.scheduler import run_forever  # noqa: E402
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(run_forever(app))
@@ -1,3 +1,3 @@
 #!/bin/sh
 flask db upgrade
-exec gunicorn app:app -b 0.0.0.0:8080
+exec gunicorn -b 0.0.0.0:8080
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""hander/image.py：截圖驗證通過後，commit 失敗時暫存流程資料必須保留，使用者才能重傳截圖。"""
+import os
+import tempfile
+
+os.environ.setdefault("SCHEDULER_MODE", "off")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+
+import pytest  # noqa: E402
+
+from app import app  # noqa: E402
+from extensions import db  # noqa: E402
+from hander import image, verify_pipeline  # noqa: E402
+from models import Whitelist  # noqa: E402
+from utils.temp_users import get_temp_user, pop_temp_user, set_temp_user  # noqa: E402
+
+USER_ID = "U_test_image_handler"
+PHONE = "0912000111"
+
+
+class _FakeApi:
+    def __init__(self):
+        self.replies = []
+
+    def reply_message(self, reply_token, messages, **kw):
+        self.replies.append(messages)
+
+
+class _Event:
+    class source:
+        user_id = USER_ID
+
+    class message:
+        id = "m1"
+
+    reply_token = "r1"
+
+
+def _passing_run(api, user_id, message_id, temp_user, matcher=None):
+    """略過下載與 OCR，直接以 PASS 執行 persist 階段（實際寫入白名單）。"""
+    ctx = verify_pipeline.VerificationContext(user_id, message_id, temp_user)
+    ctx.outcome = verify_pipeline.PASS
+    verify_pipeline.persist(ctx, verify_pipeline.get_matcher())
+    return ctx
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    api = _FakeApi()
+    monkeypatch.setattr(image, "line_bot_api", api)
+    monkeypatch.setattr(image, "reply_with_menu", lambda token, msg: api.reply_message(token, msg))
+    monkeypatch.setattr(image, "enqueue_push", lambda *a, **kw: None)
+    monkeypatch.setattr(verify_pipeline, "run", _passing_run)
+    with app.app_context():
+        set_temp_user(USER_ID, {"step": "waiting_screenshot", "phone": PHONE, "name": "測試", "line_id": "tester"})
+        yield api
+        pop_temp_user(USER_ID)
+        Whitelist.query.filter_by(phone=PHONE).delete()
+        db.session.commit()
+        db.session.remove()
+
+
+def test_commit_failure_keeps_temp_user(fake_api, monkeypatch):
+    def failing_commit():
+        db.session.rollback()
+        raise RuntimeError("commit failed")
+    monkeypatch.setattr(image, "commit_now", failing_commit)
+
+    image.handle_image(_Event)
+
+    assert get_temp_user(USER_ID) is not None
+    assert get_temp_user(USER_ID)["phone"] == PHONE
+    assert "系統錯誤" in fake_api.replies[-1].text
+
+
+def test_commit_success_clears_temp_user(fake_api):
+    image.handle_image(_Event)
+
+    assert get_temp_user(USER_ID) is None
+    assert "驗證成功" in fake_api.replies[-1]
+    assert Whitelist.query.filter_by(phone=PHONE).first() is not None
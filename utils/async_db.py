@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI 執行模式的熱查詢（asgi.py 快速路徑用）：不經 Flask app context / ORM session，直接查需要的欄位。
+
+有 async 驅動時以 SQLAlchemy AsyncEngine 查詢，事件迴圈不被 DB 往返卡住：
+  postgresql://  → postgresql+asyncpg://（需安裝 asyncpg）
+  sqlite:///     → sqlite+aiosqlite:///（需安裝 aiosqlite）
+沒有對應驅動（或 ASYNC_DB_ENABLED=0）時改在執行緒池以既有的同步 engine 執行同一個查詢，行為相同。
+
+環境變數：
+  ASYNC_DB_ENABLED     預設 1；設 0 一律走執行緒池
+  ASYNC_DB_POOL_SIZE   AsyncEngine 連線池大小（預設 10）
+"""
+import asyncio
+import logging
+import os
+
+from sqlalchemy import select
+
+from extensions import db
+from models import Whitelist
+
+ASYNC_DB_ENABLED = os.getenv("ASYNC_DB_ENABLED", "1") == "1"
+POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+
+_ASYNC_DRIVERS = {
+    "postgresql": ("postgresql+asyncpg", "asyncpg"),
+    "sqlite": ("sqlite+aiosqlite", "aiosqlite"),
+}
+
+_engine = None
+_app = None
+_executor = None
+
+_WHITELIST_COLUMNS = (Whitelist.id, Whitelist.phone, Whitelist.name, Whitelist.line_id,
+                      Whitelist.line_user_id, Whitelist.created_at)
+
+
+def async_url(url):
+    """同步 DB URL 對應的 async 驅動 URL；沒有對應或未安裝驅動時回傳 None。"""
+    dialect, _, rest = str(url).partition("://")
+    base = dialect.split("+", 1)[0]
+    if base not in _ASYNC_DRIVERS:
+        return None
+    driver_url, module = _ASYNC_DRIVERS[base]
+    try:
+        __import__(module)
+    except ImportError:
+        return None
+    return f"{driver_url}://{rest}"
+
+
+async def init_async_db(app, executor):
+    """建立 AsyncEngine（可用時）；否則記下 app / executor 供同步備援使用。"""
+    global _engine, _app, _executor
+    _app, _executor = app, executor
+    if not ASYNC_DB_ENABLED:
+        return None
+    url = async_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    if not url:
+        logging.info("[async_db] 沒有可用的 async 驅動，熱查詢改在執行緒池執行")
+        return None
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        kw = {} if url.startswith("sqlite") else {"pool_size": POOL_SIZE, "pool_pre_ping": True}
+        _engine = create_async_engine(url, **kw)
+    except Exception:
+        logging.exception("[async_db] 建立 AsyncEngine 失敗，熱查詢改在執行緒池執行")
+        _engine = None
+    return _engine
+
+
+async def close_async_db():
+    global _engine
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+
+
+def using_async_engine():
+    return _engine is not None
+
+
+async def _first(stmt):
+    if _engine is not None:
+        async with _engine.connect() as conn:
+            return (await conn.execute(stmt)).first()
+
+    def _sync():
+        with _app.app_context():
+            try:
+                return db.session.execute(stmt).first()
+            finally:
+                db.session.remove()
+    return await asyncio.get_running_loop().run_in_executor(_executor, _sync)
+
+
+async def find_whitelist(line_user_id):
+    """白名單中綁定此 LINE user id 的資料列（id / phone / name / line_id / line_user_id / created_at）或 None。"""
+    if not line_user_id:
+        return None
+    return await _first(select(*_WHITELIST_COLUMNS).where(Whitelist.line_user_id == line_user_id).limit(1))
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+會計日曆：對帳報表共用的會計日定義、區間預設（今日 / 昨日 / 本週 / 本月 / 上月 / 自訂）與 SQL 端的日期分組。
+
+定義（台北時間）：
+  會計日    台北時間減 3 小時後的日期，00:00~02:59 歸前一日
+  會計窗    起日 12:00 ~ 迄日次日 03:00（半開區間）；03:00~11:59 為非營業時段（off_hours）
+
+SQL：
+  business_date_of(created_at)   created_at（UTC naive）所屬會計日
+    PostgreSQL  CAST(date_trunc('day', created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Taipei' - INTERVAL '3 hours') AS DATE)
+    SQLite      date(created_at, '+5 hours')（台灣無日光節約時間，固定 UTC+8）
+  business_hour_of(created_at)   減 3 小時後的台北時間小時數（0 = 03 點），用來判斷 off_hours
+  stored_value_txn.business_date 即以 business_date_of 產生的 generated column，與 type 建複合索引；
+  報表以 in_range() 過濾（business_date 區間 + 起日 12:00 之後），依會計日 GROUP BY 直接在資料庫完成
+"""
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import pytz
+from sqlalchemy import Date, Integer, and_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+TZ_NAME = "Asia/Taipei"
+TZ = pytz.timezone(TZ_NAME)
+DAY_SHIFT_HOURS = 3     # 會計日於台北時間 03:00 換日
+WINDOW_OPEN_HOUR = 12   # 會計窗 12:00 開始
+UTC_OFFSET_HOURS = 8    # SQLite 無時區資料庫，以固定位移計算
+
+DAY_SHIFT = timedelta(hours=DAY_SHIFT_HOURS)
+PRESETS = ("today", "yesterday", "thisweek", "thismonth", "lastmonth")
+
+
+# ───────────────────────────────────────────────────────────────
+# Python 端（單筆交易）
+# ───────────────────────────────────────────────────────────────
+def _to_local(created_at):
+    if created_at.tzinfo is None:
+        created_at = pytz.utc.localize(created_at)
+    return created_at.astimezone(TZ)
+
+
+def business_date(created_at):
+    """交易時間（UTC naive 或 aware）所屬會計日。"""
+    return (_to_local(created_at) - DAY_SHIFT).date()
+
+
+def is_off_hours(created_at):
+    """是否落在台北時間 03:00~11:59（不在任何會計窗內的時段）。"""
+    return DAY_SHIFT_HOURS <= _to_local(created_at).hour < WINDOW_OPEN_HOUR
+
+
+def current_business_date(now=None):
+    """現在所屬的會計日（淩晨 00:00~02:59 視為前一日）。"""
+    return business_date(now or datetime.utcnow())
+
+
+# ───────────────────────────────────────────────────────────────
+# 會計窗與區間預設
+# ───────────────────────────────────────────────────────────────
+class BusinessRange(namedtuple("BusinessRange", "start_date end_date")):
+    """會計日 [start_date, end_date]，對應會計窗 起日 12:00 ~ 迄日次日 03:00（台北時間）。"""
+
+    @property
+    def start_local(self):
+        d = self.start_date
+        return TZ.localize(datetime(d.year, d.month, d.day, WINDOW_OPEN_HOUR))
+
+    @property
+    def end_local(self):
+        d = self.end_date + timedelta(days=1)
+        return TZ.localize(datetime(d.year, d.month, d.day, DAY_SHIFT_HOURS))
+
+    @property
+    def start_utc(self):
+        return self.start_local.astimezone(pytz.utc).replace(tzinfo=None)
+
+    @property
+    def end_utc(self):
+        return self.end_local.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def day_range(d):
+    """單一會計日的會計窗。"""
+    return BusinessRange(d, d)
+
+
+def _parse_date(value):
+    y, m, d = [int(x) for x in value.split('-')]
+    return date(y, m, d)
+
+
+def resolve_range(preset=None, start_str=None, end_str=None, now=None):
+    """報表查詢參數 → BusinessRange。
+
+    指定 start / end 時以自訂日期解讀（無法解析或未填則用今天的台北日期）；否則依 preset：
+      today / yesterday  目前會計日 / 前一會計日
+      thisweek           本週一 ~ 目前會計日
+      thismonth          本月 1 日 ~ 目前會計日
+      lastmonth          上月 1 日 ~ 上月最後一天
+    """
+    now = now or datetime.utcnow()
+    start_str = (start_str or '').strip()
+    end_str = (end_str or '').strip()
+    base = current_business_date(now)
+    if preset in PRESETS and not start_str and not end_str:
+        if preset == 'today':
+            return BusinessRange(base, base)
+        if preset == 'yesterday':
+            yesterday = base - timedelta(days=1)
+            return BusinessRange(yesterday, yesterday)
+        if preset == 'thisweek':
+            return BusinessRange(base - timedelta(days=base.weekday()), base)
+        if preset == 'thismonth':
+            return BusinessRange(base.replace(day=1), base)
+        last_month_end = base.replace(day=1) - timedelta(days=1)
+        return BusinessRange(last_month_end.replace(day=1), last_month_end)
+
+    today = _to_local(now).date()
+    dates = []
+    for value in (start_str, end_str):
+        try:
+            dates.append(_parse_date(value) if value else today)
+        except Exception:
+            dates.append(today)
+    return BusinessRange(*dates)
+
+
+def in_range(model, business_range):
+    """model（含 business_date / created_at 欄位）落在會計窗內的條件：會計日區間內且不早於起日 12:00。"""
+    return and_(model.business_date.between(business_range.start_date, business_range.end_date),
+                model.created_at >= business_range.start_utc)
+
+
+# ───────────────────────────────────────────────────────────────
+# SQL 端
+# ───────────────────────────────────────────────────────────────
+class business_date_of(FunctionElement):
+    """created_at（UTC naive）所屬會計日。"""
+    type = Date()
+    name = "business_date_of"
+    inherit_cache = True
+
+
+class business_hour_of(FunctionElement):
+    """created_at 減 3 小時後的台北時間小時數（0~23）；< WINDOW_OPEN_HOUR - DAY_SHIFT_HOURS 即 off_hours。"""
+    type = Integer()
+    name = "business_hour_of"
+    inherit_cache = True
+
+
+def _pg_shifted(element, compiler, **kw):
+    arg = compiler.process(element.clauses, **kw)
+    return f"((({arg}) AT TIME ZONE 'UTC' AT TIME ZONE '{TZ_NAME}') - INTERVAL '{DAY_SHIFT_HOURS} hours')"
+
+
+@compiles(business_date_of)
+@compiles(business_date_of, "postgresql")
+def _business_date_pg(element, compiler, **kw):
+    return f"CAST(date_trunc('day', {_pg_shifted(element, compiler, **kw)}) AS DATE)"
+
+
+@compiles(business_date_of, "sqlite")
+def _business_date_sqlite(element, compiler, **kw):
+    arg = compiler.process(element.clauses, **kw)
+    return f"date({arg}, '+{UTC_OFFSET_HOURS - DAY_SHIFT_HOURS} hours')"
+
+
+@compiles(business_hour_of)
+@compiles(business_hour_of, "postgresql")
+def _business_hour_pg(element, compiler, **kw):
+    return f"CAST(EXTRACT(HOUR FROM {_pg_shifted(element, compiler, **kw)}) AS INTEGER)"
+
+
+@compiles(business_hour_of, "sqlite")
+def _business_hour_sqlite(element, compiler, **kw):
+    arg = compiler.process(element.clauses, **kw)
+    return f"CAST(strftime('%H', {arg}, '+{UTC_OFFSET_HOURS - DAY_SHIFT_HOURS} hours') AS INTEGER)"
@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+"""
+推播活動（廣播）引擎：以 SQL 從白名單 / 儲值金 / 抽獎券狀態篩選名單，分批主動推播並逐一記錄。
+
+流程：
+  1. create_campaign() 建立草稿；queue_campaign() 以一條 INSERT ... SELECT 把名單寫入 campaign_delivery
+     （同一活動同一用戶只有一筆），狀態改為 queued
+  2. 排程 campaign_dispatch（utils/jobs.py，只在 leader 行程執行）每分鐘取出到期的活動呼叫 run_campaign()，
+     web worker 只寫入資料、不參與送出
+  3. multicast：每批最多 500 人，CAMPAIGN_CONCURRENCY 條執行緒同時送出並共用 CAMPAIGN_RATE 限速；
+     遇到 429 依 Retry-After（沒有則指數退避）讓所有執行緒一起暫停後重送同一批
+     narrowcast：名單上傳為受眾群組後送出一次 narrowcast，之後每輪排程查詢進度
+  4. 斷點：campaign_delivery 的狀態就是進度。每批先標記 sending 並寫入 batch_key 才送出；
+     行程中斷後再次執行時，停在 sending 的批次以同一個 batch_key 當 X-Line-Retry-Key 重送，
+     LINE 已受理過的回 409，視為已送達，不會重複推播
+  5. 可隨時暫停 / 取消（已送出的批次送完即停），暫停後重新排入會從斷點繼續；失敗的收件人可重新排入
+
+line-bot-sdk 的 retry_key 會寫進 LineBotApi 的共用 headers 且不會清除，
+因此送出時每條執行緒各自建立 LineBotApi，並在每次呼叫後移除 X-Line-Retry-Key。
+
+環境變數：
+  CAMPAIGN_CONCURRENCY      同時進行的 multicast 數（預設 4）
+  CAMPAIGN_RATE             每秒 multicast 次數上限（預設 20；LINE 上限為 200）
+  CAMPAIGN_MAX_ATTEMPTS     每批最多嘗試次數（預設 5）
+  CAMPAIGN_BACKOFF_SECONDS  429 無 Retry-After 或 5xx / 網路錯誤時第一次等待秒數，之後倍增（預設 2）
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from linebot.exceptions import LineBotApiError
+from sqlalchemy import case, exists, func, insert, literal, or_, select, update
+
+from extensions import db, line_bot_api
+from models import (
+    Blacklist, Campaign, CampaignDelivery, Coupon, StoredValueTransaction, StoredValueWallet, Whitelist,
+)
+from utils.metrics import campaign_result, campaign_throttled
+from utils.push_queue import deserialize_messages, serialize_messages
+
+CONCURRENCY = max(1, int(os.getenv("CAMPAIGN_CONCURRENCY", "4")))
+RATE = float(os.getenv("CAMPAIGN_RATE", "20"))
+MAX_ATTEMPTS = max(1, int(os.getenv("CAMPAIGN_MAX_ATTEMPTS", "5")))
+BACKOFF_SECONDS = float(os.getenv("CAMPAIGN_BACKOFF_SECONDS", "2"))
+
+MULTICAST_LIMIT = 500       # LINE multicast 單次收件者上限
+AUDIENCE_UPLOAD_LIMIT = 10000  # 上傳受眾群組單次上限
+RETRY_KEY_HEADER = "X-Line-Retry-Key"
+
+_local = threading.local()
+
+
+# ───────────────────────────────────────────────────────────────
+# 名單（SQL）
+# ───────────────────────────────────────────────────────────────
+AUDIENCES = {}
+
+
+def register_audience(name, label):
+    """註冊名單：函式接收參數 dict，回傳只有一個 line_user_id 欄位的 select()。"""
+    def deco(fn):
+        AUDIENCES[name] = {"label": label, "query": fn}
+        return fn
+    return deco
+
+
+def _members():
+    """已綁定 LINE 且不在黑名單的白名單會員。"""
+    return (
+        select(Whitelist.line_user_id.label("line_user_id"))
+        .where(Whitelist.line_user_id.isnot(None), Whitelist.line_user_id != "")
+        .where(~exists().where(Blacklist.phone == Whitelist.phone))
+    )
+
+
+def _days_ago(params, default):
+    return datetime.utcnow() - timedelta(days=int(params.get("days") or default))
+
+
+@register_audience("members", "全部已驗證會員")
+def _audience_members(params):
+    return _members()
+
+
+@register_audience("new_members", "近 N 天新驗證會員（days，預設 30）")
+def _audience_new_members(params):
+    return _members().where(Whitelist.created_at >= _days_ago(params, 30))
+
+
+@register_audience("wallet_balance", "儲值金餘額 ≥ N 元（min_balance，預設 1）")
+def _audience_wallet_balance(params):
+    min_balance = int(params.get("min_balance") or 1)
+    holders = select(StoredValueWallet.phone).where(StoredValueWallet.balance >= min_balance)
+    return _members().where(Whitelist.phone.in_(holders))
+
+
+@register_audience("coupon_holders", "仍有未使用折價券")
+def _audience_coupon_holders(params):
+    sign = case((StoredValueTransaction.type == "topup", 1), else_=-1)
+    c500 = func.sum(sign * func.coalesce(StoredValueTransaction.coupon_500_count, 0))
+    c300 = func.sum(sign * func.coalesce(StoredValueTransaction.coupon_300_count, 0))
+    c100 = func.sum(sign * func.coalesce(StoredValueTransaction.coupon_100_count, 0))
+    holders = (
+        select(StoredValueWallet.phone)
+        .join(StoredValueTransaction, StoredValueTransaction.wallet_id == StoredValueWallet.id)
+        .group_by(StoredValueWallet.phone)
+        .having(or_(c500 > 0, c300 > 0, c100 > 0))
+    )
+    return _members().where(Whitelist.phone.in_(holders))
+
+
+@register_audience("draw_coupon", "近 N 天獲得抽獎券（days，預設 30；type：draw / report）")
+def _audience_draw_coupon(params):
+    recent = select(Coupon.line_user_id).where(Coupon.created_at >= _days_ago(params, 30))
+    if params.get("type"):
+        recent = recent.where(Coupon.type == params["type"])
+    return _members().where(Whitelist.line_user_id.in_(recent))
+
+
+def audience_query(name, params=None):
+    if name not in AUDIENCES:
+        raise ValueError(f"未知的名單：{name}")
+    return AUDIENCES[name]["query"](params or {}).distinct()
+
+
+def preview_audience(name, params=None):
+    """名單人數（建立活動前預覽）。"""
+    q = audience_query(name, params).subquery()
+    return db.session.execute(select(func.count()).select_from(q)).scalar() or 0
+
+
+# ───────────────────────────────────────────────────────────────
+# 活動管理
+# ───────────────────────────────────────────────────────────────
+def create_campaign(name, messages, audience, params=None, mode="multicast", scheduled_at=None, created_by=None):
+    """建立草稿；messages 可為單一訊息或陣列（最多 5 則），scheduled_at 為 UTC（naive）。"""
+    if audience not in AUDIENCES:
+        raise ValueError(f"未知的名單：{audience}")
+    if mode not in ("multicast", "narrowcast"):
+        raise ValueError(f"未知的送出方式：{mode}")
+    messages = list(messages) if isinstance(messages, (list, tuple)) else [messages]
+    c = Campaign(name=name, payload=serialize_messages(messages), audience=audience,
+                 audience_params=json.dumps(params or {}, ensure_ascii=False), mode=mode,
+                 status="draft", scheduled_at=scheduled_at, created_by=created_by)
+    db.session.add(c)
+    db.session.commit()
+    return c
+
+
+def queue_campaign(campaign_id):
+    """草稿：產生收件名單後排入；暫停中：直接排入，從斷點繼續。回傳收件人數。"""
+    c = db.session.get(Campaign, campaign_id)
+    if c is None or c.status not in ("draft", "paused"):
+        raise ValueError("只有草稿或暫停中的活動可以排入")
+    if c.status == "draft":
+        audience = audience_query(c.audience, json.loads(c.audience_params or "{}")).subquery()
+        db.session.execute(
+            insert(CampaignDelivery).from_select(
+                ["campaign_id", "line_user_id", "status", "attempts"],
+                select(literal(c.id), audience.c.line_user_id, literal("pending"), literal(0)),
+            )
+        )
+        c.total = db.session.query(func.count(CampaignDelivery.id)).filter_by(campaign_id=c.id).scalar() or 0
+    c.status = "queued"
+    db.session.commit()
+    return c.total
+
+
+def pause_campaign(campaign_id):
+    _set_status(campaign_id, ("queued", "running"), "paused")
+
+
+def cancel_campaign(campaign_id):
+    _set_status(campaign_id, ("draft", "queued", "running", "paused"), "cancelled")
+
+
+def retry_failed(campaign_id):
+    """把失敗的收件人放回 pending 並重新排入；回傳筆數。"""
+    c = db.session.get(Campaign, campaign_id)
+    if c is None or c.status not in ("done", "failed", "paused") or c.mode != "multicast":
+        raise ValueError("只有已完成 / 暫停的 multicast 活動可以重送失敗名單")
+    n = db.session.execute(
+        update(CampaignDelivery)
+        .where(CampaignDelivery.campaign_id == c.id, CampaignDelivery.status == "failed")
+        .values(status="pending", batch_key=None, error=None)
+    ).rowcount
+    c.failed_count = max((c.failed_count or 0) - n, 0)
+    c.status = "queued"
+    c.finished_at = None
+    db.session.commit()
+    return n
+
+
+def _set_status(campaign_id, allowed, status):
+    n = db.session.execute(
+        update(Campaign).where(Campaign.id == campaign_id, Campaign.status.in_(allowed)).values(status=status)
+    ).rowcount
+    db.session.commit()
+    if n != 1:
+        raise ValueError(f"目前狀態無法改為 {status}")
+
+
+def campaign_progress(campaign_id):
+    rows = (db.session.query(CampaignDelivery.status, func.count(CampaignDelivery.id))
+            .filter_by(campaign_id=campaign_id).group_by(CampaignDelivery.status).all())
+    return {status: count for status, count in rows}
+
+
+# ───────────────────────────────────────────────────────────────
+# 送出
+# ───────────────────────────────────────────────────────────────
+class _RateLimiter:
+    """所有送出執行緒共用：每秒最多 rate 次；pause() 讓全部執行緒一起等待（429）。"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.next_at = max(self.next_at, time.monotonic() + seconds)
+
+
+def _thread_client():
+    """每條送出執行緒各自的 LineBotApi（retry key 寫在實例 headers 上，不能與其他執行緒共用）。"""
+    client = getattr(_local, "client", None)
+    if client is None:
+        from extensions import ACCESS_TOKEN
+        if ACCESS_TOKEN:
+            from linebot import LineBotApi
+            from utils.metrics import instrument_line_bot_api
+            client = instrument_line_bot_api(LineBotApi(ACCESS_TOKEN))
+        else:
+            client = line_bot_api  # 降級模式（mock）
+        _local.client = client
+    return client
+
+
+def _call(client, method, *a, **kw):
+    try:
+        return getattr(client, method)(*a, **kw)
+    finally:
+        headers = getattr(client, "headers", None)
+        if isinstance(headers, dict):
+            headers.pop(RETRY_KEY_HEADER, None)
+
+
+def _retry_after(exc):
+    try:
+        return float((exc.headers or {}).get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _send_batch(api, limiter, messages, batch_key, to):
+    """在送出執行緒中執行（不碰資料庫）；回傳 (成功與否, 嘗試次數, 錯誤訊息)。"""
+    client = api or _thread_client()
+    error = None
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        limiter.acquire()
+        try:
+            _call(client, "multicast", to, messages, retry_key=batch_key)
+            return True, attempt, None
+        except LineBotApiError as e:
+            if e.status_code == 409:
+                return True, attempt, None  # 同一 retry key 已受理（中斷前已送出）
+            error = f"{e.status_code} {getattr(e.error, 'message', '')}"[:255]
+            if e.status_code != 429 and e.status_code < 500:
+                return False, attempt, error
+            delay = BACKOFF_SECONDS * (2 ** (attempt - 1))
+            if e.status_code == 429:
+                campaign_throttled("multicast")
+                limiter.pause(_retry_after(e) or delay)
+                continue
+        except Exception as e:
+            error = str(e)[:255]
+            delay = BACKOFF_SECONDS * (2 ** (attempt - 1))
+        if attempt < MAX_ATTEMPTS:
+            time.sleep(delay)
+    return False, MAX_ATTEMPTS, error
+
+
+def _claim_batch(campaign_id):
+    rows = (db.session.query(CampaignDelivery.id, CampaignDelivery.line_user_id)
+            .filter(CampaignDelivery.campaign_id == campaign_id, CampaignDelivery.status == "pending")
+            .order_by(CampaignDelivery.id).limit(MULTICAST_LIMIT).all())
+    if not rows:
+        db.session.rollback()
+        return None, []
+    batch_key = str(uuid.uuid4())
+    db.session.execute(
+        update(CampaignDelivery)
+        .where(CampaignDelivery.id.in_([r.id for r in rows]), CampaignDelivery.status == "pending")
+        .values(status="sending", batch_key=batch_key)
+    )
+    db.session.commit()
+    return batch_key, [r.line_user_id for r in rows]
+
+
+def _interrupted_batches(campaign_id):
+    """上次執行中斷時停在 sending 的批次：{batch_key: [line_user_id]}。"""
+    rows = (db.session.query(CampaignDelivery.batch_key, CampaignDelivery.line_user_id)
+            .filter(CampaignDelivery.campaign_id == campaign_id, CampaignDelivery.status == "sending")
+            .all())
+    db.session.rollback()
+    batches = {}
+    for key, uid in rows:
+        batches.setdefault(key, []).append(uid)
+    return list(batches.items())
+
+
+def _finish_batch(campaign_id, batch_key, ok, attempts, error, count):
+    values = {"status": "sent" if ok else "failed", "attempts": CampaignDelivery.attempts + attempts, "error": error}
+    if ok:
+        values["sent_at"] = datetime.utcnow()
+    db.session.execute(
+        update(CampaignDelivery)
+        .where(CampaignDelivery.campaign_id == campaign_id, CampaignDelivery.batch_key == batch_key,
+               CampaignDelivery.status == "sending")
+        .values(**values)
+    )
+    counter = Campaign.sent_count if ok else Campaign.failed_count
+    db.session.execute(update(Campaign).where(Campaign.id == campaign_id).values({counter: counter + count}))
+    db.session.commit()
+    campaign_result("multicast", "sent" if ok else "failed", count)
+    if not ok:
+        logging.warning(f"[campaign] #{campaign_id} 批次失敗（{count} 人）：{error}")
+
+
+def _current_status(campaign_id):
+    status = db.session.query(Campaign.status).filter_by(id=campaign_id).scalar()
+    db.session.rollback()
+    return status
+
+
+def _run_multicast(c, api):
+    campaign_id = c.id
+    messages = deserialize_messages(c.payload)
+    limiter = _RateLimiter(RATE)
+    backlog = _interrupted_batches(campaign_id)
+    inflight = {}
+    stopped = False
+    with ThreadPoolExecutor(CONCURRENCY, thread_name_prefix=f"campaign-{campaign_id}") as pool:
+        while True:
+            while len(inflight) < CONCURRENCY:
+                if backlog:
+                    batch_key, to = backlog.pop()
+                elif stopped:
+                    break
+                elif _current_status(campaign_id) != "running":
+                    stopped = True  # 已暫停 / 取消：送完進行中的批次即停止
+                    break
+                else:
+                    batch_key, to = _claim_batch(campaign_id)
+                    if not to:
+                        break
+                future = pool.submit(_send_batch, api, limiter, messages, batch_key, to)
+                inflight[future] = (batch_key, len(to))
+            if not inflight:
+                break
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch_key, count = inflight.pop(future)
+                ok, attempts, error = future.result()
+                _finish_batch(campaign_id, batch_key, ok, attempts, error, count)
+    _finalize(campaign_id)
+
+
+def _finalize(campaign_id):
+    remaining = (db.session.query(func.count(CampaignDelivery.id))
+                 .filter(CampaignDelivery.campaign_id == campaign_id,
+                         CampaignDelivery.status.in_(("pending", "sending")))
+                 .scalar())
+    if not remaining:
+        db.session.execute(
+            update(Campaign).where(Campaign.id == campaign_id, Campaign.status == "running")
+            .values(status="done", finished_at=datetime.utcnow())
+        )
+    db.session.commit()
+
+
+def _audience_group_status(client, group_id):
+    group = _call(client, "get_audience_group", group_id)
+    status = getattr(group, "status", None)
+    if status is None:
+        # API 回傳 {"audienceGroup": {...}, "jobs": [...]}，部分 SDK 版本不會展開
+        status = (getattr(group, "audience_group", None) or {}).get("status")
+    return status
+
+
+def _run_narrowcast(c, api):
+    """narrowcast 不會阻塞等待：上傳 → 送出 → 之後每輪排程查詢一次進度。"""
+    from linebot.models import AudienceRecipient, Filter, Limit
+    client = api or _thread_client()
+
+    if not c.audience_group_id:
+        user_ids = [uid for (uid,) in db.session.query(CampaignDelivery.line_user_id)
+                    .filter_by(campaign_id=c.id).order_by(CampaignDelivery.id)]
+        audiences = [{"id": uid} for uid in user_ids]
+        group = _call(client, "create_audience_group", f"campaign-{c.id} {c.name}"[:120],
+                      audiences=audiences[:AUDIENCE_UPLOAD_LIMIT])
+        for i in range(AUDIENCE_UPLOAD_LIMIT, len(audiences), AUDIENCE_UPLOAD_LIMIT):
+            _call(client, "add_audiences_to_audience_group", group.audience_group_id,
+                  audiences[i:i + AUDIENCE_UPLOAD_LIMIT])
+        c.audience_group_id = str(group.audience_group_id)
+        c.retry_key = c.retry_key or str(uuid.uuid4())
+        db.session.commit()
+
+    if not c.request_id:
+        status = _audience_group_status(client, int(c.audience_group_id))
+        if status != "READY":
+            db.session.rollback()
+            return  # 受眾群組處理中，下一輪排程再送
+        try:
+            res = _call(client, "narrowcast", deserialize_messages(c.payload), retry_key=c.retry_key,
+                        recipient=AudienceRecipient(group_id=int(c.audience_group_id)),
+                        filter=Filter(), limit=Limit())
+            request_id = res.request_id
+        except LineBotApiError as e:
+            if e.status_code != 409:
+                raise
+            request_id = e.accepted_request_id  # 同一 retry key 已受理
+        c.request_id = request_id
+        db.session.execute(
+            update(CampaignDelivery).where(CampaignDelivery.campaign_id == c.id, CampaignDelivery.status == "pending")
+            .values(status="sending", attempts=CampaignDelivery.attempts + 1)
+        )
+        db.session.commit()
+        return
+
+    progress = _call(client, "get_progress_status_narrowcast", c.request_id)
+    if progress.phase not in ("succeeded", "failed"):
+        db.session.rollback()
+        return
+    ok = progress.phase == "succeeded"
+    # narrowcast 沒有逐一結果：受理對象全部標記為 sent / failed，實際成功 / 失敗人數記在活動上
+    db.session.execute(
+        update(CampaignDelivery).where(CampaignDelivery.campaign_id == c.id, CampaignDelivery.status == "sending")
+        .values(status="sent" if ok else "failed", sent_at=datetime.utcnow() if ok else None,
+                error=None if ok else (progress.failed_description or "")[:255])
+    )
+    c.sent_count = progress.success_count or 0
+    c.failed_count = progress.failure_count or 0
+    c.status = "done" if ok else "failed"
+    c.error = None if ok else progress.failed_description
+    c.finished_at = datetime.utcnow()
+    db.session.commit()
+    campaign_result("narrowcast", "sent", c.sent_count)
+    campaign_result("narrowcast", "failed", c.failed_count)
+
+
+def run_campaign(campaign_id, api=None):
+    """執行（或從斷點繼續）一個活動；api 可傳入替身供測試。"""
+    c = db.session.get(Campaign, campaign_id)
+    if c is None or c.status not in ("queued", "running"):
+        db.session.rollback()
+        return
+    if c.status == "queued":
+        c.status = "running"
+        c.started_at = c.started_at or datetime.utcnow()
+        db.session.commit()
+    try:
+        if c.mode == "narrowcast":
+            _run_narrowcast(c, api)
+        else:
+            _run_multicast(c, api)
+    except Exception as e:
+        db.session.rollback()
+        logging.exception(f"[campaign] #{campaign_id} 執行失敗")
+        db.session.execute(update(Campaign).where(Campaign.id == campaign_id).values(error=str(e)[:2000]))
+        db.session.commit()
+        raise
+
+
+def dispatch_due_campaigns(api=None):
+    """排程呼叫：依序執行所有已排入且到期的活動（含上次中斷的 running）。"""
+    now = datetime.utcnow()
+    due = [cid for (cid,) in db.session.query(Campaign.id)
+           .filter(Campaign.status.in_(("queued", "running")))
+           .filter(or_(Campaign.scheduled_at.is_(None), Campaign.scheduled_at <= now))
+           .order_by(Campaign.id)]
+    db.session.rollback()
+    for campaign_id in due:
+        try:
+            run_campaign(campaign_id, api)
+        except Exception:
+            pass  # 已記錄於 campaign.error，繼續下一個活動
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+年底折價券到期提醒（批次排程）。
+
+12/10 ~ 12/31 每日由排程（utils/jobs.py）執行一次（取代原本在每次互動時逐筆重算全部交易的提醒）：
+  1. 一次聚合查詢找出「今日尚未提醒、剩餘折價券 > 0、已綁定 LINE」的錢包
+  2. 依剩餘張數分組（同組訊息內容相同），每組以 multicast 每批 500 人送出，批次間限速
+  3. 每批送出成功後一次 UPDATE 該批錢包的 last_coupon_notice_at
+沒有主動傳訊息給官方帳號的用戶也會收到提醒。
+
+環境變數：
+  COUPON_NOTICE_HOUR  每日執行時間（台北時間，預設 12 點）
+  COUPON_NOTICE_RATE  每秒 multicast 次數上限（預設 2）
+"""
+import logging
+import os
+import time
+from datetime import datetime
+
+import pytz
+from linebot.models import TextSendMessage
+from sqlalchemy import case, func, or_, update
+
+from extensions import db, line_bot_api
+from models import StoredValueWallet, StoredValueTransaction, Whitelist
+
+NOTICE_HOUR = int(os.getenv("COUPON_NOTICE_HOUR", "12"))
+NOTICE_RATE = float(os.getenv("COUPON_NOTICE_RATE", "2"))
+NOTICE_START_DAY = 10     # 12/10 起提醒
+MULTICAST_LIMIT = 500     # LINE multicast 單次收件者上限
+
+TZ = pytz.timezone("Asia/Taipei")
+
+
+def notice_window(now_dt):
+    """回傳 (提醒開始, 到期時間)，皆為台北時間。"""
+    start = TZ.localize(datetime(now_dt.year, 12, NOTICE_START_DAY, 0, 0, 0))
+    expire = TZ.localize(datetime(now_dt.year, 12, 31, 23, 59, 59))
+    return start, expire
+
+
+def build_notice_text(expire_dt, c500, c300, c100):
+    return (
+        f"提醒：您的折價券將於 {expire_dt.strftime('%Y/%m/%d')} 到期。\n"
+        f"目前剩餘：500券 x {c500}、300券 x {c300}、100券 x {c100}"
+    )
+
+
+def _naive_utc(dt):
+    # last_coupon_notice_at 以 UTC（naive）儲存
+    return dt.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def eligible_wallets(now_dt):
+    """聚合查詢：回傳 [(wallet_id, line_user_id, c500, c300, c100)]，只含今日尚未提醒且仍有剩餘券的錢包。"""
+    sign = case((StoredValueTransaction.type == "topup", 1), else_=-1)
+    c500 = func.sum(sign * func.coalesce(StoredValueTransaction.coupon_500_count, 0))
+    c300 = func.sum(sign * func.coalesce(StoredValueTransaction.coupon_300_count, 0))
+    c100 = func.sum(sign * func.coalesce(StoredValueTransaction.coupon_100_count, 0))
+    today_start_utc = _naive_utc(TZ.localize(datetime(now_dt.year, now_dt.month, now_dt.day)))
+    rows = (
+        db.session.query(StoredValueWallet.id, Whitelist.line_user_id, c500, c300, c100)
+        .join(StoredValueTransaction, StoredValueTransaction.wallet_id == StoredValueWallet.id)
+        .join(Whitelist, Whitelist.phone == StoredValueWallet.phone)
+        .filter(Whitelist.line_user_id.isnot(None))
+        .filter(or_(StoredValueWallet.last_coupon_notice_at.is_(None),
+                    StoredValueWallet.last_coupon_notice_at < today_start_utc))
+        .group_by(StoredValueWallet.id, Whitelist.line_user_id)
+        .having(or_(c500 > 0, c300 > 0, c100 > 0))
+        .all()
+    )
+    return [(wid, uid, max(a or 0, 0), max(b or 0, 0), max(c or 0, 0)) for wid, uid, a, b, c in rows]
+
+
+def send_coupon_expiry_notices(now_dt=None, api=None):
+    """執行一次批次提醒；不在 12/10 ~ 12/31 期間時直接返回。回傳統計 dict。"""
+    api = api or line_bot_api
+    now_dt = now_dt or datetime.now(TZ)
+    start, expire = notice_window(now_dt)
+    summary = {"wallets": 0, "users": 0, "multicasts": 0, "failed_batches": 0}
+    if not (start <= now_dt <= expire):
+        return summary
+
+    rows = eligible_wallets(now_dt)
+    db.session.rollback()
+    summary["wallets"] = len(rows)
+
+    # 相同剩餘張數 → 相同訊息，合併成一組；同一用戶只提醒一次
+    groups = {}
+    seen = set()
+    for wallet_id, user_id, c500, c300, c100 in rows:
+        if user_id in seen:
+            continue
+        seen.add(user_id)
+        groups.setdefault((c500, c300, c100), []).append((wallet_id, user_id))
+    summary["users"] = len(seen)
+
+    interval = 1.0 / NOTICE_RATE if NOTICE_RATE > 0 else 0
+    last_call = 0.0
+    for (c500, c300, c100), members in groups.items():
+        message = TextSendMessage(text=build_notice_text(expire, c500, c300, c100))
+        for i in range(0, len(members), MULTICAST_LIMIT):
+            batch = members[i:i + MULTICAST_LIMIT]
+            wait = interval - (time.monotonic() - last_call)
+            if wait > 0:
+                time.sleep(wait)
+            last_call = time.monotonic()
+            try:
+                api.multicast([uid for _, uid in batch], message)
+            except Exception:
+                summary["failed_batches"] += 1
+                logging.exception(f"[coupon_notice] multicast 失敗（{len(batch)} 人），明日重試")
+                continue
+            summary["multicasts"] += 1
+            try:
+                db.session.execute(
+                    update(StoredValueWallet)
+                    .where(StoredValueWallet.id.in_([wid for wid, _ in batch]))
+                    .values(last_coupon_notice_at=_naive_utc(now_dt))
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logging.exception("[coupon_notice] 更新 last_coupon_notice_at 失敗")
+    logging.info(f"[coupon_notice] {summary}")
+    return summary
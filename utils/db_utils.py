@@ -2,6 +2,7 @@
 
 from models import Whitelist
 from extensions import db
+from utils.unit_of_work import commit, savepoint
 from datetime import datetime, timezone
 try:
     from sqlalchemy.exc import IntegrityError
@@ -13,10 +14,10 @@ def _now():
     return datetime.now(timezone.utc)
 
 def _safe_commit():
+    # 在 unit_of_work 範圍內只 flush，由事件結束時統一 commit
     try:
-        db.session.commit()
+        commit()
     except Exception as e:
-        db.session.rollback()
         logging.error(f"DB commit failed: {e}")
         raise
 
@@ -65,13 +66,13 @@ def update_or_create_whitelist_from_data(data, user_id, reverify=False):
         line_user_id=user_id,
         created_at=_now()
     )
-    db.session.add(record)
     try:
-        _safe_commit()
+        # savepoint：衝突時只退回這筆新增，同一事件先前的寫入不受影響
+        with savepoint():
+            db.session.add(record)
         is_new = True
         return record, is_new
     except IntegrityError:
-        db.session.rollback()
         logging.warning("IntegrityError on insert Whitelist, trying fallback by phone")
         fallback = Whitelist.query.filter_by(phone=phone).first() if phone else None
         if fallback:
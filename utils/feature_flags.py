@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+功能旗標：feature_flag 表的行程內快照 + 全域版本號。
+
+原本每次判斷都直接查 feature_flag，更新時逐筆改 enabled 再 commit。現在：
+  - 快照  {(key, company_id): enabled}，is_enabled(key, company_id) 為兩次 dict 查詢（O(1)）：
+          公司層級設定優先，沒有才看全域（company_id 為 NULL），兩者都沒有回傳 default
+  - 版本  config_version 表 name='feature_flag' 的 version；設定 REDIS_URL 時改用 Redis INCR。
+          每 FEATURE_FLAG_CHECK_SECONDS 秒最多比對一次版本，版本不同才重載快照
+  - 更新  set_flags() 以單一 UPDATE ... SET enabled = CASE key ... 批次更新並在同一個交易內 +1 版本；
+          經 ORM 修改 FeatureFlag（新增 / 刪除 / 後台編輯）也會在 flush 時 +1，commit 後本行程立即重載
+
+環境變數：
+  FEATURE_FLAG_CHECK_SECONDS  兩次版本比對的最短間隔秒數（預設 5）
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import case, event, update
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import ConfigVersion, FeatureFlag
+from utils.metrics import record_cache
+
+CHECK_SECONDS = float(os.getenv("FEATURE_FLAG_CHECK_SECONDS", "5"))
+VERSION_NAME = "feature_flag"
+REDIS_VERSION_KEY = "config_version:feature_flag"
+
+_DIRTY_KEY = "feature_flag_dirty"
+
+_redis = None
+try:
+    import redis
+    if os.getenv("REDIS_URL"):
+        _redis = redis.StrictRedis.from_url(os.getenv("REDIS_URL"))
+except Exception:
+    _redis = None
+
+
+# ───────────────────────────────────────────────────────────────
+# 版本號
+# ───────────────────────────────────────────────────────────────
+def _bump_db_version(connection):
+    table = ConfigVersion.__table__
+    now = datetime.utcnow()
+    done = connection.execute(
+        update(table).where(table.c.name == VERSION_NAME)
+        .values(version=table.c.version + 1, updated_at=now)
+    ).rowcount
+    if not done:
+        connection.execute(table.insert().values(name=VERSION_NAME, version=1, updated_at=now))
+
+
+def _bump_redis_version():
+    try:
+        _redis.incr(REDIS_VERSION_KEY)
+    except Exception:
+        logging.exception("[feature_flags] Redis 版本號更新失敗")
+
+
+def current_version():
+    """全域版本號（Redis 或 config_version）；讀取失敗回傳 None。"""
+    try:
+        if _redis is not None:
+            return int(_redis.get(REDIS_VERSION_KEY) or 0)
+        row = db.session.query(ConfigVersion.version).filter_by(name=VERSION_NAME).first()
+        return row[0] if row else 0
+    except Exception:
+        logging.exception("[feature_flags] 讀取版本號失敗")
+        return None
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_on_flush(session, flush_context):
+    if session.info.get(_DIRTY_KEY):
+        return
+    if any(isinstance(o, FeatureFlag) for o in (*session.new, *session.dirty, *session.deleted)):
+        session.info[_DIRTY_KEY] = True
+        if _redis is None:
+            # 與旗標修改同一個交易：rollback 時版本一起還原
+            _bump_db_version(session.connection())
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop(_DIRTY_KEY, False):
+        if _redis is not None:
+            _bump_redis_version()
+        invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop(_DIRTY_KEY, None)
+
+
+# ───────────────────────────────────────────────────────────────
+# 快照
+# ───────────────────────────────────────────────────────────────
+_lock = threading.Lock()
+_state = {"flags": None, "version": None, "checked": 0.0}
+
+
+def _load():
+    rows = db.session.query(FeatureFlag.key, FeatureFlag.company_id, FeatureFlag.enabled).all()
+    return {(key, company_id): bool(enabled) for key, company_id, enabled in rows}
+
+
+def _snapshot():
+    flags = _state["flags"]
+    if flags is not None and time.monotonic() - _state["checked"] < CHECK_SECONDS:
+        record_cache("feature_flag", True)
+        return flags
+    with _lock:
+        if _state["flags"] is not None and time.monotonic() - _state["checked"] < CHECK_SECONDS:
+            record_cache("feature_flag", True)
+            return _state["flags"]
+        version = current_version()
+        if _state["flags"] is None or version is None or version != _state["version"]:
+            # 版本讀取失敗時照樣重載，避免一直沿用舊快照
+            _state["flags"] = _load()
+            _state["version"] = version
+            record_cache("feature_flag", False)
+        else:
+            record_cache("feature_flag", True)
+        _state["checked"] = time.monotonic()
+        return _state["flags"]
+
+
+def invalidate():
+    """下次查詢時重載快照。"""
+    _state["flags"] = None
+
+
+def is_enabled(key, company_id=None, default=False):
+    """旗標是否開啟：公司層級設定優先，其次全域；都沒有設定回傳 default。"""
+    try:
+        flags = _snapshot()
+    except Exception:
+        logging.exception("[feature_flags] 載入旗標失敗")
+        return default
+    if company_id is not None:
+        value = flags.get((key, company_id))
+        if value is not None:
+            return value
+    value = flags.get((key, None))
+    return default if value is None else value
+
+
+def snapshot():
+    """目前快照的副本與版本號（後台檢視用）。"""
+    flags = _snapshot()
+    return {"version": _state["version"], "flags": dict(flags)}
+
+
+# ───────────────────────────────────────────────────────────────
+# 批次更新
+# ───────────────────────────────────────────────────────────────
+def set_flags(values, company_id=None):
+    """批次設定 {key: enabled}（只更新已存在的旗標）；單一 UPDATE 並在同一個交易內 +1 版本。回傳更新筆數。"""
+    if not values:
+        return 0
+    table = FeatureFlag.__table__
+    scope = table.c.company_id.is_(None) if company_id is None else table.c.company_id == company_id
+    stmt = (update(table)
+            .where(table.c.key.in_(list(values)), scope)
+            .values(enabled=case({k: bool(v) for k, v in values.items()}, value=table.c.key,
+                                 else_=table.c.enabled)))
+    try:
+        n = db.session.execute(stmt).rowcount
+        if _redis is None:
+            _bump_db_version(db.session.connection())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if _redis is not None:
+        _bump_redis_version()
+    invalidate()
+    return n
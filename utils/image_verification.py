@@ -1,6 +1,41 @@
+import io
+import logging
+import os
 import re
+import threading
+import time
 import pytesseract
 from PIL import Image
+from utils import ocr_roi
+from utils.metrics import ocr_timer, ocr_tier
+
+# LINE 圖片訊息上限約 10MB；超過即中止下載，避免異常檔案佔滿記憶體
+MAX_IMAGE_BYTES = int(os.getenv("OCR_MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# 設 0 則一律整張辨識
+OCR_ROI_ENABLED = os.getenv("OCR_ROI_ENABLED", "1") == "1" and ocr_roi.ROI_AVAILABLE
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def download_message_image(api, message_id, max_bytes=MAX_IMAGE_BYTES):
+    """以串流方式將 LINE 圖片下載到記憶體，回傳 bytes；超過 max_bytes 拋出 ImageTooLarge。"""
+    content = api.get_message_content(message_id)
+    buf = io.BytesIO()
+    for chunk in content.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+        if buf.tell() + len(chunk) > max_bytes:
+            raise ImageTooLarge(f"image exceeds {max_bytes} bytes")
+        buf.write(chunk)
+    return buf.getvalue()
+
+
+def open_image(data):
+    """由記憶體中的位元組解碼圖片（立即載入，之後不再依賴原始緩衝）。"""
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
 
 def normalize_phone(phone_raw):
     # 去掉空白與 - 和 +號
@@ -19,20 +54,209 @@ def normalize_phone(phone_raw):
         return phone_raw
     return phone
 
-def extract_lineid_phone(image_path, debug=False):
-    image = Image.open(image_path)
-    text = pytesseract.image_to_string(image, lang='eng+chi_tra')
-
+def extract_lineid_phone_full_text(text):
+    """由整張 OCR 全文解析 (手機, LINE ID)。"""
     # 支援 +886 903 587 063、886903587063、09xxxxxxxx
-    phone_match = re.search(r'((?:\+?886)[ -]?\d{3}[ -]?\d{3}[ -]?\d{3}|09\d{8})', text)
+    phone_match = re.search(r'((?:\+?886)[ -]?\d{3}[ -]?\d{3}[ -]?\d{3}|09\d{8})', text or "")
     phone = normalize_phone(phone_match.group(0)) if phone_match else None
 
     # LINE ID 抓法不變
-    lineid_match = re.search(r'ID[\s:：]{0,2}([A-Za-z0-9_\-\.]{3,})', text, re.IGNORECASE)
+    lineid_match = re.search(r'ID[\s:：]{0,2}([A-Za-z0-9_\-\.]{3,})', text or "", re.IGNORECASE)
     lineid = lineid_match.group(1) if lineid_match else None
+    return phone, lineid
+
+
+def extract_lineid_phone_full(image):
+    """整張截圖跑 eng+chi_tra，回傳 (手機, LINE ID, 全文)。"""
+    text = _run_full(image)
+    phone, lineid = extract_lineid_phone_full_text(text)
+    return phone, lineid, text
+
+
+# ───────────────────────────────────────────────────────────────
+# 分層 OCR：便宜的英數辨識先跑，找不到需要的欄位才載入 chi_tra 整張辨識
+#   roi        欄位文字列長條，eng + 英數白名單（需 opencv）
+#   eng_sparse 整張 eng，--psm 11 稀疏文字 + 英數白名單
+#   full       整張 eng+chi_tra（原本的做法）
+# ───────────────────────────────────────────────────────────────
+SPARSE_TESSERACT_CONFIG = f"--psm 11 -c tessedit_char_whitelist={ocr_roi.ROI_WHITELIST}"
+# 尚無實測數據時，用來估計略過某層省下的時間（毫秒）
+TIER_ESTIMATE_MS = {"roi": 300.0, "eng_sparse": 900.0, "full": 2500.0}
+LINE_ID_NOT_SET = ("尚未設定", "未設定", "無", "none", "not set")
+
+_tier_lock = threading.Lock()
+_tier_stats = {}   # tier -> {"runs", "hits", "ms", "computed"}
+_time_saved_ms = 0.0
+
+
+def _run_roi(image):
+    lines = ocr_roi.ocr_lines(image) or []
+    return "\n".join(lines)
+
+
+def _run_sparse(image):
+    return pytesseract.image_to_string(image, lang="eng", config=SPARSE_TESSERACT_CONFIG)
+
+
+def _run_full(image):
+    return pytesseract.image_to_string(image, lang="eng+chi_tra")
+
+
+def _parse_lines(text):
+    return ocr_roi.parse_fields([l.strip() for l in (text or "").splitlines() if l.strip()])
+
+
+def _parse_full(text):
+    return extract_lineid_phone_full_text(text)
+
+
+def _tiers():
+    tiers = []
+    if OCR_ROI_ENABLED:
+        tiers.append(("roi", _run_roi, _parse_lines))
+    tiers.append(("eng_sparse", _run_sparse, _parse_lines))
+    tiers.append(("full", _run_full, _parse_full))
+    return tiers
+
+
+def _avg_ms(tier):
+    st = _tier_stats.get(tier)
+    if st and st["computed"]:
+        return st["ms"] / st["computed"]
+    return TIER_ESTIMATE_MS.get(tier, 0.0)
+
+
+def _record_tier(tier, hit, ms, computed, saved_ms=0.0):
+    global _time_saved_ms
+    with _tier_lock:
+        st = _tier_stats.setdefault(tier, {"runs": 0, "hits": 0, "ms": 0.0, "computed": 0})
+        st["runs"] += 1
+        st["hits"] += 1 if hit else 0
+        if computed:
+            st["ms"] += ms
+            st["computed"] += 1
+        _time_saved_ms += saved_ms
+    ocr_tier(tier, hit, saved_ms / 1000.0)
+
+
+def tier_stats():
+    """各層命中率、平均耗時與累計省下的時間（本行程）。"""
+    with _tier_lock:
+        out = {
+            tier: {
+                "runs": st["runs"],
+                "hits": st["hits"],
+                "hit_rate": round(st["hits"] / st["runs"], 3) if st["runs"] else 0.0,
+                "avg_ms": round(st["ms"] / st["computed"], 1) if st["computed"] else None,
+            }
+            for tier, st in _tier_stats.items()
+        }
+        return {"tiers": out, "time_saved_ms": round(_time_saved_ms, 1)}
+
+
+def reset_tier_stats():
+    global _time_saved_ms
+    with _tier_lock:
+        _tier_stats.clear()
+        _time_saved_ms = 0.0
+
+
+def _line_id_in_text(expected_line_id, text):
+    """預期的 LINE ID 是否以完整詞出現在全文中（前後不接 LINE ID 可用字元，myid_1234 不算 myid_123）。"""
+    exp = (expected_line_id or "").strip()
+    if not exp or not text:
+        return False
+    return re.search(rf"(?<![A-Za-z0-9_.\-]){re.escape(exp)}(?![A-Za-z0-9_.\-])", text, re.IGNORECASE) is not None
+
+
+def _satisfied(phone, line_id, text, expected_phone, expected_line_id, need_phone=True):
+    """是否已取得比對所需的欄位；有預期值時以預期值為準。"""
+    need_line_id = not (expected_line_id and expected_line_id.strip().lower() in LINE_ID_NOT_SET)
+    if expected_phone:
+        if not phone or normalize_phone(phone) != normalize_phone(expected_phone):
+            return False
+    elif need_phone and not phone:
+        return False
+    if not need_line_id:
+        return True
+    if expected_line_id:
+        exp = expected_line_id.strip().lower()
+        return (line_id or "").lower() == exp or _line_id_in_text(expected_line_id, text)
+    return bool(line_id)
+
+
+def recognize(image=None, image_bytes=None, expected_phone=None, expected_line_id=None,
+              user_id=None, need_phone=True, tiers=None):
+    """
+    分層辨識 LINE 個人頁截圖，回傳 {"phone", "line_id", "text", "tier"}。
+    每層結果依圖片雜湊快取（見 utils/ocr_cache.py）；某層取得所需欄位即停止。
+    need_phone=False 時只要求 LINE ID（hander/verify.py 只比對 LINE ID）。
+    若各層都不滿足，phone / line_id 取與預期值相符者，否則取最先辨識到的值，text 為最後一層全文。
+    """
+    from utils import ocr_cache
+
+    if image is None:
+        image = open_image(image_bytes)
+    tiers = tiers or _tiers()
+    phones, line_ids = [], []
+    result = {"phone": None, "line_id": None, "text": "", "tier": None}
+    for idx, (tier, run, parse) in enumerate(tiers):
+        computed = []
+
+        def compute(img, run=run, tier=tier):
+            computed.append(True)
+            with ocr_timer(tier):
+                return {"text": run(img)}
+
+        t0 = time.perf_counter()
+        try:
+            if image_bytes:
+                text = ocr_cache.cached_ocr(image_bytes, f"tier:{tier}", compute, user_id=user_id, image=image)["text"]
+            else:
+                text = compute(image)["text"]
+        except Exception:
+            # 前面的層級失敗就交給下一層；最後一層失敗才往上拋
+            if idx == len(tiers) - 1:
+                raise
+            logging.exception("OCR tier %s failed", tier)
+            continue
+        ms = (time.perf_counter() - t0) * 1000.0
+        phone, line_id = parse(text)
+        if phone:
+            phones.append(phone)
+        if line_id:
+            line_ids.append(line_id)
+        result.update(text=text, tier=tier)
+        hit = _satisfied(phone, line_id, text, expected_phone, expected_line_id, need_phone)
+        saved = sum(_avg_ms(t[0]) for t in tiers[idx + 1:]) if hit else 0.0
+        _record_tier(tier, hit, ms, bool(computed), saved)
+        if hit:
+            # 因全文出現預期 LINE ID 而停止時，解析出的 line_id 可能是暱稱等其他行，改以預期值回傳
+            if expected_line_id and (line_id or "").lower() != expected_line_id.strip().lower() \
+                    and _line_id_in_text(expected_line_id, text):
+                line_id = expected_line_id.strip()
+            result.update(phone=phone, line_id=line_id)
+            return result
+
+    exp_phone = normalize_phone(expected_phone) if expected_phone else None
+    exp_line_id = (expected_line_id or "").strip().lower()
+    result["phone"] = next((p for p in phones if normalize_phone(p) == exp_phone), phones[0] if phones else None)
+    result["line_id"] = next((l for l in line_ids if l.lower() == exp_line_id), line_ids[0] if line_ids else None)
+    return result
+
+
+def extract_lineid_phone(image, debug=False, expected_phone=None, expected_line_id=None):
+    """
+    image 可為已解碼的 PIL Image 或檔案路徑。回傳 (手機, LINE ID, 全文)。
+    以分層 OCR 辨識；有預期值時取得相符欄位即停止。
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    result = recognize(image, expected_phone=expected_phone, expected_line_id=expected_line_id)
+    phone, lineid, text = result["phone"], result["line_id"], result["text"]
 
     if debug:
-        print("OCR全文：\n", text)
+        print(f"OCR全文（{result['tier']}）：\n", text)
         print("手機:", phone)
         print("LINE ID:", lineid)
 
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+排程工作（由 utils/scheduler.py 註冊，只在 leader 行程執行）。
+
+工作以「模組:函式」參照存入持久化 job store，因此必須是本模組的頂層函式；
+新增工作：以 @scheduled_job("<job id>") 裝飾並加入 JOBS。
+"""
+import os
+from datetime import datetime, timedelta
+
+import pytz
+
+from extensions import db
+from utils.scheduler import scheduled_job
+
+JOB_RUN_RETENTION_DAYS = int(os.getenv("JOB_RUN_RETENTION_DAYS", "30"))
+
+
+@scheduled_job("expire_coupons_daily")
+def expire_coupons_job():
+    """12/31 當天批次清除剩餘優惠券（寫入 consume 交易）。"""
+    from models import StoredValueWallet, StoredValueTransaction
+    tz = pytz.timezone('Asia/Taipei')
+    now_dt = datetime.now(tz)
+    expire_dt = tz.localize(datetime(now_dt.year, 12, 31, 23, 59, 59))
+    if now_dt.date() != expire_dt.date():
+        return  # 僅在 12/31 當天執行一次批次清除
+    wallets = StoredValueWallet.query.all()
+    for w in wallets:
+        txns = StoredValueTransaction.query.filter_by(wallet_id=w.id).all()
+        c500 = c300 = c100 = 0
+        for t in txns:
+            sign = 1 if t.type == 'topup' else -1
+            c500 += sign * (t.coupon_500_count or 0)
+            c300 += sign * (t.coupon_300_count or 0)
+            try:
+                c100 += sign * (getattr(t, 'coupon_100_count', 0) or 0)
+            except Exception:
+                pass
+        c500 = max(c500, 0)
+        c300 = max(c300, 0)
+        c100 = max(c100, 0)
+        if c500 > 0 or c300 > 0 or c100 > 0:
+            try:
+                txn = StoredValueTransaction()
+                txn.wallet_id = w.id
+                txn.type = 'consume'
+                txn.amount = 0
+                txn.remark = f"AUTO_EXPIRE {expire_dt.strftime('%Y/%m/%d')}"
+                txn.coupon_500_count = c500
+                txn.coupon_300_count = c300
+                try:
+                    txn.coupon_100_count = c100
+                except Exception:
+                    pass
+                db.session.add(txn)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+
+
+@scheduled_job("coupon_expiry_notice_daily")
+def coupon_expiry_notice_job():
+    """12/10~12/31 每日一次：折價券到期提醒（聚合查詢 + multicast 批次送出，見 utils/coupon_notice.py）。"""
+    from utils.coupon_notice import send_coupon_expiry_notices
+    send_coupon_expiry_notices()
+
+
+@scheduled_job("clear_pending_verify_daily")
+def clear_pending_verify_job():
+    """每日自動清除「待驗證名單」（temp_verify 狀態為 pending）。"""
+    from models import TempVerify
+    try:
+        # 僅刪除仍為 pending 的暫存驗證資料
+        pending = TempVerify.query.filter_by(status='pending').all()
+        for item in pending:
+            db.session.delete(item)
+        if pending:
+            db.session.commit()
+        else:
+            db.session.rollback()
+    except Exception:
+        db.session.rollback()
+
+
+@scheduled_job("prune_job_runs_daily")
+def prune_job_runs_job():
+    """刪除超過保留天數的 job_run 執行紀錄。"""
+    from models import JobRun
+    cutoff = datetime.utcnow() - timedelta(days=JOB_RUN_RETENTION_DAYS)
+    JobRun.query.filter(JobRun.started_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+
+
+@scheduled_job("campaign_dispatch")
+def campaign_dispatch_job():
+    """每分鐘執行已排入且到期的推播活動（utils/campaign.py）；max_instances=1，大型活動送完前不會重疊。"""
+    from utils.campaign import dispatch_due_campaigns
+    dispatch_due_campaigns()
+
+
+@scheduled_job("wallet_repair")
+def wallet_repair_job():
+    """儲值金交易資料修復：補錢包電話、標記無電話 / 孤兒交易供對帳報表顯示（utils/wallet_repair.py）。"""
+    from utils.wallet_repair import run_repair
+    run_repair()
+
+
+@scheduled_job("wallet_duplicate_sweep")
+def wallet_duplicate_sweep_job():
+    """夜間全帳掃描疑似重複儲值，重建 wallet_duplicate_candidate（utils/wallet_duplicates.py）。"""
+    from utils.wallet_duplicates import sweep
+    sweep()
+
+
+@scheduled_job("richmenu_link")
+def richmenu_link_job():
+    """分批把白名單用戶連結到已驗證 Rich Menu（既有用戶補齊 / 換選單後重新連結，utils/richmenu_link.py）。"""
+    from utils.richmenu_link import link_pending
+    link_pending()
+
+
+@scheduled_job("media_variants")
+def media_variants_job():
+    """補做尚未產生縮圖 / 響應式尺寸的媒體（行程重啟時佇列中的項目，utils/media_store.py）。"""
+    from utils.media_store import process_pending
+    process_pending()
+
+
+def _coupon_notice_hour():
+    from utils.coupon_notice import NOTICE_HOUR
+    return NOTICE_HOUR
+
+
+def _wallet_repair_minutes():
+    from utils.wallet_repair import REPAIR_INTERVAL_MINUTES
+    return REPAIR_INTERVAL_MINUTES
+
+
+def _richmenu_link_minutes():
+    from utils.richmenu_link import LINK_INTERVAL_MINUTES
+    return LINK_INTERVAL_MINUTES
+
+
+# (工作, trigger, trigger 參數)；時間皆為台北時間
+JOBS = [
+    (expire_coupons_job, "cron", {"hour": 0, "minute": 10}),
+    (coupon_expiry_notice_job, "cron", {"month": 12, "day": "10-31", "hour": _coupon_notice_hour(), "minute": 0}),
+    (clear_pending_verify_job, "cron", {"hour": 2, "minute": 0}),
+    (prune_job_runs_job, "cron", {"hour": 3, "minute": 30}),
+    (campaign_dispatch_job, "interval", {"minutes": 1}),
+    (wallet_repair_job, "interval", {"minutes": _wallet_repair_minutes()}),
+    (wallet_duplicate_sweep_job, "cron", {"hour": 4, "minute": 0}),
+    (richmenu_link_job, "interval", {"minutes": _richmenu_link_minutes()}),
+    (media_variants_job, "interval", {"minutes": 10}),
+]
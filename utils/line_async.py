@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+非同步 LINE Messaging API 用戶端（aiohttp），供 ASGI 執行模式（asgi.py）使用。
+
+同步 worker 下每個 reply_message / push_message / get_profile / get_message_content 都會佔住整個 worker
+直到 LINE 回應；ASGI 模式改由事件迴圈上的 AsyncLineClient 以共用連線池送出：
+  AsyncLineClient       原生 async 方法，ASGI 快速路徑直接 await
+  bridge_line_bot_api   以實例屬性包裝 extensions.line_bot_api（同 utils.metrics.instrument_line_bot_api），
+                        在執行緒池中跑的同步處理函式呼叫時改由事件迴圈送出：
+                          reply_message   排入事件迴圈後立即返回（回覆 token 只能用一次，本來就不重試），
+                                          失敗記錄在 log / line_api_errors_total；close() 前會等待送完
+                          其餘三個        等待結果；錯誤以 LineBotApiError 拋出，push_queue 的重試判斷不變
+                        事件迴圈未執行（啟動前 / 關閉後）或在迴圈執行緒內呼叫時改走原本的同步方法
+
+環境變數：
+  LINE_API_ENDPOINT        預設 https://api.line.me
+  LINE_API_DATA_ENDPOINT   預設 https://api-data.line.me（訊息內容下載）
+  LINE_API_TIMEOUT         單次呼叫逾時秒數（預設 10）
+  LINE_ASYNC_POOL_SIZE     連線池上限（預設 100）
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:  # 只有 ASGI 模式需要
+    aiohttp = None
+    AIOHTTP_AVAILABLE = False
+
+from linebot.exceptions import LineBotApiError
+from linebot.models import Profile
+from linebot.models.error import Error
+
+from utils.metrics import LINE_API_ERRORS, LINE_API_LATENCY
+from utils.upload_stream import CHUNK_BYTES, HashingSpool, iter_chunks
+
+API_ENDPOINT = os.getenv("LINE_API_ENDPOINT", "https://api.line.me").rstrip("/")
+DATA_ENDPOINT = os.getenv("LINE_API_DATA_ENDPOINT", "https://api-data.line.me").rstrip("/")
+TIMEOUT_SECONDS = float(os.getenv("LINE_API_TIMEOUT", "10"))
+POOL_SIZE = int(os.getenv("LINE_ASYNC_POOL_SIZE", "100"))
+
+BRIDGED_METHODS = ("reply_message", "push_message", "get_profile", "get_message_content")
+
+
+class SpooledContent:
+    """get_message_content 的回傳值：內容已下載到暫存檔，介面同 linebot Content（content / iter_content）。"""
+
+    def __init__(self, spool, content_type):
+        self._spool = spool
+        self.content_type = content_type
+        self.size = spool.size
+
+    @property
+    def content(self):
+        self._spool.seek(0)
+        return self._spool.read()
+
+    def iter_content(self, chunk_size=1024):
+        self._spool.seek(0)
+        yield from iter_chunks(self._spool, chunk_size)
+
+    def close(self):
+        self._spool.close()
+
+
+def _messages_json(messages):
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    return [m.as_json_dict() if hasattr(m, "as_json_dict") else m for m in messages]
+
+
+class AsyncLineClient:
+    """aiohttp 版 LINE API；需在事件迴圈中呼叫 start() 建立連線池，結束時 close()。"""
+
+    def __init__(self, access_token, endpoint=API_ENDPOINT, data_endpoint=DATA_ENDPOINT,
+                 timeout=TIMEOUT_SECONDS, pool_size=POOL_SIZE):
+        if not AIOHTTP_AVAILABLE:
+            raise RuntimeError("ASGI 模式需要 aiohttp（pip install aiohttp）")
+        self.access_token = access_token
+        self.endpoint = endpoint.rstrip("/")
+        self.data_endpoint = data_endpoint.rstrip("/")
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None
+        self._background = set()
+
+    async def start(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"Authorization": f"Bearer {self.access_token}"},
+            )
+        return self
+
+    def spawn(self, coro, label):
+        """在事件迴圈上背景執行（須在迴圈執行緒呼叫）；失敗只記錄 log，close() 前會等待完成。"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background.add(task)
+
+        def _done(t):
+            self._background.discard(t)
+            if not t.cancelled() and t.exception() is not None:
+                logging.warning(f"[line_async] {label} 失敗：{t.exception()}")
+        task.add_done_callback(_done)
+        return task
+
+    async def wait_background(self, timeout=None):
+        """等待背景呼叫完成；回傳仍未完成的數量。"""
+        if not self._background:
+            return 0
+        _, pending = await asyncio.wait(set(self._background), timeout=timeout)
+        return len(pending)
+
+    async def close(self):
+        await self.wait_background(timeout=self.timeout)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _raise_for_status(self, resp):
+        if resp.status < 400:
+            return
+        try:
+            error = Error.new_from_json_dict(json.loads(await resp.text()))
+        except Exception:
+            error = Error(message=f"HTTP {resp.status}")
+        raise LineBotApiError(resp.status, resp.headers, request_id=resp.headers.get("X-Line-Request-Id"),
+                              error=error)
+
+    async def _call(self, name, method, url, **kw):
+        t0 = time.perf_counter()
+        try:
+            async with self._session.request(method, url, **kw) as resp:
+                await self._raise_for_status(resp)
+                return await resp.json(content_type=None) or {}
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            LINE_API_ERRORS.labels(name, str(status) if status else type(e).__name__).inc()
+            raise
+        finally:
+            LINE_API_LATENCY.labels(name).observe(time.perf_counter() - t0)
+
+    async def reply_message(self, reply_token, messages, notification_disabled=False):
+        await self._call("reply_message", "POST", f"{self.endpoint}/v2/bot/message/reply", json={
+            "replyToken": reply_token,
+            "messages": _messages_json(messages),
+            "notificationDisabled": notification_disabled,
+        })
+
+    async def push_message(self, to, messages, retry_key=None, notification_disabled=False):
+        headers = {"X-Line-Retry-Key": retry_key} if retry_key else None
+        await self._call("push_message", "POST", f"{self.endpoint}/v2/bot/message/push", headers=headers, json={
+            "to": to,
+            "messages": _messages_json(messages),
+            "notificationDisabled": notification_disabled,
+        })
+
+    async def get_profile(self, user_id):
+        data = await self._call("get_profile", "GET", f"{self.endpoint}/v2/bot/profile/{user_id}")
+        return Profile.new_from_json_dict(data)
+
+    async def get_message_content(self, message_id, limit=None):
+        """分塊下載到 HashingSpool；超過 limit bytes 即停止讀取（呼叫端以大小判斷是否過大）。"""
+        t0 = time.perf_counter()
+        spool = HashingSpool()
+        try:
+            url = f"{self.data_endpoint}/v2/bot/message/{message_id}/content"
+            async with self._session.get(url) as resp:
+                await self._raise_for_status(resp)
+                async for chunk in resp.content.iter_chunked(CHUNK_BYTES):
+                    spool.write(chunk)
+                    if limit is not None and spool.size >= limit:
+                        break
+                content_type = resp.headers.get("Content-Type")
+        except Exception as e:
+            spool.close()
+            status = getattr(e, "status_code", None)
+            LINE_API_ERRORS.labels("get_message_content", str(status) if status else type(e).__name__).inc()
+            raise
+        finally:
+            LINE_API_LATENCY.labels("get_message_content").observe(time.perf_counter() - t0)
+        return SpooledContent(spool, content_type)
+
+
+# ───────────────────────────────────────────────────────────────
+# 同步處理函式 → 事件迴圈
+# ───────────────────────────────────────────────────────────────
+def _in_loop_thread(loop):
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+def bridge_line_bot_api(api, client, loop):
+    """把 api 的四個 I/O 方法改由 client 在 loop 上送出；回傳 unbridge() 以還原。"""
+    if getattr(api, "_async_bridged", False):
+        return lambda: None
+    originals = {name: getattr(api, name) for name in BRIDGED_METHODS}
+
+    def _usable():
+        return loop.is_running() and not loop.is_closed() and not _in_loop_thread(loop)
+
+    def _wait(coro, timeout):
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout or client.timeout * 2)
+
+    def reply_message(reply_token, messages, notification_disabled=False, timeout=None):
+        if not _usable():
+            return originals["reply_message"](reply_token, messages,
+                                              notification_disabled=notification_disabled, timeout=timeout)
+        loop.call_soon_threadsafe(
+            client.spawn, client.reply_message(reply_token, messages, notification_disabled=notification_disabled),
+            "reply_message")
+
+    def push_message(to, messages, retry_key=None, notification_disabled=False, timeout=None, **kw):
+        if not _usable():
+            return originals["push_message"](to, messages, retry_key=retry_key,
+                                             notification_disabled=notification_disabled, timeout=timeout, **kw)
+        _wait(client.push_message(to, messages, retry_key=retry_key,
+                                  notification_disabled=notification_disabled), timeout)
+
+    def get_profile(user_id, timeout=None):
+        if not _usable():
+            return originals["get_profile"](user_id, timeout=timeout)
+        return _wait(client.get_profile(user_id), timeout)
+
+    def get_message_content(message_id, timeout=None):
+        if not _usable():
+            return originals["get_message_content"](message_id, timeout=timeout)
+        from utils.image_verification import MAX_IMAGE_BYTES
+        # 多讀 1 byte，download_message_image 才判斷得出超過上限
+        return _wait(client.get_message_content(message_id, limit=MAX_IMAGE_BYTES + 1), timeout)
+
+    for fn in (reply_message, push_message, get_profile, get_message_content):
+        setattr(api, fn.__name__, fn)
+    api._async_bridged = True
+
+    def unbridge():
+        for name, fn in originals.items():
+            setattr(api, name, fn)
+        api._async_bridged = False
+    return unbridge
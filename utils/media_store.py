@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+媒體儲存：上傳圖片以內容 sha256 去重，並在背景產生縮圖與響應式尺寸。
+
+原本上傳以原始檔名存放（同名互相覆蓋），沒有去重也沒有縮圖，頁面直接載入原圖。現在：
+  存放  原檔 key = <sha256 前 2 碼>/<sha256>.<副檔名>；相同內容再次上傳直接回傳既有的 MediaAsset
+        sha256 於 multipart 解析時即算好（utils/upload_stream.py），原檔以分塊串流寫入後端，不整份讀進記憶體
+        只接受 Pillow 可辨識的 JPEG / PNG / GIF / WebP（不會把任意檔案放到同網域下提供）
+  後端  local（MEDIA_LOCAL_DIR，經 MEDIA_BASE_URL 提供）或 S3 相容儲存（S3_ENDPOINT_URL 可指向 MinIO，
+        超過 S3_MULTIPART_BYTES 以 multipart 上傳）；
+        key 由內容決定、不會改變，S3 物件帶 Cache-Control: immutable
+  尺寸  背景執行緒以 Pillow 產生 WebP 響應式寬度（MEDIA_VARIANT_WIDTHS，最小者即縮圖）與一張 JPEG 預覽
+        （LINE ImageSendMessage 的 preview_image_url 只接受 JPEG / PNG），寫入 MediaAsset.variants；
+        行程重啟等原因未處理的由排程 media_variants 補做
+  輸出  模板以 media_url(asset, width) 取寬度足夠的最小版本，media_srcset(asset) 產生 srcset
+
+環境變數：
+  MEDIA_STORAGE          local / s3（預設沿用 USE_S3：1 時為 s3）
+  MEDIA_LOCAL_DIR        本機存放目錄（預設 static/media）
+  MEDIA_BASE_URL         本機檔案網址前綴（預設 /static/media；要給 LINE 推播使用需設為 https 完整網址）
+  MEDIA_VARIANT_WIDTHS   響應式寬度（預設 320,640,1280）
+  MEDIA_WEBP_QUALITY     WebP 品質（預設 80）
+  S3_BUCKET / S3_REGION / S3_ENDPOINT_URL / S3_PUBLIC_BASE_URL / S3_KEY_PREFIX / S3_ACL / S3_MULTIPART_BYTES
+  AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY
+"""
+import io
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timedelta
+from tempfile import SpooledTemporaryFile
+
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import MediaAsset
+from utils import upload_stream
+
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+MEDIA_STORAGE = os.getenv("MEDIA_STORAGE") or ("s3" if os.getenv("USE_S3", "0") == "1" else "local")
+LOCAL_DIR = os.getenv("MEDIA_LOCAL_DIR") or os.path.join(_ROOT, "static", "media")
+BASE_URL = os.getenv("MEDIA_BASE_URL", "/static/media")
+VARIANT_WIDTHS = sorted(int(w) for w in os.getenv("MEDIA_VARIANT_WIDTHS", "320,640,1280").split(",") if w.strip())
+WEBP_QUALITY = int(os.getenv("MEDIA_WEBP_QUALITY", "80"))
+PREVIEW_WIDTH = 480
+PREVIEW_QUALITY = 80
+S3_MULTIPART_BYTES = int(os.getenv("S3_MULTIPART_BYTES", str(8 * 1024 * 1024)))
+
+FORMATS = {"JPEG": ("jpg", "image/jpeg"), "PNG": ("png", "image/png"),
+           "GIF": ("gif", "image/gif"), "WEBP": ("webp", "image/webp")}
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+# ───────────────────────────────────────────────────────────────
+# 儲存後端
+# ───────────────────────────────────────────────────────────────
+class LocalBackend:
+    name = "local"
+
+    def __init__(self, root=LOCAL_DIR, base_url=BASE_URL):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def put(self, key, fileobj, content_type):
+        path = self._path(key)
+        if os.path.isfile(path):
+            return  # 內容定址：同 key 即同內容
+        upload_stream.copy_to_path(fileobj, path)
+
+    def open(self, key):
+        return open(self._path(key), "rb")
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key):
+        return f"{self.base_url}/{key}"
+
+
+class S3Backend:
+    name = "s3"
+
+    def __init__(self):
+        # 動態匯入以避免在未安裝 boto3 的環境觸發靜態檢查錯誤
+        boto3 = __import__('boto3')
+        self.bucket = os.getenv('S3_BUCKET')
+        self.region = os.getenv('S3_REGION')
+        self.endpoint = os.getenv('S3_ENDPOINT_URL') or None
+        if not self.bucket or not (self.region or self.endpoint):
+            raise RuntimeError('S3 參數未設定')
+        self.prefix = os.getenv('S3_KEY_PREFIX', 'media/')
+        self.acl = os.getenv('S3_ACL', 'public-read')
+        self.transfer = __import__('boto3.s3.transfer', fromlist=['TransferConfig']).TransferConfig(
+            multipart_threshold=S3_MULTIPART_BYTES, multipart_chunksize=S3_MULTIPART_BYTES)
+        self.client = boto3.client('s3', region_name=self.region, endpoint_url=self.endpoint,
+                                   aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                                   aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'))
+        public = os.getenv('S3_PUBLIC_BASE_URL')
+        if not public:
+            public = (f"{self.endpoint.rstrip('/')}/{self.bucket}" if self.endpoint
+                      else f"https://{self.bucket}.s3.{self.region}.amazonaws.com")
+        self.public = public.rstrip('/')
+
+    def put(self, key, fileobj, content_type):
+        extra = {'ContentType': content_type, 'CacheControl': IMMUTABLE}
+        if self.acl:
+            extra['ACL'] = self.acl
+        # upload_fileobj 分塊讀取；超過 multipart_threshold 時以 multipart 上傳
+        self.client.upload_fileobj(fileobj, self.bucket, self.prefix + key, ExtraArgs=extra, Config=self.transfer)
+
+    def open(self, key):
+        buf = SpooledTemporaryFile(max_size=upload_stream.SPOOL_BYTES)
+        self.client.download_fileobj(self.bucket, self.prefix + key, buf, Config=self.transfer)
+        buf.seek(0)
+        return buf
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def url(self, key):
+        return f"{self.public}/{self.prefix}{key}"
+
+
+_backends = {}
+_backend_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    name = name or MEDIA_STORAGE
+    with _backend_lock:
+        if name not in _backends:
+            _backends[name] = S3Backend() if name == "s3" else LocalBackend()
+        return _backends[name]
+
+
+# ───────────────────────────────────────────────────────────────
+# 上傳 / 刪除
+# ───────────────────────────────────────────────────────────────
+def _identify(fileobj):
+    """只讀檔頭判斷格式與尺寸（Pillow 延遲解碼），讀完倒回開頭。"""
+    from PIL import Image
+    try:
+        img = Image.open(fileobj)
+        fmt, size = img.format, img.size
+    except Exception:
+        raise ValueError('無法辨識的圖片格式')
+    finally:
+        fileobj.seek(0)
+    if fmt not in FORMATS:
+        raise ValueError(f'不支援的圖片格式：{fmt}')
+    return fmt, size
+
+
+def save(fileobj, filename=None, created_by=None):
+    """存入一張圖片（可 seek 的檔案物件或 bytes），回傳 (MediaAsset, is_new)；內容相同的既有資產直接回傳。
+
+    不支援的格式拋出 ValueError。
+    """
+    if isinstance(fileobj, (bytes, bytearray)):
+        fileobj = io.BytesIO(fileobj)
+    sha, size = upload_stream.digest(fileobj)
+    existing = MediaAsset.query.filter_by(sha256=sha).first()
+    if existing:
+        return existing, False
+    fmt, (width, height) = _identify(fileobj)
+    ext, content_type = FORMATS[fmt]
+    backend = get_backend()
+    key = f"{sha[:2]}/{sha}.{ext}"
+    backend.put(key, fileobj, content_type)
+    asset = MediaAsset(sha256=sha, storage=backend.name, key=key, url=backend.url(key), filename=filename,
+                       content_type=content_type, size=size, width=width, height=height,
+                       status='pending', created_by=created_by, created_at=datetime.utcnow())
+    try:
+        db.session.add(asset)
+        db.session.commit()
+    except IntegrityError:
+        # 同內容同時上傳：以先寫入的為準（檔案 key 相同，不需清理）
+        db.session.rollback()
+        return MediaAsset.query.filter_by(sha256=sha).first(), False
+    enqueue(asset.id)
+    return asset, True
+
+
+def delete(asset):
+    """刪除資產與其所有尺寸的檔案。"""
+    try:
+        backend = get_backend(asset.storage)
+        for key in [asset.key] + [v['key'] for v in variants_of(asset).values()]:
+            backend.delete(key)
+    except Exception:
+        logging.exception(f"[media_store] 刪除檔案失敗 id={asset.id}")  # 刪除失敗不阻斷流程
+    db.session.delete(asset)
+    db.session.commit()
+
+
+# ───────────────────────────────────────────────────────────────
+# 尺寸產生
+# ───────────────────────────────────────────────────────────────
+def _encode(img, fmt, quality):
+    buf = io.BytesIO()
+    if fmt == 'WEBP':
+        img.save(buf, format='WEBP', quality=quality, method=4)
+    else:
+        img.save(buf, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def _resized(src, width):
+    from PIL import Image
+    if width >= src.width:
+        return src
+    height = max(1, round(src.height * width / float(src.width)))
+    return src.resize((width, height), Image.LANCZOS)
+
+
+def build_variants(asset):
+    """產生並上傳 asset 的各尺寸，回傳 variants dict（不寫入資料庫）。"""
+    from PIL import Image, ImageOps
+    backend = get_backend(asset.storage)
+    with backend.open(asset.key) as f:
+        src = ImageOps.exif_transpose(Image.open(f))
+        has_alpha = src.mode in ('RGBA', 'LA') or (src.mode == 'P' and 'transparency' in src.info)
+        src = src.convert('RGBA' if has_alpha else 'RGB')
+    base = f"{asset.sha256[:2]}/{asset.sha256}"
+    variants = {}
+    for i, width in enumerate(VARIANT_WIDTHS):
+        # 比原圖寬的尺寸只保留一張（原尺寸轉 WebP），不放大
+        if width > src.width and i > 0 and VARIANT_WIDTHS[i - 1] >= src.width:
+            break
+        img = _resized(src, width)
+        data = _encode(img, 'WEBP', WEBP_QUALITY)
+        key = f"{base}_w{width}.webp"
+        backend.put(key, io.BytesIO(data), 'image/webp')
+        variants[f"w{width}"] = {"key": key, "url": backend.url(key), "width": img.width, "height": img.height,
+                                 "format": "webp", "bytes": len(data)}
+    img = _resized(src, PREVIEW_WIDTH)
+    if has_alpha:
+        bg = Image.new('RGB', img.size, (255, 255, 255))
+        bg.paste(img, mask=img.split()[-1])
+        img = bg
+    data = _encode(img, 'JPEG', PREVIEW_QUALITY)
+    key = f"{base}_preview.jpg"
+    backend.put(key, io.BytesIO(data), 'image/jpeg')
+    variants["preview"] = {"key": key, "url": backend.url(key), "width": img.width, "height": img.height,
+                           "format": "jpeg", "bytes": len(data)}
+    return variants
+
+
+def process(asset_id):
+    """產生單一資產的尺寸並更新狀態；回傳是否成功。"""
+    asset = db.session.get(MediaAsset, asset_id)
+    if asset is None or asset.status == 'ready':
+        return False
+    try:
+        asset.variants = json.dumps(build_variants(asset), ensure_ascii=False)
+        asset.status = 'ready'
+        asset.error = None
+    except Exception as e:
+        logging.exception(f"[media_store] 產生尺寸失敗 id={asset_id}")
+        asset.status = 'failed'
+        asset.error = str(e)[:500]
+    asset.processed_at = datetime.utcnow()
+    db.session.commit()
+    return asset.status == 'ready'
+
+
+def process_pending(limit=100, min_age_seconds=120):
+    """補做尚未處理的資產（排程用）；剛上傳的留給背景執行緒。回傳處理筆數。"""
+    cutoff = datetime.utcnow() - timedelta(seconds=min_age_seconds)
+    ids = [i for (i,) in (db.session.query(MediaAsset.id)
+                          .filter(MediaAsset.status == 'pending', MediaAsset.created_at <= cutoff)
+                          .order_by(MediaAsset.id).limit(limit))]
+    for asset_id in ids:
+        process(asset_id)
+    return len(ids)
+
+
+# ───────────────────────────────────────────────────────────────
+# 模板輔助
+# ───────────────────────────────────────────────────────────────
+def variants_of(asset):
+    try:
+        return json.loads(asset.variants or '{}')
+    except Exception:
+        return {}
+
+
+def _webp_variants(asset):
+    return sorted((v for k, v in variants_of(asset).items() if k.startswith('w')), key=lambda v: v['width'])
+
+
+def media_url(asset, width=None):
+    """寬度 >= width 的最小 WebP 版本（未指定 width 取最大）；尚未產生時回傳原檔。"""
+    webp = _webp_variants(asset)
+    if not webp:
+        return asset.url
+    if width is None:
+        return webp[-1]['url']
+    for v in webp:
+        if v['width'] >= width:
+            return v['url']
+    return webp[-1]['url']
+
+
+def media_srcset(asset):
+    """<img srcset> 字串；尚未產生尺寸時為空字串。"""
+    return ", ".join(f"{v['url']} {v['width']}w" for v in _webp_variants(asset))
+
+
+def preview_url(asset):
+    """LINE preview_image_url 用的 JPEG 預覽（尚未產生時回傳原檔）。"""
+    return variants_of(asset).get('preview', {}).get('url') or asset.url
+
+
+# ───────────────────────────────────────────────────────────────
+# 背景執行緒
+# ───────────────────────────────────────────────────────────────
+_app = None
+_queue = queue.Queue()
+_start_lock = threading.Lock()
+_started = False
+
+
+def enqueue(asset_id):
+    """交給背景執行緒產生尺寸；未啟動執行緒的行程（例如單獨執行的腳本）留給排程補做。"""
+    if _started:
+        _queue.put(asset_id)
+
+
+def _worker():
+    while True:
+        asset_id = _queue.get()
+        try:
+            with _app.app_context():
+                process(asset_id)
+        except Exception:
+            logging.exception(f"[media_store] 背景處理失敗 id={asset_id}")
+        finally:
+            _queue.task_done()
+
+
+def init_media_store(app):
+    """註冊模板輔助函式並啟動產生尺寸的背景執行緒（每個 worker 一條）。"""
+    global _app, _started
+    app.jinja_env.globals.update(media_url=media_url, media_srcset=media_srcset, media_preview_url=preview_url)
+    with _start_lock:
+        if _started:
+            return
+        _app = app
+        threading.Thread(target=_worker, name="media-store", daemon=True).start()
+        _started = True
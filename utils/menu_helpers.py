@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from linebot.models import TextSendMessage, FlexSendMessage
 from extensions import line_bot_api
+from utils.push_queue import enqueue_push
 from storage import ADMIN_IDS  # 管理員清單
 from secrets import choice as secrets_choice
 
@@ -231,7 +232,4 @@ def notify_admins(user_id, display_name=None):
     )
 
     for admin_id in ADMIN_IDS:
-        try:
-            line_bot_api.push_message(admin_id, TextSendMessage(text=msg))
-        except Exception as e:
-            print(f"通知管理員失敗：{admin_id}，錯誤：{e}")
\ No newline at end of file
+        enqueue_push(admin_id, TextSendMessage(text=msg), source="notify_admins")
\ No newline at end of file
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus 指標：/metrics 端點與各熱路徑的量測工具。
+
+涵蓋：Webhook 事件（類型 / 意圖）、LINE 事件處理延遲、HTTP 請求延遲、OCR 耗時與通過率、
+LINE API 呼叫延遲與錯誤碼、背景推播佇列、DB 連線池使用量、每事件 commit 次數、排程工作耗時、快取命中率。
+
+gunicorn 多 worker 時請設定 PROMETHEUS_MULTIPROC_DIR（指向可寫的空目錄），
+gunicorn.conf.py 會在啟動時清空並於 worker 結束時標記失效，/metrics 會彙總所有 worker。
+
+環境變數：
+  METRICS_ENABLED          預設 1；設 0 關閉（/metrics 不註冊，量測函式皆為空操作）
+  METRICS_TOKEN            若設定，/metrics 需帶 Authorization: Bearer <token> 或 ?token=
+  PROMETHEUS_MULTIPROC_DIR prometheus_client 多行程模式目錄
+未安裝 prometheus_client 時所有量測皆為空操作，不影響主流程。
+"""
+import functools
+import inspect
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir")
+
+try:
+    from prometheus_client import (
+        Counter, Histogram, Gauge, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST, REGISTRY,
+    )
+    from prometheus_client import multiprocess
+    PROMETHEUS_AVAILABLE = True
+except Exception:
+    PROMETHEUS_AVAILABLE = False
+
+
+class _NoopMetric:
+    """prometheus_client 不可用或關閉時的替身。"""
+
+    def labels(self, *a, **kw):
+        return self
+
+    def inc(self, *a, **kw):
+        pass
+
+    def observe(self, *a, **kw):
+        pass
+
+    def set(self, *a, **kw):
+        pass
+
+
+_ENABLED = METRICS_ENABLED and PROMETHEUS_AVAILABLE
+
+# LINE 事件處理 / OCR 多在數十毫秒到數秒之間
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_OCR_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30)
+_JOB_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800)
+_COMMIT_BUCKETS = (0, 1, 2, 3, 4, 6, 8)
+
+if _ENABLED:
+    WEBHOOK_EVENTS = Counter(
+        "linebot_webhook_events_total", "LINE webhook 事件數", ["type", "intent"])
+    HANDLER_LATENCY = Histogram(
+        "linebot_handler_duration_seconds", "LINE 事件處理耗時", ["handler"], buckets=_LATENCY_BUCKETS)
+    HANDLER_ERRORS = Counter(
+        "linebot_handler_errors_total", "LINE 事件處理未捕捉例外數", ["handler"])
+    HTTP_LATENCY = Histogram(
+        "http_request_duration_seconds", "HTTP 請求耗時", ["endpoint", "method"], buckets=_LATENCY_BUCKETS)
+    HTTP_REQUESTS = Counter(
+        "http_requests_total", "HTTP 請求數", ["endpoint", "method", "status"])
+    OCR_DURATION = Histogram(
+        "ocr_duration_seconds", "OCR 耗時", ["source"], buckets=_OCR_BUCKETS)
+    OCR_RESULTS = Counter(
+        "ocr_results_total", "OCR 驗證結果（pass / confirm / mismatch / error）", ["source", "result"])
+    OCR_TIERS = Counter(
+        "ocr_tier_total", "分層 OCR 各層執行結果（hit = 在此層取得所需欄位）", ["tier", "result"])
+    OCR_TIME_SAVED = Counter(
+        "ocr_time_saved_seconds_total", "分層 OCR 略過後續層級估計省下的秒數")
+    VERIFY_STAGE_LATENCY = Histogram(
+        "verify_stage_duration_seconds", "截圖驗證各階段耗時", ["stage"], buckets=_LATENCY_BUCKETS)
+    LINE_API_LATENCY = Histogram(
+        "line_api_duration_seconds", "LINE Messaging API 呼叫耗時", ["method"], buckets=_LATENCY_BUCKETS)
+    LINE_API_ERRORS = Counter(
+        "line_api_errors_total", "LINE Messaging API 錯誤數", ["method", "status"])
+    DB_POOL = Gauge(
+        "db_pool_connections", "SQLAlchemy 連線池狀態", ["state"], multiprocess_mode="livesum")
+    SCHEDULER_JOB_DURATION = Histogram(
+        "scheduler_job_duration_seconds", "排程工作耗時", ["job"], buckets=_JOB_BUCKETS)
+    SCHEDULER_JOB_FAILURES = Counter(
+        "scheduler_job_failures_total", "排程工作失敗數", ["job"])
+    CACHE_REQUESTS = Counter(
+        "cache_requests_total", "快取查詢數", ["cache", "result"])
+    PUSH_QUEUE_MESSAGES = Counter(
+        "push_queue_messages_total", "背景推播佇列訊息數（enqueued / sent / retry / failed / sync）", ["source", "result"])
+    PUSH_QUEUE_DELAY = Histogram(
+        "push_queue_delivery_delay_seconds", "背景推播從排入到送達的秒數", ["source"], buckets=_LATENCY_BUCKETS)
+    DB_COMMITS = Histogram(
+        "db_commits_per_event", "每個 unit of work 範圍（LINE 事件）的 DB commit 次數", ["scope"],
+        buckets=_COMMIT_BUCKETS)
+    CAMPAIGN_RECIPIENTS = Counter(
+        "campaign_recipients_total", "推播活動收件人數（sent / failed）", ["mode", "result"])
+    CAMPAIGN_THROTTLED = Counter(
+        "campaign_throttled_total", "推播活動遇到 LINE 429 的次數", ["mode"])
+else:
+    WEBHOOK_EVENTS = HANDLER_LATENCY = HANDLER_ERRORS = HTTP_LATENCY = HTTP_REQUESTS = _NoopMetric()
+    OCR_DURATION = OCR_RESULTS = OCR_TIERS = OCR_TIME_SAVED = VERIFY_STAGE_LATENCY = LINE_API_LATENCY = LINE_API_ERRORS = DB_POOL = _NoopMetric()
+    SCHEDULER_JOB_DURATION = SCHEDULER_JOB_FAILURES = CACHE_REQUESTS = DB_COMMITS = _NoopMetric()
+    PUSH_QUEUE_MESSAGES = PUSH_QUEUE_DELAY = CAMPAIGN_RECIPIENTS = CAMPAIGN_THROTTLED = _NoopMetric()
+
+
+# ───────────────────────────────────────────────────────────────
+# LINE 事件
+# ───────────────────────────────────────────────────────────────
+# 文字指令 → 意圖（與 hander/entrypoint.py、hander/verify.py 的關鍵字一致；其餘歸 other 以限制標籤數量）
+TEXT_INTENTS = {
+    "主選單": "menu", "功能選單": "menu", "選單": "menu", "menu": "menu", "Menu": "menu",
+    "查詢規則": "menu", "規則查詢": "menu",
+    "驗證資訊": "verify_info", "驗證 資訊": "verify_info",
+    "每日抽獎": "daily_draw", "每日 抽獎": "daily_draw",
+    "折價券管理": "coupon_records", "券紀錄": "coupon_records", "我的券紀錄": "coupon_records",
+    "我的 券紀錄": "coupon_records",
+    "活動快訊": "promo",
+    "廣告專區": "ad_menu",
+    "呼叫管理員": "call_admin",
+    "回報文": "report", "Report": "report", "report": "report",
+    "儲值金": "wallet",
+    "1": "confirm",
+    "重新上傳": "reupload", "重新輸入LINE ID": "reenter_line_id", "重新驗證": "reverify",
+}
+_PHONE_RE = re.compile(r"^(?:09\d{8}|\+?8869\d{8})$")
+_POSTBACK_RE = re.compile(r"^[A-Za-z_]{1,32}$")
+
+
+def classify_event(handler_name, event):
+    """回傳事件的意圖標籤（值域有限，避免 Prometheus 標籤爆量）。"""
+    try:
+        if handler_name == "message.text":
+            text = (event.message.text or "").replace("　", " ").strip()
+            if text in TEXT_INTENTS:
+                return TEXT_INTENTS[text]
+            if text.startswith("/"):
+                return "admin_command"
+            if _PHONE_RE.match(text.replace(" ", "").replace("-", "")):
+                return "phone"
+            return "other"
+        if handler_name == "postback":
+            prefix = (event.postback.data or "").split("|", 1)[0]
+            return prefix if _POSTBACK_RE.match(prefix) else "other"
+    except Exception:
+        return "unknown"
+    return handler_name.split(".")[-1]
+
+
+def observe_event(handler_name):
+    """
+    裝飾 LINE 事件處理函式：計數事件（類型 / 意圖）並記錄處理耗時。
+    保留原函式簽章，linebot WebhookHandler 依參數個數決定是否傳入 destination。
+    """
+    def deco(fn):
+        @functools.wraps(fn)
+        def _wrap(event, *a, **kw):
+            WEBHOOK_EVENTS.labels(handler_name, classify_event(handler_name, event)).inc()
+            t0 = time.perf_counter()
+            try:
+                return fn(event, *a, **kw)
+            except Exception:
+                HANDLER_ERRORS.labels(handler_name).inc()
+                raise
+            finally:
+                HANDLER_LATENCY.labels(handler_name).observe(time.perf_counter() - t0)
+        _wrap.__signature__ = inspect.signature(fn)
+        return _wrap
+    return deco
+
+
+# ───────────────────────────────────────────────────────────────
+# OCR
+# ───────────────────────────────────────────────────────────────
+@contextmanager
+def ocr_timer(source):
+    """量測 OCR 耗時；區塊內拋出例外時計為 error。"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        OCR_RESULTS.labels(source, "error").inc()
+        raise
+    finally:
+        OCR_DURATION.labels(source).observe(time.perf_counter() - t0)
+
+
+def ocr_result(source, result):
+    """result：pass（自動通過）/ confirm（待使用者確認）/ mismatch（不符）/ too_large / error。"""
+    OCR_RESULTS.labels(source, result).inc()
+
+
+def observe_verify_stage(stage, seconds):
+    VERIFY_STAGE_LATENCY.labels(stage).observe(seconds)
+
+
+def ocr_tier(tier, hit, saved_seconds=0.0):
+    OCR_TIERS.labels(tier, "hit" if hit else "miss").inc()
+    if saved_seconds > 0:
+        OCR_TIME_SAVED.inc(saved_seconds)
+
+
+# ───────────────────────────────────────────────────────────────
+# LINE Messaging API
+# ───────────────────────────────────────────────────────────────
+def instrument_line_bot_api(api):
+    """
+    以實例屬性包裝 LineBotApi 的公開方法，記錄延遲與錯誤碼。
+    各模組以 from extensions import line_bot_api 取得同一個實例，故包裝一次即全域生效。
+    """
+    if not _ENABLED or getattr(api, "_metrics_instrumented", False):
+        return api
+    for name, member in inspect.getmembers(type(api), inspect.isfunction):
+        if name.startswith("_"):
+            continue
+        setattr(api, name, _timed_api_call(name, getattr(api, name)))
+    api._metrics_instrumented = True
+    return api
+
+
+def _timed_api_call(name, bound):
+    @functools.wraps(bound)
+    def _call(*a, **kw):
+        t0 = time.perf_counter()
+        try:
+            return bound(*a, **kw)
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            LINE_API_ERRORS.labels(name, str(status) if status else type(e).__name__).inc()
+            raise
+        finally:
+            LINE_API_LATENCY.labels(name).observe(time.perf_counter() - t0)
+    return _call
+
+
+# ───────────────────────────────────────────────────────────────
+# 排程 / 快取 / DB 連線池
+# ───────────────────────────────────────────────────────────────
+def observe_job(job_name):
+    """裝飾 APScheduler 工作函式：記錄耗時與失敗次數。"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def _wrap(*a, **kw):
+            t0 = time.perf_counter()
+            try:
+                return fn(*a, **kw)
+            except Exception:
+                SCHEDULER_JOB_FAILURES.labels(job_name).inc()
+                raise
+            finally:
+                SCHEDULER_JOB_DURATION.labels(job_name).observe(time.perf_counter() - t0)
+        return _wrap
+    return deco
+
+
+def record_cache(cache_name, hit):
+    CACHE_REQUESTS.labels(cache_name, "hit" if hit else "miss").inc()
+
+
+def push_result(source, result, delay_seconds=None):
+    PUSH_QUEUE_MESSAGES.labels(source, result).inc()
+    if delay_seconds is not None:
+        PUSH_QUEUE_DELAY.labels(source).observe(delay_seconds)
+
+
+def observe_commits(scope, commits):
+    DB_COMMITS.labels(scope).observe(commits)
+
+
+def campaign_result(mode, result, count=1):
+    CAMPAIGN_RECIPIENTS.labels(mode, result).inc(count)
+
+
+def campaign_throttled(mode):
+    CAMPAIGN_THROTTLED.labels(mode).inc()
+
+
+def update_db_pool_metrics():
+    """以目前 worker 的連線池狀態更新 gauge（多行程模式下以 livesum 彙總）。"""
+    if not _ENABLED:
+        return
+    try:
+        from extensions import db
+        pool = db.engine.pool
+        for state, getter in (("checked_out", "checkedout"), ("checked_in", "checkedin"),
+                              ("overflow", "overflow"), ("size", "size")):
+            fn = getattr(pool, getter, None)
+            if callable(fn):
+                DB_POOL.labels(state).set(fn())
+    except Exception:
+        pass
+
+
+# ───────────────────────────────────────────────────────────────
+# Flask 整合
+# ───────────────────────────────────────────────────────────────
+def render_metrics():
+    """回傳 (內容, content-type)。多行程模式下彙總所有 worker 的指標檔。"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_metrics(app):
+    """註冊 /metrics 與 HTTP 請求量測。"""
+    if not _ENABLED:
+        if METRICS_ENABLED and not PROMETHEUS_AVAILABLE:
+            logger.warning("未安裝 prometheus_client，/metrics 停用")
+        return
+
+    from flask import Response, abort, g, request
+
+    @app.before_request
+    def _metrics_begin():
+        g._metrics_t0 = time.perf_counter()
+
+    @app.after_request
+    def _metrics_end(response):
+        t0 = g.pop("_metrics_t0", None)
+        if t0 is not None:
+            endpoint = request.endpoint or "unmatched"
+            HTTP_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - t0)
+            HTTP_REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+        update_db_pool_metrics()
+        return response
+
+    def metrics():
+        if METRICS_TOKEN:
+            auth = request.headers.get("Authorization", "")
+            token = auth[7:] if auth.startswith("Bearer ") else request.args.get("token", "")
+            if token != METRICS_TOKEN:
+                abort(401)
+        update_db_pool_metrics()
+        body, content_type = render_metrics()
+        return Response(body, content_type=content_type)
+
+    app.add_url_rule("/metrics", "metrics", metrics, methods=["GET"])
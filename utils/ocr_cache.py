@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+OCR 結果快取：以截圖內容雜湊為鍵，保存辨識出的全文 / 手機 / LINE ID。
+
+使用者在「重新上傳」時常傳同一張截圖，命中快取即可跳過 tesseract。
+  1. SHA-256（完全相同的位元組，全域共用）
+  2. 感知雜湊 dHash（重新壓縮、略有差異的同一張圖）；僅比對同一使用者的上傳，
+     避免版面相同的不同人個人頁被誤判為同一張。預設停用：個人頁截圖版面固定，
+     修正 LINE ID 後重傳的新截圖距離常在 0~4 之內，會拿到上一張的辨識結果而一再判定不符
+本機為有界 LRU；設定 REDIS_URL 時另有 Redis 層（多 worker 共用，具 TTL）。
+
+環境變數：
+  OCR_CACHE_ENABLED         預設 1；設 0 關閉
+  OCR_CACHE_SIZE            本機 LRU 筆數上限（預設 512）
+  OCR_CACHE_TTL             Redis 保存秒數（預設 86400）
+  OCR_CACHE_PHASH_DISTANCE  dHash 漢明距離門檻（預設 -1 停用近似比對，只以 SHA-256 完全比對）
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from utils.image_verification import open_image
+from utils.metrics import record_cache
+
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") == "1"
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "512"))
+OCR_CACHE_TTL = int(os.getenv("OCR_CACHE_TTL", "86400"))
+OCR_CACHE_PHASH_DISTANCE = int(os.getenv("OCR_CACHE_PHASH_DISTANCE", "-1"))
+REDIS_PREFIX = "ocr_cache:"
+
+redis_client = None
+try:
+    import redis
+    REDIS_URL = os.getenv("REDIS_URL")
+    if REDIS_URL:
+        redis_client = redis.StrictRedis.from_url(REDIS_URL)
+except Exception:
+    redis_client = None
+
+
+class _LRU:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local = _LRU(OCR_CACHE_SIZE)
+# 感知雜湊索引：(namespace, user_id) -> LRU{phash: sha 鍵}
+_phash_index = _LRU(OCR_CACHE_SIZE)
+
+
+def sha_key(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def dhash(image, size=8):
+    """差異雜湊（64 bit）；image 可為 PIL Image 或位元組，無法解碼時回傳 None。"""
+    try:
+        from PIL import Image
+        if not isinstance(image, Image.Image):
+            image = Image.open(io.BytesIO(image))
+        px = list(image.convert("L").resize((size + 1, size)).getdata())
+        bits = 0
+        for row in range(size):
+            for col in range(size):
+                left = px[row * (size + 1) + col]
+                right = px[row * (size + 1) + col + 1]
+                bits = (bits << 1) | (1 if left > right else 0)
+        return bits
+    except Exception:
+        return None
+
+
+def _hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _redis_get(key):
+    if not redis_client:
+        return None
+    try:
+        raw = redis_client.get(REDIS_PREFIX + key)
+        return json.loads(raw) if raw else None
+    except Exception:
+        logging.exception("ocr_cache redis get failed")
+        return None
+
+
+def _redis_set(key, value):
+    if not redis_client:
+        return
+    try:
+        redis_client.set(REDIS_PREFIX + key, json.dumps(value, ensure_ascii=False), ex=OCR_CACHE_TTL)
+    except Exception:
+        logging.exception("ocr_cache redis set failed")
+
+
+def _lookup_exact(key):
+    value = _local.get(key)
+    if value is None:
+        value = _redis_get(key)
+        if value is not None:
+            _local.put(key, value)
+    return value
+
+
+def _lookup_near(namespace, user_id, phash):
+    index = _phash_index.get((namespace, user_id))
+    if index is None:
+        return None
+    for known, key in reversed(index.items()):
+        if _hamming(known, phash) <= OCR_CACHE_PHASH_DISTANCE:
+            return _lookup_exact(key)
+    return None
+
+
+def _get(image_bytes, namespace, user_id, decoded=None):
+    key = f"{namespace}:{sha_key(image_bytes)}"
+    phash = None
+    value = _lookup_exact(key)
+    if value is None and user_id and OCR_CACHE_PHASH_DISTANCE >= 0:
+        phash = dhash(decoded() if decoded else image_bytes)
+        if phash is not None:
+            value = _lookup_near(namespace, user_id, phash)
+    record_cache("ocr", value is not None)
+    return value, key, phash
+
+
+def _put(key, value, namespace, user_id, phash):
+    _local.put(key, value)
+    _redis_set(key, value)
+    if user_id and phash is not None:
+        index = _phash_index.get((namespace, user_id))
+        if index is None:
+            index = _LRU(8)  # 同一使用者最近幾張即可
+            _phash_index.put((namespace, user_id), index)
+        index.put(phash, key)
+
+
+def get(image_bytes, namespace, user_id=None):
+    """回傳快取的 OCR 結果 dict，未命中回傳 None。"""
+    if not OCR_CACHE_ENABLED or not image_bytes:
+        return None
+    return _get(image_bytes, namespace, user_id)[0]
+
+
+def put(image_bytes, namespace, value, user_id=None):
+    if not OCR_CACHE_ENABLED or not image_bytes:
+        return
+    phash = dhash(image_bytes) if user_id and OCR_CACHE_PHASH_DISTANCE >= 0 else None
+    _put(f"{namespace}:{sha_key(image_bytes)}", value, namespace, user_id, phash)
+
+
+def cached_ocr(image_bytes, namespace, compute, user_id=None, image=None):
+    """
+    命中快取直接回傳；否則呼叫 compute(image) 取得結果 dict 並寫入快取。
+    image 為解碼後的 PIL Image，與感知雜湊共用同一次解碼；完全命中時不解碼。
+    呼叫端已解碼時可直接傳入 image。
+    compute 拋出例外時不寫入快取（交由呼叫端處理）。
+    """
+    decoded_box = [image] if image is not None else []
+
+    def decoded():
+        if not decoded_box:
+            decoded_box.append(open_image(image_bytes))
+        return decoded_box[0]
+
+    if not OCR_CACHE_ENABLED or not image_bytes:
+        return compute(decoded())
+    value, key, phash = _get(image_bytes, namespace, user_id, decoded)
+    if value is not None:
+        return value
+    value = compute(decoded())
+    if phash is None and user_id and OCR_CACHE_PHASH_DISTANCE >= 0:
+        phash = dhash(decoded())
+    _put(key, value, namespace, user_id, phash)
+    return value
+
+
+def clear():
+    _local.clear()
+    _phash_index.clear()
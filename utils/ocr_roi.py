@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+LINE 個人頁截圖的區域 OCR（Region of Interest）。
+
+只需要「電話號碼」與「ID」兩欄，不必對整張截圖跑 eng+chi_tra：
+  1. 以 OpenCV 找出靠左對齊的文字列（個人頁欄位皆貼齊左側邊界）
+  2. 逐列裁切、放大到固定字高、Otsu 二值化，垂直拼成一張窄長條
+  3. 長條只跑一次 tesseract（--psm 6，英數白名單），再逐行解析手機 / LINE ID
+深色 / 淺色主題皆可（背景偏亮時先反相）。未安裝 opencv / numpy 時 ROI_AVAILABLE 為 False，
+呼叫端應退回整張 OCR。
+"""
+import logging
+import re
+
+import pytesseract
+from PIL import Image
+
+try:
+    import cv2
+    import numpy as np
+    ROI_AVAILABLE = True
+except Exception:
+    ROI_AVAILABLE = False
+
+# 版面參數皆以截圖寬 / 高的比例表示，與裝置解析度無關
+LEFT_MARGIN_RATIO = 0.12      # 文字列左緣需落在此範圍內
+MIN_LINE_HEIGHT_RATIO = 0.008
+MAX_LINE_HEIGHT_RATIO = 0.045
+MIN_LINE_WIDTH_RATIO = 0.02
+MERGE_GAP_RATIO = 0.03        # 水平膨脹寬度：把同一列的字元 / 空白合併成一塊
+TEXT_CONTRAST = 50            # 與背景亮度差超過此值視為文字
+TARGET_LINE_HEIGHT = 48       # 送進 tesseract 的字列高度（px）
+STRIP_GAP = 24
+MAX_LINES = 24
+
+ROI_WHITELIST = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz._-+:@"
+ROI_TESSERACT_CONFIG = f"--psm 6 -c tessedit_char_whitelist={ROI_WHITELIST}"
+
+PHONE_RE = re.compile(r"(?:\+?886)9\d{8}|09\d{8}")
+LINE_ID_RE = re.compile(r"^[A-Za-z0-9_\-\.]{3,20}$")
+
+
+def _to_gray(image):
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    arr = np.asarray(image)
+    if arr.ndim == 3:
+        arr = cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+    # 統一成「亮字暗底」
+    if np.median(arr) > 127:
+        arr = 255 - arr
+    return arr
+
+
+def locate_text_lines(image):
+    """回傳靠左對齊文字列的 (x, y, w, h)，依 y 由上而下排序。"""
+    gray = _to_gray(image)
+    h_img, w_img = gray.shape[:2]
+    background = int(np.median(gray))
+    mask = (gray > min(background + TEXT_CONTRAST, 250)).astype(np.uint8) * 255
+    kernel_w = max(3, int(w_img * MERGE_GAP_RATIO))
+    merged = cv2.dilate(mask, cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_w, 3)))
+    contours, _ = cv2.findContours(merged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = []
+    for c in contours:
+        x, y, w, h = cv2.boundingRect(c)
+        if x > w_img * LEFT_MARGIN_RATIO:
+            continue
+        if not (h_img * MIN_LINE_HEIGHT_RATIO <= h <= h_img * MAX_LINE_HEIGHT_RATIO):
+            continue
+        if w < w_img * MIN_LINE_WIDTH_RATIO:
+            continue
+        boxes.append((x, y, w, h))
+    boxes.sort(key=lambda b: b[1])
+    return boxes[:MAX_LINES]
+
+
+def build_strip(image, boxes):
+    """將各文字列裁切、放大、二值化（黑字白底）後垂直拼接成一張圖。"""
+    gray = _to_gray(image)
+    h_img, w_img = gray.shape[:2]
+    pieces = []
+    for x, y, w, h in boxes:
+        pad = max(2, h // 4)
+        crop = gray[max(0, y - pad):min(h_img, y + h + pad), max(0, x - pad):min(w_img, x + w + pad)]
+        scale = min(4.0, max(1.0, TARGET_LINE_HEIGHT / float(h)))
+        if scale != 1.0:
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+        _, bw = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        pieces.append(bw)
+    if not pieces:
+        return None
+    width = max(p.shape[1] for p in pieces) + 2 * STRIP_GAP
+    rows = []
+    for p in pieces:
+        row = np.full((p.shape[0] + STRIP_GAP, width), 255, dtype=np.uint8)
+        row[STRIP_GAP // 2:STRIP_GAP // 2 + p.shape[0], STRIP_GAP:STRIP_GAP + p.shape[1]] = p
+        rows.append(row)
+    return Image.fromarray(np.vstack(rows))
+
+
+def ocr_lines(image, config=ROI_TESSERACT_CONFIG):
+    """對 ROI 長條跑一次 tesseract，回傳非空白文字行；找不到文字列時回傳 None。"""
+    if not ROI_AVAILABLE:
+        return None
+    boxes = locate_text_lines(image)
+    strip = build_strip(image, boxes)
+    if strip is None:
+        return None
+    text = pytesseract.image_to_string(strip, lang="eng", config=config)
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def parse_fields(lines):
+    """由 ROI 文字行解析 (手機, LINE ID)；LINE ID 優先取「ID」標籤的下一行。"""
+    from utils.image_verification import normalize_phone
+    phone = None
+    line_id = None
+    for i, line in enumerate(lines or []):
+        compact = re.sub(r"[\s\-]", "", line)
+        if phone is None:
+            m = PHONE_RE.search(compact)
+            if m:
+                phone = normalize_phone(m.group(0))
+                continue
+        if line_id is None and line.strip().upper() == "ID" and i + 1 < len(lines):
+            candidate = lines[i + 1].replace(" ", "")
+            if LINE_ID_RE.match(candidate):
+                line_id = candidate
+    if line_id is None:
+        for line in lines or []:
+            candidate = line.replace(" ", "")
+            if (LINE_ID_RE.match(candidate) and not candidate.isdigit() and len(candidate) >= 4
+                    and not PHONE_RE.search(re.sub(r"[\-]", "", candidate))):
+                line_id = candidate
+                break
+    return phone, line_id
+
+
+def extract_fields(image):
+    """回傳 (手機, LINE ID, ROI 文字)；無法使用 ROI 時回傳 (None, None, None)。"""
+    try:
+        lines = ocr_lines(image)
+    except Exception:
+        logging.exception("ROI OCR failed")
+        return None, None, None
+    if lines is None:
+        return None, None, None
+    phone, line_id = parse_fields(lines)
+    return phone, line_id, "\n".join(lines)
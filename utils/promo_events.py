@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+活動行事曆：promo_event 表 + 記憶體區間索引 + 每日首次顯示紀錄。
+
+原本活動期間與圖片網址以 datetime(2025, 9, ...) 寫死在 hander/entrypoint.py 多個分支，每次選單請求都重算，
+「今日是否已看過前導圖」則記在 temp_users。現在：
+  - 活動存於 promo_event（kind：promo = 活動快訊內容、banner = 主選單 / 驗證資訊每日首次顯示的前導圖）
+  - 索引：只載入尚未結束的活動，依所有起訖時間切成互不重疊的區段並預先算好每段進行中的活動，
+    查詢「現在有哪些活動」只需一次二分搜尋（O(log n)），不查資料庫
+  - 重新整理：本行程修改 promo_event 時 commit 後立即重建；其他 worker 的修改最遲 PROMO_EVENT_TTL 秒後生效
+  - 已看過前導圖：以「活動 + 台北日期」為一組的集合，日期改變時整組丟棄；設定 REDIS_URL 時改用
+    Redis SET（SADD 原子判斷是否第一次，多 worker 共用，2 天後自動過期）
+
+環境變數：
+  PROMO_EVENT_TTL  索引最長沿用秒數（預設 60）
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import pytz
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import PromoEvent
+from utils.metrics import record_cache
+
+INDEX_TTL = float(os.getenv("PROMO_EVENT_TTL", "60"))
+SEEN_TTL_SECONDS = 2 * 86400
+
+TZ = pytz.timezone("Asia/Taipei")
+
+# 索引內的活動快照（不保留 ORM 物件，跨請求 / 執行緒共用）
+ActiveEvent = namedtuple("ActiveEvent", "id kind title text image_url start_at end_at priority")
+
+_DIRTY_KEY = "promo_event_dirty"
+
+
+class _IntervalIndex:
+    """points 為排序後的所有起訖時間；segments[i] 是 [points[i], points[i+1]) 期間進行中的活動。"""
+
+    def __init__(self, events):
+        self.points = sorted({p for e in events for p in (e.start_at, e.end_at)})
+        self.segments = []
+        for p in self.points:
+            active = [e for e in events if e.start_at <= p < e.end_at]
+            active.sort(key=lambda e: (e.priority, e.start_at, e.id))
+            self.segments.append(tuple(active))
+
+    def at(self, when):
+        i = bisect.bisect_right(self.points, when) - 1
+        return self.segments[i] if i >= 0 else ()
+
+
+_lock = threading.Lock()
+_state = {"index": None, "expires": 0.0}
+
+
+def _load():
+    now = datetime.utcnow()
+    rows = (PromoEvent.query
+            .filter(PromoEvent.enabled.is_(True), PromoEvent.end_at > now)
+            .all())
+    events = [ActiveEvent(r.id, r.kind, r.title, r.text, r.image_url, r.start_at, r.end_at, r.priority or 0)
+              for r in rows if r.start_at < r.end_at]
+    return _IntervalIndex(events)
+
+
+def _index():
+    index = _state["index"]
+    if index is not None and time.monotonic() < _state["expires"]:
+        record_cache("promo_event", True)
+        return index
+    with _lock:
+        if _state["index"] is None or time.monotonic() >= _state["expires"]:
+            _state["index"] = _load()
+            _state["expires"] = time.monotonic() + INDEX_TTL
+        record_cache("promo_event", False)
+        return _state["index"]
+
+
+def invalidate():
+    """下次查詢時重新載入。"""
+    _state["expires"] = 0.0
+
+
+@event.listens_for(Session, "before_flush")
+def _mark_dirty(session, flush_context, instances):
+    if any(isinstance(o, PromoEvent) for o in (*session.new, *session.dirty, *session.deleted)):
+        session.info[_DIRTY_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop(_DIRTY_KEY, False):
+        invalidate()
+
+
+def active_events(kind=None, now=None):
+    """目前進行中的活動（依 priority 排序）；now 為 aware datetime 或 UTC naive。"""
+    when = now or datetime.utcnow()
+    if when.tzinfo is not None:
+        when = when.astimezone(pytz.utc).replace(tzinfo=None)
+    events = _index().at(when)
+    return [e for e in events if kind is None or e.kind == kind]
+
+
+# ───────────────────────────────────────────────────────────────
+# 每日首次顯示
+# ───────────────────────────────────────────────────────────────
+class _SeenStore:
+    """{(活動 id, 台北日期): set(user_id)}；日期改變時前一天的集合整組刪除。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.day = None
+        self.buckets = {}
+
+    def first_view(self, event_id, user_id, day):
+        with self.lock:
+            if day != self.day:
+                self.day = day
+                self.buckets = {}
+            seen = self.buckets.setdefault(event_id, set())
+            if user_id in seen:
+                return False
+            seen.add(user_id)
+            return True
+
+
+class _RedisSeenStore:
+    def __init__(self, client):
+        self.client = client
+
+    def first_view(self, event_id, user_id, day):
+        key = f"promo_seen:{event_id}:{day}"
+        pipe = self.client.pipeline()
+        pipe.sadd(key, user_id)
+        pipe.expire(key, SEEN_TTL_SECONDS)
+        added, _ = pipe.execute()
+        return added == 1
+
+
+_local_seen = _SeenStore()
+_seen = _local_seen
+try:
+    import redis
+    if os.getenv("REDIS_URL"):
+        _seen = _RedisSeenStore(redis.StrictRedis.from_url(os.getenv("REDIS_URL")))
+except Exception:
+    _seen = _local_seen
+
+
+def first_view_today(event_id, user_id, now=None):
+    """此用戶今天（台北日期）是否第一次看到這個活動；回傳 True 時同時記為已看過。"""
+    day = (now or datetime.now(TZ)).astimezone(TZ).strftime("%Y%m%d")
+    try:
+        return _seen.first_view(event_id, user_id, day)
+    except Exception:
+        logging.exception("[promo_events] Redis 已看過紀錄失敗，改用本機")
+        return _local_seen.first_view(event_id, user_id, day)
+
+
+def daily_banner(user_id, now=None):
+    """進行中、且此用戶今天還沒看過的第一張前導圖（同時記為已看過）；沒有則回傳 None。"""
+    for e in active_events("banner", now):
+        if e.image_url and first_view_today(e.id, user_id, now):
+            return e
+    return None
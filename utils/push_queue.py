@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+背景推播佇列：reply 之後的額外推播（EXTRA_NOTICE、折價券到期提醒、回報文審核結果、通知管理員…）
+改為寫入 outbound_message 後立即返回，由背景執行緒送出，Webhook 延遲只剩 reply 本身。
+
+- 持久化：先寫入 outbound_message，commit 後才交給背景執行緒（在 unit_of_work 範圍內會與同一事件的
+  其他寫入一起 commit，事件 rollback 則不送出；範圍外以獨立連線寫入，不影響呼叫端的 session）；
+  行程重啟或送出失敗的訊息由掃描執行緒補送。
+- 順序：依收件者雜湊分配到固定執行緒；同一收件者只送最早一筆未送達的訊息，前一筆重試中時後面的會等待。
+- 重試：網路錯誤、429、5xx 依指數退避重試，超過 PUSH_QUEUE_MAX_ATTEMPTS 次標記 failed；
+  其餘 4xx（已封鎖、無效 user id）直接標記 failed。
+- 多 worker：送出前以 UPDATE ... WHERE status='pending' 搶占，同一筆只會由一個行程送出。
+  送出中行程中斷的訊息（sending 超過 PUSH_QUEUE_STUCK_SECONDS）會放回 pending（至少送達一次）。
+
+環境變數：
+  PUSH_QUEUE_ENABLED          預設 1；設 0 時 enqueue_push() 直接同步推播（舊行為）
+  PUSH_QUEUE_WORKERS          送出執行緒數（預設 2）
+  PUSH_QUEUE_POLL_SECONDS     掃描到期 / 補送間隔（預設 5）
+  PUSH_QUEUE_MAX_ATTEMPTS     最多嘗試次數（預設 6）
+  PUSH_QUEUE_BACKOFF_SECONDS  第一次重試等待秒數，之後倍增（預設 5）
+  PUSH_QUEUE_BACKOFF_MAX      重試等待上限秒數（預設 600）
+  PUSH_QUEUE_STUCK_SECONDS    sending 狀態逾時秒數（預設 120）
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from linebot.models import (
+    TextSendMessage, ImageSendMessage, VideoSendMessage, AudioSendMessage, LocationSendMessage,
+    StickerSendMessage, TemplateSendMessage, FlexSendMessage,
+)
+from sqlalchemy import event, func, insert, update
+from sqlalchemy.orm import Session
+
+from extensions import db, line_bot_api
+from models import OutboundMessage
+from utils.metrics import push_result
+from utils.unit_of_work import active as unit_of_work_active, commit
+
+PUSH_QUEUE_ENABLED = os.getenv("PUSH_QUEUE_ENABLED", "1") == "1"
+WORKERS = max(1, int(os.getenv("PUSH_QUEUE_WORKERS", "2")))
+POLL_SECONDS = float(os.getenv("PUSH_QUEUE_POLL_SECONDS", "5"))
+MAX_ATTEMPTS = int(os.getenv("PUSH_QUEUE_MAX_ATTEMPTS", "6"))
+BACKOFF_SECONDS = float(os.getenv("PUSH_QUEUE_BACKOFF_SECONDS", "5"))
+BACKOFF_MAX = float(os.getenv("PUSH_QUEUE_BACKOFF_MAX", "600"))
+STUCK_SECONDS = float(os.getenv("PUSH_QUEUE_STUCK_SECONDS", "120"))
+SWEEP_BATCH = 500
+
+_MESSAGE_TYPES = {
+    "text": TextSendMessage,
+    "image": ImageSendMessage,
+    "video": VideoSendMessage,
+    "audio": AudioSendMessage,
+    "location": LocationSendMessage,
+    "sticker": StickerSendMessage,
+    "template": TemplateSendMessage,
+    "flex": FlexSendMessage,
+}
+
+_SESSION_KEY = "push_queue_pending"
+
+_app = None
+_workers = []
+_inflight = set()
+_inflight_lock = threading.Lock()
+_start_lock = threading.Lock()
+
+
+def _as_list(messages):
+    return list(messages) if isinstance(messages, (list, tuple)) else [messages]
+
+
+def serialize_messages(messages):
+    """訊息物件陣列 → JSON（outbound_message / campaign 的 payload 欄位）。"""
+    return json.dumps([m.as_json_dict() for m in messages], ensure_ascii=False)
+
+
+def deserialize_messages(payload):
+    return [_MESSAGE_TYPES[d["type"]].new_from_json_dict(d) for d in json.loads(payload)]
+
+
+def _send_now(to, messages, source):
+    try:
+        line_bot_api.push_message(to, messages)
+        push_result(source, "sync")
+    except Exception:
+        push_result(source, "failed")
+        logging.exception(f"[push_queue] 同步推播失敗 to={to} source={source}")
+
+
+def enqueue_push(to, messages, source="push"):
+    """排入背景推播；messages 可為單一訊息或陣列（同一次 push，最多 5 則）。失敗時退回同步推播。"""
+    messages = _as_list(messages)
+    if not PUSH_QUEUE_ENABLED or not to:
+        _send_now(to, messages, source)
+        return
+    values = dict(to_id=to, payload=serialize_messages(messages), source=source,
+                  status="pending", attempts=0, next_attempt_at=datetime.utcnow())
+    try:
+        if unit_of_work_active():
+            # 與同一事件的其他寫入一起 commit；commit 後才交給執行緒（見 _dispatch_after_commit）
+            row = OutboundMessage(**values)
+            db.session.add(row)
+            db.session.flush()
+            db.session.info.setdefault(_SESSION_KEY, []).append((row.id, to))
+            commit()
+        else:
+            # 範圍外以獨立連線寫入並 commit，不連帶 commit / rollback 呼叫端 session 內其他未完成的變更
+            with db.engine.begin() as conn:
+                msg_id = conn.execute(insert(OutboundMessage.__table__).values(**values)).inserted_primary_key[0]
+            _dispatch(msg_id, to)
+        push_result(source, "enqueued")
+    except Exception:
+        logging.exception(f"[push_queue] 寫入佇列失敗，改為同步推播 to={to} source={source}")
+        _send_now(to, messages, source)
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_after_commit(session):
+    for msg_id, to in session.info.pop(_SESSION_KEY, ()):
+        _dispatch(msg_id, to)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_after_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(_SESSION_KEY, None)
+
+
+def _dispatch(msg_id, to):
+    """交給收件者對應的執行緒；未啟動執行緒的行程（例如單獨執行的腳本）留給 web 行程掃描補送。"""
+    if not _workers:
+        return
+    with _inflight_lock:
+        if msg_id in _inflight:
+            return
+        _inflight.add(msg_id)
+    _workers[zlib.crc32(to.encode("utf-8")) % len(_workers)].queue.put(msg_id)
+
+
+def _dispatch_next(to, after_id):
+    nxt = (db.session.query(OutboundMessage.id)
+           .filter(OutboundMessage.to_id == to, OutboundMessage.id > after_id, OutboundMessage.status == "pending")
+           .order_by(OutboundMessage.id).first())
+    if nxt:
+        _dispatch(nxt.id, to)
+
+
+def _is_permanent(exc):
+    status = getattr(exc, "status_code", None)
+    return status is not None and 400 <= status < 500 and status != 429
+
+
+def _deliver(msg_id):
+    now = datetime.utcnow()
+    row = db.session.get(OutboundMessage, msg_id)
+    if row is None or row.status != "pending" or row.next_attempt_at > now:
+        db.session.rollback()
+        return
+    to, payload, source, created_at, attempts = row.to_id, row.payload, row.source, row.created_at, row.attempts + 1
+    # 同一收件者還有更早未送達的訊息：等它先送出（送達後會接續派送，或由掃描補送）
+    earlier = (db.session.query(OutboundMessage.id)
+               .filter(OutboundMessage.to_id == to, OutboundMessage.id < msg_id,
+                       OutboundMessage.status.in_(("pending", "sending")))
+               .first())
+    if earlier:
+        db.session.rollback()
+        return
+    claimed = db.session.execute(
+        update(OutboundMessage)
+        .where(OutboundMessage.id == msg_id, OutboundMessage.status == "pending")
+        .values(status="sending", attempts=attempts, next_attempt_at=now)
+    ).rowcount
+    db.session.commit()
+    if claimed != 1:
+        return
+
+    try:
+        line_bot_api.push_message(to, deserialize_messages(payload))
+    except Exception as e:
+        permanent = _is_permanent(e) or attempts >= MAX_ATTEMPTS
+        values = {"last_error": str(e)[:500]}
+        if permanent:
+            values["status"] = "failed"
+        else:
+            values["status"] = "pending"
+            delay = min(BACKOFF_SECONDS * (2 ** (attempts - 1)), BACKOFF_MAX)
+            values["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=delay)
+        db.session.execute(update(OutboundMessage).where(OutboundMessage.id == msg_id).values(**values))
+        db.session.commit()
+        push_result(source, "failed" if permanent else "retry")
+        logging.warning(f"[push_queue] 推播失敗 id={msg_id} to={to} source={source} attempts={attempts} "
+                        f"status={values['status']} error={e}")
+        if permanent:
+            _dispatch_next(to, msg_id)
+        return
+
+    db.session.execute(
+        update(OutboundMessage)
+        .where(OutboundMessage.id == msg_id)
+        .values(status="sent", sent_at=datetime.utcnow(), last_error=None)
+    )
+    db.session.commit()
+    push_result(source, "sent", (datetime.utcnow() - created_at).total_seconds())
+    _dispatch_next(to, msg_id)
+
+
+def _sweep():
+    """放回逾時的 sending，並派送每位收件者最早一筆已到期的 pending。"""
+    now = datetime.utcnow()
+    db.session.execute(
+        update(OutboundMessage)
+        .where(OutboundMessage.status == "sending",
+               OutboundMessage.next_attempt_at < now - timedelta(seconds=STUCK_SECONDS))
+        .values(status="pending")
+    )
+    db.session.commit()
+    rows = (db.session.query(OutboundMessage.id, OutboundMessage.to_id, OutboundMessage.status,
+                             OutboundMessage.next_attempt_at)
+            .filter(OutboundMessage.status.in_(("pending", "sending")))
+            .order_by(OutboundMessage.id).limit(SWEEP_BATCH).all())
+    db.session.rollback()
+    seen = set()
+    for msg_id, to, status, due in rows:
+        if to in seen:
+            continue
+        seen.add(to)
+        if status == "pending" and due <= now:
+            _dispatch(msg_id, to)
+
+
+class _Worker(threading.Thread):
+    def __init__(self, index):
+        super().__init__(name=f"push-queue-{index}", daemon=True)
+        self.queue = queue.Queue()
+
+    def run(self):
+        while True:
+            msg_id = self.queue.get()
+            try:
+                with _app.app_context():
+                    _deliver(msg_id)
+            except Exception:
+                logging.exception(f"[push_queue] 送出失敗 id={msg_id}")
+            finally:
+                with _inflight_lock:
+                    _inflight.discard(msg_id)
+                self.queue.task_done()
+
+
+def _sweeper():
+    while True:
+        try:
+            with _app.app_context():
+                _sweep()
+        except Exception:
+            logging.exception("[push_queue] 掃描失敗")
+        time.sleep(POLL_SECONDS)
+
+
+def init_push_queue(app):
+    """啟動送出執行緒與掃描執行緒（每個 gunicorn worker 各自一組）；重複呼叫無副作用。"""
+    global _app
+    if not PUSH_QUEUE_ENABLED:
+        return
+    with _start_lock:
+        if _workers:
+            return
+        _app = app
+        for i in range(WORKERS):
+            worker = _Worker(i)
+            worker.start()
+            _workers.append(worker)
+        threading.Thread(target=_sweeper, name="push-queue-sweeper", daemon=True).start()
+
+
+def drain(timeout=10.0):
+    """等待本行程已派送的訊息處理完（基準測試 / 關閉前使用）；逾時回傳 False。"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not any(w.queue.unfinished_tasks for w in _workers):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def queue_stats():
+    rows = db.session.query(OutboundMessage.status, func.count(OutboundMessage.id)).group_by(OutboundMessage.status).all()
+    return {
+        "enabled": PUSH_QUEUE_ENABLED,
+        "workers": len(_workers),
+        "local_queued": sum(w.queue.qsize() for w in _workers),
+        "inflight": len(_inflight),
+        "status": {status: count for status, count in rows},
+    }
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+每個 Flask 請求 / LINE 事件的 SQL 統計：查詢數、DB 總耗時、最慢的幾條語句。
+以 SQLAlchemy cursor 事件收集，超過門檻時寫入 log，彙總結果由 /admin/query_stats 提供。
+
+環境變數：
+  QUERY_STATS_ENABLED      預設 1；設 0 關閉
+  QUERY_STATS_SLOW_MS      單一範圍 DB 總耗時超過此毫秒數即記錄（預設 200）
+  QUERY_STATS_MAX_QUERIES  單一範圍查詢數超過此值即記錄（預設 30）
+"""
+import functools
+import heapq
+import inspect
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUERY_STATS_ENABLED = os.getenv("QUERY_STATS_ENABLED", "1") == "1"
+SLOW_MS = float(os.getenv("QUERY_STATS_SLOW_MS", "200"))
+MAX_QUERIES = int(os.getenv("QUERY_STATS_MAX_QUERIES", "30"))
+TOP_STATEMENTS = 5       # 每個範圍保留最慢的幾條
+SQL_PREVIEW_LEN = 300    # 語句截斷長度
+
+logger = logging.getLogger(__name__)
+
+# 目前作用中的範圍（可巢狀：/callback 請求內含多個 LINE 事件）
+_scopes = ContextVar("query_stats_scopes", default=())
+
+_lock = threading.Lock()
+_aggregates = {}   # name -> dict
+_installed = False
+
+
+class _Scope:
+    __slots__ = ("name", "queries", "db_ms", "slowest", "started")
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.db_ms = 0.0
+        self.slowest = []  # min-heap of (ms, sql)
+        self.started = time.perf_counter()
+
+    def add(self, sql, ms):
+        self.queries += 1
+        self.db_ms += ms
+        item = (ms, (sql or "")[:SQL_PREVIEW_LEN])
+        if len(self.slowest) < TOP_STATEMENTS:
+            heapq.heappush(self.slowest, item)
+        elif ms > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, item)
+
+    def top(self):
+        return [{"ms": round(ms, 2), "sql": sql} for ms, sql in sorted(self.slowest, reverse=True)]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_stats_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_stats_start")
+    if not starts:
+        return
+    ms = (time.perf_counter() - starts.pop()) * 1000.0
+    for scope in _scopes.get():
+        scope.add(statement, ms)
+
+
+def _handle_error(exception_context):
+    # 執行失敗時不會觸發 after_cursor_execute；取出對應的起點，避免連線池中的連線累積並錯配後續查詢的耗時
+    conn, context = exception_context.connection, exception_context.execution_context
+    if conn is None or context is None:  # 建立連線時的錯誤：沒有對應的 before_cursor_execute
+        return
+    _after_cursor_execute(conn, context.cursor, exception_context.statement,
+                          exception_context.parameters, context, context.executemany)
+
+
+def _record(scope):
+    elapsed_ms = (time.perf_counter() - scope.started) * 1000.0
+    top = scope.top()
+    with _lock:
+        agg = _aggregates.setdefault(scope.name, {
+            "count": 0, "queries": 0, "db_ms": 0.0, "elapsed_ms": 0.0,
+            "max_queries": 0, "max_db_ms": 0.0, "slow": 0, "slowest": [],
+        })
+        agg["count"] += 1
+        agg["queries"] += scope.queries
+        agg["db_ms"] += scope.db_ms
+        agg["elapsed_ms"] += elapsed_ms
+        agg["max_queries"] = max(agg["max_queries"], scope.queries)
+        if scope.db_ms > agg["max_db_ms"]:
+            agg["max_db_ms"] = scope.db_ms
+            agg["slowest"] = top
+    if scope.db_ms >= SLOW_MS or scope.queries >= MAX_QUERIES:
+        with _lock:
+            _aggregates[scope.name]["slow"] += 1
+        logger.warning(
+            "[query_stats] %s 查詢 %d 次 / DB %.1fms / 全程 %.1fms，最慢語句：%s",
+            scope.name, scope.queries, scope.db_ms, elapsed_ms,
+            " | ".join(f"{s['ms']}ms {s['sql']}" for s in top),
+        )
+
+
+def start_scope(name):
+    """開始一個統計範圍，回傳 token 供 end_scope 使用。"""
+    if not QUERY_STATS_ENABLED:
+        return None
+    scope = _Scope(name)
+    token = _scopes.set(_scopes.get() + (scope,))
+    return scope, token
+
+
+def end_scope(handle):
+    if not handle:
+        return
+    scope, token = handle
+    try:
+        _scopes.reset(token)
+    except ValueError:
+        # 不同 context 結束（例如 teardown 在另一個 context 執行），直接移除
+        _scopes.set(tuple(s for s in _scopes.get() if s is not scope))
+    _record(scope)
+
+
+def track(name):
+    """裝飾器：將函式執行期間的 SQL 計入指定範圍，例如 @track("line:message.text")。"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def _wrap(*a, **kw):
+            handle = start_scope(name)
+            try:
+                return fn(*a, **kw)
+            finally:
+                end_scope(handle)
+        # linebot WebhookHandler 依參數個數決定是否傳入 destination，需保留原簽章
+        _wrap.__signature__ = inspect.signature(fn)
+        return _wrap
+    return deco
+
+
+def snapshot():
+    """回傳各範圍彙總（平均值已換算）。"""
+    out = {}
+    with _lock:
+        for name, agg in _aggregates.items():
+            n = agg["count"] or 1
+            out[name] = {
+                "count": agg["count"],
+                "avg_queries": round(agg["queries"] / n, 2),
+                "max_queries": agg["max_queries"],
+                "avg_db_ms": round(agg["db_ms"] / n, 2),
+                "max_db_ms": round(agg["max_db_ms"], 2),
+                "avg_elapsed_ms": round(agg["elapsed_ms"] / n, 2),
+                "slow": agg["slow"],
+                "slowest": list(agg["slowest"]),
+            }
+    return out
+
+
+def reset():
+    with _lock:
+        _aggregates.clear()
+
+
+def init_query_stats(app):
+    """註冊 SQLAlchemy 事件與 Flask 請求掛勾。重複呼叫無副作用。"""
+    global _installed
+    if not QUERY_STATS_ENABLED:
+        return
+    if not _installed:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+        _installed = True
+
+    from flask import g, request
+
+    @app.before_request
+    def _query_stats_begin():
+        g._query_stats = start_scope(f"http:{request.endpoint or request.path}")
+
+    @app.teardown_request
+    def _query_stats_end(exc=None):
+        end_scope(g.pop("_query_stats", None))
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+LINE Rich Menu 服務：後台 Rich Menu 頁面的清單讀取與圖片上傳。
+
+原本每次開啟後台頁面都即時呼叫 LINE list API，上傳則把使用者原檔直接送出（常超過 LINE 的 1MB 上限）。
+（line-richmenu-server / line-richmenu-web 是另一套獨立的上傳工具，不經過此模組。）現在：
+  - 連線  共用 requests.Session（HTTPAdapter 連線池；GET 遇 429 / 5xx 自動重試）
+  - 清單  行程內快取 RICHMENU_CACHE_SECONDS 秒，並記錄內容雜湊（etag）；
+          上傳 / 建立 / 刪除後 invalidate()。設定 REDIS_URL 時以 Redis INCR 版本號讓其他 worker 一起失效
+  - 圖片  optimize_image() 以 Pillow 縮放裁切成 Rich Menu 建立時的 size（get_richmenu()：快取清單沒有時
+          向 LINE 查詢單一選單），再壓到 1MB 以內（PNG 優化 → JPEG 逐步降低品質；尺寸固定不再縮小，
+          最低品質仍超過時回報錯誤）；原檔已符合規格時不解碼，直接把上傳暫存檔分塊轉送給 LINE
+  - 連結  bulk_link() / bulk_unlink()：LINE bulk API（每次最多 500 人），由 utils/richmenu_link.py 批次呼叫
+
+環境變數：
+  RICHMENU_CACHE_SECONDS   清單快取秒數（預設 300）
+  RICHMENU_MAX_BYTES       上傳圖片大小上限（預設 1000000，LINE 規定 1MB）
+  RICHMENU_POOL_SIZE       HTTP 連線池大小（預設 4）
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import LINE_CHANNEL_ACCESS_TOKEN
+from utils import upload_stream
+from utils.metrics import record_cache
+
+API_BASE = "https://api.line.me/v2/bot/richmenu"
+API_DATA_BASE = "https://api-data.line.me/v2/bot/richmenu"
+
+CACHE_SECONDS = float(os.getenv("RICHMENU_CACHE_SECONDS", "300"))
+MAX_BYTES = int(os.getenv("RICHMENU_MAX_BYTES", "1000000"))
+POOL_SIZE = int(os.getenv("RICHMENU_POOL_SIZE", "4"))
+REDIS_VERSION_KEY = "config_version:richmenu"
+
+# 官方範本尺寸（未指定選單時依圖片比例挑選）
+STANDARD_SIZES = ((2500, 1686), (2500, 843), (1200, 810), (1200, 405), (800, 540), (800, 270))
+JPEG_QUALITIES = (90, 85, 80, 75, 70, 65, 60, 55, 50)
+ALREADY_UPLOADED = 'An image has already been uploaded to the richmenu'
+BULK_LIMIT = 500  # bulk link / unlink 每次最多 userIds 數
+
+_redis = None
+try:
+    import redis
+    if os.getenv("REDIS_URL"):
+        _redis = redis.StrictRedis.from_url(os.getenv("REDIS_URL"))
+except Exception:
+    _redis = None
+
+
+# ───────────────────────────────────────────────────────────────
+# HTTP
+# ───────────────────────────────────────────────────────────────
+def _build_session():
+    s = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET"]), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE, max_retries=retry)
+    s.mount("https://", adapter)
+    return s
+
+
+_session = _build_session()
+
+
+def access_token():
+    return LINE_CHANNEL_ACCESS_TOKEN or os.getenv('LINE_CHANNEL_ACCESS_TOKEN', '')
+
+
+def _auth_headers():
+    return {'Authorization': f'Bearer {access_token()}'}
+
+
+def _error_detail(resp):
+    try:
+        return resp.json().get('message') or resp.text
+    except Exception:
+        return resp.text
+
+
+# ───────────────────────────────────────────────────────────────
+# 清單快取
+# ───────────────────────────────────────────────────────────────
+_lock = threading.Lock()
+_state = {"items": None, "etag": None, "version": None, "fetched": 0.0}
+
+
+def _shared_version():
+    if _redis is None:
+        return None
+    try:
+        return int(_redis.get(REDIS_VERSION_KEY) or 0)
+    except Exception:
+        logging.exception("[richmenu] 讀取 Redis 版本號失敗")
+        return None
+
+
+def invalidate():
+    """清單有異動：本行程下次讀取時重新呼叫 LINE；有 Redis 時其他 worker 也一起失效。"""
+    _state["items"] = None
+    if _redis is not None:
+        try:
+            _redis.incr(REDIS_VERSION_KEY)
+        except Exception:
+            logging.exception("[richmenu] Redis 版本號更新失敗")
+
+
+def _fetch():
+    resp = _session.get(f"{API_BASE}/list", headers=_auth_headers(), timeout=10)
+    if 200 <= resp.status_code < 300:
+        data = resp.json() or {}
+        return data.get('richmenus', []) or [], None
+    return None, f'LINE API 讀取 Rich Menu 清單失敗（{resp.status_code}）：{_error_detail(resp)}'
+
+
+def list_richmenus(force=False):
+    """取得 Rich Menu 清單，回傳 (list, error_message, etag)；錯誤不快取。"""
+    if not access_token():
+        return [], '尚未設定 LINE_CHANNEL_ACCESS_TOKEN，無法取得 Rich Menu 清單', None
+    version = _shared_version()
+    items = _state["items"]
+    if (not force and items is not None and version == _state["version"]
+            and time.monotonic() - _state["fetched"] < CACHE_SECONDS):
+        record_cache("richmenu_list", True)
+        return items, None, _state["etag"]
+    with _lock:
+        items = _state["items"]
+        if (not force and items is not None and version == _state["version"]
+                and time.monotonic() - _state["fetched"] < CACHE_SECONDS):
+            record_cache("richmenu_list", True)
+            return items, None, _state["etag"]
+        record_cache("richmenu_list", False)
+        try:
+            items, error = _fetch()
+        except Exception as e:
+            return [], f'呼叫 LINE Rich Menu 清單 API 發生錯誤：{e}', None
+        if error:
+            return [], error, None
+        body = json.dumps(items, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        _state.update(items=items, etag=hashlib.sha1(body).hexdigest(), version=version,
+                      fetched=time.monotonic())
+        return items, None, _state["etag"]
+
+
+def find_richmenu(rich_menu_id):
+    """從快取清單找出指定 Rich Menu（找不到回傳 None，不額外呼叫 LINE）。"""
+    for m in _state["items"] or []:
+        if m.get('richMenuId') == rich_menu_id:
+            return m
+    return None
+
+
+def get_richmenu(rich_menu_id):
+    """取得指定 Rich Menu，回傳 (menu, error_message)；快取清單沒有時（已失效、過期或在其他 worker 讀取）
+    呼叫 GET /v2/bot/richmenu/{id}。"""
+    menu = find_richmenu(rich_menu_id)
+    if menu is not None:
+        return menu, None
+    try:
+        resp = _session.get(f"{API_BASE}/{rich_menu_id}", headers=_auth_headers(), timeout=10)
+    except Exception as e:
+        return None, f'呼叫 LINE 查詢 Rich Menu 時發生錯誤：{e}'
+    if 200 <= resp.status_code < 300:
+        return resp.json() or {}, None
+    if resp.status_code == 404:
+        return None, f'找不到 Rich Menu {rich_menu_id}（可能已刪除），請重新整理清單'
+    return None, f'LINE API 查詢 Rich Menu 失敗（{resp.status_code}）：{_error_detail(resp)}'
+
+
+# ───────────────────────────────────────────────────────────────
+# 圖片最佳化
+# ───────────────────────────────────────────────────────────────
+def _target_size(width, height, menu=None):
+    size = (menu or {}).get('size') or {}
+    if size.get('width') and size.get('height'):
+        return int(size['width']), int(size['height'])
+    aspect = width / float(height)
+    return min(STANDARD_SIZES, key=lambda s: (abs(s[0] / float(s[1]) - aspect), -s[0]))
+
+
+def _encode_png(img):
+    buf = io.BytesIO()
+    img.save(buf, format='PNG', optimize=True)
+    return buf.getvalue()
+
+
+def _encode_jpeg(img, quality):
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def _flatten(img):
+    """JPEG 不支援透明：透明區域鋪白底。"""
+    from PIL import Image
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        rgba = img.convert('RGBA')
+        bg = Image.new('RGB', rgba.size, (255, 255, 255))
+        bg.paste(rgba, mask=rgba.split()[-1])
+        return bg
+    return img.convert('RGB')
+
+
+def optimize_image(source, menu=None, max_bytes=None):
+    """原始圖片（bytes 或可 seek 的檔案物件）→ (body, content_type, info)；尺寸符合 Rich Menu、大小 <= max_bytes。
+
+    原檔已符合規格時 body 即倒回開頭的原檔案物件（只讀檔頭，不解碼、不整份讀進記憶體），
+    否則為重新編碼後的 bytes。無法辨識的圖片或壓到最小仍超過上限時拋出 ValueError。
+    """
+    from PIL import Image, ImageOps
+    max_bytes = max_bytes or MAX_BYTES
+    fileobj = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    size = upload_stream.stream_size(fileobj)
+    try:
+        src = Image.open(fileobj)  # 延遲解碼：此時只讀了檔頭
+    except Exception as e:
+        raise ValueError(f'無法辨識圖片格式：{e}')
+    fmt = src.format
+    rotated = src.getexif().get(0x0112, 1) not in (None, 1)
+    width, height = _target_size(*src.size, menu=menu)
+
+    # 原本就是 PNG / JPEG 且尺寸、方向正確、大小合格：原檔照送
+    if fmt in ('PNG', 'JPEG') and src.size == (width, height) and not rotated and size <= max_bytes:
+        fileobj.seek(0)
+        return fileobj, f'image/{fmt.lower()}', {'width': width, 'height': height, 'format': fmt, 'bytes': size}
+
+    try:
+        src.load()
+    except Exception as e:
+        raise ValueError(f'無法辨識圖片格式：{e}')
+    if rotated:
+        src = ImageOps.exif_transpose(src)
+        width, height = _target_size(*src.size, menu=menu)
+    if src.size == (width, height):
+        img = src
+    else:
+        # 等比縮放後置中裁切成目標尺寸（與 LINE 範本的 cover 行為一致）
+        img = ImageOps.fit(src, (width, height), method=Image.LANCZOS)
+
+    if fmt == 'PNG':
+        out = _encode_png(img if img.mode in ('RGB', 'RGBA', 'P', 'L') else img.convert('RGBA'))
+        if len(out) <= max_bytes:
+            return out, 'image/png', {'width': width, 'height': height, 'format': 'PNG', 'bytes': len(out)}
+
+    rgb = _flatten(img)
+    for quality in JPEG_QUALITIES:
+        out = _encode_jpeg(rgb, quality)
+        if len(out) <= max_bytes:
+            return out, 'image/jpeg', {'width': width, 'height': height, 'format': 'JPEG',
+                                       'quality': quality, 'bytes': len(out)}
+    # 圖片必須與選單尺寸相同，不能再縮小
+    raise ValueError(f'圖片以最低品質壓縮後仍超過 {max_bytes // 1000}KB（選單尺寸 {width}×{height}），'
+                     f'請改用色彩較單純的圖片')
+
+
+# ───────────────────────────────────────────────────────────────
+# 上傳
+# ───────────────────────────────────────────────────────────────
+def upload_image(rich_menu_id, source):
+    """最佳化後上傳 Rich Menu 圖片（bytes 或可 seek 的檔案物件），回傳 (ok, message)；
+    message 為可直接顯示給管理員的中文說明。"""
+    if not access_token():
+        return False, '環境尚未設定 LINE_CHANNEL_ACCESS_TOKEN，無法呼叫 LINE API'
+    menu, error = get_richmenu(rich_menu_id)
+    if error:
+        return False, error
+    try:
+        body, content_type, info = optimize_image(source, menu=menu)
+    except ValueError as e:
+        return False, str(e)
+    try:
+        # 根據 LINE 官方文件，上傳 Rich Menu 圖片需使用 api-data.line.me 網域；
+        # body 為檔案物件時 requests 以 Content-Length 分塊送出
+        resp = _session.post(f"{API_DATA_BASE}/{rich_menu_id}/content", data=body,
+                             headers={**_auth_headers(), 'Content-Type': content_type}, timeout=15)
+    except Exception as e:
+        return False, f'上傳至 LINE 時發生錯誤：{e}'
+    if 200 <= resp.status_code < 300:
+        invalidate()
+        sha = getattr(source, 'sha256', None)
+        logging.info(f"[richmenu] 已上傳 {rich_menu_id}：{info}（原檔 sha256={sha}）")
+        return True, (f"Rich Menu 圖片更新成功（{info['width']}×{info['height']} {info['format']}，"
+                      f"{info['bytes'] // 1000}KB）")
+    detail = _error_detail(resp)
+    # 特別處理「圖片已存在」的情況，給出更清楚的中文說明
+    if ALREADY_UPLOADED in str(detail):
+        return False, ('LINE 回覆：這個 Rich Menu 已經有設定圖片，官方規則不允許覆蓋。'
+                       '若要換圖，必須建立新的 Rich Menu 再上傳圖片。')
+    return False, f'LINE API 回應錯誤（{resp.status_code}）：{detail}'
+
+
+# ───────────────────────────────────────────────────────────────
+# 用戶連結
+# ───────────────────────────────────────────────────────────────
+def _bulk(path, payload):
+    try:
+        resp = _session.post(f"{API_BASE}/bulk/{path}", json=payload, headers=_auth_headers(), timeout=15)
+    except Exception as e:
+        return False, None, str(e)
+    if 200 <= resp.status_code < 300:
+        return True, resp.status_code, None
+    # 400 時 details 會標出出錯的欄位（例如 userIds[3]），呼叫端據此判斷是否為個別用戶的問題
+    try:
+        data = resp.json() or {}
+        details = "; ".join(f"{d.get('property')}: {d.get('message')}" for d in data.get('details') or [])
+        detail = f"{data.get('message') or resp.text}" + (f"（{details}）" if details else "")
+    except Exception:
+        detail = resp.text
+    return False, resp.status_code, detail
+
+
+def bulk_link(rich_menu_id, user_ids):
+    """把 rich_menu_id 連結給 user_ids（<= BULK_LIMIT 人）；回傳 (ok, status_code, detail)。"""
+    return _bulk("link", {"richMenuId": rich_menu_id, "userIds": list(user_ids)})
+
+
+def bulk_unlink(user_ids):
+    """解除 user_ids（<= BULK_LIMIT 人）的個人 Rich Menu，回到預設選單；回傳 (ok, status_code, detail)。"""
+    return _bulk("unlink", {"userIds": list(user_ids)})
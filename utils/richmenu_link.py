@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+已驗證會員的 Rich Menu 批次連結：原本未驗證 / 已驗證的用戶看到同一個選單，點選功能後才由
+guard_verified 查白名單並以文字回覆引導。現在白名單有 line_user_id 的用戶會被連結到「已驗證」選單，
+未驗證者維持 LINE 後台設定的預設選單：
+
+  觸發  Whitelist 新增、line_user_id 變更（before_flush 將 richmenu_id 清空）時，commit 後喚醒背景執行緒；
+        刪除白名單或換綁帳號時，舊的 line_user_id 於 commit 後 bulk unlink 回預設選單
+  連結  link_pending()：以 id keyset 分批（每批 500 人，LINE bulk link 上限）找出 richmenu_id 與設定不同者，
+        呼叫 bulk link 成功後以 executemany 記錄 richmenu_id（line_user_id 未變才寫入）
+        執行前先確認 RICHMENU_VERIFIED_ID 存在（richmenu.get_richmenu），不存在即停止，不會把全部用戶標記 rejected
+        400 且錯誤指向 userIds 時對半拆批找出無效的 user id，標記 rejected 不再重試；
+        其他 400、網路錯誤 / 429 / 5xx 停止本次執行，留待下次
+  補齊  排程 richmenu_link 每 RICHMENU_LINK_INTERVAL_MINUTES 分鐘執行 link_pending()，
+        既有白名單與更換 RICHMENU_VERIFIED_ID 後的重新連結都由它分批完成；也可執行 flask richmenu link-all
+
+環境變數：
+  RICHMENU_VERIFIED_ID            已驗證會員的 Rich Menu ID；未設定時整個功能停用
+  RICHMENU_LINK_INTERVAL_MINUTES  補齊排程間隔分鐘（預設 30）
+  RICHMENU_LINK_PAUSE_SECONDS     兩批之間的間隔秒數，避免觸發 LINE 流量限制（預設 0.5）
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import and_, bindparam, event, func, inspect as sa_inspect, or_, update
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Whitelist
+from utils import richmenu
+
+VERIFIED_RICHMENU_ID = os.getenv("RICHMENU_VERIFIED_ID", "").strip()
+LINK_INTERVAL_MINUTES = int(os.getenv("RICHMENU_LINK_INTERVAL_MINUTES", "30"))
+PAUSE_SECONDS = float(os.getenv("RICHMENU_LINK_PAUSE_SECONDS", "0.5"))
+REJECTED = "rejected"  # LINE 拒絕的 user id（已封鎖 / 無效），line_user_id 變更前不再重試
+_USER_ID_ERROR = re.compile(r"user\s*ids?", re.IGNORECASE)
+
+_LINK_KEY = "richmenu_link_pending"
+_UNLINK_KEY = "richmenu_unlink_pending"
+
+_app = None
+_wake = threading.Event()
+_unlink_lock = threading.Lock()
+_unlink_ids = set()
+_start_lock = threading.Lock()
+_started = False
+
+
+def enabled():
+    return bool(VERIFIED_RICHMENU_ID and richmenu.access_token())
+
+
+# ───────────────────────────────────────────────────────────────
+# 觸發：白名單異動
+# ───────────────────────────────────────────────────────────────
+@event.listens_for(Session, "before_flush")
+def _collect(session, flush_context, instances):
+    if not VERIFIED_RICHMENU_ID:
+        return
+    for obj in session.new:
+        if isinstance(obj, Whitelist) and obj.line_user_id:
+            session.info[_LINK_KEY] = True
+    for obj in session.dirty:
+        if not isinstance(obj, Whitelist):
+            continue
+        hist = sa_inspect(obj).attrs.line_user_id.history
+        if not hist.has_changes():
+            continue
+        old = [uid for uid in hist.deleted if uid]
+        if old:
+            session.info.setdefault(_UNLINK_KEY, set()).update(old)
+        obj.richmenu_id = None
+        if obj.line_user_id:
+            session.info[_LINK_KEY] = True
+    for obj in session.deleted:
+        if isinstance(obj, Whitelist) and obj.line_user_id and obj.richmenu_id:
+            session.info.setdefault(_UNLINK_KEY, set()).add(obj.line_user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    link = session.info.pop(_LINK_KEY, False)
+    unlink = session.info.pop(_UNLINK_KEY, None)
+    if unlink:
+        with _unlink_lock:
+            _unlink_ids.update(unlink)
+    if (link or unlink) and _started:
+        _wake.set()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_after_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(_LINK_KEY, None)
+        session.info.pop(_UNLINK_KEY, None)
+
+
+# ───────────────────────────────────────────────────────────────
+# 批次連結
+# ───────────────────────────────────────────────────────────────
+def _pending_filter(target):
+    W = Whitelist
+    return and_(W.line_user_id.isnot(None), W.line_user_id != '',
+                or_(W.richmenu_id.is_(None), and_(W.richmenu_id != target, W.richmenu_id != REJECTED)))
+
+
+def _mark(rows, value):
+    table = Whitelist.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.id == bindparam("b_id"), table.c.line_user_id == bindparam("b_uid"))
+        .values(richmenu_id=value),
+        [{"b_id": r.id, "b_uid": r.line_user_id} for r in rows])
+
+
+def _link_chunk(target, rows, stats):
+    """連結一批；回傳 False 表示無法繼續（暫時性錯誤或與個別用戶無關的 400，停止本次執行）。"""
+    ok, status, detail = richmenu.bulk_link(target, [r.line_user_id for r in rows])
+    if ok:
+        _mark(rows, target)
+        stats["linked"] += len(rows)
+        return True
+    if status == 400 and _USER_ID_ERROR.search(detail or ""):
+        if len(rows) == 1:
+            logging.warning(f"[richmenu_link] LINE 拒絕 user={rows[0].line_user_id}：{detail}")
+            _mark(rows, REJECTED)
+            stats["rejected"] += 1
+            return True
+        mid = len(rows) // 2
+        return _link_chunk(target, rows[:mid], stats) and _link_chunk(target, rows[mid:], stats)
+    logging.warning(f"[richmenu_link] bulk link 失敗（{status}）：{detail}")
+    if status == 400:
+        stats["error"] = f"LINE 拒絕 bulk link（400）：{detail}"
+    return False
+
+
+def link_pending(max_batches=None):
+    """把尚未連結（或連結到舊選單）的白名單用戶分批連結到已驗證選單；回傳統計。"""
+    stats = {"linked": 0, "rejected": 0, "batches": 0, "stopped": False, "error": None}
+    if not enabled():
+        return stats
+    target = VERIFIED_RICHMENU_ID
+    _menu, error = richmenu.get_richmenu(target)
+    if error:
+        logging.warning(f"[richmenu_link] RICHMENU_VERIFIED_ID={target} 無法使用，停止連結：{error}")
+        stats.update(stopped=True, error=error)
+        return stats
+    W = Whitelist
+    last_id = 0
+    while max_batches is None or stats["batches"] < max_batches:
+        rows = (db.session.query(W.id, W.line_user_id)
+                .filter(W.id > last_id, _pending_filter(target))
+                .order_by(W.id)
+                .limit(richmenu.BULK_LIMIT)
+                .all())
+        if not rows:
+            break
+        last_id = rows[-1].id
+        if stats["batches"]:
+            time.sleep(PAUSE_SECONDS)
+        try:
+            done = _link_chunk(target, rows, stats)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        stats["batches"] += 1
+        if not done:
+            stats["stopped"] = True
+            break
+    if stats["batches"]:
+        logging.info(f"[richmenu_link] {stats}")
+    return stats
+
+
+def unlink_pending():
+    """解除已刪除 / 換綁的 line_user_id 的個人選單；失敗者放回待處理。"""
+    with _unlink_lock:
+        ids = list(_unlink_ids)
+        _unlink_ids.clear()
+    failed = []
+    for i in range(0, len(ids), richmenu.BULK_LIMIT):
+        chunk = ids[i:i + richmenu.BULK_LIMIT]
+        ok, status, detail = richmenu.bulk_unlink(chunk)
+        if not ok and status != 400:
+            logging.warning(f"[richmenu_link] bulk unlink 失敗（{status}）：{detail}")
+            failed.extend(chunk)
+    if failed:
+        with _unlink_lock:
+            _unlink_ids.update(failed)
+    return len(ids) - len(failed)
+
+
+def link_summary():
+    """白名單中已連結 / 待連結 / 被拒絕的人數（後台 Rich Menu 頁面顯示用）。"""
+    W = Whitelist
+    has_user = and_(W.line_user_id.isnot(None), W.line_user_id != '')
+    target = VERIFIED_RICHMENU_ID
+    row = db.session.query(
+        func.count(W.id).filter(W.richmenu_id == target),
+        func.count(W.id).filter(_pending_filter(target)),
+        func.count(W.id).filter(W.richmenu_id == REJECTED),
+    ).filter(has_user).one()
+    return {"richmenu_id": target, "enabled": enabled(),
+            "linked": row[0], "pending": row[1], "rejected": row[2]}
+
+
+def request_link():
+    """立即處理待連結的用戶：有背景執行緒時喚醒它，否則同步執行。"""
+    if _started:
+        _wake.set()
+        return None
+    return link_pending()
+
+
+# ───────────────────────────────────────────────────────────────
+# 背景執行緒
+# ───────────────────────────────────────────────────────────────
+def _worker():
+    while True:
+        _wake.wait()
+        # 稍等一下，讓同時完成驗證的多位用戶合併成一次 bulk 呼叫
+        time.sleep(1)
+        _wake.clear()
+        try:
+            with _app.app_context():
+                if _unlink_ids:
+                    unlink_pending()
+                link_pending()
+        except Exception:
+            logging.exception("[richmenu_link] 背景連結失敗")
+
+
+def init_richmenu_link(app):
+    """註冊 flask richmenu 指令並啟動背景連結執行緒（每個 worker 一條）；未設定 RICHMENU_VERIFIED_ID 時不啟動。"""
+    global _app, _started
+    import click
+
+    @app.cli.group("richmenu")
+    def richmenu_cli():
+        """LINE Rich Menu。"""
+
+    @richmenu_cli.command("link-all")
+    def link_all_command():
+        stats = link_pending()
+        click.echo(f"已連結 {stats['linked']} 人，拒絕 {stats['rejected']} 人"
+                   + (f"（{stats['error']}）" if stats["error"]
+                      else "（LINE 暫時無法處理，稍後再試）" if stats["stopped"] else ""))
+
+    if not VERIFIED_RICHMENU_ID:
+        return
+    with _start_lock:
+        if _started:
+            return
+        _app = app
+        threading.Thread(target=_worker, name="richmenu-link", daemon=True).start()
+        _started = True
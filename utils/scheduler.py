@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+排程子系統：APScheduler + leader election + 持久化 job store + 執行紀錄。
+
+gunicorn 每個 worker 都會 import app.py；原本每個 worker 各自啟動 BackgroundScheduler，
+同一個工作會同時跑 N 次（例如到期清除重複寫入 consume 交易）。現在：
+  - 每個行程都建立排程器但以暫停狀態啟動，只有取得 leader 鎖的行程會恢復執行；
+    leader 行程結束或失聯後，其他行程在下一輪（SCHEDULER_LEADER_INTERVAL 秒內）接手
+  - 鎖：PostgreSQL advisory lock（綁定一條專用連線，連線斷開即釋放）、Redis（SET NX + 續約），
+    其他資料庫（本機 SQLite）退回檔案鎖
+  - job store 預設存在資料庫 apscheduler_jobs 表，換 leader 後下次執行時間與錯過的排程可以接續
+  - 每次執行寫入 job_run（開始時間、耗時、結果、錯誤、主機），/admin/jobs 可查詢
+
+獨立排程行程（選用）：Procfile 的 scheduler（python scheduler.py）預設不啟動；部署此行程後才替 web 設
+SCHEDULER_MODE=off。web 只設 off 而沒有 scheduler 行程時，所有排程工作都不會執行。
+
+環境變數：
+  SCHEDULER_MODE             embedded（預設，web 行程內以 leader election 執行）/ off（web 不執行排程）
+  SCHEDULER_LOCK             auto（預設：PostgreSQL → pg，否則有 REDIS_URL → redis，否則 file）/ pg / redis / file
+  SCHEDULER_LEADER_INTERVAL  搶 leader / 續約間隔秒數（預設 15；Redis 鎖 TTL 為其 3 倍）
+  SCHEDULER_JOBSTORE         sqlalchemy（預設）/ memory
+  SCHEDULER_LOCK_FILE        檔案鎖路徑（預設系統暫存目錄下 linebot-scheduler.lock）
+"""
+import functools
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+import zlib
+from datetime import datetime
+
+from sqlalchemy import text
+
+from extensions import db
+from utils.metrics import observe_job
+
+try:
+    from apscheduler.schedulers.background import BackgroundScheduler
+    APSCHEDULER_AVAILABLE = True
+except Exception:
+    APSCHEDULER_AVAILABLE = False
+
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "embedded")
+SCHEDULER_LOCK = os.getenv("SCHEDULER_LOCK", "auto")
+LEADER_INTERVAL = float(os.getenv("SCHEDULER_LEADER_INTERVAL", "15"))
+JOBSTORE = os.getenv("SCHEDULER_JOBSTORE", "sqlalchemy")
+LOCK_FILE = os.getenv("SCHEDULER_LOCK_FILE") or os.path.join(tempfile.gettempdir(), "linebot-scheduler.lock")
+
+LOCK_NAME = "linebot-scheduler"
+PG_LOCK_KEY = zlib.crc32(LOCK_NAME.encode("utf-8"))  # pg_try_advisory_lock(bigint)
+IDENTITY = f"{socket.gethostname()}:{os.getpid()}"
+
+_app = None
+_state = {"scheduler": None, "lock": None, "leader": False, "since": None}
+
+
+# ───────────────────────────────────────────────────────────────
+# leader 鎖
+# ───────────────────────────────────────────────────────────────
+class _PgAdvisoryLock:
+    name = "pg"
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.conn = None
+
+    def acquire(self):
+        conn = self.engine.connect()
+        try:
+            got = conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": PG_LOCK_KEY}).scalar()
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        if not got:
+            conn.close()
+            return False
+        self.conn = conn
+        return True
+
+    def check(self):
+        # advisory lock 屬於連線本身，連線還活著就仍持有
+        try:
+            self.conn.execute(text("SELECT 1"))
+            self.conn.commit()
+            return True
+        except Exception:
+            self.release()
+            return False
+
+    def release(self):
+        if self.conn is None:
+            return
+        try:
+            self.conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": PG_LOCK_KEY})
+            self.conn.commit()
+        except Exception:
+            pass
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+
+
+class _RedisLock:
+    name = "redis"
+    _RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, client):
+        self.client = client
+        self.key = f"lock:{LOCK_NAME}"
+        self.token = f"{IDENTITY}:{uuid.uuid4().hex}"
+        self.ttl_ms = int(LEADER_INTERVAL * 3 * 1000)
+
+    def acquire(self):
+        return bool(self.client.set(self.key, self.token, nx=True, px=self.ttl_ms))
+
+    def check(self):
+        return bool(self.client.eval(self._RENEW, 1, self.key, self.token, self.ttl_ms))
+
+    def release(self):
+        try:
+            self.client.eval(self._RELEASE, 1, self.key, self.token)
+        except Exception:
+            pass
+
+
+class _FileLock:
+    """單機多行程（本機開發 / SQLite）用；fcntl 不可用時視為唯一行程。"""
+    name = "file"
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def acquire(self):
+        try:
+            import fcntl
+        except ImportError:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.fd = fd
+        return True
+
+    def check(self):
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+
+
+def _make_lock(engine):
+    kind = SCHEDULER_LOCK
+    if kind == "auto":
+        if engine.dialect.name == "postgresql":
+            kind = "pg"
+        elif os.getenv("REDIS_URL"):
+            kind = "redis"
+        else:
+            kind = "file"
+    if kind == "pg":
+        return _PgAdvisoryLock(engine)
+    if kind == "redis":
+        import redis
+        return _RedisLock(redis.StrictRedis.from_url(os.getenv("REDIS_URL")))
+    return _FileLock(LOCK_FILE)
+
+
+def _leader_loop(sched, lock, stop):
+    while not stop.is_set() and sched.running:
+        try:
+            if _state["leader"]:
+                if not lock.check():
+                    _state["leader"] = False
+                    sched.pause()
+                    logging.warning(f"[scheduler] {IDENTITY} 失去 leader（{lock.name}），暫停排程")
+            elif lock.acquire():
+                _state["leader"] = True
+                _state["since"] = datetime.utcnow()
+                sched.resume()
+                logging.info(f"[scheduler] {IDENTITY} 取得 leader（{lock.name}），開始執行排程")
+        except Exception:
+            logging.exception("[scheduler] leader election 失敗")
+            if _state["leader"]:
+                _state["leader"] = False
+                try:
+                    sched.pause()
+                except Exception:
+                    pass
+        stop.wait(LEADER_INTERVAL)
+
+
+# ───────────────────────────────────────────────────────────────
+# 工作裝飾器與執行紀錄
+# ───────────────────────────────────────────────────────────────
+def scheduled_job(job_id):
+    """裝飾排程工作：在 app context 中執行，寫入 job_run 並記錄 Prometheus 指標。"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def _wrap(*a, **kw):
+            with _app.app_context():
+                started = datetime.utcnow()
+                t0 = time.perf_counter()
+                status, error = "success", None
+                try:
+                    return fn(*a, **kw)
+                except Exception:
+                    status, error = "failed", traceback.format_exc()[-4000:]
+                    db.session.rollback()
+                    raise
+                finally:
+                    _record_run(job_id, started, int((time.perf_counter() - t0) * 1000), status, error)
+        wrapped = observe_job(job_id)(_wrap)
+        wrapped.job_id = job_id
+        return wrapped
+    return deco
+
+
+def _record_run(job_id, started, duration_ms, status, error):
+    from models import JobRun
+    try:
+        db.session.add(JobRun(job_id=job_id, started_at=started, finished_at=datetime.utcnow(),
+                              duration_ms=duration_ms, status=status, error=error, host=IDENTITY))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logging.exception(f"[scheduler] 寫入 job_run 失敗 job={job_id}")
+
+
+# ───────────────────────────────────────────────────────────────
+# 啟動
+# ───────────────────────────────────────────────────────────────
+def _build_scheduler():
+    jobstores = {}
+    if JOBSTORE == "sqlalchemy":
+        from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+        jobstores["default"] = SQLAlchemyJobStore(engine=db.engine)
+    return BackgroundScheduler(
+        timezone="Asia/Taipei",
+        jobstores=jobstores,
+        # 換 leader 或重啟期間錯過的排程：合併成一次補跑，超過一小時則略過
+        job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": 3600},
+    )
+
+
+def start_scheduler(app):
+    """建立排程器（暫停狀態）、註冊 utils/jobs.py 的工作並啟動 leader election；回傳 BackgroundScheduler。"""
+    global _app
+    if not APSCHEDULER_AVAILABLE:
+        logging.warning("[scheduler] 未安裝 apscheduler，略過排程")
+        return None
+    if _state["scheduler"] is not None:
+        return _state["scheduler"]
+    _app = app
+    from utils.jobs import JOBS
+    with app.app_context():
+        sched = _build_scheduler()
+        sched.start(paused=True)
+        for func, trigger, kwargs in JOBS:
+            sched.add_job(func, trigger, id=func.job_id, replace_existing=True, **kwargs)
+        lock = _make_lock(db.engine)
+    _state.update(scheduler=sched, lock=lock)
+    stop = threading.Event()
+    _state["stop"] = stop
+    threading.Thread(target=_leader_loop, args=(sched, lock, stop), name="scheduler-leader", daemon=True).start()
+    return sched
+
+
+def init_scheduler(app):
+    """web 行程呼叫：SCHEDULER_MODE=off 時不啟動（由獨立 scheduler 行程負責）。"""
+    if SCHEDULER_MODE == "off":
+        return None
+    return start_scheduler(app)
+
+
+def stop_scheduler():
+    sched, lock = _state["scheduler"], _state["lock"]
+    if _state.get("stop"):
+        _state["stop"].set()
+    if sched is not None and sched.running:
+        sched.shutdown(wait=True)
+    if lock is not None:
+        lock.release()
+    _state.update(scheduler=None, lock=None, leader=False)
+
+
+def run_forever(app):
+    """獨立排程行程的主迴圈（python scheduler.py）；收到 SIGTERM / SIGINT 時釋放 leader 鎖後結束。"""
+    import signal
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+    if start_scheduler(app) is None:
+        return 1
+    logging.info(f"[scheduler] 獨立排程行程啟動 {IDENTITY}")
+    while not stop.is_set():
+        stop.wait(1)
+    stop_scheduler()
+    return 0
+
+
+def scheduler_status():
+    sched = _state["scheduler"]
+    jobs = []
+    if sched is not None:
+        for job in sched.get_jobs():
+            jobs.append({"id": job.id, "next_run_time": job.next_run_time.isoformat() if job.next_run_time else None})
+    return {
+        "mode": SCHEDULER_MODE,
+        "identity": IDENTITY,
+        "lock": _state["lock"].name if _state["lock"] else None,
+        "leader": _state["leader"],
+        "leader_since": _state["since"].isoformat() if _state["since"] else None,
+        "jobs": jobs,
+    }
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+驗證流程的 Unit of Work：同一個 LINE 事件內的多筆寫入合併成一次 commit。
+
+原本一次成功驗證會在 update_or_create_whitelist_from_data、mark_tempverify_verified_by_phone、
+upsert_tempverify 各 commit 一次（每次一趟往返 + 一次 fsync）。
+在 unit_of_work() 範圍內：
+  commit()     只 flush（送出 SQL、取得自動編號、唯一鍵衝突當場拋出），範圍結束時才真正 commit 一次
+  savepoint()  以 SAVEPOINT 包住一段寫入，失敗只退回該段，不影響同一事件其他寫入
+               （例如新增白名單遇到 IntegrityError 後改走依手機查詢的備援）
+  commit_now() 立即 commit 目前累積的寫入；回覆「驗證成功」等無法撤回的訊息前呼叫，
+               避免 reply token 用掉之後範圍結束的 commit 才失敗
+範圍外呼叫時行為與原本相同：commit() 直接 commit、失敗 rollback；savepoint() 成功即 commit。
+範圍可巢狀，內層併入最外層；範圍內拋出例外則整批 rollback。
+
+每個範圍實際 commit 的次數（含範圍內直接呼叫 db.session.commit() 者）記錄於
+Prometheus db_commits_per_event{scope}。
+
+環境變數：
+  UOW_ENABLED  預設 1；設 0 時 unit_of_work() 不合併，各處照舊各自 commit
+"""
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from extensions import db
+from utils.metrics import observe_commits
+
+UOW_ENABLED = os.getenv("UOW_ENABLED", "1") == "1"
+
+_current = ContextVar("unit_of_work", default=None)
+
+
+class _Unit:
+    __slots__ = ("name", "commits", "pending")
+
+    def __init__(self, name):
+        self.name = name
+        self.commits = 0      # 範圍內實際 commit 次數
+        self.pending = False  # 有已 flush、尚未 commit 的寫入
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    unit = _current.get()
+    if unit is not None:
+        unit.commits += 1
+        unit.pending = False
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _after_rollback(session, previous_transaction):
+    unit = _current.get()
+    if unit is not None and previous_transaction.parent is None:
+        unit.pending = False
+
+
+def active():
+    """目前是否在 unit_of_work() 範圍內。"""
+    return _current.get() is not None
+
+
+@contextmanager
+def unit_of_work(name):
+    """合併範圍內的 commit；可當 context manager 或裝飾器，例如 @unit_of_work("verify:image")。"""
+    if not UOW_ENABLED or _current.get() is not None:
+        yield
+        return
+    unit = _Unit(name)
+    token = _current.set(unit)
+    try:
+        yield
+        if unit.pending:
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        _current.reset(token)
+        observe_commits(name, unit.commits)
+
+
+def commit():
+    """範圍內只 flush，由 unit_of_work 結束時統一 commit；範圍外直接 commit，失敗 rollback 後拋出。"""
+    unit = _current.get()
+    if unit is None:
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return
+    db.session.flush()
+    unit.pending = True
+
+
+def commit_now():
+    """立即 commit（範圍內外皆同），失敗 rollback 後拋出；之後的寫入仍由範圍結束時 commit。"""
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+@contextmanager
+def savepoint():
+    """包住一段寫入：範圍內以 SAVEPOINT 隔離失敗，範圍外等同「成功 commit / 失敗 rollback」。"""
+    unit = _current.get()
+    if unit is None:
+        try:
+            yield
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return
+    # 離開時 flush 並 RELEASE；失敗則 ROLLBACK TO SAVEPOINT，外層交易仍可繼續
+    with db.session.begin_nested():
+        yield
+    unit.pending = True
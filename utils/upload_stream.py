@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+上傳串流：大小上限、邊解析邊計算雜湊、分塊轉送。
+
+原本上傳路徑以 file.stream.read() 把整個檔案讀進記憶體再送出，也沒有設定請求大小上限。現在：
+  上限  MAX_CONTENT_LENGTH：Content-Length 超過時 Werkzeug 在讀取 body 前直接回 413；
+        chunked 傳輸則讀到超過時中斷（見 app.py 的 413 處理）
+  解析  StreamingRequest 讓 multipart 的每個檔案寫入 HashingSpool：超過 UPLOAD_SPOOL_BYTES 即落地為暫存檔，
+        寫入的同時累計 sha256 / 大小，解析完成即可取得雜湊，不需再讀一次
+  轉送  暫存檔以固定大小分塊讀出，交給本機檔案（copy_to_path）、S3 upload_fileobj（multipart）
+        或 requests（LINE content API，data= 檔案物件即分塊送出）；每個上傳佔用的記憶體固定
+
+環境變數：
+  MAX_CONTENT_LENGTH   請求 body 上限 bytes（預設 16MB）
+  UPLOAD_SPOOL_BYTES   單一檔案留在記憶體的上限，超過改寫暫存檔（預設 512KB）
+  UPLOAD_CHUNK_BYTES   分塊讀寫大小（預設 64KB）
+"""
+import hashlib
+import os
+import uuid
+from tempfile import SpooledTemporaryFile
+
+from flask import Request
+
+MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", str(16 * 1024 * 1024)))
+SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(512 * 1024)))
+CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(64 * 1024)))
+
+
+class HashingSpool:
+    """可讀寫的暫存檔（SpooledTemporaryFile），寫入時同步計算 sha256 與大小。"""
+
+    def __init__(self, max_size=SPOOL_BYTES):
+        self._file = SpooledTemporaryFile(max_size=max_size, mode="w+b")
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+
+class StreamingRequest(Request):
+    """multipart 檔案改寫入 HashingSpool（app.request_class）。"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpool()
+
+
+class HashingReader:
+    """包裝可讀檔案物件，讀取的同時計算 sha256 / 大小（轉送給 S3 / requests 時順便取得雜湊）。"""
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def read(self, n=-1):
+        data = self._file.read(n)
+        self._hash.update(data)
+        self.size += len(data)
+        return data
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+
+def iter_chunks(fileobj, chunk_size=CHUNK_BYTES):
+    while True:
+        data = fileobj.read(chunk_size)
+        if not data:
+            return
+        yield data
+
+
+def stream_size(fileobj):
+    """可 seek 的檔案物件剩餘大小（不讀取內容）；位置不變。"""
+    pos = fileobj.tell()
+    fileobj.seek(0, os.SEEK_END)
+    end = fileobj.tell()
+    fileobj.seek(pos)
+    return end - pos
+
+
+def digest(fileobj):
+    """(sha256, size)：HashingSpool 直接取解析時算好的值，其他檔案物件分塊讀一次後倒回開頭。"""
+    if isinstance(fileobj, HashingSpool):
+        fileobj.seek(0)
+        return fileobj.sha256, fileobj.size
+    reader = HashingReader(fileobj)
+    for _ in iter_chunks(reader):
+        pass
+    fileobj.seek(0)
+    return reader.sha256, reader.size
+
+
+def copy_to_path(fileobj, path):
+    """分塊寫入 path（先寫同目錄暫存檔再 rename，讀者不會看到寫一半的檔案）。"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp, "wb") as out:
+            for chunk in iter_chunks(fileobj):
+                out.write(chunk)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def init_upload_stream(app):
+    """設定請求大小上限與串流解析的 request class。"""
+    if app.config.get("MAX_CONTENT_LENGTH") is None:
+        app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
+    app.request_class = StreamingRequest
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+疑似重複儲值偵測：原本對帳報表把區間內的明細全部載入後，以 (電話, 金額, 備註) 在 Python 分組，
+且只看得到目前選取的區間。現在整段在資料庫以 window function 完成，web worker 只拿到候選名單：
+
+  SELECT ... ROW_NUMBER() OVER w AS seq, LAG(id) OVER w, LAG(created_at) OVER w
+  FROM stored_value_txn WHERE type = 'topup' [AND created_at 區間]
+  WINDOW w AS (PARTITION BY wallet_id, amount, remark ORDER BY created_at, id)
+  → seq > 1 且與前一筆相隔不超過容許分鐘數者為候選（duplicate_of = 前一筆）
+
+  區間查詢會往前多讀容許分鐘數，區間第一筆也能和區間外的前一筆比對；
+  索引 ix_stored_value_txn_dup_key (type, wallet_id, amount, created_at) 供分組排序使用
+  夜間排程 wallet_duplicate_sweep 以 INSERT ... SELECT 全帳重建 wallet_duplicate_candidate
+
+環境變數：
+  WALLET_DUPLICATE_TOLERANCE_MINUTES  同錢包 / 金額 / 備註的兩筆相隔幾分鐘內視為疑似重複（預設 10）
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import Float, func, literal, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from extensions import db
+from models import StoredValueTransaction, StoredValueWallet, WalletDuplicateCandidate
+
+DUPLICATE_TOLERANCE_MINUTES = float(os.getenv("WALLET_DUPLICATE_TOLERANCE_MINUTES", "10"))
+
+
+class _minutes_between(FunctionElement):
+    """_minutes_between(a, b)：b - a 的分鐘數。"""
+    type = Float()
+    name = "minutes_between"
+    inherit_cache = True
+
+
+@compiles(_minutes_between)
+@compiles(_minutes_between, "postgresql")
+def _minutes_between_pg(element, compiler, **kw):
+    a, b = [compiler.process(c, **kw) for c in element.clauses]
+    return f"(EXTRACT(EPOCH FROM ({b} - {a})) / 60.0)"
+
+
+@compiles(_minutes_between, "sqlite")
+def _minutes_between_sqlite(element, compiler, **kw):
+    a, b = [compiler.process(c, **kw) for c in element.clauses]
+    return f"((julianday({b}) - julianday({a})) * 1440.0)"
+
+
+def _tolerance(tolerance_minutes):
+    return DUPLICATE_TOLERANCE_MINUTES if tolerance_minutes is None else float(tolerance_minutes)
+
+
+def candidates_query(start_utc=None, end_utc=None, tolerance_minutes=None, type_="topup"):
+    """疑似重複交易的 SELECT（尚未執行）：id, duplicate_of, wallet_id, amount, remark, created_at, seq, gap_minutes。"""
+    T = StoredValueTransaction
+    tolerance = _tolerance(tolerance_minutes)
+    window = {"partition_by": (T.wallet_id, T.amount, T.remark), "order_by": (T.created_at, T.id)}
+    inner = select(T.id, T.wallet_id, T.amount, T.remark, T.created_at,
+                   func.row_number().over(**window).label("seq"),
+                   func.lag(T.id).over(**window).label("prev_id"),
+                   func.lag(T.created_at).over(**window).label("prev_created_at")).where(T.type == type_)
+    if start_utc is not None:
+        inner = inner.where(T.created_at >= start_utc - timedelta(minutes=tolerance))
+    if end_utc is not None:
+        inner = inner.where(T.created_at < end_utc)
+    sub = inner.subquery()
+    gap = _minutes_between(sub.c.prev_created_at, sub.c.created_at)
+    q = (select(sub.c.id, sub.c.prev_id.label("duplicate_of"), sub.c.wallet_id, sub.c.amount, sub.c.remark,
+                sub.c.created_at, sub.c.seq, gap.label("gap_minutes"))
+         .where(sub.c.seq > 1, gap <= tolerance))
+    if start_utc is not None:
+        q = q.where(sub.c.created_at >= start_utc)
+    return q
+
+
+def find_duplicates(business_range=None, tolerance_minutes=None, limit=500):
+    """會計窗（BusinessRange；None 為全帳）內的疑似重複儲值，依時間排序，最多 limit 筆。"""
+    start_utc = business_range.start_utc if business_range else None
+    end_utc = business_range.end_utc if business_range else None
+    sub = candidates_query(start_utc, end_utc, tolerance_minutes).subquery()
+    W = StoredValueWallet
+    q = (select(sub, W.phone)
+         .outerjoin(W, W.id == sub.c.wallet_id)
+         .order_by(sub.c.created_at, sub.c.id))
+    if limit:
+        q = q.limit(limit)
+    return [dict(r._mapping) for r in db.session.execute(q)]
+
+
+def sweep(tolerance_minutes=None):
+    """全帳掃描並重建 wallet_duplicate_candidate（INSERT ... SELECT，不經過 Python）；回傳候選筆數。"""
+    sub = candidates_query(tolerance_minutes=tolerance_minutes).subquery()
+    C = WalletDuplicateCandidate
+    now = datetime.utcnow()
+    sel = select(sub.c.id, sub.c.duplicate_of, sub.c.wallet_id, sub.c.amount, sub.c.gap_minutes,
+                 sub.c.created_at, literal(now, C.detected_at.type))
+    try:
+        C.query.delete(synchronize_session=False)
+        db.session.execute(C.__table__.insert().from_select(
+            ["txn_id", "duplicate_of", "wallet_id", "amount", "gap_minutes", "txn_created_at", "detected_at"], sel))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    n = C.query.count()
+    logging.info(f"[wallet_duplicates] 夜間掃描：{n} 筆疑似重複（容許 {_tolerance(tolerance_minutes)} 分鐘）")
+    return n
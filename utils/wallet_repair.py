@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+儲值金交易資料修復：原本在對帳報表 GET 時逐筆重查交易 / 錢包、解析備註並逐筆 commit，
+clean_invalid=1 時再逐筆刪除。改由排程（utils/jobs.py 的 wallet_repair）在背景處理，報表只讀結果：
+
+  掃描  依 id 以 keyset 分批（WALLET_REPAIR_BATCH 筆）讀取交易 + 錢包 + 白名單電話（單一 outer join 查詢）
+  修復  錢包無電話而白名單有電話、或儲值交易（金額 > 0 且備註含 TOPUP_CASH / 儲值）的備註有手機號碼
+        → 每批一次 executemany UPDATE 補上
+  標記  仍找不到電話、金額 > 0 且備註含 TOPUP_CASH / 儲值 的儲值交易 → wallet_txn_issue(kind=invalid)
+        錢包已不存在的交易 → wallet_txn_issue(kind=orphan)
+        本次掃描沒再出現的問題視為已解決並刪除
+  清理  clean_invalid()：刪除 invalid 交易並扣回餘額（批次 UPDATE / DELETE），再重建受影響日期的會計日彙總
+  稽核  補電話與刪除都寫入 wallet_repair_log（修改前後的值、來源）
+
+環境變數：
+  WALLET_REPAIR_BATCH             每批交易數（預設 1000）
+  WALLET_REPAIR_INTERVAL_MINUTES  排程間隔分鐘（預設 60）
+"""
+import json
+import logging
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import bindparam, func, or_, update
+
+from extensions import db
+from models import (StoredValueTransaction, StoredValueWallet, Whitelist,
+                    WalletRepairLog, WalletTxnIssue)
+from utils import business_calendar
+
+REPAIR_BATCH = int(os.getenv("WALLET_REPAIR_BATCH", "1000"))
+REPAIR_INTERVAL_MINUTES = int(os.getenv("WALLET_REPAIR_INTERVAL_MINUTES", "60"))
+
+PHONE_RE = re.compile(r'(09\d{8})')
+TOPUP_KEYWORDS = ('TOPUP_CASH', '儲值')
+
+
+def _is_invalid_topup(type_, amount, remark):
+    return type_ == 'topup' and (amount or 0) > 0 and any(kw in (remark or '') for kw in TOPUP_KEYWORDS)
+
+
+def _scan_batch(last_id):
+    T, W, WL = StoredValueTransaction, StoredValueWallet, Whitelist
+    return (db.session.query(T.id, T.wallet_id, T.type, T.amount, T.remark,
+                             W.id.label("wid"), W.phone.label("wallet_phone"), WL.phone.label("wl_phone"))
+            .outerjoin(W, W.id == T.wallet_id)
+            .outerjoin(WL, WL.id == W.whitelist_id)
+            .filter(T.id > last_id)
+            .order_by(T.id)
+            .limit(REPAIR_BATCH)
+            .all())
+
+
+def _fill_phones(fills, now, source):
+    """fills：{wallet_id: (phone, txn_id, 原電話)}；只補仍為空的電話。"""
+    if not fills:
+        return 0
+    table = StoredValueWallet.__table__
+    stmt = (update(table)
+            .where(table.c.id == bindparam("b_id"), or_(table.c.phone.is_(None), table.c.phone == ''))
+            .values(phone=bindparam("b_phone"), updated_at=now))
+    db.session.execute(stmt, [{"b_id": wid, "b_phone": phone} for wid, (phone, _tid, _old) in fills.items()])
+    db.session.execute(WalletRepairLog.__table__.insert(), [
+        {"action": "fill_phone", "txn_id": tid, "wallet_id": wid, "source": source, "created_at": now,
+         "detail": json.dumps({"phone": [old, phone]}, ensure_ascii=False)}
+        for wid, (phone, tid, old) in fills.items()
+    ])
+    return len(fills)
+
+
+def _mark_issues(issues, now):
+    """issues：{txn_id: (kind, wallet_id)}；已存在的更新 last_seen_at / kind，新的批次寫入。"""
+    if not issues:
+        return 0
+    I = WalletTxnIssue
+    existing = {tid for (tid,) in db.session.query(I.txn_id).filter(I.txn_id.in_(list(issues)))}
+    if existing:
+        table = I.__table__
+        db.session.execute(
+            update(table).where(table.c.txn_id == bindparam("b_txn_id"))
+            .values(kind=bindparam("b_kind"), last_seen_at=now),
+            [{"b_txn_id": tid, "b_kind": issues[tid][0]} for tid in existing])
+    new = [{"txn_id": tid, "kind": kind, "wallet_id": wid, "detected_at": now, "last_seen_at": now}
+           for tid, (kind, wid) in issues.items() if tid not in existing]
+    if new:
+        db.session.execute(I.__table__.insert(), new)
+    return len(new)
+
+
+def run_repair(source="job"):
+    """掃描全部交易並修復 / 標記問題；回傳統計。每批一個交易（commit）。"""
+    started = datetime.utcnow()
+    stats = {"scanned": 0, "phones_filled": 0, "invalid": 0, "orphan": 0, "new_issues": 0, "resolved": 0}
+    last_id = 0
+    while True:
+        batch = _scan_batch(last_id)
+        if not batch:
+            break
+        last_id = batch[-1].id
+        now = datetime.utcnow()
+        fills = {}
+        issues = {}
+        for r in batch:
+            if r.wid is None:
+                issues[r.id] = ("orphan", r.wallet_id)
+                stats["orphan"] += 1
+                continue
+            phone = r.wallet_phone or r.wl_phone or (fills[r.wid][0] if r.wid in fills else None)
+            invalid_topup = _is_invalid_topup(r.type, r.amount, r.remark)
+            if not phone and invalid_topup:
+                # 只有儲值交易的備註才當作電話來源；消費 / 其他備註裡的號碼可能是別人的
+                m = PHONE_RE.search(r.remark or '')
+                phone = m.group(1) if m else None
+            if phone and not r.wallet_phone:
+                fills.setdefault(r.wid, (phone, r.id, r.wallet_phone))
+            if not phone and invalid_topup:
+                issues[r.id] = ("invalid", r.wallet_id)
+                stats["invalid"] += 1
+        try:
+            stats["phones_filled"] += _fill_phones(fills, now, source)
+            stats["new_issues"] += _mark_issues(issues, now)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        stats["scanned"] += len(batch)
+
+    # 本次掃描沒再看到的問題已解決（交易已刪除或已補上電話）
+    stats["resolved"] = (WalletTxnIssue.query
+                         .filter(WalletTxnIssue.last_seen_at < started)
+                         .delete(synchronize_session=False))
+    db.session.commit()
+    logging.info(f"[wallet_repair] {stats}")
+    return stats
+
+
+def clean_invalid(source="admin"):
+    """刪除標記為 invalid 的儲值交易並扣回錢包餘額；回傳刪除筆數。"""
+    from utils import wallet_rollup
+    T, W, WL, I = StoredValueTransaction, StoredValueWallet, Whitelist, WalletTxnIssue
+    rows = (db.session.query(T.id, T.wallet_id, T.type, T.amount, T.remark, T.created_at, T.business_date,
+                             W.phone.label("wallet_phone"), WL.phone.label("wl_phone"))
+            .join(I, I.txn_id == T.id)
+            .outerjoin(W, W.id == T.wallet_id)
+            .outerjoin(WL, WL.id == W.whitelist_id)
+            .filter(I.kind == "invalid")
+            .all())
+    # 標記後狀態可能已改變（例如已補電話），刪除前以同一條件再確認
+    rows = [r for r in rows
+            if not (r.wallet_phone or r.wl_phone or PHONE_RE.search(r.remark or ''))
+            and _is_invalid_topup(r.type, r.amount, r.remark)]
+    if not rows:
+        return 0
+    now = datetime.utcnow()
+    ids = [r.id for r in rows]
+    deltas = {}
+    for r in rows:
+        deltas[r.wallet_id] = deltas.get(r.wallet_id, 0) - (r.amount or 0)
+    try:
+        wallet_table = W.__table__
+        db.session.execute(
+            update(wallet_table).where(wallet_table.c.id == bindparam("b_id"))
+            .values(balance=wallet_table.c.balance + bindparam("b_delta"), updated_at=now),
+            [{"b_id": wid, "b_delta": delta} for wid, delta in deltas.items()])
+        for i in range(0, len(ids), REPAIR_BATCH):
+            chunk = ids[i:i + REPAIR_BATCH]
+            T.query.filter(T.id.in_(chunk)).delete(synchronize_session=False)
+            I.query.filter(I.txn_id.in_(chunk)).delete(synchronize_session=False)
+        db.session.execute(WalletRepairLog.__table__.insert(), [
+            {"action": "delete_invalid", "txn_id": r.id, "wallet_id": r.wallet_id, "source": source, "created_at": now,
+             "detail": json.dumps({"type": r.type, "amount": r.amount, "remark": r.remark,
+                                   "created_at": r.created_at.isoformat() if r.created_at else None},
+                                  ensure_ascii=False)}
+            for r in rows
+        ])
+        # 批次 DELETE 不經 ORM 事件，重建受影響會計日的彙總（與刪除同一個 commit）
+        dates = [r.business_date for r in rows if r.business_date]
+        if dates:
+            wallet_rollup.backfill(min(dates), max(dates))
+        else:
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    logging.info(f"[wallet_repair] 已清理 {len(ids)} 筆無效交易（{source}）")
+    return len(ids)
+
+
+def flagged_txn_ids(business_range, kind="invalid", type_="topup"):
+    """會計窗內被標記為 kind 的交易 id（報表用，只讀）。"""
+    T, I = StoredValueTransaction, WalletTxnIssue
+    q = (db.session.query(I.txn_id)
+         .join(T, T.id == I.txn_id)
+         .filter(I.kind == kind, business_calendar.in_range(T, business_range)))
+    if type_:
+        q = q.filter(T.type == type_)
+    return {tid for (tid,) in q}
+
+
+def repair_summary():
+    """目前的問題筆數與最近一次掃描時間。"""
+    from models import JobRun
+    counts = dict(db.session.query(WalletTxnIssue.kind, func.count()).group_by(WalletTxnIssue.kind).all())
+    last_run = (JobRun.query.filter_by(job_id="wallet_repair", status="success")
+                .order_by(JobRun.started_at.desc()).first())
+    return {
+        "invalid": counts.get("invalid", 0),
+        "orphan": counts.get("orphan", 0),
+        "last_run_at": last_run.started_at if last_run else None,
+    }
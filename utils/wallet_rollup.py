@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+儲值金交易的會計日彙總表 wallet_daily_rollup：對帳報表的合計、支出、依日彙總改讀這張表，
+一個月約 31 天 × 類型 × 付款方式筆，不再每次把區間內的交易全部載入後在 Python 分組。
+
+鍵：會計日 × type × payment_method × off_hours（會計日定義見 utils/business_calendar.py）
+  off_hours  台北時間 03:00~11:59 的交易。報表的會計窗是「起日 12:00 ~ 迄日次日 03:00」，
+             只有起日的這段不在區間內，因此區間合計 = 起日~迄日全部 − 起日 off_hours
+值：筆數、金額、500 / 300 / 100 券張數、純用券（金額 0 且有用券）筆數與券張數
+
+維護：
+  - StoredValueTransaction 經 ORM 新增 / 修改 / 刪除時，在同一個交易內以 upsert 累加差額，
+    與交易一起 commit / rollback
+  - 繞過 ORM 的大量寫入（例如 bench/seed.py）之後需重建：flask wallet-rollup backfill [--start --end]，
+    以 stored_value_txn.business_date 在資料庫端 GROUP BY 後 INSERT ... SELECT
+  - 啟動時若彙總表為空而交易表有資料，自動 backfill 一次
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import and_, case, event, func, inspect, literal, not_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from extensions import db
+from models import StoredValueTransaction, WalletDailyRollup
+from utils import business_calendar
+from utils.business_calendar import business_hour_of
+
+_KEY = ("business_date", "type", "payment_method", "off_hours")
+_VALUES = ("txn_count", "amount_sum", "coupon_500_sum", "coupon_300_sum", "coupon_100_sum",
+           "coupon_only_count", "coupon_only_coupons")
+_TRACKED = ("created_at", "type", "payment_method", "amount",
+            "coupon_500_count", "coupon_300_count", "coupon_100_count")
+
+
+def _contribution(created_at, type_, payment_method, amount, c500, c300, c100):
+    """單筆交易對彙總表的貢獻：(鍵, 值)。"""
+    if created_at is None or not type_:
+        return None
+    business_date = business_calendar.business_date(created_at)
+    off_hours = business_calendar.is_off_hours(created_at)
+    amount = amount or 0
+    c500, c300, c100 = c500 or 0, c300 or 0, c100 or 0
+    coupons = c500 + c300 + c100
+    coupon_only = amount == 0 and coupons > 0
+    key = (business_date, type_, payment_method or "", off_hours)
+    values = (1, amount, c500, c300, c100, 1 if coupon_only else 0, coupons if coupon_only else 0)
+    return key, values
+
+
+def _current(txn):
+    return _contribution(*(getattr(txn, name) for name in _TRACKED))
+
+
+def _previous(txn):
+    state = inspect(txn)
+    old = []
+    for name in _TRACKED:
+        hist = state.attrs[name].history
+        old.append(hist.deleted[0] if hist.deleted else getattr(txn, name))
+    return _contribution(*old)
+
+
+def _apply(connection, key, values, sign):
+    row = dict(zip(_KEY, key))
+    row.update({name: sign * v for name, v in zip(_VALUES, values)})
+    row["updated_at"] = datetime.utcnow()
+    table = WalletDailyRollup.__table__
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(table).values(**row)
+        set_ = {name: table.c[name] + stmt.excluded[name] for name in _VALUES}
+        set_["updated_at"] = stmt.excluded.updated_at
+        connection.execute(stmt.on_conflict_do_update(index_elements=list(_KEY), set_=set_))
+        return
+    where = [table.c[name] == row[name] for name in _KEY]
+    done = connection.execute(
+        update(table).where(*where)
+        .values({name: table.c[name] + row[name] for name in _VALUES}, updated_at=row["updated_at"])
+    ).rowcount
+    if not done:
+        connection.execute(table.insert().values(**row))
+
+
+@event.listens_for(StoredValueTransaction, "after_insert")
+def _on_insert(mapper, connection, target):
+    contrib = _current(target)
+    if contrib:
+        _apply(connection, contrib[0], contrib[1], 1)
+
+
+@event.listens_for(StoredValueTransaction, "after_update")
+def _on_update(mapper, connection, target):
+    old, new = _previous(target), _current(target)
+    if old == new:
+        return
+    if old:
+        _apply(connection, old[0], old[1], -1)
+    if new:
+        _apply(connection, new[0], new[1], 1)
+
+
+@event.listens_for(StoredValueTransaction, "after_delete")
+def _on_delete(mapper, connection, target):
+    contrib = _previous(target)
+    if contrib:
+        _apply(connection, contrib[0], contrib[1], -1)
+
+
+# ───────────────────────────────────────────────────────────────
+# 重建
+# ───────────────────────────────────────────────────────────────
+def backfill(start_date=None, end_date=None):
+    """依交易表重建指定會計日區間（預設全部）的彙總；分組在資料庫完成。回傳重建的彙總筆數。"""
+    T = StoredValueTransaction
+    R = WalletDailyRollup
+    c500 = func.coalesce(T.coupon_500_count, 0)
+    c300 = func.coalesce(T.coupon_300_count, 0)
+    c100 = func.coalesce(T.coupon_100_count, 0)
+    coupons = c500 + c300 + c100
+    coupon_only = and_(func.coalesce(T.amount, 0) == 0, coupons > 0)
+    payment_method = func.coalesce(T.payment_method, '')
+    off_hours = business_hour_of(T.created_at) < (
+        business_calendar.WINDOW_OPEN_HOUR - business_calendar.DAY_SHIFT_HOURS)
+
+    sel = (select(T.business_date, T.type, payment_method, off_hours,
+                  func.count(),
+                  func.coalesce(func.sum(T.amount), 0),
+                  func.sum(c500), func.sum(c300), func.sum(c100),
+                  func.sum(case((coupon_only, 1), else_=0)),
+                  func.sum(case((coupon_only, coupons), else_=0)),
+                  literal(datetime.utcnow(), R.updated_at.type))
+           .where(T.type.isnot(None), T.type != '')
+           .group_by(T.business_date, T.type, payment_method, off_hours))
+    delete_q = R.query
+    if start_date:
+        sel = sel.where(T.business_date >= start_date)
+        delete_q = delete_q.filter(R.business_date >= start_date)
+    if end_date:
+        sel = sel.where(T.business_date <= end_date)
+        delete_q = delete_q.filter(R.business_date <= end_date)
+
+    delete_q.delete(synchronize_session=False)
+    db.session.execute(R.__table__.insert().from_select(list(_KEY) + list(_VALUES) + ["updated_at"], sel))
+    db.session.commit()
+    n = delete_q.count()
+    logging.info(f"[wallet_rollup] backfill {start_date or '-'} ~ {end_date or '-'}：{n} 筆彙總")
+    return n
+
+
+# ───────────────────────────────────────────────────────────────
+# 查詢（對帳報表）
+# ───────────────────────────────────────────────────────────────
+def _window(business_range, type_=None, payment_method=None):
+    """會計窗內的彙總列條件：會計日區間內，扣除起日 03:00~11:59（off_hours）。"""
+    R = WalletDailyRollup
+    cond = [R.business_date.between(business_range.start_date, business_range.end_date),
+            not_(and_(R.business_date == business_range.start_date, R.off_hours.is_(True)))]
+    if type_:
+        cond.append(R.type == type_)
+    if payment_method:
+        cond.append(R.payment_method == payment_method)
+    return cond
+
+
+def totals(business_range, type_, payment_method=None):
+    """會計窗（BusinessRange）內某類型交易的合計：{count, amount, coupon_500, coupon_300, coupon_100, coupon_only_count, coupon_only_coupons}。"""
+    R = WalletDailyRollup
+    names = ("count", "amount", "coupon_500", "coupon_300", "coupon_100",
+             "coupon_only_count", "coupon_only_coupons")
+    row = (db.session.query(*(func.coalesce(func.sum(getattr(R, name)), 0) for name in _VALUES))
+           .filter(*_window(business_range, type_, payment_method))
+           .one())
+    return {name: int(v) for name, v in zip(names, row)}
+
+
+def amount_by_day(business_range, type_, payment_method=None):
+    """會計窗內依會計日的金額合計 {'YYYY-MM-DD': amount}（只含有交易的日期）。"""
+    R = WalletDailyRollup
+    rows = (db.session.query(R.business_date, func.sum(R.amount_sum))
+            .filter(*_window(business_range, type_, payment_method))
+            .group_by(R.business_date)
+            .having(func.sum(R.txn_count) > 0)
+            .order_by(R.business_date)
+            .all())
+    return {d.strftime('%Y-%m-%d'): int(amount) for d, amount in rows}
+
+
+def init_wallet_rollup(app):
+    """註冊 flask wallet-rollup 指令；彙總表為空而交易表有資料時自動 backfill。"""
+    import click
+
+    @app.cli.group("wallet-rollup")
+    def wallet_rollup_cli():
+        """儲值金會計日彙總表。"""
+
+    @wallet_rollup_cli.command("backfill")
+    @click.option("--start", default=None, help="起始會計日 YYYY-MM-DD（預設全部）")
+    @click.option("--end", default=None, help="結束會計日 YYYY-MM-DD（預設全部）")
+    def backfill_command(start, end):
+        parse = lambda s: datetime.strptime(s, "%Y-%m-%d").date() if s else None
+        n = backfill(parse(start), parse(end))
+        click.echo(f"已重建 {n} 筆彙總")
+
+    with app.app_context():
+        try:
+            if (db.session.query(WalletDailyRollup.id).first() is None
+                    and db.session.query(StoredValueTransaction.id).first() is not None):
+                backfill()
+        except Exception:
+            db.session.rollback()
+            logging.exception("[wallet_rollup] 啟動 backfill 失敗")